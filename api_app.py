@@ -2,15 +2,32 @@
 """
 api_app.py - Flask Backend API para AsRecorded v1.1
 """
+import datetime
 import logging
 import os
+import time
+import json
 from functools import wraps
-from flask import Flask, request, jsonify, session, make_response
+from urllib.parse import urlencode
+from flask import Flask, g, request, jsonify, session, make_response, redirect, stream_with_context
 from flask_cors import CORS
-from flask_bcrypt import Bcrypt
+from werkzeug.http import unquote_etag
 from werkzeug.utils import secure_filename
+import capitulo_export
 import db_handler
-from data_handler import DataHandler
+import instrumentation
+import job_scheduler
+import lifecycle
+import odoo_io
+import prepared_statements
+import timecode
+from cache import cache
+from change_feed import change_feed, format_event, EVENT_CLOSE, SSE_HEARTBEAT_SECONDS, SSE_RETRY_MS, SubscriberLimit
+from data_handler import DataHandler, UPDATE_CONFLICT, UPDATE_NOT_FOUND, AUTOCOMPLETE_LIMIT, SEARCH_LIMIT
+from odoo_io import ConvocatoriaImportError
+from pagination import PaginationError
+from password_pool import password_pool, PasswordPoolBusy
+from series_import import SeriesImportError
 
 # --- Configuración ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s')
@@ -26,18 +43,54 @@ app.config['SESSION_COOKIE_SECURE'] = os.getenv('FLASK_ENV') == 'production'
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 
 # --- Inicialización de Extensiones ---
-CORS(app, supports_credentials=True, origins=["http://localhost:3000", "http://127.0.0.1:3000", "http://localhost:5173"])
-bcrypt = Bcrypt(app)
+CORS(app, supports_credentials=True, origins=["http://localhost:3000", "http://127.0.0.1:3000", "http://localhost:5173"],
+     expose_headers=["ETag", "Link", "X-Next-Cursor", "X-Total-Count", "X-Total-Exact", "X-DB-Queries", "Server-Timing"])
+# Histogramas por endpoint, SQL por huella y cabeceras X-DB-Queries / Server-Timing (GET /metrics).
+instrumentation.init_app(app)
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Read-your-writes con réplica de lectura: la sesión guarda el LSN de su última
+# escritura y, mientras la réplica no lo haya aplicado, sus lecturas van al primario.
+if db_handler.DB_REPLICA_HOST:
+    @app.before_request
+    def _begin_db_routing():
+        db_handler.begin_request_routing(session.get('db_lsn'))
+
+    @app.after_request
+    def _end_db_routing(response):
+        lsn = db_handler.end_request_routing()
+        if lsn is not None:
+            session['db_lsn'] = lsn
+        return response
 
 # --- Instancia del Handler ---
 handler_instance = DataHandler()
 
+# Al drenar el worker (SIGTERM) se cierran los streams SSE abiertos.
+lifecycle.on_drain(change_feed.shutdown)
+
 # --- Decoradores de Autenticación y Autorización ---
 def login_required(f):
+    """
+    Exige sesión de un usuario existente y activo. El registro (rol incluido) sale de
+    la caché de DataHandler.get_usuario_sesion, así que un cambio de rol o una
+    desactivación se aplican sin esperar a que caduque la cookie de sesión. La
+    invalidación llega a todos los workers (change_feed.attach_cache); si el
+    listener de un worker está caído, ese worker lee el usuario de la BD.
+    """
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return jsonify({"error": "Acceso no autorizado. Se requiere inicio de sesión."}), 401
+        try:
+            user = handler_instance.get_usuario_sesion(session['user_id'])
+        except Exception as e:
+            logging.error(f"Error comprobando la sesión del usuario {session['user_id']}: {e}")
+            return jsonify({"error": "No se pudo comprobar la sesión."}), 503
+        if not user or not user['activo']:
+            session.clear()
+            return jsonify({"error": "La sesión ya no es válida."}), 401
+        g.current_user = user
         return f(*args, **kwargs)
     return decorated_function
 
@@ -45,25 +98,263 @@ def roles_required(allowed_roles):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            user_role = session.get('user_rol')
-            if not user_role or user_role not in allowed_roles:
+            user_role = g.current_user['rol']
+            if user_role not in allowed_roles:
                 logging.warning(f"Acceso denegado para rol '{user_role}' a {request.path}.")
                 return jsonify({"error": "Permiso denegado para este recurso."}), 403
             return f(*args, **kwargs)
         return login_required(decorated_function) # Asegura que también esté logueado
     return decorator
 
+# --- Validaciones compartidas ---
+# Las usan tanto los PATCH individuales como el lote de /api/intervenciones/batch.
+ESTADOS = ('pendiente', 'realizado', 'omitido')
+ROLES = ('admin', 'director', 'tecnico', 'supervisor')
+FX_SOURCES = ('manual', 'personaje_default', 'odoo')
+FX_BULK_MAX_IDS = 5000
+INTERVENTION_BATCH_MAX_OPS = 500
+
+def validate_estado(estado, estado_nota):
+    """Valida un cambio de estado. Retorna el mensaje de error o None si es válido."""
+    if not estado or estado not in ESTADOS:
+        return "El campo 'estado' es inválido."
+    if estado == 'omitido' and not estado_nota:
+        return "El campo 'estado_nota' es obligatorio si el estado es 'omitido'."
+    return None
+
+def validate_fx(needs_fx, fx_note, fx_source):
+    """Valida una marca FX. Retorna el mensaje de error o None si es válida."""
+    if needs_fx is None or not isinstance(needs_fx, bool):
+        return "El campo 'needs_fx' (booleano) es requerido."
+    if needs_fx and (not fx_note or len(fx_note) < 3 or len(fx_note) > 120):
+        return "Si 'needs_fx' es true, 'fx_note' es obligatorio (3-120 caracteres)."
+    if fx_source not in FX_SOURCES:
+        return f"El campo 'fx_source' debe ser uno de {', '.join(FX_SOURCES)}."
+    return None
+
+def validate_dialogo(dialogo):
+    if dialogo is not None and not isinstance(dialogo, str):
+        return "El campo 'dialogo' debe ser texto o null."
+    return None
+
+def validate_timecode_cambios(cambios):
+    if not cambios:
+        return "Se requiere 'tc_in' o 'tc_out'."
+    if any(v is not None and not isinstance(v, str) for v in cambios.values()):
+        return "Los campos 'tc_in' y 'tc_out' deben ser texto HH:MM:SS:FF o null."
+    return None
+
+def _optional_int(value):
+    """Retorna `value` si es None o un entero (no booleano); si no, lanza ValueError."""
+    if value is None or (isinstance(value, int) and not isinstance(value, bool)):
+        return value
+    raise ValueError(value)
+
+def validate_intervention_op(op):
+    """
+    Valida y normaliza una operación del lote con las mismas reglas que su PATCH.
+    Retorna (operación normalizada, None) o (None, mensaje de error).
+    """
+    if not isinstance(op, dict):
+        return None, "Cada operación debe ser un objeto."
+    tipo, intervencion_id, version = op.get('op'), op.get('id'), op.get('version')
+    if not isinstance(intervencion_id, int) or isinstance(intervencion_id, bool):
+        return None, "El campo 'id' (entero) es requerido."
+    if version is not None and (not isinstance(version, int) or isinstance(version, bool)):
+        return None, "El campo 'version' debe ser un entero."
+    normalizada = {'op': tipo, 'id': intervencion_id, 'version': version}
+
+    if tipo == 'estado':
+        error = validate_estado(op.get('estado'), op.get('estado_nota'))
+        normalizada.update(estado=op.get('estado'), estado_nota=op.get('estado_nota'))
+    elif tipo == 'fx':
+        fx_source = op.get('fx_source', 'manual')
+        error = validate_fx(op.get('needs_fx'), op.get('fx_note'), fx_source)
+        normalizada.update(needs_fx=op.get('needs_fx'), fx_note=op.get('fx_note'), fx_source=fx_source)
+    elif tipo == 'dialogo':
+        error = "El campo 'dialogo' es requerido." if 'dialogo' not in op else validate_dialogo(op['dialogo'])
+        normalizada['dialogo'] = op.get('dialogo')
+    elif tipo == 'timecode':
+        cambios = {campo: op[campo] for campo in ('tc_in', 'tc_out') if campo in op}
+        error = validate_timecode_cambios(cambios)
+        normalizada['cambios'] = cambios
+    else:
+        error = "El campo 'op' debe ser 'estado', 'fx', 'dialogo' o 'timecode'."
+    return (None, error) if error else (normalizada, None)
+
+# --- ETag / peticiones condicionales ---
+def version_etag(version):
+    """ETag fuerte de una intervención: su número de versión."""
+    return f'"{version}"'
+
+def expected_version_from_request(data):
+    """
+    Versión esperada para un PATCH condicional: cabecera If-Match ("<version>") o,
+    en su defecto, el campo 'version' del body. None si no se envía ninguna.
+    Lanza ValueError si el valor no es una versión válida.
+    """
+    if_match = request.headers.get('If-Match')
+    if if_match:
+        if if_match.strip() == '*':
+            return None
+        value = if_match.split(',')[0].strip()
+        if value.startswith('W/'):
+            value = value[2:]
+        return int(value.strip('"'))
+    version = data.get('version')
+    if version is None:
+        return None
+    if not isinstance(version, int) or isinstance(version, bool):
+        raise ValueError(version)
+    return version
+
+def intervention_update_response(result, message):
+    """Traduce el resultado de un UPDATE condicional a respuesta HTTP con ETag."""
+    if result is None:
+        return jsonify({"error": "No se pudo actualizar la intervención."}), 500
+    if result['resultado'] == UPDATE_NOT_FOUND:
+        return jsonify({"error": "Intervención no encontrada."}), 404
+    if result['resultado'] == UPDATE_CONFLICT:
+        response = make_response(jsonify({
+            "error": "La intervención fue modificada por otro usuario.",
+            "version": result['version']
+        }), 412)
+    else:
+        response = make_response(jsonify({"message": message, "version": result['version']}), 200)
+    response.headers['ETag'] = version_etag(result['version'])
+    return response
+
+def not_modified(etag):
+    """Respuesta 304 si el cliente ya tiene la representación con ese ETag."""
+    # If-None-Match usa comparación débil (RFC 9110 §13.1.2).
+    if etag and request.if_none_match.contains_weak(unquote_etag(etag)[0]):
+        response = make_response('', 304)
+        response.headers['ETag'] = etag
+        return response
+    return None
+
+# --- Listados paginados ---
+# Los listados responden con el array de la página (lo que ya espera el frontend);
+# el cursor de la siguiente página y el total van en cabeceras.
+LIST_PARAMS = ('sort', 'order', 'cursor', 'limit', 'sortBy', 'sortOrder')
+
+def list_response(listar, *args, not_found="Recurso no encontrado."):
+    """
+    Llama a `listar(*args, filters, sort=..., order=..., cursor=..., limit=...)` con la
+    query string. sortBy/sortOrder se aceptan como alias de sort/order.
+    """
+    query = request.args
+    filters = {k: v for k, v in query.items() if k not in LIST_PARAMS}
+    try:
+        page = listar(*args, filters,
+                      sort=query.get('sort') or query.get('sortBy'),
+                      order=query.get('order') or query.get('sortOrder'),
+                      cursor=query.get('cursor'),
+                      limit=query.get('limit'))
+    except PaginationError as e:
+        return jsonify({"error": str(e)}), 400
+    if page is False:
+        return jsonify({"error": not_found}), 404
+    if page is None:
+        return jsonify({"error": "No se pudo obtener el listado."}), 500
+
+    response = make_response(jsonify(page['items']), 200)
+    if page['next_cursor']:
+        response.headers['X-Next-Cursor'] = page['next_cursor']
+        next_args = query.to_dict()
+        next_args['cursor'] = page['next_cursor']
+        response.headers['Link'] = f'<{request.base_url}?{urlencode(next_args)}>; rel="next"'
+    if page['total'] is not None:
+        response.headers['X-Total-Count'] = str(page['total'])
+        response.headers['X-Total-Exact'] = 'true' if page['total_exacto'] else 'false'
+    return response
+
+# --- Stats de los componentes (/metrics) ---
+def _component_stats():
+    """Stats de los componentes del proceso que /metrics exporta como gauges."""
+    return {
+        'db_pool': db_handler.get_pool_stats(),
+        'audit': db_handler.get_audit_stats(),
+        'cache': cache.stats(),
+        'change_feed': change_feed.stats(),
+        'password_pool': password_pool.stats(),
+        'db_replica': db_handler.get_replica_stats(),
+        'prepared_statements': prepared_statements.stats(),
+    }
+
+instrumentation.set_component_stats(_component_stats)
+
 # --- API Endpoints ---
 
+# === Salud del servicio (docker-compose / balanceador) ===
+@app.route('/api/health/live', methods=['GET'])
+def liveness():
+    """El proceso responde. No toca la BD: un fallo de BD no debe reiniciar la API."""
+    return jsonify({"status": "ok", "pid": os.getpid()}), 200
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness():
+    """Listo para recibir tráfico: no está drenando y la BD responde."""
+    if lifecycle.is_draining():
+        return jsonify({"status": "draining"}), 503
+    try:
+        db_handler.ping()
+    except Exception as e:
+        logging.warning(f"Readiness: la BD no responde ({e}).")
+        return jsonify({"status": "db_unavailable"}), 503
+    return jsonify({"status": "ready", "pool": db_handler.get_pool_stats()}), 200
+
+# === Métricas de rendimiento (Prometheus) ===
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """
+    Formato de exposición de Prometheus. Si METRICS_TOKEN está definido, exige
+    `Authorization: Bearer <token>`. Con gunicorn (METRICS_DIR) cualquier worker
+    responde con los totales de todos, así que basta un scrape del servicio.
+    """
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "Acceso no autorizado."}), 401
+    body = instrumentation.render(_component_stats())
+    return app.response_class(body, status=200, mimetype='text/plain; version=0.0.4')
+
 # === Autenticación y Usuarios ===
 @app.route('/api/users/me', methods=['GET'])
 @login_required
 def get_current_user():
-    return jsonify({
-        "id": session.get('user_id'),
-        "nombre": session.get('user_nombre'),
-        "rol": session.get('user_rol')
-    }), 200
+    user = g.current_user
+    return jsonify({"id": user['id'], "nombre": user['nombre'], "rol": user['rol']}), 200
+
+@app.route('/api/users', methods=['GET'])
+@roles_required(['admin'])
+def list_users_endpoint():
+    return list_response(handler_instance.list_usuarios)
+
+@app.route('/api/users/<int:usuario_id>', methods=['PATCH'])
+@roles_required(['admin'])
+def update_user_endpoint(usuario_id):
+    """Cambia el rol y/o desactiva (o reactiva) un usuario. Body: {rol?, activo?}."""
+    data = request.get_json(silent=True) or {}
+    cambios = {k: data[k] for k in ('rol', 'activo') if data.get(k) is not None}
+    if not cambios:
+        return jsonify({"error": "Se requiere 'rol' o 'activo'."}), 400
+    if 'rol' in cambios and cambios['rol'] not in ROLES:
+        return jsonify({"error": f"El campo 'rol' debe ser uno de {', '.join(ROLES)}."}), 400
+    if 'activo' in cambios and not isinstance(cambios['activo'], bool):
+        return jsonify({"error": "El campo 'activo' debe ser booleano."}), 400
+    if usuario_id == g.current_user['id'] and (cambios.get('activo') is False or cambios.get('rol', 'admin') != 'admin'):
+        return jsonify({"error": "Un administrador no puede desactivarse ni quitarse el rol a sí mismo."}), 400
+
+    user = handler_instance.update_usuario(usuario_id, cambios, g.current_user['id'])
+    if user is None:
+        return jsonify({"error": "Error al actualizar el usuario."}), 500
+    if user is False:
+        return jsonify({"error": "Usuario no encontrado."}), 404
+    return jsonify(user), 200
+
+@app.route('/api/actores', methods=['GET'])
+@login_required
+def list_actores_endpoint():
+    return list_response(handler_instance.list_actores)
 
 @app.route('/api/login', methods=['POST'])
 def login():
@@ -71,19 +362,36 @@ def login():
     if not data or not data.get('nombre') or not data.get('password'):
         return jsonify({"error": "Faltan nombre o contraseña."}), 400
 
-    user = db_handler.execute_query('SELECT * FROM "Usuario" WHERE nombre = %s', (data['nombre'],), fetch_mode="one")
-
-    if user and bcrypt.check_password_hash(user['password_hash'], data['password']):
-        session['user_id'] = user['id']
-        session['user_nombre'] = user['nombre']
-        session['user_rol'] = user['rol']
-        logging.info(f"Login exitoso para usuario '{data['nombre']}'")
-        return jsonify({"message": "Login exitoso", "user": {"id": user['id'], "nombre": user['nombre'], "rol": user['rol']}}), 200
+    user = handler_instance.get_usuario_login(data['nombre'])
+    # bcrypt corre en el pool de procesos (password_pool.py), no en el hilo de la petición.
+    try:
+        valido = bool(user) and password_pool.check_password(data['password'], user['password_hash'])
+    except PasswordPoolBusy as e:
+        logging.warning(f"Login de '{data['nombre']}' rechazado por saturación: {e}")
+        response = make_response(jsonify({"error": "Demasiados inicios de sesión a la vez. Reintente en unos segundos."}), 503)
+        response.headers['Retry-After'] = '1'
+        return response
+    if not valido:
+        return jsonify({"error": "Credenciales inválidas."}), 401
+    if not user['activo']:
+        return jsonify({"error": "Usuario desactivado."}), 403
 
-    return jsonify({"error": "Credenciales inválidas."}), 401
+    if password_pool.needs_rehash(user['password_hash']):
+        password_pool.rehash_in_background(
+            data['password'], lambda nuevo_hash, usuario_id=user['id']: handler_instance.update_password_hash(usuario_id, nuevo_hash)
+        )
+    session['user_id'] = user['id']
+    session['user_nombre'] = user['nombre']
+    session['user_rol'] = user['rol']
+    logging.info(f"Login exitoso para usuario '{data['nombre']}'")
+    db_handler.audit_log('Usuario', user['id'], user['id'], 'LOGIN', {'ip': request.remote_addr})
+    return jsonify({"message": "Login exitoso", "user": {"id": user['id'], "nombre": user['nombre'], "rol": user['rol']}}), 200
 
 @app.route('/api/logout', methods=['POST'])
 def logout():
+    user_id = session.get('user_id')
+    if user_id:
+        db_handler.audit_log('Usuario', user_id, user_id, 'LOGOUT')
     session.clear()
     return jsonify({"message": "Sesión cerrada."}), 200
 
@@ -91,57 +399,468 @@ def logout():
 @app.route('/api/salas/<int:sala_id>/convocatoria', methods=['GET'])
 @roles_required(['admin', 'director', 'tecnico', 'supervisor'])
 def get_convocatoria_endpoint(sala_id):
+    """
+    Convocatoria de la sala para una fecha. Con ?vista=arbol devuelve el árbol
+    convocatoria -> takes -> intervenciones en un solo round-trip; sin él, las filas
+    planas por item de siempre.
+    """
     fecha = request.args.get('fecha') # Formato YYYY-MM-DD
     if not fecha:
         return jsonify({"error": "El parámetro 'fecha' es requerido."}), 400
-    
-    convocatoria_data = handler_instance.get_convocatoria_hoy(sala_id, fecha)
-    if convocatoria_data is None:
+    vista = request.args.get('vista', 'plana')
+    if vista not in ('plana', 'arbol'):
+        return jsonify({"error": "El parámetro 'vista' debe ser 'plana' o 'arbol'."}), 400
+
+    # La huella es un agregado barato: si el cliente ya tiene esta versión, 304 sin cargar filas.
+    etag = handler_instance.get_convocatoria_etag(sala_id, fecha, vista)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    start = time.perf_counter()
+    if vista == 'arbol':
+        payload = handler_instance.get_convocatoria_arbol_json(sala_id, fecha)
+        if payload is None:
+            return jsonify({"error": "Error al obtener la convocatoria."}), 500
+        response = app.response_class(payload, status=200, mimetype='application/json')
+    else:
+        convocatoria_data = handler_instance.get_convocatoria_hoy(sala_id, fecha)
+        if convocatoria_data is None:
+            return jsonify({"error": "Error al obtener la convocatoria."}), 500
+        response = make_response(jsonify(convocatoria_data), 200)
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    size = response.calculate_content_length()
+    response.headers['Server-Timing'] = f'convocatoria;desc="{vista}";dur={elapsed_ms:.1f}'
+    logging.info(f"Convocatoria sala {sala_id} {fecha} (vista {vista}): {size} bytes en {elapsed_ms:.1f} ms")
+    if etag:
+        response.headers['ETag'] = etag
+    return response
+
+# --- Cambios en vivo (Server-Sent Events) ---
+# URL pública de sse_server.py. Si está definida, los streams se redirigen (307)
+# allí y no ocupan hilos de los workers; vacía (desarrollo), los sirve la API.
+SSE_URL = os.getenv('SSE_URL', '').rstrip('/')
+
+def served_by_sse_server(f):
+    """Con SSE_URL redirige a sse_server.py con la misma ruta y query (antes de autenticar: lo hace él)."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if SSE_URL:
+            return redirect(SSE_URL + request.full_path.rstrip('?'), 307)
+        return f(*args, **kwargs)
+    return decorated_function
+
+def change_stream_response(convocatoria_ids):
+    """
+    Respuesta text/event-stream con los cambios de las convocatorias indicadas.
+    Eventos: 'cambio' ({intervencion_id, estado, needs_fx, version}) y 'resync'
+    (el cliente debe recargar la convocatoria). Cada SSE_HEARTBEAT_SECONDS se envía
+    un comentario para que los proxies no corten la conexión.
+    Solo sin SSE_URL (desarrollo): cada stream ocupa un hilo del worker y, pasado
+    CHANGE_FEED_MAX_SUBSCRIBERS por worker, se responde 503 con Retry-After.
+    """
+    if lifecycle.is_draining():
+        response = make_response(jsonify({"error": "Servidor reiniciándose."}), 503)
+        response.headers['Retry-After'] = str(max(SSE_RETRY_MS // 1000, 1))
+        return response
+    try:
+        subscription = change_feed.subscribe(convocatoria_ids)
+    except SubscriberLimit:
+        response = make_response(jsonify({"error": "Demasiados streams abiertos en este servidor."}), 503)
+        response.headers['Retry-After'] = str(max(SSE_RETRY_MS // 1000, 1))
+        return response
+
+    def events():
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            while True:
+                item = subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+                if item is None:
+                    yield ": ping\n\n"
+                    continue
+                event, data = item
+                if event == EVENT_CLOSE:
+                    # El cliente reconecta solo (retry) y cae en otro worker.
+                    return
+                yield format_event(event, data)
+        finally:
+            change_feed.unsubscribe(subscription)
+
+    response = app.response_class(stream_with_context(events()), mimetype='text/event-stream')
+    # Si el cliente se va antes de leer nada, el generador no llega a su finally.
+    response.call_on_close(lambda: change_feed.unsubscribe(subscription))
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/salas/<int:sala_id>/convocatoria/stream', methods=['GET'])
+@served_by_sse_server
+@roles_required(['admin', 'director', 'tecnico', 'supervisor'])
+def stream_convocatoria_sala(sala_id):
+    """Cambios en vivo de las convocatorias de la sala para ?fecha=YYYY-MM-DD."""
+    fecha = request.args.get('fecha')
+    if not fecha:
+        return jsonify({"error": "El parámetro 'fecha' es requerido."}), 400
+    convocatoria_ids = handler_instance.get_convocatoria_ids(sala_id, fecha)
+    if convocatoria_ids is None:
         return jsonify({"error": "Error al obtener la convocatoria."}), 500
-    
-    return jsonify(convocatoria_data), 200
+    if not convocatoria_ids:
+        return jsonify({"error": "No hay convocatoria para esa sala y fecha."}), 404
+    return change_stream_response(convocatoria_ids)
+
+@app.route('/api/convocatorias/<int:convocatoria_id>/stream', methods=['GET'])
+@served_by_sse_server
+@roles_required(['admin', 'director', 'tecnico', 'supervisor'])
+def stream_convocatoria(convocatoria_id):
+    """Cambios en vivo de una convocatoria."""
+    return change_stream_response([convocatoria_id])
+
+@app.route('/api/convocatorias/import', methods=['POST'])
+@roles_required(['admin'])
+def import_convocatoria_endpoint():
+    """
+    Importa un lote de Odoo. Acepta JSON { sala_id, fecha, turno, odoo_batch_id, items[] }
+    o multipart con un fichero CSV/XLSX en 'file' y la cabecera en campos de formulario.
+    """
+    user_id = session.get('user_id')
+    try:
+        upload = request.files.get('file')
+        if upload:
+            header = odoo_io.parse_header(request.form)
+            items = odoo_io.iter_file_items(upload.stream, secure_filename(upload.filename or ''))
+        else:
+            data = request.get_json(silent=True) or {}
+            header = odoo_io.parse_header(data)
+            items = odoo_io.iter_json_items(data.get('items'))
+        result = handler_instance.import_convocatoria(header, items, user_id=user_id)
+    except ConvocatoriaImportError as e:
+        return jsonify({"error": e.mensaje, "details": e.errores}), 422
+    except Exception as e:
+        logging.error(f"Error importando convocatoria: {e}")
+        return jsonify({"error": "Error al importar la convocatoria."}), 500
+
+    if result['ya_importado']:
+        return jsonify({"message": "El lote ya estaba importado.", **result}), 200
+    return jsonify({"message": "Convocatoria importada correctamente.", **result}), 201
+
+@app.route('/api/convocatorias/<int:convocatoria_id>/export', methods=['POST'])
+@roles_required(['admin'])
+def export_convocatoria_endpoint(convocatoria_id):
+    # El envío a Odoo (con reintentos) puede tardar minutos: se encola en "JobRun"
+    # y el estado se consulta en /api/admin/jobs/<job_id>.
+    try:
+        sala_id = handler_instance.get_convocatoria_sala_id(convocatoria_id)
+    except Exception as e:
+        logging.error(f"Error consultando la convocatoria {convocatoria_id}: {e}")
+        return jsonify({"error": "Error al exportar la convocatoria."}), 500
+    if sala_id is None:
+        return jsonify({"error": "Convocatoria no encontrada."}), 404
+
+    params = {'convocatoria_id': convocatoria_id, 'user_id': session.get('user_id')}
+    job_id = job_scheduler.enqueue_job('export_convocatoria', sala_id=sala_id, params=params)
+    return jsonify({"message": "Exportación encolada.", "job_id": job_id}), 202
 
 # === Intervenciones (Ejemplos de PATCH) ===
 
 @app.route('/api/intervenciones/<int:intervencion_id>/estado', methods=['PATCH'])
 @roles_required(['admin', 'director', 'tecnico'])
 def patch_intervencion_estado(intervencion_id):
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     estado = data.get('estado')
     estado_nota = data.get('estado_nota')
     user_id = session.get('user_id')
 
-    if not estado or estado not in ['pendiente', 'realizado', 'omitido']:
-        return jsonify({"error": "El campo 'estado' es inválido."}), 400
-    if estado == 'omitido' and not estado_nota:
-        return jsonify({"error": "El campo 'estado_nota' es obligatorio si el estado es 'omitido'."}), 400
+    error = validate_estado(estado, estado_nota)
+    if error:
+        return jsonify({"error": error}), 400
 
-    success = handler_instance.update_intervention_status(intervencion_id, estado, estado_nota, user_id)
-    if success:
-        return jsonify({"message": "Estado actualizado correctamente."}), 200
-    else:
-        return jsonify({"error": "No se pudo actualizar la intervención."}), 500
+    try:
+        expected_version = expected_version_from_request(data)
+    except ValueError:
+        return jsonify({"error": "Cabecera If-Match o campo 'version' inválido."}), 400
+
+    result = handler_instance.update_intervention_status(
+        intervencion_id, estado, estado_nota, user_id, expected_version=expected_version
+    )
+    return intervention_update_response(result, "Estado actualizado correctamente.")
 
 
 @app.route('/api/intervenciones/<int:intervencion_id>/fx', methods=['PATCH'])
 @roles_required(['admin', 'director', 'tecnico'])
 def patch_intervencion_fx(intervencion_id):
-    data = request.get_json()
+    data = request.get_json(silent=True) or {}
     needs_fx = data.get('needs_fx')
     fx_note = data.get('fx_note')
     fx_source = data.get('fx_source', 'manual')
     user_id = session.get('user_id')
 
-    if needs_fx is None or not isinstance(needs_fx, bool):
-        return jsonify({"error": "El campo 'needs_fx' (booleano) es requerido."}), 400
-    if needs_fx and (not fx_note or len(fx_note) < 3 or len(fx_note) > 120):
-        return jsonify({"error": "Si 'needs_fx' es true, 'fx_note' es obligatorio (3-120 caracteres)."}), 400
-    
-    success = handler_instance.update_intervention_fx(intervencion_id, needs_fx, fx_note, fx_source, user_id)
-    if success:
-        return jsonify({"message": "FX actualizado correctamente."}), 200
-    else:
-        return jsonify({"error": "No se pudo actualizar el FX de la intervención."}), 500
+    error = validate_fx(needs_fx, fx_note, fx_source)
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        expected_version = expected_version_from_request(data)
+    except ValueError:
+        return jsonify({"error": "Cabecera If-Match o campo 'version' inválido."}), 400
+
+    result = handler_instance.update_intervention_fx(
+        intervencion_id, needs_fx, fx_note, fx_source, user_id, expected_version=expected_version
+    )
+    return intervention_update_response(result, "FX actualizado correctamente.")
+
+@app.route('/api/intervenciones/<int:intervencion_id>/timecode', methods=['PATCH'])
+@roles_required(['admin', 'director', 'tecnico'])
+def patch_intervencion_timecode(intervencion_id):
+    """Actualiza tc_in y/o tc_out, validados contra los fps de la serie."""
+    data = request.get_json(silent=True) or {}
+    cambios = {campo: data[campo] for campo in ('tc_in', 'tc_out') if campo in data}
+    error = validate_timecode_cambios(cambios)
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        expected_version = expected_version_from_request(data)
+    except ValueError:
+        return jsonify({"error": "Cabecera If-Match o campo 'version' inválido."}), 400
+
+    try:
+        result = handler_instance.update_intervention_timecode(
+            intervencion_id, cambios, session.get('user_id'), expected_version=expected_version
+        )
+    except timecode.TimecodeError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error actualizando timecode de intervención {intervencion_id}: {e}")
+        result = None
+    return intervention_update_response(result, "Timecode actualizado correctamente.")
+
+@app.route('/api/intervenciones/<int:intervencion_id>/dialogo', methods=['PATCH'])
+@roles_required(['admin', 'director', 'tecnico'])
+def patch_intervencion_dialogo(intervencion_id):
+    data = request.get_json(silent=True) or {}
+    if 'dialogo' not in data:
+        return jsonify({"error": "El campo 'dialogo' es requerido."}), 400
+    error = validate_dialogo(data['dialogo'])
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        expected_version = expected_version_from_request(data)
+    except ValueError:
+        return jsonify({"error": "Cabecera If-Match o campo 'version' inválido."}), 400
+
+    result = handler_instance.update_intervention_dialogo(
+        intervencion_id, data['dialogo'], session.get('user_id'), expected_version=expected_version
+    )
+    return intervention_update_response(result, "Diálogo actualizado correctamente.")
+
+@app.route('/api/intervenciones/batch', methods=['POST'])
+@roles_required(['admin', 'director', 'tecnico'])
+def post_intervenciones_batch():
+    """
+    Aplica en orden una lista de operaciones sobre intervenciones en una única
+    transacción. Body: { operaciones: [{op, id, version?, ...campos del PATCH}], atomico?: bool }.
+    Un error de validación rechaza el lote completo (400) sin tocar la BD.
+    """
+    data = request.get_json(silent=True) or {}
+    operaciones = data.get('operaciones')
+    atomico = data.get('atomico', False)
+    if not isinstance(operaciones, list) or not operaciones:
+        return jsonify({"error": "El campo 'operaciones' debe ser una lista no vacía."}), 400
+    if len(operaciones) > INTERVENTION_BATCH_MAX_OPS:
+        return jsonify({"error": f"Máximo {INTERVENTION_BATCH_MAX_OPS} operaciones por petición."}), 400
+    if not isinstance(atomico, bool):
+        return jsonify({"error": "El campo 'atomico' debe ser booleano."}), 400
+
+    validas, errores = [], []
+    for indice, op in enumerate(operaciones):
+        normalizada, error = validate_intervention_op(op)
+        if error:
+            errores.append({"indice": indice, "error": error})
+        validas.append(normalizada)
+    if errores:
+        return jsonify({"error": "Hay operaciones inválidas; no se aplicó ninguna.", "details": errores}), 400
+
+    result = handler_instance.apply_intervention_batch(validas, session.get('user_id'), atomico=atomico)
+    if result is None:
+        return jsonify({"error": "No se pudo aplicar el lote."}), 500
+    resultados, aplicado = result
+    actualizadas = sum(1 for r in resultados if r['resultado'] == 'actualizado')
+    return jsonify({
+        "aplicado": aplicado,
+        "total": len(resultados),
+        "actualizadas": actualizadas,
+        "resultados": resultados
+    }), 200 if aplicado else 409
+
+@app.route('/api/fx/bulk', methods=['POST'])
+@roles_required(['admin', 'director', 'tecnico'])
+def post_fx_bulk():
+    data = request.get_json(silent=True) or {}
+    capitulo_id = data.get('capitulo_id')
+    personaje_id = data.get('personaje_id')
+    intervencion_ids = data.get('intervencion_ids')
+    apply = data.get('apply') or {}
+    fx_source = apply.get('fx_source', 'manual')
+    fx_note = apply.get('fx_note')
+    needs_fx = apply.get('needs_fx')
+    user_id = session.get('user_id')
+
+    if not isinstance(capitulo_id, int) or isinstance(capitulo_id, bool):
+        return jsonify({"error": "El campo 'capitulo_id' (entero) es requerido."}), 400
+    if personaje_id is not None and (not isinstance(personaje_id, int) or isinstance(personaje_id, bool)):
+        return jsonify({"error": "El campo 'personaje_id' debe ser un entero."}), 400
+    if intervencion_ids is not None:
+        if (not isinstance(intervencion_ids, list) or not intervencion_ids
+                or not all(isinstance(i, int) and not isinstance(i, bool) for i in intervencion_ids)):
+            return jsonify({"error": "El campo 'intervencion_ids' debe ser una lista de enteros no vacía."}), 400
+        if len(intervencion_ids) > FX_BULK_MAX_IDS:
+            return jsonify({"error": f"Máximo {FX_BULK_MAX_IDS} intervenciones por petición."}), 400
+        intervencion_ids = list(dict.fromkeys(intervencion_ids))
+    if fx_source not in ('manual', 'personaje_default'):
+        return jsonify({"error": "En FX masivo 'fx_source' debe ser 'manual' o 'personaje_default'."}), 400
+    if fx_source == 'manual':
+        error = validate_fx(needs_fx, fx_note, fx_source)
+        if error:
+            return jsonify({"error": error}), 400
+    elif fx_note is not None and (len(fx_note) < 3 or len(fx_note) > 120):
+        return jsonify({"error": "'fx_note' debe tener entre 3 y 120 caracteres."}), 400
+
+    resultados = handler_instance.bulk_update_fx(
+        capitulo_id, needs_fx, fx_note, fx_source, user_id,
+        personaje_id=personaje_id, intervencion_ids=intervencion_ids
+    )
+    if resultados is None:
+        return jsonify({"error": "No se pudo aplicar el FX masivo."}), 500
+
+    actualizadas = sum(1 for r in resultados if r['resultado'] == 'actualizado')
+    return jsonify({
+        "capitulo_id": capitulo_id,
+        "total": len(resultados),
+        "actualizadas": actualizadas,
+        "resultados": resultados
+    }), 200
+
+# === Series ===
+@app.route('/api/series', methods=['GET'])
+@login_required
+def list_series_endpoint():
+    return list_response(handler_instance.list_series)
+
+@app.route('/api/series/<int:serie_id>/capitulos', methods=['GET'])
+@login_required
+def list_capitulos_endpoint(serie_id):
+    return list_response(handler_instance.list_capitulos, serie_id, not_found="Serie no encontrada.")
+
+@app.route('/api/import/excel', methods=['POST'])
+@roles_required(['admin', 'director'])
+def import_excel_endpoint():
+    """Import del XLSX clásico (§16.1) recibido como multipart en 'file'."""
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        return jsonify({"error": "Se requiere un fichero XLSX en el campo 'file'."}), 400
+    filename = secure_filename(upload.filename)
+    if not filename.lower().endswith(('.xlsx', '.xlsm')):
+        return jsonify({"error": "Formato no soportado: solo .xlsx."}), 400
+
+    try:
+        result = handler_instance.import_series_xlsx(upload.stream, filename=filename, user_id=session.get('user_id'))
+    except SeriesImportError as e:
+        return jsonify({"error": e.mensaje, "details": e.errores}), 422
+    except Exception as e:
+        logging.error(f"Error importando XLSX {filename}: {e}")
+        return jsonify({"error": "Error al importar el fichero."}), 500
+
+    message = (f"Importación completada: {result['filas']} filas en {result['segundos']} s "
+               f"({result['filas_por_segundo']} filas/s).")
+    return jsonify({"message": message, **result}), 200
+
+@app.route('/api/series/<int:serie_id>/duracion-actores', methods=['GET'])
+@login_required
+def get_duracion_actores_serie(serie_id):
+    return jsonify(handler_instance.get_duracion_por_actor(serie_id=serie_id)), 200
+
+# === Capítulos ===
+@app.route('/api/capitulos/<int:capitulo_id>/details', methods=['GET'])
+@roles_required(['admin', 'director', 'tecnico', 'supervisor'])
+def get_capitulo_details_endpoint(capitulo_id):
+    etag = handler_instance.get_capitulo_etag(capitulo_id)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    detalle = handler_instance.get_capitulo_detalle(capitulo_id, etag=etag)
+    if detalle is None:
+        return jsonify({"error": "Capítulo no encontrado."}), 404
+
+    response = make_response(jsonify(detalle), 200)
+    if etag:
+        response.headers['ETag'] = etag
+    return response
+
+@app.route('/api/capitulos/<int:capitulo_id>/export/excel', methods=['GET'])
+@login_required
+def export_capitulo_excel(capitulo_id):
+    return export_capitulo(capitulo_id, 'xlsx')
+
+@app.route('/api/capitulos/<int:capitulo_id>/export/<formato>', methods=['GET'])
+@login_required
+def export_capitulo_formato(capitulo_id, formato):
+    return export_capitulo(capitulo_id, formato)
+
+def export_capitulo(capitulo_id, formato):
+    """
+    Export del capítulo en streaming (xlsx, csv o parquet): las filas salen de un
+    cursor de servidor y la respuesta se envía a trozos (Transfer-Encoding: chunked).
+    """
+    if formato not in capitulo_export.FORMATS:
+        return jsonify({"error": f"Formato no soportado. Use uno de {', '.join(capitulo_export.FORMATS)}."}), 400
+    if formato == 'parquet' and not capitulo_export.parquet_available():
+        return jsonify({"error": "El export Parquet requiere el paquete 'pyarrow' en el servidor."}), 501
+    info = handler_instance.get_capitulo_export_info(capitulo_id)
+    if info is None:
+        return jsonify({"error": "Capítulo no encontrado."}), 404
+
+    mimetype, extension = capitulo_export.FORMATS[formato]
+    titulo = f"{info['serie_referencia']} {info['numero']}"
+    filename = secure_filename(f"{info['serie_referencia']}_cap{info['numero']}.{extension}") or f"capitulo_{capitulo_id}.{extension}"
+    start = time.perf_counter()
+
+    def generate():
+        enviados = 0
+        rows = handler_instance.iter_capitulo_export_rows(capitulo_id)
+        try:
+            for chunk in capitulo_export.iter_export(formato, titulo, rows):
+                enviados += len(chunk)
+                yield chunk
+        finally:
+            rows.close()
+            logging.info(f"Export {formato} del capítulo {capitulo_id}: {enviados} bytes en "
+                         f"{(time.perf_counter() - start) * 1000:.1f} ms")
+
+    response = app.response_class(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@app.route('/api/capitulos/<int:capitulo_id>/intervenciones', methods=['GET'])
+@login_required
+def get_intervenciones_por_tc(capitulo_id):
+    """Intervenciones con tc_in entre ?tc_desde= y ?tc_hasta= (HH:MM:SS:FF), ordenadas por timecode."""
+    try:
+        rows = handler_instance.get_intervenciones_por_tc(
+            capitulo_id, request.args.get('tc_desde'), request.args.get('tc_hasta')
+        )
+    except timecode.TimecodeError as e:
+        return jsonify({"error": str(e)}), 400
+    if rows is None:
+        return jsonify({"error": "Capítulo no encontrado."}), 404
+    return jsonify(rows), 200
+
+@app.route('/api/capitulos/<int:capitulo_id>/duracion-actores', methods=['GET'])
+@login_required
+def get_duracion_actores_capitulo(capitulo_id):
+    return jsonify(handler_instance.get_duracion_por_actor(capitulo_id=capitulo_id)), 200
 
 # === Repartos ===
 @app.route('/api/series/<int:serie_id>/reparto', methods=['GET'])
@@ -150,25 +869,211 @@ def get_reparto_endpoint(serie_id):
     reparto = handler_instance.get_reparto(serie_id)
     return jsonify(reparto), 200
 
+@app.route('/api/series/<int:serie_id>/reparto', methods=['POST'])
+@roles_required(['admin', 'director'])
+def post_reparto_endpoint(serie_id):
+    """Asigna un actor a un personaje. El actor es del personaje, no solo de esta serie."""
+    data = request.get_json(silent=True) or {}
+    personaje_id = data.get('personaje_id')
+    if not isinstance(personaje_id, int) or isinstance(personaje_id, bool):
+        return jsonify({"error": "El campo 'personaje_id' (entero) es requerido."}), 400
+    try:
+        actor_id = _optional_int(data.get('actor_id'))
+    except ValueError:
+        return jsonify({"error": "El campo 'actor_id' debe ser un entero o null."}), 400
+
+    result = handler_instance.assign_reparto(personaje_id, actor_id, session.get('user_id'))
+    if result is None:
+        return jsonify({"error": "No se pudo asignar el reparto."}), 500
+    if not result:
+        return jsonify({"error": "Personaje o actor no encontrado."}), 404
+    return jsonify({"message": "Reparto actualizado.", "serie_id": serie_id}), 200
+
+# === Búsqueda (§5, §17) ===
+@app.route('/api/personajes/buscar', methods=['GET'])
+@login_required
+def buscar_personajes_endpoint():
+    """Autocompletado: ?q= y, opcionalmente, ?capitulo_id= o ?convocatoria_id=."""
+    limit = min(request.args.get('limit', AUTOCOMPLETE_LIMIT, type=int), 50)
+    rows = handler_instance.buscar_personajes(
+        request.args.get('q'),
+        capitulo_id=request.args.get('capitulo_id', type=int),
+        convocatoria_id=request.args.get('convocatoria_id', type=int),
+        limit=limit,
+    )
+    if rows is None:
+        return jsonify({"error": "No se pudo completar la búsqueda."}), 500
+    return jsonify(rows), 200
+
+@app.route('/api/intervenciones/buscar', methods=['GET'])
+@login_required
+def buscar_dialogos_endpoint():
+    """Texto completo en diálogos: ?q= y, opcionalmente, ?capitulo_id= o ?serie_id=."""
+    limit = min(request.args.get('limit', SEARCH_LIMIT, type=int), 200)
+    rows = handler_instance.buscar_dialogos(
+        request.args.get('q'),
+        capitulo_id=request.args.get('capitulo_id', type=int),
+        serie_id=request.args.get('serie_id', type=int),
+        limit=limit,
+    )
+    if rows is None:
+        return jsonify({"error": "No se pudo completar la búsqueda."}), 500
+    return jsonify(rows), 200
+
+@app.route('/api/personajes/<int:personaje_id>/siguiente-pendiente', methods=['GET'])
+@login_required
+def get_siguiente_pendiente_endpoint(personaje_id):
+    """?capitulo_id= o ?convocatoria_id=, y ?despues_de=<intervencion_id> para avanzar desde la actual."""
+    capitulo_id = request.args.get('capitulo_id', type=int)
+    convocatoria_id = request.args.get('convocatoria_id', type=int)
+    if capitulo_id is None and convocatoria_id is None:
+        return jsonify({"error": "Se requiere 'capitulo_id' o 'convocatoria_id'."}), 400
+    row = handler_instance.get_siguiente_pendiente(
+        personaje_id, capitulo_id=capitulo_id, convocatoria_id=convocatoria_id,
+        despues_de=request.args.get('despues_de', type=int),
+    )
+    if row is None:
+        return jsonify({"error": "No quedan intervenciones pendientes de este personaje."}), 404
+    return jsonify(row), 200
+
+# === Métricas (§11) ===
+@app.route('/api/metricas', methods=['GET'])
+@roles_required(['admin', 'director', 'supervisor'])
+def get_metricas():
+    """Dashboard de KPIs. ?desde=&hasta= (YYYY-MM-DD, por defecto los últimos 30 días), ?sala_id=, ?serie_id=."""
+    try:
+        hasta = datetime.date.fromisoformat(request.args['hasta']) if request.args.get('hasta') else datetime.date.today()
+        desde = (datetime.date.fromisoformat(request.args['desde']) if request.args.get('desde')
+                 else hasta - datetime.timedelta(days=30))
+    except ValueError:
+        return jsonify({"error": "Los parámetros 'desde' y 'hasta' deben ser fechas YYYY-MM-DD."}), 400
+    sala_id = request.args.get('sala_id', type=int)
+    serie_id = request.args.get('serie_id', type=int)
+
+    start = time.perf_counter()
+    try:
+        metricas = handler_instance.get_metricas(desde, hasta, sala_id=sala_id, serie_id=serie_id)
+    except Exception as e:
+        logging.error(f"Error obteniendo métricas: {e}")
+        return jsonify({"error": "Error al obtener las métricas."}), 500
+    response = make_response(jsonify(metricas), 200)
+    response.headers['Server-Timing'] = f'metricas;dur={(time.perf_counter() - start) * 1000:.1f}'
+    return response
+
+# === Administración ===
+@app.route('/api/admin/db/pool', methods=['GET'])
+@roles_required(['admin'])
+def get_db_pool_stats():
+    return jsonify(db_handler.get_pool_stats()), 200
+
+@app.route('/api/admin/db/replica', methods=['GET'])
+@roles_required(['admin'])
+def get_db_replica_stats():
+    return jsonify(db_handler.get_replica_stats()), 200
+
+@app.route('/api/admin/audit', methods=['GET'])
+@roles_required(['admin'])
+def get_audit_stats():
+    return jsonify(db_handler.get_audit_stats()), 200
+
+@app.route('/api/admin/auditoria', methods=['GET'])
+@roles_required(['admin'])
+def list_auditoria_endpoint():
+    return list_response(handler_instance.list_auditoria)
+
+@app.route('/api/admin/change-feed', methods=['GET'])
+@roles_required(['admin'])
+def get_change_feed_stats():
+    return jsonify(change_feed.stats()), 200
+
+@app.route('/api/admin/slow-queries', methods=['GET'])
+@roles_required(['admin'])
+def get_slow_queries():
+    """Consultas lentas de todos los workers (cada muestra lleva el pid del que la registró)."""
+    return jsonify(instrumentation.get_slow_queries()), 200
+
+@app.route('/api/admin/cache', methods=['GET'])
+@roles_required(['admin'])
+def get_cache_stats():
+    return jsonify(cache.stats()), 200
+
+# Las tareas de I/O no se ejecutan en el hilo de la petición: se encolan en "JobRun"
+# y las procesa el worker (job_scheduler.py) en su propio proceso.
+@app.route('/api/admin/io/config', methods=['GET'])
+@roles_required(['admin'])
+def get_io_config_endpoint():
+    return jsonify(job_scheduler.get_io_config()), 200
+
+@app.route('/api/admin/io/config', methods=['POST'])
+@roles_required(['admin'])
+def save_io_config_endpoint():
+    data = request.get_json(silent=True) or {}
+    try:
+        job_scheduler.save_io_config(data)
+    except ValueError as e:
+        return jsonify({"error": f"Expresión de programación inválida: {e}"}), 400
+    return jsonify({"message": "Configuración guardada."}), 200
+
+@app.route('/api/admin/import/now', methods=['POST'])
+@roles_required(['admin'])
+def import_now_endpoint():
+    data = request.get_json(silent=True) or {}
+    params = {'import_path': data.get('import_path_override')} if data.get('import_path_override') else {}
+    try:
+        sala_id = _optional_int(data.get('sala_id'))
+    except ValueError:
+        return jsonify({"error": "El campo 'sala_id' debe ser un entero."}), 400
+    job_id = job_scheduler.enqueue_job('import_convo_diario', sala_id=sala_id, params=params)
+    return jsonify({"message": "Importación encolada.", "job_id": job_id}), 202
+
+@app.route('/api/admin/metricas/refresh', methods=['POST'])
+@roles_required(['admin'])
+def refresh_metricas_now():
+    job_id = job_scheduler.enqueue_job('refrescar_metricas')
+    return jsonify({"message": "Refresco de métricas encolado.", "job_id": job_id}), 202
+
+@app.route('/api/admin/export/now', methods=['POST'])
+@roles_required(['admin'])
+def export_now_endpoint():
+    data = request.get_json(silent=True) or {}
+    series_ids = data.get('series_ids_to_export')
+    params = {'series_ids': series_ids if isinstance(series_ids, list) else 'all'}
+    try:
+        sala_id = _optional_int(data.get('sala_id'))
+    except ValueError:
+        return jsonify({"error": "El campo 'sala_id' debe ser un entero."}), 400
+    job_id = job_scheduler.enqueue_job('export_convo_cierre', sala_id=sala_id, params=params)
+    return jsonify({"message": "Exportación encolada.", "job_id": job_id}), 202
+
+@app.route('/api/admin/jobs', methods=['GET'])
+@roles_required(['admin'])
+def list_jobs_endpoint():
+    estado = request.args.get('estado')
+    if estado and estado not in ('pendiente', 'en_curso', 'ok', 'fallido'):
+        return jsonify({"error": "El parámetro 'estado' es inválido."}), 400
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify(job_scheduler.list_job_runs(estado=estado, limit=limit)), 200
+
+@app.route('/api/admin/jobs/<int:job_run_id>', methods=['GET'])
+@roles_required(['admin'])
+def get_job_endpoint(job_run_id):
+    job_run = job_scheduler.get_job_run(job_run_id)
+    if not job_run:
+        return jsonify({"error": "Ejecución no encontrada."}), 404
+    return jsonify(job_run), 200
+
 
 # --- Inicialización de la aplicación ---
+# Servidor de desarrollo. En producción: gunicorn -c gunicorn.conf.py wsgi:app
 if __name__ == '__main__':
-    with app.app_context():
-        # Comprobar si la tabla "Usuario" existe. Si no, inicializar la BD.
-        try:
-            db_handler.execute_query('SELECT 1 FROM "Usuario" LIMIT 1;', fetch_mode="one")
-            logging.info("La base de datos ya parece estar inicializada.")
-        except Exception:
-            logging.warning("No se pudo acceder a las tablas. Se intentará inicializar la base de datos.")
-            try:
-                db_handler.initialize_database()
-            except Exception as e:
-                logging.critical(f"FALLO CRÍTICO: No se pudo inicializar la base de datos. La aplicación no puede continuar. Error: {e}")
-                # En un entorno real, esto debería detener la aplicación.
-                # Para desarrollo, podemos dejar que Flask continúe e informe del error.
-                
+    try:
+        db_handler.ensure_schema()
+    except Exception as e:
+        logging.critical(f"FALLO CRÍTICO: el esquema de la base de datos no es utilizable. Error: {e}")
+        raise SystemExit(1)
+
     app.run(
         host=os.getenv('FLASK_RUN_HOST', '0.0.0.0'),
         port=int(os.getenv('FLASK_RUN_PORT', 5000)),
         debug=os.getenv('FLASK_ENV') != 'production'
-    )
\ No newline at end of file
+    )
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+audit_writer.py
+
+Escritor de auditoría en segundo plano: los eventos se encolan en memoria y un
+hilo los vuelca por lotes (INSERT multi-fila) al alcanzar AUDIT_BATCH_SIZE
+eventos o AUDIT_FLUSH_INTERVAL segundos. Lo usa db_handler.audit_log para
+sacar la escritura del camino crítico de la petición.
+Si la cola está llena, `enqueue` retorna False y quien llama escribe en síncrono.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))   # segundos
+AUDIT_RETRY_MAX = float(os.getenv("AUDIT_RETRY_MAX", "30"))              # espera máxima entre reintentos
+
+
+class AuditWriter:
+    """
+    Cola acotada más hilo de volcado. `write_batch(rows)` recibe una lista de
+    tuplas (entidad, entidad_id, usuario_id, accion, payload, created_at) y
+    debe insertarlas en una única transacción.
+    """
+
+    def __init__(self, write_batch, maxsize=AUDIT_QUEUE_SIZE, batch_size=AUDIT_BATCH_SIZE,
+                 flush_interval=AUDIT_FLUSH_INTERVAL):
+        self._write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()          # serializa los volcados (hilo y flush explícito)
+        self._thread = None
+        self._stop = threading.Event()
+        self._closed = False
+        self._carry = []                        # lote del hilo sin escribir al parar
+
+        # Estadísticas
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.rejected = 0
+        self.failed_batches = 0
+
+    def enqueue(self, row):
+        """Encola un evento. Retorna False si la cola está llena o el escritor está cerrado."""
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.enqueued += 1
+        self._ensure_started()
+        return True
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+                self._thread.start()
+
+    def _drain(self, batch):
+        """Completa `batch` con lo encolado, hasta batch_size eventos."""
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """Escribe un lote. Retorna False (sin perder el lote) si la BD falla."""
+        try:
+            self._write_batch(batch)
+        except Exception as e:
+            self.failed_batches += 1
+            logging.error(f"Fallo volcando {len(batch)} eventos de auditoría: {e}")
+            return False
+        self.written += len(batch)
+        self.batches += 1
+        return True
+
+    def _run(self):
+        pending = []
+        backoff = self.flush_interval
+        deadline = None
+        while not self._stop.is_set():
+            if not pending:
+                try:
+                    pending = [self._queue.get(timeout=self.flush_interval)]
+                except queue.Empty:
+                    continue
+                deadline = time.monotonic() + self.flush_interval
+            self._drain(pending)
+            if len(pending) < self.batch_size and time.monotonic() < deadline:
+                self._stop.wait(min(0.05, max(deadline - time.monotonic(), 0)))
+                continue
+            with self._lock:
+                ok = self._write(pending)
+            if ok:
+                pending, backoff = [], self.flush_interval
+            else:
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, AUDIT_RETRY_MAX)
+        # Al parar, lo que quedase a medias lo vuelca close() junto con la cola.
+        self._carry = pending
+
+    def flush(self):
+        """Vuelca en el hilo actual todo lo encolado. Retorna el número de eventos escritos."""
+        written = 0
+        with self._lock:
+            while True:
+                batch = self._drain(self._carry)
+                self._carry = []
+                if not batch:
+                    return written
+                if not self._write(batch):
+                    self._carry = batch
+                    return written
+                written += len(batch)
+
+    def close(self, timeout=10.0):
+        """
+        Detiene el hilo y vuelca lo pendiente (apagado ordenado). Si la BD falla,
+        reintenta con backoff hasta agotar `timeout` segundos en total.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._stop.set()
+        deadline = time.monotonic() + timeout
+        if self._thread is not None:
+            self._thread.join(timeout)
+        backoff = self.flush_interval
+        while True:
+            self.flush()
+            pendientes = self._queue.qsize() + len(self._carry)
+            if not pendientes or time.monotonic() + backoff > deadline:
+                break
+            time.sleep(backoff)
+            backoff = min(backoff * 2, AUDIT_RETRY_MAX)
+        if pendientes:
+            logging.error(f"Auditoría: {pendientes} eventos sin escribir al cerrar.")
+
+    def stats(self):
+        return {
+            'pending': self._queue.qsize() + len(self._carry),
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'batches': self.batches,
+            'rejected': self.rejected,
+            'failed_batches': self.failed_batches,
+        }
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark
+
+Banco de pruebas de carga y latencia de los caminos calientes de la API
+(login, convocatoria de sala, PATCH de estado/FX y reparto) contra un
+Postgres local.
+
+    python -m benchmark seed --series 10 --capitulos 20 --takes 40 --intervenciones 8
+    python -m benchmark run --clients 8 --duration 30 --output resultados.json
+    python -m benchmark compare base.json resultados.json
+    python -m benchmark statements --iteraciones 500 --output sentencias.json
+
+`seed` amplía seed.py con datos sintéticos marcados con el prefijo BENCH (se
+borran y regeneran en cada ejecución). `run` ataca la app Flask en el propio
+proceso (test client) o un servidor ya levantado (--url) con clientes
+concurrentes y escribe percentiles, throughput y sentencias SQL por endpoint.
+`statements` compara, sentencia a sentencia, el SQL de texto con las sentencias
+preparadas de prepared_statements.py (latencia, planificación y memoria).
+"""
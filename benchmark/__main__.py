@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Punto de entrada: python -m benchmark {seed,run,compare,statements}
+"""
+import argparse
+import datetime
+import json
+import logging
+import sys
+
+from benchmark import dataset, report, runner, statements
+
+
+def _parse_mix(value):
+    """'convocatoria=4,estado=3' -> {'convocatoria': 4.0, 'estado': 3.0}"""
+    mix = {}
+    for parte in value.split(','):
+        nombre, _, peso = parte.partition('=')
+        try:
+            mix[nombre.strip()] = float(peso) if peso else 1.0
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"Peso inválido en '{parte}'.")
+    return mix
+
+
+def _cmd_seed(args):
+    resultado = dataset.generate(
+        series=args.series, capitulos=args.capitulos, takes=args.takes, intervenciones=args.intervenciones,
+        personajes=args.personajes, actores=args.actores, salas=args.salas,
+        convocatorias=args.convocatorias, items=args.items, fecha=args.fecha, semilla=args.semilla,
+    )
+    print(json.dumps(resultado, indent=2))
+    return 0
+
+
+def _cmd_run(args):
+    ctx = dataset.load_context(args.fecha)
+    mix = args.mix or runner.DEFAULT_MIX
+    muestras, segundos, errores = runner.run(
+        ctx, clients=args.clients, duration=args.duration, warmup=args.warmup,
+        mix=mix, url=args.url, semilla=args.semilla,
+    )
+    parametros = {
+        'modo': 'http' if args.url else 'en_proceso',
+        'url': args.url,
+        'clients': args.clients,
+        'duration': args.duration,
+        'warmup': args.warmup,
+        'mix': mix,
+    }
+    resultados = report.build(muestras, segundos, parametros, dataset.describe(), errores)
+    print(report.format_table(resultados))
+    if errores:
+        print(f"\nErrores de cliente ({len(errores)}): {errores[0]}", file=sys.stderr)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados escritos en {args.output}")
+    return 0 if muestras else 1
+
+
+def _cmd_compare(args):
+    with open(args.base, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(args.nuevo, encoding='utf-8') as f:
+        nuevo = json.load(f)
+    texto, regresiones = report.compare(base, nuevo, args.umbral)
+    print(f"base:  {base['meta'].get('commit')} ({base['meta'].get('fecha')})")
+    print(f"nuevo: {nuevo['meta'].get('commit')} ({nuevo['meta'].get('fecha')})\n")
+    print(texto)
+    if regresiones:
+        print(f"\nRegresiones por encima del {args.umbral}%: {', '.join(regresiones)}")
+        return 1
+    return 0
+
+
+def _cmd_statements(args):
+    ctx = dataset.load_context(args.fecha)
+    sentencias = statements.run(ctx, iteraciones=args.iteraciones, warmup=args.warmup, semilla=args.semilla)
+    actualizacion = statements.run_actualizacion(ctx, iteraciones=args.iteraciones, semilla=args.semilla)
+    print(statements.format_table(sentencias))
+    print()
+    print(statements.format_table({'update_intervention_status': actualizacion}))
+    if args.output:
+        parametros = {'iteraciones': args.iteraciones, 'warmup': args.warmup}
+        resultados = {
+            'meta': report.meta(parametros, dataset.describe()),
+            'sentencias': sentencias,
+            'actualizacion': actualizacion,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados escritos en {args.output}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description="Benchmark de carga y latencia de la API.")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    fecha = dict(type=datetime.date.fromisoformat, default=None, help="Fecha de las convocatorias (hoy por defecto).")
+
+    p = sub.add_parser('seed', help="Regenera los datos sintéticos BENCH.")
+    p.add_argument('--series', type=int, default=10)
+    p.add_argument('--capitulos', type=int, default=20)
+    p.add_argument('--takes', type=int, default=40, help="Takes por capítulo.")
+    p.add_argument('--intervenciones', type=int, default=8, help="Intervenciones por take.")
+    p.add_argument('--personajes', type=int, default=12, help="Personajes por serie.")
+    p.add_argument('--actores', type=int, default=30)
+    p.add_argument('--salas', type=int, default=2)
+    p.add_argument('--convocatorias', type=int, default=1, help="Días de convocatoria por sala.")
+    p.add_argument('--items', type=int, default=60, help="Takes por convocatoria.")
+    p.add_argument('--fecha', **fecha)
+    p.add_argument('--semilla', type=int, default=42)
+    p.set_defaults(func=_cmd_seed)
+
+    p = sub.add_parser('run', help="Lanza los clientes concurrentes y mide.")
+    p.add_argument('--clients', type=int, default=8)
+    p.add_argument('--duration', type=float, default=30.0, help="Segundos medidos.")
+    p.add_argument('--warmup', type=float, default=5.0, help="Segundos de calentamiento descartados.")
+    p.add_argument('--mix', type=_parse_mix, default=None,
+                   help=f"Pesos por escenario, p. ej. 'convocatoria=4,estado=3' ({', '.join(runner.SCENARIOS)}).")
+    p.add_argument('--url', default=None, help="Servidor ya levantado (p. ej. http://localhost:5000). "
+                                               "Sin él se usa el test client de Flask en este proceso.")
+    p.add_argument('--output', default=None, help="Fichero JSON de resultados.")
+    p.add_argument('--fecha', **fecha)
+    p.add_argument('--semilla', type=int, default=1)
+    p.set_defaults(func=_cmd_run)
+
+    p = sub.add_parser('compare', help="Compara dos ficheros de resultados.")
+    p.add_argument('base')
+    p.add_argument('nuevo')
+    p.add_argument('--umbral', type=float, default=10.0, help="Porcentaje de empeoramiento que cuenta como regresión.")
+    p.set_defaults(func=_cmd_compare)
+
+    p = sub.add_parser('statements', help="SQL de texto frente a sentencias preparadas (latencia, plan, memoria).")
+    p.add_argument('--iteraciones', type=int, default=500, help="Llamadas medidas por sentencia y variante.")
+    p.add_argument('--warmup', type=int, default=20, help="Llamadas de calentamiento descartadas.")
+    p.add_argument('--output', default=None, help="Fichero JSON de resultados.")
+    p.add_argument('--fecha', **fecha)
+    p.add_argument('--semilla', type=int, default=1)
+    p.set_defaults(func=_cmd_statements)
+
+    args = parser.parse_args(argv)
+    # El log INFO de cada petición distorsionaría las medidas.
+    logging.basicConfig(level=logging.WARNING, force=True)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
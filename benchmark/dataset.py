@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark/dataset.py
+
+Datos sintéticos para el benchmark: series × capítulos × takes × intervenciones,
+actores y personajes por serie, y convocatorias por sala. Se apoya en seed.py
+para los usuarios y salas base; todo lo demás lleva el prefijo BENCH para poder
+borrarlo y regenerarlo sin tocar datos reales.
+"""
+import collections
+import datetime
+import random
+import time
+
+import db_handler
+import seed
+import timecode
+
+PREFIX = 'BENCH'
+FPS = 25
+PAGE_SIZE = 5000
+
+# Usuario de seed.py con el que se autentican los clientes (rol director).
+BENCH_USER = 'director_ana'
+BENCH_PASSWORD = 'director123'
+
+DIALOGOS = (
+    "¿Dónde estabas anoche?",
+    "No pienso volver a esa casa.",
+    "Te lo advertí, pero nunca escuchas.",
+    "Tenemos que salir de aquí antes de que amanezca.",
+    "Eso no es lo que acordamos.",
+    "Mira, no quiero discutir contigo ahora.",
+    "¡Corre, corre, que nos alcanzan!",
+    "La reunión empieza en cinco minutos.",
+    "Nunca imaginé que acabaría así.",
+    "Dame las llaves y vete.",
+    "Hay algo que no me estás contando.",
+    "Gracias por venir, de verdad.",
+)
+
+
+def clear(tx):
+    """Borra los datos BENCH. Las FK en cascada arrastran capítulos, takes, intervenciones e items."""
+    like = f"{PREFIX}%"
+    tx.execute('DELETE FROM "Convocatoria" WHERE odoo_batch_id LIKE %s;', (like,), fetch_mode="none")
+    tx.execute('DELETE FROM "Serie" WHERE referencia LIKE %s;', (like,), fetch_mode="none")
+    tx.execute('DELETE FROM "Personaje" WHERE nombre LIKE %s;', (like,), fetch_mode="none")
+    tx.execute('DELETE FROM "Actor" WHERE nombre LIKE %s;', (like,), fetch_mode="none")
+    tx.execute('DELETE FROM "Sala" WHERE codigo LIKE %s;', (like,), fetch_mode="none")
+
+
+def _insert_serie(tx, rng, numero, capitulos, takes, intervenciones, personajes, actor_ids, contadores):
+    """Inserta una serie completa. Retorna [(serie_id, capitulo_id, take_id)] en orden de grabación."""
+    ref = f"{PREFIX}-{numero:04d}"
+    serie_id = tx.execute(
+        'INSERT INTO "Serie" (nombre, referencia, fps) VALUES (%s, %s, %s) RETURNING id;',
+        (f"{PREFIX} serie {numero}", ref, FPS), fetch_mode="one"
+    )['id']
+    personaje_ids = [r['id'] for r in tx.execute_values(
+        'INSERT INTO "Personaje" (nombre, actor_id) VALUES %s RETURNING id;',
+        [(f"{PREFIX} {ref} personaje {n}", rng.choice(actor_ids)) for n in range(1, personajes + 1)],
+        fetch=True
+    )]
+    capitulo_ids = {r['numero']: r['id'] for r in tx.execute_values(
+        'INSERT INTO "Capitulo" (serie_id, numero, titulo) VALUES %s RETURNING id, numero;',
+        [(serie_id, n, f"Capítulo {n}") for n in range(1, capitulos + 1)], fetch=True
+    )}
+    take_rows = tx.execute_values(
+        'INSERT INTO "Take" (capitulo_id, numero) VALUES %s RETURNING id, capitulo_id, numero;',
+        [(capitulo_ids[c], n) for c in range(1, capitulos + 1) for n in range(1, takes + 1)],
+        page_size=PAGE_SIZE, fetch=True
+    )
+    take_rows.sort(key=lambda r: (r['capitulo_id'], r['numero']))
+
+    filas, en_capitulo = [], set()
+    frame_por_capitulo = collections.defaultdict(int)
+    for take in take_rows:
+        for orden in range(1, intervenciones + 1):
+            personaje_id = rng.choice(personaje_ids)
+            tc_in = frame_por_capitulo[take['capitulo_id']] + rng.randint(0, 2 * FPS)
+            tc_out = tc_in + rng.randint(FPS, 8 * FPS)
+            frame_por_capitulo[take['capitulo_id']] = tc_out
+            filas.append((take['id'], personaje_id, orden, rng.choice(DIALOGOS),
+                          timecode.format_frames(tc_in, FPS), timecode.format_frames(tc_out, FPS), tc_in, tc_out))
+            en_capitulo.add((take['capitulo_id'], personaje_id))
+    tx.execute_values("""
+        INSERT INTO "Intervencion" (take_id, personaje_id, orden, dialogo, tc_in, tc_out, tc_in_frames, tc_out_frames)
+        VALUES %s;
+    """, filas, page_size=PAGE_SIZE)
+    tx.execute_values(
+        'INSERT INTO "PersonajeEnCapitulo" (capitulo_id, personaje_id) VALUES %s;',
+        sorted(en_capitulo), page_size=PAGE_SIZE
+    )
+
+    contadores['series'] += 1
+    contadores['capitulos'] += len(capitulo_ids)
+    contadores['takes'] += len(take_rows)
+    contadores['intervenciones'] += len(filas)
+    contadores['personajes'] += len(personaje_ids)
+    return [(serie_id, take['capitulo_id'], take['id']) for take in take_rows]
+
+
+def generate(series=10, capitulos=20, takes=40, intervenciones=8, personajes=12, actores=30,
+             salas=2, convocatorias=1, items=60, fecha=None, semilla=42):
+    """
+    Regenera el juego de datos BENCH en una única transacción y actualiza las
+    estadísticas del planner. Las convocatorias empiezan en `fecha` (hoy por
+    defecto), una por día y sala, con `items` takes consecutivos cada una.
+    Retorna los contadores y el tiempo empleado.
+    """
+    rng = random.Random(semilla)
+    fecha = fecha or datetime.date.today()
+    seed.seed_data()
+    start = time.perf_counter()
+    contadores = collections.Counter()
+
+    with db_handler.transaction() as tx:
+        clear(tx)
+        actor_ids = [r['id'] for r in tx.execute_values(
+            'INSERT INTO "Actor" (nombre) VALUES %s RETURNING id;',
+            [(f"{PREFIX} actor {n}",) for n in range(1, actores + 1)], fetch=True
+        )]
+        contadores['actores'] = len(actor_ids)
+
+        todos_los_takes = []
+        for numero in range(1, series + 1):
+            todos_los_takes.extend(_insert_serie(
+                tx, rng, numero, capitulos, takes, intervenciones, personajes, actor_ids, contadores
+            ))
+
+        sala_ids = [r['id'] for r in tx.execute_values(
+            'INSERT INTO "Sala" (nombre, codigo) VALUES %s RETURNING id;',
+            [(f"{PREFIX} sala {n}", f"{PREFIX}-S{n}") for n in range(1, salas + 1)], fetch=True
+        )]
+        items = min(items, len(todos_los_takes))
+        for sala_id in sala_ids:
+            for dia in range(convocatorias):
+                dia_fecha = fecha + datetime.timedelta(days=dia)
+                convocatoria_id = tx.execute("""
+                    INSERT INTO "Convocatoria" (sala_id, fecha, turno, estado, odoo_batch_id)
+                    VALUES (%s, %s, 'mañana', 'importada', %s) RETURNING id;
+                """, (sala_id, dia_fecha, f"{PREFIX}-{sala_id}-{dia_fecha.isoformat()}"), fetch_mode="one")['id']
+                inicio = rng.randrange(len(todos_los_takes) - items + 1)
+                tx.execute_values("""
+                    INSERT INTO "ConvocatoriaItem" (convocatoria_id, serie_id, capitulo_id, take_id, odoo_item_id)
+                    VALUES %s;
+                """, [(convocatoria_id, serie_id, capitulo_id, take_id, f"{PREFIX}-{convocatoria_id}-{n}")
+                      for n, (serie_id, capitulo_id, take_id) in enumerate(todos_los_takes[inicio:inicio + items])])
+                contadores['convocatorias'] += 1
+                contadores['convocatoria_items'] += items
+
+    db_handler.execute_query('ANALYZE;', fetch_mode="none")
+    return {'contadores': dict(contadores), 'segundos': round(time.perf_counter() - start, 2)}
+
+
+def load_context(fecha=None, muestra=5000):
+    """
+    Lo que necesitan los escenarios: salas con convocatoria en `fecha`, series y
+    una muestra de intervenciones convocadas ese día. Lanza RuntimeError si no hay datos BENCH.
+    """
+    fecha = fecha or datetime.date.today()
+    salas = [r['sala_id'] for r in db_handler.execute_query("""
+        SELECT DISTINCT sala_id FROM "Convocatoria" WHERE fecha = %s AND odoo_batch_id LIKE %s;
+    """, (fecha, f"{PREFIX}%"))]
+    if not salas:
+        raise RuntimeError(f"No hay convocatorias BENCH para {fecha}: ejecute antes `python -m benchmark seed`.")
+    series = [r['id'] for r in db_handler.execute_query(
+        'SELECT id FROM "Serie" WHERE referencia LIKE %s;', (f"{PREFIX}%",)
+    )]
+    intervenciones = [r['id'] for r in db_handler.execute_query("""
+        SELECT i.id
+        FROM "Convocatoria" c
+        JOIN "ConvocatoriaItem" ci ON ci.convocatoria_id = c.id
+        JOIN "Intervencion" i ON i.take_id = ci.take_id
+        WHERE c.fecha = %s AND c.odoo_batch_id LIKE %s
+        ORDER BY random()
+        LIMIT %s;
+    """, (fecha, f"{PREFIX}%", muestra))]
+    return {'fecha': fecha.isoformat(), 'salas': salas, 'series': series, 'intervenciones': intervenciones}
+
+
+def describe():
+    """Tamaño de los datos BENCH (para dejarlo anotado junto a los resultados)."""
+    like = f"{PREFIX}%"
+    return dict(db_handler.execute_query("""
+        SELECT
+            (SELECT count(*) FROM "Serie" WHERE referencia LIKE %(like)s) AS series,
+            (SELECT count(*) FROM "Capitulo" c JOIN "Serie" s ON s.id = c.serie_id
+              WHERE s.referencia LIKE %(like)s) AS capitulos,
+            (SELECT count(*) FROM "Take" t JOIN "Capitulo" c ON c.id = t.capitulo_id
+              JOIN "Serie" s ON s.id = c.serie_id WHERE s.referencia LIKE %(like)s) AS takes,
+            (SELECT count(*) FROM "Intervencion" i JOIN "Take" t ON t.id = i.take_id
+              JOIN "Capitulo" c ON c.id = t.capitulo_id JOIN "Serie" s ON s.id = c.serie_id
+              WHERE s.referencia LIKE %(like)s) AS intervenciones,
+            (SELECT count(*) FROM "Convocatoria" WHERE odoo_batch_id LIKE %(like)s) AS convocatorias;
+    """, {'like': like}, fetch_mode="one"))
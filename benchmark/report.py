@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark/report.py
+
+Resumen de las muestras por escenario (percentiles de latencia, throughput,
+errores y sentencias SQL), salida JSON y comparación entre dos ejecuciones.
+"""
+import datetime
+import math
+import os
+import platform
+import subprocess
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, p):
+    """Percentil por rango más cercano sobre una lista ya ordenada."""
+    if not sorted_values:
+        return None
+    k = max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)
+    return sorted_values[k]
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), timeout=5)
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if commit.returncode != 0:
+        return None
+    return commit.stdout.strip() + ('-dirty' if dirty.stdout.strip() else '')
+
+
+def _resumen(latencias, statuses, queries, segundos):
+    latencias = sorted(latencias)
+    errores = sum(1 for s in statuses if s is None or s >= 500)
+    rechazos = sum(1 for s in statuses if s is not None and 400 <= s < 500)
+    resumen = {
+        'peticiones': len(latencias),
+        'errores': errores,
+        'rechazos_4xx': rechazos,
+        'rps': round(len(latencias) / segundos, 2) if segundos else None,
+        'latencia_ms': {
+            **{f"p{p}": round(percentile(latencias, p), 2) if latencias else None for p in PERCENTILES},
+            'media': round(sum(latencias) / len(latencias), 2) if latencias else None,
+            'max': round(latencias[-1], 2) if latencias else None,
+        },
+    }
+    queries = [q for q in queries if q is not None]
+    resumen['sql_por_peticion'] = {
+        'media': round(sum(queries) / len(queries), 2),
+        'max': max(queries),
+    } if queries else None
+    return resumen
+
+
+def meta(parametros, dataset, **extra):
+    """Cabecera común de los resultados: cuándo, qué commit, dónde y con qué datos."""
+    return {
+        'fecha': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'host': platform.node(),
+        'parametros': parametros,
+        'dataset': dataset,
+        **extra,
+    }
+
+
+def build(muestras, segundos, parametros, dataset, errores_cliente):
+    """Documento de resultados (serializable a JSON)."""
+    por_escenario = {}
+    for nombre, ms, status, queries in muestras:
+        bucket = por_escenario.setdefault(nombre, ([], [], []))
+        bucket[0].append(ms)
+        bucket[1].append(status)
+        bucket[2].append(queries)
+    return {
+        'meta': meta(parametros, dataset, segundos_medidos=round(segundos, 2), errores_cliente=errores_cliente),
+        'total': _resumen([m[1] for m in muestras], [m[2] for m in muestras], [m[3] for m in muestras], segundos),
+        'endpoints': {
+            nombre: _resumen(lat, st, q, segundos) for nombre, (lat, st, q) in sorted(por_escenario.items())
+        },
+    }
+
+
+def format_table(resultados):
+    filas = [f"{'escenario':<14}{'pet.':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'err':>6}{'sql':>7}"]
+    for nombre, r in list(resultados['endpoints'].items()) + [('TOTAL', resultados['total'])]:
+        lat = r['latencia_ms']
+        sql = r['sql_por_peticion']['media'] if r['sql_por_peticion'] else '-'
+        filas.append(f"{nombre:<14}{r['peticiones']:>8}{r['rps'] or 0:>9}{lat['p50'] or 0:>9}"
+                     f"{lat['p95'] or 0:>9}{lat['p99'] or 0:>9}{r['errores']:>6}{sql:>7}")
+    return "\n".join(filas)
+
+
+def _delta(antes, despues):
+    if antes in (None, 0) or despues is None:
+        return None
+    return round((despues - antes) / antes * 100, 1)
+
+
+def compare(base, nuevo, umbral=10.0):
+    """
+    Compara dos ejecuciones por endpoint. Retorna (texto, regresiones): una
+    regresión es un p95 que empeora más de `umbral` %, o un throughput que baja más de `umbral` %.
+    """
+    filas = [f"{'escenario':<14}{'p95 antes':>11}{'p95 ahora':>11}{'Δ%':>8}{'rps antes':>11}{'rps ahora':>11}{'Δ%':>8}"]
+    regresiones = []
+    for nombre in sorted(set(base['endpoints']) | set(nuevo['endpoints'])):
+        a, b = base['endpoints'].get(nombre), nuevo['endpoints'].get(nombre)
+        if a is None or b is None:
+            filas.append(f"{nombre:<14} solo en {'la nueva' if a is None else 'la base'}")
+            continue
+        p95_a, p95_b = a['latencia_ms']['p95'], b['latencia_ms']['p95']
+        d_p95, d_rps = _delta(p95_a, p95_b), _delta(a['rps'], b['rps'])
+        filas.append(f"{nombre:<14}{p95_a or 0:>11}{p95_b or 0:>11}{d_p95 if d_p95 is not None else '-':>8}"
+                     f"{a['rps'] or 0:>11}{b['rps'] or 0:>11}{d_rps if d_rps is not None else '-':>8}")
+        if (d_p95 is not None and d_p95 > umbral) or (d_rps is not None and d_rps < -umbral):
+            regresiones.append(nombre)
+    return "\n".join(filas), regresiones
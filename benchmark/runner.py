@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark/runner.py
+
+Clientes concurrentes contra la API. Cada cliente es un hilo con su propia
+sesión: hace login y después elige escenarios al azar según los pesos de la
+mezcla hasta que se acaba el tiempo. Se descartan las peticiones del
+calentamiento.
+
+Dos modos:
+- en proceso (por defecto): `app.test_client()` de api_app, sin red de por medio.
+- HTTP (--url): contra un servidor ya levantado (p. ej. gunicorn).
+En ambos las sentencias SQL de cada petición se leen de la cabecera
+X-DB-Queries que añade instrumentation.py.
+"""
+import http.cookiejar
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from benchmark.dataset import BENCH_PASSWORD, BENCH_USER
+
+DEFAULT_MIX = {'convocatoria': 4, 'estado': 3, 'fx': 2, 'reparto': 1, 'login': 0.2}
+
+
+def _queries(headers):
+    queries = headers.get('X-DB-Queries')
+    return int(queries) if queries is not None else None
+
+
+class InProcessClient:
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, body=None):
+        """Retorna (status, sentencias SQL)."""
+        response = self._client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code, _queries(response.headers)
+
+
+class HttpClient:
+    def __init__(self, base_url, timeout=30):
+        self._base_url = base_url.rstrip('/')
+        self._timeout = timeout
+        self._opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def request(self, method, path, body=None):
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(
+            self._base_url + path, data=data, method=method,
+            headers={'Content-Type': 'application/json'} if data else {}
+        )
+        try:
+            with self._opener.open(request, timeout=self._timeout) as response:
+                response.read()
+                status, headers = response.status, response.headers
+        except urllib.error.HTTPError as e:
+            e.read()
+            status, headers = e.code, e.headers
+        return status, _queries(headers)
+
+
+# --- Escenarios: (método, ruta, body) a partir del contexto de datos ---
+def _login(ctx, rng):
+    return 'POST', '/api/login', {'nombre': BENCH_USER, 'password': BENCH_PASSWORD}
+
+def _convocatoria(ctx, rng):
+    return 'GET', f"/api/salas/{rng.choice(ctx['salas'])}/convocatoria?fecha={ctx['fecha']}", None
+
+def _estado(ctx, rng):
+    estado = rng.choice(('pendiente', 'realizado', 'omitido'))
+    body = {'estado': estado, 'estado_nota': 'Benchmark' if estado == 'omitido' else None}
+    return 'PATCH', f"/api/intervenciones/{rng.choice(ctx['intervenciones'])}/estado", body
+
+def _fx(ctx, rng):
+    needs_fx = rng.random() < 0.5
+    body = {'needs_fx': needs_fx, 'fx_note': 'Efecto benchmark' if needs_fx else None, 'fx_source': 'manual'}
+    return 'PATCH', f"/api/intervenciones/{rng.choice(ctx['intervenciones'])}/fx", body
+
+def _reparto(ctx, rng):
+    return 'GET', f"/api/series/{rng.choice(ctx['series'])}/reparto", None
+
+SCENARIOS = {
+    'login': _login,
+    'convocatoria': _convocatoria,
+    'estado': _estado,
+    'fx': _fx,
+    'reparto': _reparto,
+}
+
+
+def _client_loop(make_client, ctx, mix, semilla, inicio_medida, fin, muestras, errores):
+    rng = random.Random(semilla)
+    nombres, pesos = zip(*mix.items())
+    try:
+        client = make_client()
+        status, _ = client.request(*_login(ctx, rng))
+        if status != 200:
+            raise RuntimeError(f"login devolvió {status}")
+    except Exception as e:
+        errores.append(str(e))
+        return
+    while True:
+        ahora = time.perf_counter()
+        if ahora >= fin:
+            return
+        nombre = rng.choices(nombres, pesos)[0]
+        method, path, body = SCENARIOS[nombre](ctx, rng)
+        start = time.perf_counter()
+        try:
+            status, queries = client.request(method, path, body)
+        except Exception as e:
+            status, queries = None, None
+            if len(errores) < 20:
+                errores.append(f"{nombre}: {e}")
+        elapsed = time.perf_counter() - start
+        if start >= inicio_medida:
+            muestras.append((nombre, elapsed * 1000, status, queries))
+
+
+def run(ctx, clients=8, duration=30.0, warmup=5.0, mix=None, url=None, semilla=1):
+    """
+    Lanza `clients` hilos durante `warmup + duration` segundos. Retorna
+    (muestras, segundos medidos, errores de cliente); cada muestra es
+    (escenario, milisegundos, status HTTP o None, sentencias SQL o None).
+    """
+    mix = {k: v for k, v in (mix or DEFAULT_MIX).items() if v > 0}
+    desconocidos = set(mix) - set(SCENARIOS)
+    if desconocidos:
+        raise ValueError(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+    if url:
+        def make_client():
+            return HttpClient(url)
+    else:
+        from api_app import app
+        def make_client():
+            return InProcessClient(app)
+
+    inicio = time.perf_counter()
+    inicio_medida = inicio + warmup
+    fin = inicio_medida + duration
+    por_hilo = [[] for _ in range(clients)]
+    errores = []
+    threads = [
+        threading.Thread(
+            target=_client_loop, name=f"bench-{n}",
+            args=(make_client, ctx, mix, semilla + n, inicio_medida, fin, por_hilo[n], errores),
+        )
+        for n in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    medidos = min(time.perf_counter(), fin) - inicio_medida
+    return [m for muestras in por_hilo for m in muestras], medidos, errores
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark/statements.py
+
+Micro-benchmark de las sentencias del registro de prepared_statements, sobre
+una sola conexión y sin HTTP. Para cada sentencia compara:
+
+- dict_texto: SQL completo con RealDictCursor (el camino de execute_query).
+- tupla_texto: SQL completo con cursor de tuplas y filas namedtuple.
+- preparada: EXECUTE por nombre con filas namedtuple.
+
+Mide latencia por llamada, tiempo de planificación en el servidor (EXPLAIN
+ANALYZE, solo lecturas) y memoria que reserva Python por llamada (tracemalloc).
+Las escrituras se deshacen con ROLLBACK tras cada llamada.
+"""
+import random
+import time
+import tracemalloc
+
+import psycopg2.extras
+
+import db_handler
+import prepared_statements
+from benchmark import dataset, report
+from data_handler import CONVOCATORIA_ETAG, CONVOCATORIA_HOY, CONVOCATORIA_IDS, REPARTO, DataHandler
+
+VARIANTES = ('dict_texto', 'tupla_texto', 'preparada')
+
+
+def _casos(ctx, usuario_id):
+    """{nombre: (Statement, función rng -> params)} de las sentencias a medir."""
+    fecha = ctx['fecha']
+    salas, series, intervenciones = ctx['salas'], ctx['series'], ctx['intervenciones']
+    return {
+        'convocatoria_hoy': (CONVOCATORIA_HOY, lambda rng: (rng.choice(salas), fecha)),
+        'convocatoria_ids': (CONVOCATORIA_IDS, lambda rng: (rng.choice(salas), fecha)),
+        'convocatoria_etag': (CONVOCATORIA_ETAG, lambda rng: (rng.choice(salas), fecha)),
+        'reparto': (REPARTO, lambda rng: (rng.choice(series),)),
+        'audit_insert': (db_handler._AUDIT_INSERT_TX, lambda rng: (
+            'Intervencion', rng.choice(intervenciones), usuario_id, 'BENCH', None)),
+    }
+
+
+def _ejecutar(conn, cursores, statement, params, variante):
+    if variante == 'dict_texto':
+        cursor = cursores['dict']
+        cursor.execute(statement.sql, params)
+        return cursor.fetchall() if cursor.description else cursor.rowcount
+    fetch_mode = 'all' if not statement.writes else 'none'
+    prepared_statements.DB_PREPARED_STATEMENTS = variante == 'preparada'
+    return prepared_statements.execute(conn, cursores['tupla'], statement, params, fetch_mode)
+
+
+def _planificacion(cursor, statement, params, variante):
+    """Planning Time (ms) que informa EXPLAIN ANALYZE para la variante."""
+    if variante == 'preparada':
+        sql, args = statement.execute_sql, statement.bind(params)
+    else:
+        sql, args = statement.sql, params
+    cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", args)
+    return cursor.fetchone()[0][0]['Planning Time']
+
+
+def _medir(conn, cursores, statement, generar, variante, iteraciones, semilla):
+    rng = random.Random(semilla)
+    latencias, planificacion = [], []
+    for i in range(iteraciones):
+        params = generar(rng)
+        start = time.perf_counter()
+        _ejecutar(conn, cursores, statement, params, variante)
+        latencias.append((time.perf_counter() - start) * 1000)
+        if statement.writes:
+            conn.rollback()
+        elif i % 10 == 0:
+            planificacion.append(_planificacion(cursores['tupla'], statement, params, variante))
+    conn.rollback()
+
+    # Memoria en una pasada aparte: tracemalloc ralentiza todo lo demás.
+    muestras = max(iteraciones // 10, 1)
+    tracemalloc.start()
+    try:
+        reservado = 0
+        for _ in range(muestras):
+            params = generar(rng)
+            antes = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            filas = _ejecutar(conn, cursores, statement, params, variante)
+            reservado += tracemalloc.get_traced_memory()[1] - antes
+            del filas
+            if statement.writes:
+                conn.rollback()
+    finally:
+        tracemalloc.stop()
+    conn.rollback()
+
+    latencias.sort()
+    return {
+        'llamadas': iteraciones,
+        'p50_ms': round(report.percentile(latencias, 50), 3),
+        'p95_ms': round(report.percentile(latencias, 95), 3),
+        'media_ms': round(sum(latencias) / len(latencias), 3),
+        'planificacion_ms': round(sum(planificacion) / len(planificacion), 3) if planificacion else None,
+        'kib_por_llamada': round(reservado / muestras / 1024, 1),
+    }
+
+
+def run(ctx, iteraciones=500, warmup=20, semilla=1):
+    """Retorna {sentencia: {variante: métricas}}."""
+    usuario_id = db_handler.execute_query(
+        'SELECT id FROM "Usuario" WHERE nombre = %s;', (dataset.BENCH_USER,), fetch_mode="one"
+    )['id']
+    casos = _casos(ctx, usuario_id)
+    anterior = prepared_statements.DB_PREPARED_STATEMENTS
+    resultados = {}
+    try:
+        with db_handler.pooled_connection() as conn:
+            cursores = {'dict': conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor), 'tupla': conn.cursor()}
+            try:
+                for nombre, (statement, generar) in casos.items():
+                    resultados[nombre] = {}
+                    for variante in VARIANTES:
+                        # Calentamiento: PREPARE y paso a plan genérico (tras 5 EXECUTE) fuera de la medida.
+                        _medir(conn, cursores, statement, generar, variante, warmup, semilla)
+                        resultados[nombre][variante] = _medir(
+                            conn, cursores, statement, generar, variante, iteraciones, semilla)
+            finally:
+                for cursor in cursores.values():
+                    cursor.close()
+                conn.rollback()
+    finally:
+        prepared_statements.DB_PREPARED_STATEMENTS = anterior
+    return resultados
+
+
+def run_actualizacion(ctx, iteraciones=500, semilla=1):
+    """
+    update_intervention_status dentro de una transacción deshecha, con y sin
+    sentencias preparadas (el UPDATE con su auditoría y NOTIFY en una sentencia).
+    """
+    handler = DataHandler()
+    usuario_id = db_handler.execute_query(
+        'SELECT id FROM "Usuario" WHERE nombre = %s;', (dataset.BENCH_USER,), fetch_mode="one"
+    )['id']
+    anterior = prepared_statements.DB_PREPARED_STATEMENTS
+    resultados = {}
+    try:
+        for variante in ('tupla_texto', 'preparada'):
+            prepared_statements.DB_PREPARED_STATEMENTS = variante == 'preparada'
+            rng = random.Random(semilla)
+            latencias = []
+            with db_handler.pooled_connection() as conn:
+                tx = db_handler.Transaction(conn)
+                try:
+                    for _ in range(iteraciones):
+                        estado = rng.choice(('pendiente', 'realizado', 'omitido'))
+                        start = time.perf_counter()
+                        handler.update_intervention_status(
+                            rng.choice(ctx['intervenciones']), estado, None, usuario_id, tx=tx)
+                        latencias.append((time.perf_counter() - start) * 1000)
+                        conn.rollback()
+                finally:
+                    tx.cursor.close()
+                    if tx.tuple_cursor is not None:
+                        tx.tuple_cursor.close()
+                    conn.rollback()
+            latencias.sort()
+            resultados[variante] = {
+                'llamadas': iteraciones,
+                'p50_ms': round(report.percentile(latencias, 50), 3),
+                'p95_ms': round(report.percentile(latencias, 95), 3),
+                'media_ms': round(sum(latencias) / len(latencias), 3),
+            }
+    finally:
+        prepared_statements.DB_PREPARED_STATEMENTS = anterior
+    return resultados
+
+
+def format_table(resultados):
+    """Tabla de texto: una fila por sentencia y variante."""
+    cabecera = (f"{'sentencia':<22} {'variante':<12} {'p50 ms':>8} {'p95 ms':>8} {'media ms':>9} "
+                f"{'plan ms':>8} {'KiB/llam':>9}")
+    lineas = [cabecera, '-' * len(cabecera)]
+    for nombre, variantes in resultados.items():
+        for variante, m in variantes.items():
+            plan = f"{m['planificacion_ms']:.3f}" if m.get('planificacion_ms') is not None else '-'
+            kib = f"{m['kib_por_llamada']:.1f}" if m.get('kib_por_llamada') is not None else '-'
+            lineas.append(f"{nombre:<22} {variante:<12} {m['p50_ms']:>8.3f} {m['p95_ms']:>8.3f} "
+                          f"{m['media_ms']:>9.3f} {plan:>8} {kib:>9}")
+    return '\n'.join(lineas)
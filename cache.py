@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+cache.py
+
+Caché read-through para datos que cambian poco y se leen mucho (reparto,
+estructura de capítulos). Por defecto vive en memoria del proceso (TTL + LRU);
+si CACHE_URL apunta a un Redis (o compatible) y el paquete `redis` está
+instalado, se comparte entre procesos.
+
+Las claves van agrupadas por espacio de nombres ('reparto', 'capitulo', ...).
+Cada espacio lleva un número de generación: invalidar el espacio entero es
+incrementar la generación, sin recorrer claves.
+
+En memoria cada proceso (worker de gunicorn, worker de tareas) tiene su copia:
+las invalidaciones se reenvían al resto con el publicador que instala
+change_feed.attach_cache (NOTIFY); sin él solo se invalida este proceso.
+"""
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+CACHE_URL = os.getenv("CACHE_URL")                         # ej. redis://localhost:6379/0
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "2048"))
+CACHE_DEFAULT_TTL = float(os.getenv("CACHE_DEFAULT_TTL", "60"))
+
+
+class MemoryBackend:
+    """Almacén en memoria con TTL por entrada y expulsión LRU."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = collections.OrderedDict()   # key -> (expires_at, value)
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return False, None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return False, None
+            self._data.move_to_end(key)
+            return True, value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def generation(self, namespace):
+        with self._lock:
+            return self._generations.get(namespace, 0)
+
+    def bump_generation(self, namespace):
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+
+    def size(self):
+        with self._lock:
+            return len(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class RedisBackend:
+    """Almacén Redis: TTL nativo y LRU según la política maxmemory del servidor."""
+
+    def __init__(self, url):
+        import redis  # dependencia opcional
+        self._client = redis.Redis.from_url(url)
+        self.evictions = None
+
+    def get(self, key):
+        raw = self._client.get(key)
+        if raw is None:
+            return False, None
+        return True, json.loads(raw)
+
+    def set(self, key, value, ttl):
+        self._client.set(key, json.dumps(value, default=str), px=int(ttl * 1000))
+
+    def delete(self, key):
+        self._client.delete(key)
+
+    def generation(self, namespace):
+        return int(self._client.get(f"gen:{namespace}") or 0)
+
+    def bump_generation(self, namespace):
+        self._client.incr(f"gen:{namespace}")
+
+    def size(self):
+        return self._client.dbsize()
+
+
+class Cache:
+    """Fachada con espacios de nombres, read-through y contadores de aciertos/fallos."""
+
+    def __init__(self, backend, default_ttl=CACHE_DEFAULT_TTL):
+        self.backend = backend
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        self._hits = collections.Counter()
+        self._misses = collections.Counter()
+        self._publisher = None
+        self._synced = True        # False: pueden haberse perdido invalidaciones de otros procesos
+        self.published = 0
+        self.remote_invalidations = 0
+
+    @property
+    def shared(self):
+        """True si el backend es común a todos los procesos (no hace falta reenviar invalidaciones)."""
+        return not isinstance(self.backend, MemoryBackend)
+
+    def set_publisher(self, publish):
+        """`publish(namespace, key)` avisa de una invalidación a los demás procesos."""
+        self._publisher = publish
+
+    def _key(self, namespace, key):
+        return f"asrec:{namespace}:{self.backend.generation(namespace)}:{key}"
+
+    def set_synced(self, synced):
+        """
+        Con synced=False la caché se salta (todo va al loader) hasta volver a True,
+        momento en que se vacía la copia local: lo cacheado antes puede estar obsoleto.
+        """
+        if synced and not self.shared:
+            self.backend.clear()
+        self._synced = synced
+
+    def get_or_load(self, namespace, key, loader, ttl=None):
+        """Retorna el valor cacheado o llama a `loader()` y lo guarda. No cachea None."""
+        if not self._synced:
+            return loader()
+        full_key = self._key(namespace, key)
+        try:
+            hit, value = self.backend.get(full_key)
+        except Exception as e:
+            logging.warning(f"Caché no disponible ({e}); se consulta la BD directamente.")
+            return loader()
+        with self._lock:
+            (self._hits if hit else self._misses)[namespace] += 1
+        if hit:
+            return value
+
+        value = loader()
+        if value is not None:
+            try:
+                self.backend.set(full_key, value, ttl or self.default_ttl)
+            except Exception as e:
+                logging.warning(f"No se pudo guardar en caché {full_key}: {e}")
+        return value
+
+    def _invalidate_local(self, namespace, key):
+        try:
+            if key is None:
+                self.backend.bump_generation(namespace)
+            else:
+                self.backend.delete(self._key(namespace, key))
+        except Exception as e:
+            logging.warning(f"No se pudo invalidar la caché {namespace}:{key}: {e}")
+
+    def invalidate(self, namespace, key=None):
+        """
+        Invalida una clave o, sin `key`, todo el espacio de nombres, en este proceso
+        y (con publicador) en los demás. Llamar después del COMMIT del cambio.
+        """
+        self._invalidate_local(namespace, key)
+        if self._publisher is None or self.shared:
+            return
+        try:
+            self._publisher(namespace, key)
+            self.published += 1
+        except Exception as e:
+            logging.warning(f"No se pudo avisar de la invalidación {namespace}:{key} a otros procesos: {e}")
+
+    def apply_remote(self, namespace, key=None):
+        """Aplica una invalidación que llega de otro proceso (sin reenviarla)."""
+        self._invalidate_local(namespace, key)
+        self.remote_invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            namespaces = set(self._hits) | set(self._misses)
+            por_espacio = {
+                ns: {'hits': self._hits[ns], 'misses': self._misses[ns]} for ns in sorted(namespaces)
+            }
+            hits, misses = sum(self._hits.values()), sum(self._misses.values())
+        try:
+            entries = self.backend.size()
+        except Exception:
+            entries = None
+        return {
+            'backend': type(self.backend).__name__,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+            'entries': entries,
+            'evictions': self.backend.evictions,
+            'broadcast': self._publisher is not None and not self.shared,
+            'synced': self._synced,
+            'published': self.published,
+            'remote_invalidations': self.remote_invalidations,
+            'namespaces': por_espacio,
+        }
+
+
+def _create_backend():
+    if CACHE_URL:
+        try:
+            return RedisBackend(CACHE_URL)
+        except ImportError:
+            logging.warning("CACHE_URL definido pero el paquete 'redis' no está instalado; se usa caché en memoria.")
+    return MemoryBackend()
+
+
+cache = Cache(_create_backend())
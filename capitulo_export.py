@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+capitulo_export.py
+
+Serialización en streaming del guion de un capítulo (takes e intervenciones)
+a XLSX, CSV o Parquet. Las filas llegan de un cursor de servidor y cada
+formato produce trozos de bytes, así que la memoria no crece con el capítulo.
+"""
+import csv
+import io
+import os
+import re
+import tempfile
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", str(64 * 1024)))
+# Por encima de este tamaño el XLSX temporal pasa de memoria a disco.
+EXPORT_SPOOL_MAX = int(os.getenv("EXPORT_SPOOL_MAX", str(8 * 1024 * 1024)))
+
+# (clave de la fila, cabecera en el fichero)
+COLUMNS = (
+    ('take_numero', 'Take'),
+    ('orden', 'Orden'),
+    ('personaje', 'Personaje'),
+    ('actor', 'Actor'),
+    ('tc_in', 'TC IN'),
+    ('tc_out', 'TC OUT'),
+    ('dialogo', 'Diálogo'),
+    ('estado', 'Estado'),
+    ('estado_nota', 'Nota estado'),
+    ('needs_fx', 'FX'),
+    ('fx_note', 'Nota FX'),
+)
+
+FORMATS = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def _values(row):
+    return [row[key] for key, _ in COLUMNS]
+
+
+def _iter_file(f):
+    f.seek(0)
+    while True:
+        chunk = f.read(EXPORT_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_xlsx(titulo, rows):
+    """
+    XLSX en modo write_only: openpyxl vuelca cada fila a un XML temporal en disco
+    en lugar de mantener las celdas en memoria. El zip final solo existe al
+    cerrar el libro, así que se escribe a un fichero temporal y se envía a trozos.
+    """
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=re.sub(r'[\[\]:*?/\\]', ' ', titulo)[:31] or 'Capitulo')
+    sheet.freeze_panes = 'A2'
+    bold = Font(bold=True)
+    header = []
+    for _, nombre in COLUMNS:
+        cell = WriteOnlyCell(sheet, value=nombre)
+        cell.font = bold
+        header.append(cell)
+    sheet.append(header)
+    for row in rows:
+        sheet.append(_values(row))
+
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX) as f:
+        workbook.save(f)
+        yield from _iter_file(f)
+
+
+def iter_csv(rows):
+    """CSV (UTF-8 con BOM para que Excel respete los acentos), un trozo por bloque de filas."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow([nombre for _, nombre in COLUMNS])
+    for row in rows:
+        writer.writerow(_values(row))
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def iter_parquet(rows, row_group_size=10000):
+    """Parquet por row groups de `row_group_size` filas. Requiere pyarrow (opcional)."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('take_numero', pa.int32()), ('orden', pa.int32()), ('personaje', pa.string()),
+        ('actor', pa.string()), ('tc_in', pa.string()), ('tc_out', pa.string()),
+        ('dialogo', pa.string()), ('estado', pa.string()), ('estado_nota', pa.string()),
+        ('needs_fx', pa.bool_()), ('fx_note', pa.string()),
+    ])
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX) as f:
+        writer = pq.ParquetWriter(f, schema)
+        page = []
+        for row in rows:
+            page.append(row)
+            if len(page) >= row_group_size:
+                writer.write_table(pa.Table.from_pylist(page, schema=schema))
+                page = []
+        if page:
+            writer.write_table(pa.Table.from_pylist(page, schema=schema))
+        writer.close()
+        yield from _iter_file(f)
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def iter_export(formato, titulo, rows):
+    """Trozos de bytes del export en el formato pedido ('xlsx', 'csv' o 'parquet')."""
+    if formato == 'xlsx':
+        return iter_xlsx(titulo, rows)
+    if formato == 'csv':
+        return iter_csv(rows)
+    if formato == 'parquet':
+        return iter_parquet(rows)
+    raise ValueError(f"Formato de export no soportado: {formato}")
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+change_feed.py
+
+Difusión en tiempo real de cambios en intervenciones.
+Las escrituras de DataHandler lanzan un pg_notify en el canal CHANGE_FEED_CHANNEL;
+un único hilo por proceso hace LISTEN con una conexión dedicada (fuera del pool)
+y reparte cada aviso entre los clientes suscritos a la convocatoria afectada.
+Cada cliente tiene su propia cola acotada: si no la vacía a tiempo se le envía
+un evento 'resync' para que recargue la convocatoria completa.
+
+En producción los streams los sirve sse_server.py (un proceso asyncio: un
+cliente es una corrutina, no un hilo) y la API solo redirige a él (SSE_URL).
+Sin SSE_URL la API los sirve ella misma con este ChangeFeed: con workers
+gthread cada suscriptor ocupa un hilo del worker mientras dura, así que
+CHANGE_FEED_MAX_SUBSCRIBERS los limita por proceso (por defecto la mitad de
+WEB_THREADS) y los streams de más se rechazan con SubscriberLimit.
+
+El mismo listener atiende el canal CACHE_CHANNEL: las invalidaciones de la caché
+en memoria de un proceso se aplican en todos (ver attach_cache).
+"""
+import json
+import logging
+import os
+import queue
+import select
+import socket
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+import db_handler
+
+CHANGE_FEED_CHANNEL = "intervencion_cambios"
+CACHE_CHANNEL = "cache_invalidacion"
+CHANGE_FEED_QUEUE_SIZE = int(os.getenv("CHANGE_FEED_QUEUE_SIZE", "256"))
+CHANGE_FEED_RECONNECT_MAX = float(os.getenv("CHANGE_FEED_RECONNECT_MAX", "30"))
+CHANGE_FEED_MAX_SUBSCRIBERS = int(os.getenv(
+    "CHANGE_FEED_MAX_SUBSCRIBERS", str(max(int(os.getenv("WEB_THREADS", "8")) // 2, 1))))
+
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "3000"))
+
+EVENT_CAMBIO = "cambio"
+EVENT_RESYNC = "resync"
+EVENT_CLOSE = "close"      # interno: el stream debe terminar (drenaje del worker)
+
+
+def parse_cambio(payload, channel=CHANGE_FEED_CHANNEL):
+    """Aviso de cambio -> (ids de convocatoria, diff para los clientes); None si está malformado."""
+    try:
+        cambio = json.loads(payload)
+    except ValueError:
+        logging.warning(f"Aviso de cambio malformado en '{channel}': {payload[:200]}")
+        return None
+    diff = {
+        'intervencion_id': cambio.get('intervencion_id'),
+        'estado': cambio.get('estado'),
+        'needs_fx': cambio.get('needs_fx'),
+        'version': cambio.get('version'),
+    }
+    return cambio.get('convocatorias') or (), diff
+
+
+def format_event(event, data):
+    """Evento SSE (texto) listo para escribir en el stream."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class SubscriberLimit(Exception):
+    """El proceso ya tiene CHANGE_FEED_MAX_SUBSCRIBERS suscriptores."""
+
+
+class Subscription:
+    """Suscripción de un cliente a una o varias convocatorias."""
+
+    def __init__(self, convocatoria_ids, maxsize=CHANGE_FEED_QUEUE_SIZE):
+        self.convocatoria_ids = frozenset(convocatoria_ids)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def push(self, event, data):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait((event, data))
+        except queue.Full:
+            # El cliente va atrasado: se vacía su cola y se le pide que recargue.
+            self.overflowed = True
+            with self.queue.mutex:
+                self.queue.queue.clear()
+            self.queue.put_nowait((EVENT_RESYNC, None))
+
+    def close(self):
+        """Descarta lo pendiente y deja solo el aviso de cierre."""
+        with self.queue.mutex:
+            self.queue.queue.clear()
+        self.queue.put_nowait((EVENT_CLOSE, None))
+
+    def get(self, timeout):
+        """Retorna (evento, datos) o None si no llega nada en `timeout` segundos."""
+        try:
+            item = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if item[0] == EVENT_RESYNC:
+            self.overflowed = False
+        return item
+
+
+class ChangeFeed:
+    """Listener único (LISTEN) con reparto en memoria a los suscriptores."""
+
+    def __init__(self, connect=db_handler.get_db_connection, channel=CHANGE_FEED_CHANNEL,
+                 max_subscribers=CHANGE_FEED_MAX_SUBSCRIBERS):
+        self._connect = connect
+        self.channel = channel
+        self.max_subscribers = max_subscribers
+        self._subscribers = {}          # convocatoria_id -> set(Subscription)
+        self._active = set()            # todas las suscripciones abiertas
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._channels = {channel: self._dispatch}   # canal -> función(payload)
+        self._on_connect = []
+        self._on_disconnect = []
+        self.notifications = 0
+        self.reconnects = 0
+
+    def add_channel(self, channel, on_notify, on_connect=None, on_disconnect=None):
+        """
+        Escucha también `channel` y pasa cada payload a `on_notify`. `on_connect` se
+        llama tras cada (re)conexión y `on_disconnect` en cuanto se deja de escuchar
+        (caída o parada): entre ambos se pueden perder avisos. Debe registrarse antes
+        de que arranque el listener.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                raise RuntimeError(f"El listener ya está en marcha; no se puede añadir el canal '{channel}'.")
+            self._channels[channel] = on_notify
+            if on_connect is not None:
+                self._on_connect.append(on_connect)
+            if on_disconnect is not None:
+                self._on_disconnect.append(on_disconnect)
+
+    def start(self):
+        """Arranca el listener sin esperar al primer suscriptor."""
+        self._ensure_started()
+
+    # --- Suscripciones ---
+    def subscribe(self, convocatoria_ids):
+        """Nueva suscripción. Lanza SubscriberLimit si el proceso ya tiene max_subscribers."""
+        subscription = Subscription(convocatoria_ids)
+        with self._lock:
+            if self.max_subscribers and len(self._active) >= self.max_subscribers:
+                self.rejected += 1
+                raise SubscriberLimit(f"Máximo de {self.max_subscribers} streams por proceso alcanzado.")
+            self._active.add(subscription)
+            for convocatoria_id in subscription.convocatoria_ids:
+                self._subscribers.setdefault(convocatoria_id, set()).add(subscription)
+        self._ensure_started()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Idempotente: se puede llamar al terminar el stream y al cerrar la respuesta."""
+        with self._lock:
+            if subscription not in self._active:
+                return
+            self._active.discard(subscription)
+            for convocatoria_id in subscription.convocatoria_ids:
+                subs = self._subscribers.get(convocatoria_id)
+                if subs is None:
+                    continue
+                subs.discard(subscription)
+                if not subs:
+                    del self._subscribers[convocatoria_id]
+
+    def _dispatch(self, payload):
+        parsed = parse_cambio(payload, self.channel)
+        if parsed is None:
+            return
+        convocatoria_ids, diff = parsed
+        with self._lock:
+            targets = set()
+            for convocatoria_id in convocatoria_ids:
+                targets.update(self._subscribers.get(convocatoria_id, ()))
+        for subscription in targets:
+            subscription.push(EVENT_CAMBIO, diff)
+
+    def _resync_all(self):
+        """Tras una reconexión se pudieron perder avisos: todos recargan."""
+        with self._lock:
+            targets = {s for subs in self._subscribers.values() for s in subs}
+        for subscription in targets:
+            subscription.push(EVENT_RESYNC, None)
+
+    # --- Hilo listener ---
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def shutdown(self):
+        """Detiene el listener y cierra todas las suscripciones (drenaje del worker)."""
+        self.stop()
+        with self._lock:
+            targets = {s for subs in self._subscribers.values() for s in subs}
+        for subscription in targets:
+            subscription.close()
+
+    def _listen(self):
+        conn = self._connect()
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            for channel in self._channels:
+                cursor.execute(f"LISTEN {channel};")
+        return conn
+
+    def _run(self):
+        backoff = 1.0
+        first = True
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = self._listen()
+                logging.info(f"Change feed escuchando en {', '.join(self._channels)}.")
+                for on_connect in self._on_connect:
+                    on_connect()
+                if not first:
+                    self.reconnects += 1
+                    self._resync_all()
+                first = False
+                backoff = 1.0
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.notifications += 1
+                        handler = self._channels.get(notify.channel)
+                        if handler is not None:
+                            handler(notify.payload)
+            except psycopg2.Error as e:
+                for on_disconnect in self._on_disconnect:
+                    on_disconnect()
+                logging.warning(f"Change feed desconectado ({e}); reintento en {backoff:.0f}s.")
+                first = False
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, CHANGE_FEED_RECONNECT_MAX)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+        for on_disconnect in self._on_disconnect:
+            on_disconnect()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'listening': self._thread is not None and self._thread.is_alive(),
+                'subscribers': len(self._active),
+                'max_subscribers': self.max_subscribers,
+                'rejected': self.rejected,
+                'convocatorias': len(self._subscribers),
+                'notifications': self.notifications,
+                'reconnects': self.reconnects,
+            }
+
+
+change_feed = ChangeFeed()
+
+
+# --- Invalidación de la caché entre procesos ---
+def _origin():
+    # Se calcula en cada llamada: tras el fork cada worker tiene su pid.
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def publish_cache_invalidation(namespace, key):
+    """NOTIFY con la invalidación; la reciben los listeners de todos los procesos."""
+    payload = json.dumps({'origen': _origin(), 'namespace': namespace, 'key': key})
+    db_handler.execute_query("SELECT pg_notify(%s, %s);", (CACHE_CHANNEL, payload), fetch_mode="none")
+
+def _apply_cache_invalidation(cache, payload):
+    try:
+        aviso = json.loads(payload)
+    except ValueError:
+        logging.warning(f"Aviso de invalidación malformado en '{CACHE_CHANNEL}': {payload[:200]}")
+        return
+    if aviso.get('origen') == _origin():
+        return      # ya se aplicó al invalidar
+    cache.apply_remote(aviso.get('namespace'), aviso.get('key'))
+
+def attach_cache(cache, listen=True):
+    """
+    Con la caché en memoria (sin CACHE_URL), cada proceso tiene su copia:
+    reenvía sus invalidaciones a los demás por NOTIFY y, con listen=True, aplica
+    las que llegan. Tras cada (re)conexión del listener vacía la copia local,
+    porque los avisos de mientras no estaba escuchando se han perdido.
+    Mientras el listener no está conectado la caché no se usa (se lee de la BD).
+    Con un backend compartido (Redis) no hace nada.
+    """
+    if cache.shared:
+        return
+    cache.set_publisher(publish_cache_invalidation)
+    if listen:
+        cache.set_synced(False)
+        change_feed.add_channel(
+            CACHE_CHANNEL, lambda payload: _apply_cache_invalidation(cache, payload),
+            on_connect=lambda: cache.set_synced(True), on_disconnect=lambda: cache.set_synced(False),
+        )
+        change_feed.start()
@@ -3,123 +3,1679 @@
 data_handler.py
 Capa de lógica de negocio. Orquesta las llamadas a db_handler.
 """
+import collections
 import db_handler
+import datetime
+import hashlib
+import itertools
+import json
 import logging
+import time
+
+import psycopg2.errors
+
+import odoo_io
+import pagination
+import prepared_statements
+import series_import
+import timecode
+from cache import cache
+from change_feed import CHANGE_FEED_CHANNEL
+from odoo_io import ConvocatoriaImportError
+from pagination import Filter, Listing
+from series_import import SeriesImportError
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+IMPORT_PAGE_SIZE = 1000      # filas por INSERT multi-fila al volcar a staging
+IMPORT_MAX_ERRORS = 50       # errores detallados que se devuelven/registran por lote
+EXPORT_MAX_ATTEMPTS = 4      # intentos de envío a Odoo antes de dar el export por fallido
+EXPORT_BACKOFF_BASE = 1.0    # segundos; se duplica en cada reintento
+REPARTO_CACHE_TTL = 300      # segundos; además se invalida en cada asignación de reparto
+CAPITULO_CACHE_TTL = 120     # segundos; además se invalida en cada cambio de intervención
+USUARIO_CACHE_TTL = 30       # segundos; además se invalida al cambiar el rol o el estado activo
+AUTOCOMPLETE_LIMIT = 10      # sugerencias de personaje por petición
+SEARCH_LIMIT = 50            # resultados de búsqueda en diálogos por petición
+TRIGRAM_MIN_LENGTH = 3       # por debajo, el autocompletado solo busca por prefijo
+
+# Resultados de las actualizaciones condicionales de intervenciones
+UPDATE_OK = 'actualizado'
+UPDATE_CONFLICT = 'conflicto'
+UPDATE_NOT_FOUND = 'no_encontrado'
+# Solo en lotes (apply_intervention_batch)
+UPDATE_INVALID = 'invalido'          # la operación no es válida (p.ej. timecode imposible para los fps)
+UPDATE_ROLLED_BACK = 'revertido'     # se aplicó, pero el lote atómico se deshizo
+UPDATE_SKIPPED = 'no_aplicado'       # no llegó a intentarse porque el lote atómico se deshizo
+
+# CTE que avisa del cambio a change_feed.py (una notificación por fila de `upd`).
+# pg_notify es transaccional: solo se entrega tras el COMMIT. Hay que unirla a la
+# consulta final para que se evalúe.
+_NOTIFY_CTE = f"""
+    ntf AS (
+        SELECT upd.id, pg_notify('{CHANGE_FEED_CHANNEL}', json_build_object(
+            'intervencion_id', upd.id, 'estado', upd.estado, 'needs_fx', upd.needs_fx,
+            'version', upd."version",
+            'convocatorias', ARRAY(
+                SELECT ci.convocatoria_id FROM "ConvocatoriaItem" ci WHERE ci.take_id = upd.take_id
+            )
+        )::text) AS notificado
+        FROM upd
+    )
+"""
+
+# Listados paginados (ver pagination.py). Los nombres de columna de series y
+# capítulos son los que ya consumen el frontend y la GUI.
+SERIES_LISTING = Listing(
+    source='"Serie" s',
+    columns='s.id, s.referencia AS numero_referencia, s.nombre AS nombre_serie, s.fps',
+    sorts={'id': 's.id', 'referencia': 's.referencia', 'nombre': 's.nombre', 'created_at': 's.created_at'},
+    default_sort='referencia',
+    filters={'search': Filter("(s.nombre ILIKE %(search)s OR s.referencia ILIKE %(search)s)", 'contains')},
+    key='s.id',
+)
+CAPITULOS_LISTING = Listing(
+    source='"Capitulo" c',
+    columns='c.id, c.serie_id, c.numero AS numero_capitulo, c.titulo AS titulo_capitulo',
+    sorts={'numero': 'c.numero', 'id': 'c.id'},
+    default_sort='numero',
+    filters={
+        'serie_id': Filter("c.serie_id = %(serie_id)s", 'int'),
+        'search': Filter("c.titulo ILIKE %(search)s", 'contains'),
+    },
+    key='c.id',
+)
+USUARIOS_LISTING = Listing(
+    source='"Usuario" u',
+    columns='u.id, u.nombre, u.email, u.rol, u.activo, u.created_at AS fecha_creacion, '
+            'u.updated_at AS fecha_actualizacion',
+    sorts={'id': 'u.id', 'nombre': 'u.nombre', 'rol': 'u.rol', 'created_at': 'u.created_at'},
+    default_sort='nombre',
+    filters={
+        'search': Filter("(u.nombre ILIKE %(search)s OR u.email ILIKE %(search)s)", 'contains'),
+        'rol': Filter("u.rol = %(rol)s", 'enum', ('admin', 'director', 'tecnico', 'supervisor')),
+        'activo': Filter("u.activo = %(activo)s", 'bool'),
+    },
+    key='u.id',
+)
+ACTORES_LISTING = Listing(
+    source='"Actor" a',
+    columns='a.id, a.nombre',
+    sorts={'id': 'a.id', 'nombre': 'a.nombre'},
+    default_sort='nombre',
+    filters={'search': Filter("a.nombre ILIKE %(search)s", 'contains')},
+    key='a.id',
+)
+# "Auditoria" está particionada por created_at: solo se ordena por fecha para
+# que el recorrido use idx_auditoria_fecha (y la poda de particiones con desde/hasta).
+AUDITORIA_LISTING = Listing(
+    source='"Auditoria" au',
+    columns='au.id, au.entidad, au.entidad_id, au.usuario_id, au.accion, au.payload, au.created_at',
+    sorts={'created_at': 'au.created_at'},
+    default_sort='created_at',
+    default_order='desc',
+    filters={
+        'entidad': Filter("au.entidad = %(entidad)s"),
+        'entidad_id': Filter("au.entidad_id = %(entidad_id)s", 'int'),
+        'usuario_id': Filter("au.usuario_id = %(usuario_id)s", 'int'),
+        'accion': Filter("au.accion = %(accion)s"),
+        'desde': Filter("au.created_at >= %(desde)s", 'datetime'),
+        'hasta': Filter("au.created_at < %(hasta)s", 'datetime'),
+    },
+    key='au.id',
+)
+
+# Sentencias preparadas de los caminos calientes (ver prepared_statements.py):
+# se preparan una vez por conexión del pool y devuelven filas namedtuple.
+CONVOCATORIA_HOY = prepared_statements.register("convocatoria_hoy", """
+    SELECT c.id, c.sala_id, c.fecha, c.turno, c.estado, c.odoo_batch_id, c.created_at, c.updated_at,
+           ci.id as item_id, ci.odoo_item_id, t.id as take_id, t.numero as take_numero,
+           cap.id as capitulo_id, cap.numero as capitulo_numero, s.id as serie_id, s.nombre as serie_nombre
+    FROM "Convocatoria" c
+    JOIN "ConvocatoriaItem" ci ON c.id = ci.convocatoria_id
+    JOIN "Take" t ON ci.take_id = t.id
+    JOIN "Capitulo" cap ON t.capitulo_id = cap.id
+    JOIN "Serie" s ON cap.serie_id = s.id
+    WHERE c.sala_id = %s AND c.fecha = %s
+    ORDER BY t.numero;
+""")
+CONVOCATORIA_IDS = prepared_statements.register(
+    "convocatoria_ids", 'SELECT id FROM "Convocatoria" WHERE sala_id = %s AND fecha = %s ORDER BY id;'
+)
+CONVOCATORIA_ETAG = prepared_statements.register("convocatoria_etag", """
+    SELECT count(DISTINCT ci.id) AS items, count(i.id) AS intervenciones,
+           COALESCE(sum(i."version"), 0) AS versiones,
+           max(GREATEST(c.updated_at, ci.updated_at, i.updated_at)) AS updated_at
+    FROM "Convocatoria" c
+    JOIN "ConvocatoriaItem" ci ON ci.convocatoria_id = c.id
+    LEFT JOIN "Intervencion" i ON i.take_id = ci.take_id
+    WHERE c.sala_id = %s AND c.fecha = %s;
+""")
+# El árbol lleva además take, capítulo, serie, personaje y actor: sus updated_at
+# entran en la huella (p. ej. assign_reparto cambia Personaje.actor_id).
+CONVOCATORIA_ARBOL_ETAG = prepared_statements.register("convocatoria_arbol_etag", """
+    SELECT count(DISTINCT ci.id) AS items, count(i.id) AS intervenciones,
+           COALESCE(sum(i."version"), 0) AS versiones,
+           max(GREATEST(c.updated_at, ci.updated_at, t.updated_at, cap.updated_at, s.updated_at,
+                        i.updated_at, p.updated_at, a.updated_at)) AS updated_at
+    FROM "Convocatoria" c
+    JOIN "ConvocatoriaItem" ci ON ci.convocatoria_id = c.id
+    JOIN "Take" t ON t.id = ci.take_id
+    JOIN "Capitulo" cap ON cap.id = t.capitulo_id
+    JOIN "Serie" s ON s.id = cap.serie_id
+    LEFT JOIN "Intervencion" i ON i.take_id = ci.take_id
+    LEFT JOIN "Personaje" p ON p.id = i.personaje_id
+    LEFT JOIN "Actor" a ON a.id = p.actor_id
+    WHERE c.sala_id = %s AND c.fecha = %s;
+""")
+REPARTO = prepared_statements.register("reparto", """
+    SELECT p.id as personaje_id, p.nombre as personaje_nombre, a.id as actor_id, a.nombre as actor_nombre
+    FROM "Personaje" p
+    LEFT JOIN "Actor" a ON p.actor_id = a.id
+    WHERE p.id IN (
+        SELECT DISTINCT i.personaje_id
+        FROM "Intervencion" i
+        JOIN "Take" t ON i.take_id = t.id
+        JOIN "Capitulo" c ON t.capitulo_id = c.id
+        WHERE c.serie_id = %s
+    )
+    ORDER BY p.nombre;
+""")
+
+class _BatchRollback(Exception):
+    """Deshace un lote atómico de operaciones sobre intervenciones."""
+
+
+def _fingerprint_etag(kind, row):
+    """ETag débil a partir de una fila-huella (contadores, suma de versiones, último updated_at)."""
+    values = tuple(row.values()) if isinstance(row, dict) else tuple(row)
+    digest = hashlib.sha1(f"{kind}:{values!r}".encode('utf-8')).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+class _SeriesXlsxLoader:
+    """
+    Vuelca las hojas del XLSX clásico dentro de una transacción. Los nombres
+    (serie_ref, actor, personaje) y las claves (serie, capítulo, take) se
+    resuelven contra diccionarios en memoria; lo que falta se crea con un
+    INSERT multi-fila por página, sin SELECT por fila.
+    """
+
+    def __init__(self, tx):
+        self.tx = tx
+        self.series, self.fps = {}, {}
+        for r in tx.execute('SELECT id, referencia, fps FROM "Serie";'):
+            self.series[r['referencia']] = r['id']
+            self.fps[r['id']] = r['fps']
+        self.actores = {}
+        for r in tx.execute('SELECT id, nombre FROM "Actor" ORDER BY id;'):
+            self.actores.setdefault(r['nombre'], r['id'])
+        self.personajes = {}
+        for r in tx.execute('SELECT id, nombre FROM "Personaje" ORDER BY id;'):
+            self.personajes.setdefault(r['nombre'], r['id'])
+        self.capitulos = {}         # (serie_id, numero) -> id
+        self.takes = {}             # (capitulo_id, numero) -> id
+        self._series_cargadas = set()
+        self.contadores = collections.Counter()
+
+    def _upsert(self, query, rows, template=None):
+        return self.tx.execute_values(query, rows, template=template, page_size=len(rows), fetch=True)
+
+    def _serie_id(self, serie_ref, sheet, linea, errores):
+        serie_id = self.series.get(serie_ref)
+        if serie_id is None:
+            if len(errores) < IMPORT_MAX_ERRORS:
+                errores.append(f"Hoja '{sheet}' fila {linea}: serie_ref '{serie_ref}' no existe.")
+            return None
+        if serie_id not in self._series_cargadas:
+            # Capítulos y takes existentes de la serie, una sola vez por serie.
+            for r in self.tx.execute("""
+                SELECT c.id AS capitulo_id, c.numero AS capitulo_numero, t.id AS take_id, t.numero AS take_numero
+                FROM "Capitulo" c
+                LEFT JOIN "Take" t ON t.capitulo_id = c.id
+                WHERE c.serie_id = %s;
+            """, (serie_id,)):
+                self.capitulos[(serie_id, r['capitulo_numero'])] = r['capitulo_id']
+                if r['take_id'] is not None:
+                    self.takes[(r['capitulo_id'], r['take_numero'])] = r['take_id']
+            self._series_cargadas.add(serie_id)
+        return serie_id
+
+    # --- Creación de lo que falta ---
+    def _ensure_actores(self, nombres):
+        nuevos = [n for n in dict.fromkeys(nombres) if n and n not in self.actores]
+        if nuevos:
+            for r in self._upsert('INSERT INTO "Actor" (nombre) VALUES %s RETURNING id, nombre;', [(n,) for n in nuevos]):
+                self.actores[r['nombre']] = r['id']
+            self.contadores['actores_nuevos'] += len(nuevos)
+
+    def _ensure_personajes(self, pares):
+        """`pares`: (personaje, nombre_actor). El actor solo se asigna al crear el personaje."""
+        nuevos = {}
+        for personaje, actor in pares:
+            if personaje not in self.personajes:
+                nuevos.setdefault(personaje, self.actores.get(actor))
+        if nuevos:
+            for r in self._upsert('INSERT INTO "Personaje" (nombre, actor_id) VALUES %s RETURNING id, nombre;',
+                                  list(nuevos.items())):
+                self.personajes[r['nombre']] = r['id']
+            self.contadores['personajes_nuevos'] += len(nuevos)
+
+    def _ensure_capitulos(self, claves):
+        nuevos = [k for k in dict.fromkeys(claves) if k not in self.capitulos]
+        if nuevos:
+            self._upsert_capitulos([(serie_id, numero, None) for serie_id, numero in nuevos])
+
+    def _ensure_takes(self, claves):
+        nuevos = [k for k in dict.fromkeys(claves) if k not in self.takes]
+        if nuevos:
+            self._upsert_takes([(capitulo_id, numero, None) for capitulo_id, numero in nuevos])
+
+    def _upsert_capitulos(self, rows):
+        for r in self._upsert("""
+            INSERT INTO "Capitulo" (serie_id, numero, titulo) VALUES %s
+            ON CONFLICT (serie_id, numero) DO UPDATE SET titulo = COALESCE(EXCLUDED.titulo, "Capitulo".titulo)
+            RETURNING id, serie_id, numero;
+        """, rows):
+            self.capitulos[(r['serie_id'], r['numero'])] = r['id']
+        self.contadores['capitulos'] += len(rows)
+
+    def _upsert_takes(self, rows):
+        for r in self._upsert("""
+            INSERT INTO "Take" (capitulo_id, numero, descripcion) VALUES %s
+            ON CONFLICT (capitulo_id, numero) DO UPDATE SET descripcion = COALESCE(EXCLUDED.descripcion, "Take".descripcion)
+            RETURNING id, capitulo_id, numero;
+        """, rows):
+            self.takes[(r['capitulo_id'], r['numero'])] = r['id']
+        self.contadores['takes'] += len(rows)
+
+    # --- Una página por hoja ---
+    def load_series(self, page, errores):
+        rows = {ref: (ref, nombre, fps) for ref, nombre, fps in page}
+        for r in self._upsert("""
+            INSERT INTO "Serie" (referencia, nombre, fps) VALUES %s
+            ON CONFLICT (referencia) DO UPDATE SET nombre = EXCLUDED.nombre, fps = EXCLUDED.fps
+            RETURNING id, referencia, fps;
+        """, list(rows.values())):
+            self.series[r['referencia']] = r['id']
+            self.fps[r['id']] = r['fps']
+        self.contadores['series'] += len(rows)
+
+    def load_actores(self, page, errores):
+        self._ensure_actores(nombre for (nombre,) in page)
+
+    def load_capitulos(self, page, errores):
+        rows = {}
+        for linea, serie_ref, numero, titulo in page:
+            serie_id = self._serie_id(serie_ref, 'capitulos', linea, errores)
+            if serie_id is not None:
+                rows[(serie_id, numero)] = (serie_id, numero, titulo)
+        if rows:
+            self._upsert_capitulos(list(rows.values()))
+
+    def load_takes(self, page, errores):
+        claves = []
+        for linea, serie_ref, capitulo_numero, take_numero, descripcion in page:
+            serie_id = self._serie_id(serie_ref, 'takes', linea, errores)
+            if serie_id is not None:
+                claves.append(((serie_id, capitulo_numero), take_numero, descripcion))
+        self._ensure_capitulos(c for c, _, _ in claves)
+        rows = {}
+        for capitulo, numero, descripcion in claves:
+            capitulo_id = self.capitulos[capitulo]
+            rows[(capitulo_id, numero)] = (capitulo_id, numero, descripcion)
+        if rows:
+            self._upsert_takes(list(rows.values()))
+
+    def _timecode_frames(self, validas, errores):
+        """
+        Valida tc_in/tc_out de la página contra los fps de cada serie (en bloque, con
+        timecode.parse_many) y retorna la lista de (tc_in_frames, tc_out_frames).
+        """
+        frames = [(None, None)] * len(validas)
+        por_serie = collections.defaultdict(list)
+        for pos, (serie_id, _) in enumerate(validas):
+            por_serie[serie_id].append(pos)
+        for serie_id, posiciones in por_serie.items():
+            fps = self.fps[serie_id]
+            tc_in, malos_in = timecode.parse_many([validas[p][1][8] for p in posiciones], fps)
+            tc_out, malos_out = timecode.parse_many([validas[p][1][9] for p in posiciones], fps)
+            for campo, columna, malos in (('tc_in', 8, malos_in), ('tc_out', 9, malos_out)):
+                for i in malos:
+                    row = validas[posiciones[i]][1]
+                    if len(errores) < IMPORT_MAX_ERRORS:
+                        errores.append(f"Hoja 'intervenciones' fila {row[0]}: '{campo}' ({row[columna]}) "
+                                       f"no es un timecode válido a {fps} fps.")
+            for i, pos in enumerate(posiciones):
+                frames[pos] = (tc_in[i], tc_out[i])
+        return frames
+
+    def load_intervenciones(self, page, errores):
+        validas = []
+        for row in page:
+            linea, serie_ref = row[0], row[1]
+            serie_id = self._serie_id(serie_ref, 'intervenciones', linea, errores)
+            if serie_id is not None:
+                validas.append((serie_id, row))
+        if not validas:
+            return
+
+        self._ensure_capitulos((serie_id, row[2]) for serie_id, row in validas)
+        self._ensure_takes((self.capitulos[(serie_id, row[2])], row[3]) for serie_id, row in validas)
+        self._ensure_actores(row[5] for _, row in validas)
+        self._ensure_personajes((row[4], row[5]) for _, row in validas)
+
+        frames = self._timecode_frames(validas, errores)
+        intervenciones, reparto = {}, {}
+        for (serie_id, (linea, _, capitulo_numero, take_numero, personaje, _actor, orden,
+                        dialogo, tc_in, tc_out)), (tc_in_frames, tc_out_frames) in zip(validas, frames):
+            capitulo_id = self.capitulos[(serie_id, capitulo_numero)]
+            take_id = self.takes[(capitulo_id, take_numero)]
+            personaje_id = self.personajes[personaje]
+            intervenciones[(take_id, orden)] = (take_id, personaje_id, orden, dialogo,
+                                                tc_in, tc_out, tc_in_frames, tc_out_frames)
+            reparto[(capitulo_id, personaje_id)] = (capitulo_id, personaje_id)
+
+        self.tx.execute_values("""
+            INSERT INTO "PersonajeEnCapitulo" (capitulo_id, personaje_id) VALUES %s
+            ON CONFLICT (capitulo_id, personaje_id) DO NOTHING;
+        """, list(reparto.values()), page_size=len(reparto))
+        # Las filas que no cambian no se tocan (ni suben de versión); las que cambian
+        # conservan su estado/FX y suben de versión.
+        result = self._upsert("""
+            INSERT INTO "Intervencion"
+                (take_id, personaje_id, orden, dialogo, tc_in, tc_out, tc_in_frames, tc_out_frames)
+            VALUES %s
+            ON CONFLICT (take_id, orden) DO UPDATE
+            SET personaje_id = EXCLUDED.personaje_id, dialogo = EXCLUDED.dialogo,
+                tc_in = EXCLUDED.tc_in, tc_out = EXCLUDED.tc_out,
+                tc_in_frames = EXCLUDED.tc_in_frames, tc_out_frames = EXCLUDED.tc_out_frames,
+                "version" = "Intervencion"."version" + 1
+            WHERE ("Intervencion".personaje_id, "Intervencion".dialogo, "Intervencion".tc_in, "Intervencion".tc_out)
+                  IS DISTINCT FROM (EXCLUDED.personaje_id, EXCLUDED.dialogo, EXCLUDED.tc_in, EXCLUDED.tc_out)
+            RETURNING (xmax = 0) AS insertada;
+        """, list(intervenciones.values()))
+        nuevas = sum(1 for r in result if r['insertada'])
+        self.contadores['intervenciones_nuevas'] += nuevas
+        self.contadores['intervenciones_actualizadas'] += len(result) - nuevas
+        self.contadores['intervenciones_sin_cambios'] += len(intervenciones) - len(result)
+
+
+# Las lecturas pesadas sin caché (convocatorias, listados, búsquedas, exports y
+# métricas) van con readonly=True y pueden servirse desde la réplica (db_handler).
+# Los loaders de la caché leen del primario: cachear una lectura con retraso la
+# dejaría fija durante todo el TTL.
 class DataHandler:
     def __init__(self):
         logging.info("DataHandler inicializado para el nuevo esquema.")
 
+    # --- Listados paginados ---
+    def _paginate(self, listing, filters=None, sort=None, order=None, cursor=None, limit=None, con_total=True):
+        """
+        Una página de `listing`: {'items', 'next_cursor', 'total', 'total_exacto'}.
+        El total sale de la estimación del planner (EXPLAIN) y solo se cuenta de
+        verdad si es pequeño (pagination.EXACT_COUNT_MAX).
+        Lanza PaginationError si los parámetros no son válidos; None si falla la BD.
+        """
+        query, params, sort, order, limit = listing.query(filters, sort, order, cursor, limit)
+        try:
+            page = listing.page(db_handler.execute_query(query, params, readonly=True), sort, order, limit)
+            page['total'], page['total_exacto'] = self._count(listing, filters) if con_total else (None, False)
+        except Exception as e:
+            logging.error(f"Error listando {listing.source}: {e}")
+            return None
+        return page
+
+    def _count(self, listing, filters):
+        query, params = listing.count_query(filters, explain=True)
+        plan = db_handler.execute_query(query, params, fetch_mode="one", readonly=True)['QUERY PLAN']
+        estimado = int(plan[0]['Plan']['Plan Rows'])
+        if estimado > pagination.EXACT_COUNT_MAX:
+            return estimado, False
+        query, params = listing.count_query(filters)
+        return db_handler.execute_query(query, params, fetch_mode="one", readonly=True)['total'], True
+
+    def list_series(self, filters=None, sort=None, order=None, cursor=None, limit=None, con_total=True):
+        return self._paginate(SERIES_LISTING, filters, sort, order, cursor, limit, con_total=con_total)
+
+    def get_all_series(self):
+        """Todas las series (para la GUI), recorridas página a página. None si hay un error."""
+        series, cursor = [], None
+        while True:
+            page = self._paginate(SERIES_LISTING, cursor=cursor, limit=pagination.PAGE_SIZE_MAX, con_total=False)
+            if page is None:
+                return None
+            series.extend(page['items'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                return series
+
+    def list_capitulos(self, serie_id, filters=None, sort=None, order=None, cursor=None, limit=None):
+        """Capítulos de una serie. False si la serie no existe, None si hay un error."""
+        try:
+            if not db_handler.execute_query('SELECT 1 FROM "Serie" WHERE id = %s;', (serie_id,), fetch_mode="one",
+                                            readonly=True):
+                return False
+        except Exception as e:
+            logging.error(f"Error comprobando la serie {serie_id}: {e}")
+            return None
+        filters = dict(filters or {}, serie_id=serie_id)
+        return self._paginate(CAPITULOS_LISTING, filters, sort, order, cursor, limit)
+
+    def list_usuarios(self, filters=None, sort=None, order=None, cursor=None, limit=None):
+        return self._paginate(USUARIOS_LISTING, filters, sort, order, cursor, limit)
+
+    def list_actores(self, filters=None, sort=None, order=None, cursor=None, limit=None):
+        return self._paginate(ACTORES_LISTING, filters, sort, order, cursor, limit)
+
+    def list_auditoria(self, filters=None, sort=None, order=None, cursor=None, limit=None):
+        return self._paginate(AUDITORIA_LISTING, filters, sort, order, cursor, limit)
+
+    # --- Usuarios y sesión ---
+    def get_usuario_login(self, nombre):
+        """Usuario por nombre con su hash de contraseña (solo para el login). None si no existe."""
+        return db_handler.execute_query(
+            'SELECT id, nombre, rol, activo, password_hash FROM "Usuario" WHERE nombre = %s;',
+            (nombre,), fetch_mode="one"
+        )
+
+    def get_usuario_sesion(self, usuario_id):
+        """
+        Registro de sesión {id, nombre, rol, activo} del usuario, para las comprobaciones
+        de autorización. Se sirve desde la caché (espacio 'usuario'); update_usuario
+        invalida la clave. Retorna None si el usuario no existe;
+        los errores de BD se propagan (no deben confundirse con una sesión inválida).
+        """
+        return cache.get_or_load(
+            'usuario', usuario_id, lambda: self._load_usuario_sesion(usuario_id), ttl=USUARIO_CACHE_TTL
+        )
+
+    def _load_usuario_sesion(self, usuario_id):
+        row = db_handler.execute_query(
+            'SELECT id, nombre, rol, activo FROM "Usuario" WHERE id = %s;', (usuario_id,), fetch_mode="one"
+        )
+        return dict(row) if row else None
+
+    def update_usuario(self, usuario_id, cambios, user_id):
+        """
+        Cambia el rol y/o el estado activo de un usuario (`cambios` con las claves
+        'rol' y/o 'activo') y registra la auditoría. Invalida su registro de sesión
+        cacheado: el cambio se aplica en la siguiente petición del usuario.
+        Retorna el usuario actualizado, False si no existe, None si hay un error.
+        """
+        query = """
+            WITH upd AS (
+                UPDATE "Usuario" SET
+                    rol = COALESCE(%(rol)s::rol_usuario, rol),
+                    activo = COALESCE(%(activo)s, activo),
+                    updated_at = NOW()
+                WHERE id = %(usuario_id)s
+                RETURNING id, nombre, rol, activo
+            ), aud AS (
+                INSERT INTO "Auditoria" (entidad, entidad_id, usuario_id, accion, payload)
+                SELECT 'Usuario', upd.id, %(user_id)s, 'UPDATE_USUARIO', %(payload)s::jsonb
+                FROM upd
+            )
+            SELECT * FROM upd;
+        """
+        params = {
+            'rol': cambios.get('rol'), 'activo': cambios.get('activo'), 'usuario_id': usuario_id,
+            'user_id': user_id, 'payload': json.dumps(cambios),
+        }
+        try:
+            row = db_handler.execute_query(query, params, fetch_mode="one")
+        except Exception as e:
+            logging.error(f"Error actualizando el usuario {usuario_id}: {e}")
+            return None
+        cache.invalidate('usuario', usuario_id)
+        return dict(row) if row else False
+
+    def update_password_hash(self, usuario_id, password_hash):
+        """Guarda un hash de contraseña recalculado (rehash por cambio de coste)."""
+        db_handler.execute_query(
+            'UPDATE "Usuario" SET password_hash = %s, updated_at = NOW() WHERE id = %s;',
+            (password_hash, usuario_id), fetch_mode="none"
+        )
+
     # --- Lógica de Convocatorias ---
     def get_convocatoria_hoy(self, sala_id, fecha):
         """
         Obtiene la convocatoria para una sala y fecha, incluyendo sus items y las intervenciones asociadas.
         """
-        query = """
-            SELECT c.*, ci.id as item_id, ci.odoo_item_id, t.id as take_id, t.numero as take_numero,
-                   cap.id as capitulo_id, cap.numero as capitulo_numero, s.id as serie_id, s.nombre as serie_nombre
-            FROM "Convocatoria" c
-            JOIN "ConvocatoriaItem" ci ON c.id = ci.convocatoria_id
-            JOIN "Take" t ON ci.take_id = t.id
-            JOIN "Capitulo" cap ON t.capitulo_id = cap.id
-            JOIN "Serie" s ON cap.serie_id = s.id
-            WHERE c.sala_id = %s AND c.fecha = %s
-            ORDER BY t.numero;
-        """
-        params = (sala_id, fecha)
         try:
-            return db_handler.execute_query(query, params, fetch_mode="all")
+            rows = db_handler.execute_prepared(CONVOCATORIA_HOY, (sala_id, fecha), fetch_mode="all", readonly=True)
+            return [row._asdict() for row in rows]
         except Exception as e:
             logging.error(f"Error obteniendo convocatoria para sala {sala_id} en fecha {fecha}: {e}")
             return None
 
-    # --- Lógica de Intervenciones ---
-    def update_intervention_status(self, intervention_id, estado, estado_nota, user_id):
+    def get_convocatoria_ids(self, sala_id, fecha):
+        """Ids de las convocatorias de una sala y fecha (para suscribirse a sus cambios). None si hay error."""
+        try:
+            return [row.id for row in db_handler.execute_prepared(CONVOCATORIA_IDS, (sala_id, fecha), readonly=True)]
+        except Exception as e:
+            logging.error(f"Error obteniendo convocatorias de la sala {sala_id} en fecha {fecha}: {e}")
+            return None
+
+    def get_convocatoria_sala_id(self, convocatoria_id):
+        """Sala de una convocatoria, o None si no existe."""
+        row = db_handler.execute_query(
+            'SELECT sala_id FROM "Convocatoria" WHERE id = %s', (convocatoria_id,), fetch_mode="one", readonly=True
+        )
+        return row['sala_id'] if row else None
+
+    def get_convocatoria_arbol_json(self, sala_id, fecha):
         """
-        Actualiza el estado de una intervención y registra la auditoría.
+        Convocatorias de una sala y fecha como árbol convocatoria -> takes -> intervenciones
+        (con personaje/actor y contadores de progreso), construido en Postgres con
+        json_agg en un único round-trip. Retorna el JSON ya serializado (str) para
+        enviarlo tal cual, sin decodificar y re-codificar en Python; None si hay error.
         """
         query = """
-            UPDATE "Intervencion"
-            SET estado = %s,
-                estado_nota = %s,
-                realizado_por_usuario_id = %s,
-                realizado_at = CASE WHEN %s IN ('realizado', 'omitido') THEN NOW() ELSE NULL END,
-                "version" = "version" + 1
-            WHERE id = %s
-            RETURNING id, estado;
-        """
-        params = (estado, estado_nota, user_id, estado, intervention_id)
-        try:
-            result = db_handler.execute_query(query, params, fetch_mode="one")
-            if result:
+            WITH conv AS (
+                SELECT c.id, c.sala_id, c.fecha, c.turno, c.estado, c.odoo_batch_id
+                FROM "Convocatoria" c
+                WHERE c.sala_id = %s AND c.fecha = %s
+            ), interv AS (
+                SELECT i.take_id,
+                       json_agg(json_build_object(
+                           'id', i.id, 'orden', i.orden,
+                           'personaje_id', p.id, 'personaje', p.nombre,
+                           'actor_id', a.id, 'actor', a.nombre,
+                           'dialogo', i.dialogo, 'tc_in', i.tc_in, 'tc_out', i.tc_out,
+                           'estado', i.estado, 'estado_nota', i.estado_nota,
+                           'needs_fx', i.needs_fx, 'fx_note', i.fx_note, 'fx_source', i.fx_source,
+                           'version', i."version"
+                       ) ORDER BY i.orden) AS intervenciones,
+                       count(*) AS total,
+                       count(*) FILTER (WHERE i.estado = 'realizado') AS realizadas,
+                       count(*) FILTER (WHERE i.estado = 'omitido') AS omitidas
+                FROM "Intervencion" i
+                JOIN "Personaje" p ON p.id = i.personaje_id
+                LEFT JOIN "Actor" a ON a.id = p.actor_id
+                WHERE i.take_id IN (
+                    SELECT ci.take_id FROM "ConvocatoriaItem" ci JOIN conv ON conv.id = ci.convocatoria_id
+                )
+                GROUP BY i.take_id
+            ), takes AS (
+                SELECT ci.convocatoria_id,
+                       json_agg(json_build_object(
+                           'item_id', ci.id, 'odoo_item_id', ci.odoo_item_id,
+                           'estado_planificado', ci.estado_planificado,
+                           'take_id', t.id, 'take_numero', t.numero,
+                           'capitulo_id', cap.id, 'capitulo_numero', cap.numero,
+                           'serie_id', s.id, 'serie_nombre', s.nombre,
+                           'progreso', json_build_object(
+                               'total', COALESCE(iv.total, 0),
+                               'realizadas', COALESCE(iv.realizadas, 0),
+                               'omitidas', COALESCE(iv.omitidas, 0),
+                               'pendientes', COALESCE(iv.total - iv.realizadas - iv.omitidas, 0)
+                           ),
+                           'intervenciones', COALESCE(iv.intervenciones, '[]'::json)
+                       ) ORDER BY s.nombre, cap.numero, t.numero) AS takes,
+                       sum(COALESCE(iv.total, 0)) AS total,
+                       sum(COALESCE(iv.realizadas, 0)) AS realizadas,
+                       sum(COALESCE(iv.omitidas, 0)) AS omitidas
+                FROM "ConvocatoriaItem" ci
+                JOIN conv ON conv.id = ci.convocatoria_id
+                JOIN "Take" t ON t.id = ci.take_id
+                JOIN "Capitulo" cap ON cap.id = t.capitulo_id
+                JOIN "Serie" s ON s.id = cap.serie_id
+                LEFT JOIN interv iv ON iv.take_id = t.id
+                GROUP BY ci.convocatoria_id
+            )
+            SELECT COALESCE(json_agg(json_build_object(
+                       'id', conv.id, 'sala_id', conv.sala_id, 'fecha', conv.fecha, 'turno', conv.turno,
+                       'estado', conv.estado, 'odoo_batch_id', conv.odoo_batch_id,
+                       'progreso', json_build_object(
+                           'total', COALESCE(tk.total, 0),
+                           'realizadas', COALESCE(tk.realizadas, 0),
+                           'omitidas', COALESCE(tk.omitidas, 0),
+                           'pendientes', COALESCE(tk.total - tk.realizadas - tk.omitidas, 0)
+                       ),
+                       'takes', COALESCE(tk.takes, '[]'::json)
+                   ) ORDER BY conv.turno NULLS FIRST, conv.id), '[]'::json)::text AS payload
+            FROM conv
+            LEFT JOIN takes tk ON tk.convocatoria_id = conv.id;
+        """
+        try:
+            row = db_handler.execute_query(query, (sala_id, fecha), fetch_mode="one", readonly=True)
+            return row['payload']
+        except Exception as e:
+            logging.error(f"Error obteniendo árbol de convocatoria para sala {sala_id} en fecha {fecha}: {e}")
+            return None
+
+    def get_convocatoria_etag(self, sala_id, fecha, vista='plana'):
+        """
+        ETag de la convocatoria de una sala y fecha calculado con una consulta de agregados
+        (sin traer las filas). Cualquier cambio en una intervención incrementa su version,
+        así que la suma de versiones cambia con cada edición. La vista 'arbol' tiene su
+        propia huella, que cubre también las tablas que solo aparecen en el árbol.
+        """
+        statement = CONVOCATORIA_ARBOL_ETAG if vista == 'arbol' else CONVOCATORIA_ETAG
+        try:
+            row = db_handler.execute_prepared(statement, (sala_id, fecha), fetch_mode="one", readonly=True)
+            return _fingerprint_etag(f"convocatoria:{vista}:{sala_id}:{fecha}", row)
+        except Exception as e:
+            logging.error(f"Error calculando ETag de convocatoria para sala {sala_id} en fecha {fecha}: {e}")
+            return None
+
+    def import_convocatoria(self, header, items, user_id=None):
+        """
+        Importa un lote de Odoo de forma atómica e idempotente por odoo_batch_id.
+
+        Los items (iterable de tuplas de odoo_io.normalize_item) se vuelcan por páginas
+        a una tabla temporal; serie_ref/capitulo_numero/take_numero se resuelven con un
+        único JOIN y los ConvocatoriaItem se insertan con un INSERT ... SELECT. Todo en
+        una transacción: o entran todos los items o ninguno.
+
+        Lanza ConvocatoriaImportError si el lote no es válido.
+        """
+        batch_id = header['odoo_batch_id']
+        start = time.perf_counter()
+        try:
+            with db_handler.transaction() as tx:
+                convocatoria = tx.execute("""
+                    INSERT INTO "Convocatoria" (sala_id, fecha, turno, estado, odoo_batch_id)
+                    VALUES (%(sala_id)s, %(fecha)s, %(turno)s, 'importada', %(odoo_batch_id)s)
+                    ON CONFLICT (odoo_batch_id) DO NOTHING
+                    RETURNING id;
+                """, header, fetch_mode="one")
+
+                if convocatoria is None:
+                    existente = tx.execute("""
+                        SELECT c.id, count(ci.id) AS items
+                        FROM "Convocatoria" c
+                        LEFT JOIN "ConvocatoriaItem" ci ON ci.convocatoria_id = c.id
+                        WHERE c.odoo_batch_id = %s
+                        GROUP BY c.id;
+                    """, (batch_id,), fetch_mode="one")
+                    logging.info(f"Lote {batch_id} ya importado (convocatoria {existente['id']}); se omite.")
+                    return {'convocatoria_id': existente['id'], 'items': existente['items'], 'ya_importado': True}
+
+                convocatoria_id = convocatoria['id']
+                tx.execute("""
+                    CREATE TEMP TABLE _convocatoria_import (
+                        linea INT, odoo_item_id TEXT, serie_ref TEXT,
+                        capitulo_numero INT, take_numero INT, estado_planificado TEXT
+                    ) ON COMMIT DROP;
+                """, fetch_mode="none")
+
+                leidos = 0
+                for page in odoo_io.batched(items, IMPORT_PAGE_SIZE):
+                    tx.execute_values(
+                        "INSERT INTO _convocatoria_import VALUES %s", page, page_size=IMPORT_PAGE_SIZE
+                    )
+                    leidos += len(page)
+                if not leidos:
+                    raise ConvocatoriaImportError("El lote no contiene items.")
+
+                duplicados = tx.execute("""
+                    SELECT odoo_item_id, array_agg(linea ORDER BY linea) AS lineas
+                    FROM _convocatoria_import
+                    GROUP BY odoo_item_id HAVING count(*) > 1
+                    LIMIT %s;
+                """, (IMPORT_MAX_ERRORS,))
+                if duplicados:
+                    raise ConvocatoriaImportError("odoo_item_id duplicados en el lote.", [
+                        f"odoo_item_id '{d['odoo_item_id']}' repetido en items {d['lineas']}." for d in duplicados
+                    ])
+
+                no_resueltos = tx.execute("""
+                    SELECT s.linea, s.serie_ref, s.capitulo_numero, s.take_numero,
+                           se.id IS NOT NULL AS serie_ok, c.id IS NOT NULL AS capitulo_ok
+                    FROM _convocatoria_import s
+                    LEFT JOIN "Serie" se ON se.referencia = s.serie_ref
+                    LEFT JOIN "Capitulo" c ON c.serie_id = se.id AND c.numero = s.capitulo_numero
+                    LEFT JOIN "Take" t ON t.capitulo_id = c.id AND t.numero = s.take_numero
+                    WHERE t.id IS NULL
+                    ORDER BY s.linea
+                    LIMIT %s;
+                """, (IMPORT_MAX_ERRORS,))
+                if no_resueltos:
+                    errores = []
+                    for r in no_resueltos:
+                        if not r['serie_ok']:
+                            motivo = f"serie_ref '{r['serie_ref']}' no encontrada"
+                        elif not r['capitulo_ok']:
+                            motivo = f"capítulo {r['capitulo_numero']} no existe en la serie '{r['serie_ref']}'"
+                        else:
+                            motivo = f"take {r['take_numero']} no existe en el capítulo {r['capitulo_numero']}"
+                        errores.append(f"Item {r['linea']}: {motivo}.")
+                    raise ConvocatoriaImportError("Hay items que no se pudieron resolver.", errores)
+
+                insertados = tx.execute("""
+                    INSERT INTO "ConvocatoriaItem"
+                        (convocatoria_id, serie_id, capitulo_id, take_id, odoo_item_id, estado_planificado)
+                    SELECT %s, se.id, c.id, t.id, s.odoo_item_id, s.estado_planificado
+                    FROM _convocatoria_import s
+                    JOIN "Serie" se ON se.referencia = s.serie_ref
+                    JOIN "Capitulo" c ON c.serie_id = se.id AND c.numero = s.capitulo_numero
+                    JOIN "Take" t ON t.capitulo_id = c.id AND t.numero = s.take_numero
+                    ORDER BY s.linea;
+                """, (convocatoria_id,), fetch_mode="none")
+
                 db_handler.audit_log(
-                    entidad='Intervencion',
-                    entidad_id=intervention_id,
-                    usuario_id=user_id,
-                    accion='UPDATE_ESTADO',
-                    payload={'estado': estado, 'nota': estado_nota}
+                    entidad='Convocatoria', entidad_id=convocatoria_id, usuario_id=user_id,
+                    accion='IMPORT', payload={'odoo_batch_id': batch_id, 'items': insertados}, tx=tx
                 )
-                return True
-            return False
+        except ConvocatoriaImportError as e:
+            db_handler.io_log('import', 'error', e.mensaje, odoo_batch_id=batch_id,
+                              detalles={'errores': e.errores[:IMPORT_MAX_ERRORS]})
+            raise
+        except psycopg2.errors.UniqueViolation as e:
+            mensaje = "El lote choca con datos ya importados (odoo_item_id o sala/fecha/turno)."
+            db_handler.io_log('import', 'error', mensaje, odoo_batch_id=batch_id,
+                              detalles={'errores': [str(e).strip()]})
+            raise ConvocatoriaImportError(mensaje, [str(e).strip()])
+
+        segundos = time.perf_counter() - start
+        items_por_segundo = round(insertados / segundos, 1) if segundos > 0 else None
+        db_handler.io_log(
+            'import', 'ok', f"Lote importado: {insertados} items.",
+            odoo_batch_id=batch_id, convocatoria_id=convocatoria_id,
+            detalles={'items': insertados, 'segundos': round(segundos, 3), 'items_por_segundo': items_por_segundo}
+        )
+        return {
+            'convocatoria_id': convocatoria_id, 'items': insertados, 'ya_importado': False,
+            'segundos': round(segundos, 3), 'items_por_segundo': items_por_segundo,
+        }
+
+    def export_convocatoria(self, convocatoria_id, user_id=None, sink=None):
+        """
+        Exporta a Odoo el delta de una convocatoria: solo las intervenciones cuya
+        version supera la última exportada ("ExportWatermark"). El payload se
+        serializa en streaming desde un cursor de servidor hacia el destino
+        (odoo_io.get_export_sink() por defecto) con reintentos y backoff exponencial.
+        La marca de agua solo avanza si el envío termina bien. Sin marca (primer
+        export) van todas las intervenciones, también las que nunca se editaron.
+
+        Retorna un dict con el resultado o None si la convocatoria no existe.
+        """
+        convocatoria = db_handler.execute_query(
+            'SELECT id, odoo_batch_id FROM "Convocatoria" WHERE id = %s', (convocatoria_id,), fetch_mode="one"
+        )
+        if not convocatoria:
+            return None
+
+        delta_query = """
+            SELECT ci.odoo_item_id, i.id AS intervencion_id, i."version", i.estado, i.estado_nota,
+                   i.tc_in, i.tc_out, i.needs_fx, i.fx_note, i.fx_source, i.fx_marked_at,
+                   u.nombre AS usuario_ejecucion, i.realizado_at
+            FROM "ConvocatoriaItem" ci
+            JOIN "Intervencion" i ON i.take_id = ci.take_id
+            LEFT JOIN "Usuario" u ON u.id = i.realizado_por_usuario_id
+            LEFT JOIN "ExportWatermark" w
+                   ON w.convocatoria_id = ci.convocatoria_id AND w.intervencion_id = i.id
+            WHERE ci.convocatoria_id = %s
+              AND i."version" > COALESCE(w."version", 0)
+            ORDER BY ci.odoo_item_id, i.orden;
+        """
+        sink = sink or odoo_io.get_export_sink()
+        batch_id = convocatoria['odoo_batch_id']
+        stamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+        name = f"{batch_id or 'convocatoria'}_{convocatoria_id}_{stamp}.json"
+        start = time.perf_counter()
+
+        for intento in range(1, EXPORT_MAX_ATTEMPTS + 1):
+            exported = []
+            rows = db_handler.stream_query(delta_query, (convocatoria_id,))
+            try:
+                first = next(rows, None)
+                if first is None:
+                    db_handler.io_log('export', 'ok', "Sin cambios desde el último export.",
+                                      odoo_batch_id=batch_id, convocatoria_id=convocatoria_id)
+                    return {'convocatoria_id': convocatoria_id, 'items': 0, 'enviado': False}
+                payload = odoo_io.iter_export_payload(convocatoria, itertools.chain([first], rows), exported)
+                bytes_enviados = sink.send(name, payload)
+                break
+            except odoo_io.ExportSinkError as e:
+                if intento == EXPORT_MAX_ATTEMPTS:
+                    db_handler.io_log('export', 'error', f"Export fallido tras {intento} intentos: {e}",
+                                      odoo_batch_id=batch_id, convocatoria_id=convocatoria_id)
+                    return {'convocatoria_id': convocatoria_id, 'items': 0, 'enviado': False, 'error': str(e)}
+                espera = EXPORT_BACKOFF_BASE * 2 ** (intento - 1)
+                db_handler.io_log('export', 'reintento', f"Intento {intento} fallido, reintento en {espera}s: {e}",
+                                  odoo_batch_id=batch_id, convocatoria_id=convocatoria_id)
+                time.sleep(espera)
+            finally:
+                rows.close()
+
+        # ConvocatoriaItem no es único por take: una intervención puede salir en dos items.
+        # Una sola fila por intervención (la versión mayor) o el upsert fallaría con
+        # "ON CONFLICT DO UPDATE command cannot affect row a second time".
+        marcas = {}
+        for intervencion_id, version in exported:
+            marcas[intervencion_id] = max(version, marcas.get(intervencion_id, version))
+        with db_handler.transaction() as tx:
+            tx.execute_values("""
+                INSERT INTO "ExportWatermark" (convocatoria_id, intervencion_id, "version")
+                VALUES %s
+                ON CONFLICT (convocatoria_id, intervencion_id) DO UPDATE
+                SET "version" = GREATEST("ExportWatermark"."version", EXCLUDED."version"),
+                    exported_at = NOW();
+            """, [(convocatoria_id, intervencion_id, version) for intervencion_id, version in marcas.items()])
+            db_handler.audit_log(
+                entidad='Convocatoria', entidad_id=convocatoria_id, usuario_id=user_id,
+                accion='EXPORT', payload={'items': len(exported), 'destino': name}, tx=tx
+            )
+
+        segundos = time.perf_counter() - start
+        result = {
+            'convocatoria_id': convocatoria_id, 'items': len(exported), 'enviado': True,
+            'intentos': intento, 'bytes': bytes_enviados, 'segundos': round(segundos, 3),
+        }
+        db_handler.io_log('export', 'ok', f"Export enviado: {len(exported)} items.",
+                          odoo_batch_id=batch_id, convocatoria_id=convocatoria_id, detalles=result)
+        return result
+
+    # --- Lógica de Intervenciones ---
+    # El UPDATE y su fila de "Auditoria" viajan en una única sentencia (CTE con
+    # data-modifying statements), así comparten conexión, round-trip y COMMIT.
+    # Con expected_version el UPDATE es condicional (bloqueo optimista): si no
+    # coincide, la misma sentencia devuelve la versión actual sin SELECT previo.
+    # Cada variante del SET es una sentencia preparada distinta (register_variant).
+    def _update_intervention(self, intervention_id, set_sql, params, accion, payload, user_id,
+                             expected_version=None, tx=None, guard_sql=None, guard_error=None):
+        """
+        Aplica `set_sql` (fragmento SET con parámetros nombrados, nunca datos del usuario)
+        a una intervención, incrementa version y audita. Retorna
+        {'resultado': UPDATE_OK | UPDATE_CONFLICT | UPDATE_NOT_FOUND, 'version': int}.
+
+        La fila se lee con FOR UPDATE (cur): en un conflicto la versión que se
+        devuelve es la vigente, no la de la instantánea de la sentencia.
+        `guard_sql` es una condición sobre esa fila vigente (columnas de cur) que
+        debe cumplirse para actualizar; si la versión coincide pero la condición
+        no, se lanza `guard_error`.
+        """
+        query = f"""
+            WITH cur AS (
+                SELECT id, "version", tc_in_frames, tc_out_frames
+                FROM "Intervencion"
+                WHERE id = %(id)s
+                FOR UPDATE
+            ), upd AS (
+                UPDATE "Intervencion" i
+                SET {set_sql},
+                    "version" = i."version" + 1
+                FROM cur
+                WHERE i.id = cur.id
+                  AND (%(expected_version)s::int IS NULL OR cur."version" = %(expected_version)s::int)
+                  AND ({guard_sql or 'true'})
+                RETURNING i.id, i.take_id, i."version", i.estado, i.needs_fx
+            ), aud AS (
+                INSERT INTO "Auditoria" (entidad, entidad_id, usuario_id, accion, payload)
+                SELECT 'Intervencion', upd.id, %(user_id)s::int, %(accion)s::text, %(payload)s::jsonb
+                FROM upd
+            ), {_NOTIFY_CTE}
+            SELECT upd."version", true AS actualizado, t.capitulo_id, true AS valido
+            FROM upd
+            JOIN "Take" t ON t.id = upd.take_id
+            JOIN ntf ON ntf.id = upd.id
+            UNION ALL
+            SELECT cur."version", false AS actualizado, NULL::int AS capitulo_id, ({guard_sql or 'true'}) AS valido
+            FROM cur
+            WHERE NOT EXISTS (SELECT 1 FROM upd);
+        """
+        params = {
+            **params,
+            'id': intervention_id, 'expected_version': expected_version, 'user_id': user_id,
+            'accion': accion, 'payload': json.dumps(payload),
+        }
+        statement = prepared_statements.register_variant("upd_intervencion", query)
+        row = (tx.execute_prepared(statement, params, fetch_mode="one") if tx
+               else db_handler.execute_prepared(statement, params, fetch_mode="one"))
+        if row is None:
+            return {'resultado': UPDATE_NOT_FOUND, 'version': None}
+        if not row.actualizado:
+            if not row.valido and (expected_version is None or row.version == expected_version):
+                raise guard_error
+            return {'resultado': UPDATE_CONFLICT, 'version': row.version}
+        # Con tx la invalidación es responsabilidad de quien confirma la transacción.
+        if tx is None:
+            cache.invalidate('capitulo', row.capitulo_id)
+        logging.info(f"AUDIT: User {user_id} | Action '{accion}' on Intervencion ID {intervention_id}")
+        return {'resultado': UPDATE_OK, 'version': row.version, 'capitulo_id': row.capitulo_id}
+
+    def update_intervention_status(self, intervention_id, estado, estado_nota, user_id, expected_version=None,
+                                   tx=None):
+        """
+        Actualiza el estado de una intervención y registra la auditoría.
+        Retorna el resultado de _update_intervention o None si hay un error de BD
+        (dentro de `tx` el error se propaga para que se deshaga la transacción).
+        """
+        set_sql = """
+            estado = %(estado)s,
+            estado_nota = %(estado_nota)s,
+            realizado_por_usuario_id = %(user_id)s,
+            realizado_at = CASE WHEN %(estado)s IN ('realizado', 'omitido') THEN NOW() ELSE NULL END
+        """
+        try:
+            return self._update_intervention(
+                intervention_id, set_sql, {'estado': estado, 'estado_nota': estado_nota},
+                'UPDATE_ESTADO', {'estado': estado, 'nota': estado_nota}, user_id, expected_version, tx=tx
+            )
         except Exception as e:
+            if tx is not None:
+                raise
             logging.error(f"Error actualizando estado de intervención {intervention_id}: {e}")
-            return False
+            return None
 
-    def update_intervention_fx(self, intervention_id, needs_fx, fx_note, fx_source, user_id):
+    def update_intervention_fx(self, intervention_id, needs_fx, fx_note, fx_source, user_id, expected_version=None,
+                               tx=None):
         """
         Actualiza la marca FX de una intervención y registra la auditoría.
+        Retorna el resultado de _update_intervention o None si hay un error de BD
+        (dentro de `tx` el error se propaga para que se deshaga la transacción).
         """
-        query = """
-            UPDATE "Intervencion"
-            SET needs_fx = %s,
-                fx_note = %s,
-                fx_source = %s,
-                fx_marked_by = %s,
-                fx_marked_at = CASE WHEN %s THEN NOW() ELSE NULL END,
-                "version" = "version" + 1
-            WHERE id = %s
-            RETURNING id;
-        """
-        params = (needs_fx, fx_note, fx_source, user_id, needs_fx, intervention_id)
-        try:
-            result = db_handler.execute_query(query, params, fetch_mode="one")
-            if result:
-                db_handler.audit_log(
-                    entidad='Intervencion',
-                    entidad_id=intervention_id,
-                    usuario_id=user_id,
-                    accion='UPDATE_FX',
-                    payload={'needs_fx': needs_fx, 'nota': fx_note, 'source': fx_source}
-                )
-                return True
-            return False
+        set_sql = """
+            needs_fx = %(needs_fx)s,
+            fx_note = %(fx_note)s,
+            fx_source = %(fx_source)s,
+            fx_marked_by = %(user_id)s,
+            fx_marked_at = CASE WHEN %(needs_fx)s THEN NOW() ELSE NULL END
+        """
+        try:
+            return self._update_intervention(
+                intervention_id, set_sql, {'needs_fx': needs_fx, 'fx_note': fx_note, 'fx_source': fx_source},
+                'UPDATE_FX', {'needs_fx': needs_fx, 'nota': fx_note, 'source': fx_source}, user_id, expected_version,
+                tx=tx
+            )
         except Exception as e:
+            if tx is not None:
+                raise
             logging.error(f"Error actualizando FX de intervención {intervention_id}: {e}")
-            return False
+            return None
 
-    # --- Lógica de Repartos ---
-    def get_reparto(self, serie_id):
-        """Obtiene el reparto (personaje -> actor) para una serie."""
+    def update_intervention_dialogo(self, intervention_id, dialogo, user_id, expected_version=None, tx=None):
+        """
+        Actualiza el diálogo de una intervención (dialogo_tsv se recalcula solo) y
+        registra la auditoría. Retorna el resultado de _update_intervention o None si
+        hay un error de BD (dentro de `tx` el error se propaga).
+        """
+        try:
+            return self._update_intervention(
+                intervention_id, "dialogo = %(dialogo)s", {'dialogo': dialogo},
+                'UPDATE_DIALOGO', {'dialogo': dialogo}, user_id, expected_version, tx=tx
+            )
+        except Exception as e:
+            if tx is not None:
+                raise
+            logging.error(f"Error actualizando diálogo de intervención {intervention_id}: {e}")
+            return None
+
+    def get_intervention_fps(self, intervention_ids, tx=None):
+        """
+        fps de la serie de cada intervención: {intervencion_id: fps}. Las que no
+        existen no aparecen. Acepta un id suelto o una colección de ids.
+        """
+        if isinstance(intervention_ids, int):
+            intervention_ids = [intervention_ids]
+        query = """
+            SELECT i.id, s.fps
+            FROM "Intervencion" i
+            JOIN "Take" t ON t.id = i.take_id
+            JOIN "Capitulo" cap ON cap.id = t.capitulo_id
+            JOIN "Serie" s ON s.id = cap.serie_id
+            WHERE i.id = ANY(%s);
+        """
+        params = (list(intervention_ids),)
+        rows = tx.execute(query, params) if tx else db_handler.execute_query(query, params)
+        return {row['id']: row['fps'] for row in rows}
+
+    def update_intervention_timecode(self, intervention_id, cambios, user_id, expected_version=None, tx=None,
+                                     fps=None):
+        """
+        Actualiza tc_in y/o tc_out (claves presentes en `cambios`; None los borra)
+        validándolos contra los fps de la serie y guardando también su número de frame.
+        `fps` evita la consulta si quien llama ya lo conoce (lotes).
+        Lanza timecode.TimecodeError si alguno no es válido. Retorna el resultado de
+        _update_intervention.
+        """
+        if fps is None:
+            fps = self.get_intervention_fps(intervention_id, tx=tx).get(intervention_id)
+        if fps is None:
+            return {'resultado': UPDATE_NOT_FOUND, 'version': None}
+        params, asignaciones, payload = {}, [], {}
+        for campo in ('tc_in', 'tc_out'):
+            if campo not in cambios:
+                continue
+            frames = timecode.parse(cambios[campo], fps)
+            params[campo] = timecode.format_frames(frames, fps) if frames is not None else None
+            params[f"{campo}_frames"] = frames
+            asignaciones.append(f"{campo} = %({campo})s, {campo}_frames = %({campo}_frames)s")
+            payload[campo] = params[campo]
+        if not asignaciones:
+            raise timecode.TimecodeError("Se requiere 'tc_in' o 'tc_out'.")
+        if params.get('tc_in_frames') is not None and params.get('tc_out_frames') is not None \
+                and params['tc_out_frames'] < params['tc_in_frames']:
+            raise timecode.TimecodeError("'tc_out' no puede ser anterior a 'tc_in'.")
+        # Si solo cambia un extremo, el otro es el guardado (el vigente al actualizar).
+        tc_in = "%(tc_in_frames)s::int" if 'tc_in' in cambios else "cur.tc_in_frames"
+        tc_out = "%(tc_out_frames)s::int" if 'tc_out' in cambios else "cur.tc_out_frames"
+        return self._update_intervention(
+            intervention_id, ",\n".join(asignaciones), params, 'UPDATE_TIMECODE', payload,
+            user_id, expected_version, tx=tx,
+            guard_sql=f"{tc_in} IS NULL OR {tc_out} IS NULL OR {tc_out} >= {tc_in}",
+            guard_error=timecode.TimecodeError("'tc_out' no puede ser anterior a 'tc_in' (valor guardado)."),
+        )
+
+    def _apply_intervention_op(self, op, user_id, expected_version, tx, fps):
+        if op['op'] == 'estado':
+            return self.update_intervention_status(
+                op['id'], op['estado'], op.get('estado_nota'), user_id, expected_version, tx=tx)
+        if op['op'] == 'fx':
+            return self.update_intervention_fx(
+                op['id'], op['needs_fx'], op.get('fx_note'), op['fx_source'], user_id, expected_version, tx=tx)
+        if op['op'] == 'dialogo':
+            return self.update_intervention_dialogo(op['id'], op['dialogo'], user_id, expected_version, tx=tx)
+        if op['op'] == 'timecode':
+            if op['id'] not in fps:
+                return {'resultado': UPDATE_NOT_FOUND, 'version': None}
+            return self.update_intervention_timecode(
+                op['id'], op['cambios'], user_id, expected_version, tx=tx, fps=fps[op['id']])
+        raise ValueError(f"Operación desconocida: {op['op']}")
+
+    def apply_intervention_batch(self, operaciones, user_id, atomico=False):
+        """
+        Aplica en orden una lista de operaciones ya validadas
+        ({'op': 'estado'|'fx'|'dialogo'|'timecode', 'id', 'version', ...campos})
+        en una única transacción: una conexión y un COMMIT para todo el lote.
+
+        Cada operación lleva su propio control de versión. Si una operación anterior
+        del lote ya modificó la misma intervención, la versión que envió el cliente
+        se traduce a la resultante, porque el cliente no puede conocerla.
+        Sin `atomico` los conflictos solo afectan a su operación; con `atomico`
+        cualquier operación no aplicada deshace el lote entero.
+
+        Retorna (resultados, aplicado): un resultado por operación y si se confirmó
+        el lote. None si hay un error de BD.
+        """
+        resultados = []
+        capitulos = set()
+        try:
+            with db_handler.transaction() as tx:
+                ids_tc = {op['id'] for op in operaciones if op['op'] == 'timecode'}
+                fps = self.get_intervention_fps(ids_tc, tx=tx) if ids_tc else {}
+                versiones = {}  # id -> (versión que envió el cliente, versión tras el lote)
+                for indice, op in enumerate(operaciones):
+                    expected = op.get('version')
+                    vista = versiones.get(op['id'])
+                    if vista and expected is not None and expected == vista[0]:
+                        expected = vista[1]
+                    try:
+                        result = self._apply_intervention_op(op, user_id, expected, tx, fps)
+                    except timecode.TimecodeError as e:
+                        result = {'resultado': UPDATE_INVALID, 'version': None, 'error': str(e)}
+                    if result['resultado'] == UPDATE_OK:
+                        capitulos.add(result.pop('capitulo_id'))
+                        versiones[op['id']] = (vista[0] if vista else op.get('version'), result['version'])
+                    resultados.append({'indice': indice, 'op': op['op'], 'id': op['id'], **result})
+                    if atomico and result['resultado'] != UPDATE_OK:
+                        raise _BatchRollback()
+        except _BatchRollback:
+            fallida = len(resultados) - 1
+            for r in resultados[:fallida]:
+                r.update(resultado=UPDATE_ROLLED_BACK, version=None)
+            resultados.extend(
+                {'indice': indice, 'op': op['op'], 'id': op['id'], 'resultado': UPDATE_SKIPPED, 'version': None}
+                for indice, op in enumerate(operaciones) if indice > fallida
+            )
+            logging.info(f"Lote de {len(operaciones)} operaciones deshecho en la operación {fallida}.")
+            return resultados, False
+        except Exception as e:
+            logging.error(f"Error aplicando lote de {len(operaciones)} operaciones: {e}")
+            return None
+        for capitulo_id in capitulos:
+            cache.invalidate('capitulo', capitulo_id)
+        return resultados, True
+
+    def bulk_update_fx(self, capitulo_id, needs_fx, fx_note, fx_source, user_id,
+                       personaje_id=None, intervencion_ids=None):
+        """
+        Aplica una marca FX a todas las intervenciones de un capítulo (opcionalmente
+        filtradas por personaje y/o lista de ids) con un único UPDATE ... RETURNING
+        y un INSERT multi-fila en "Auditoria".
+
+        Con fx_source='personaje_default' los valores salen de PersonajeEnCapitulo:
+        needs_fx = fx_default y la nota es fx_note o, si falta, fx_default_note.
+
+        Retorna una lista con el resultado por intervención
+        ('actualizado', 'nota_invalida', 'sin_fx_default', 'no_encontrado') o None si falla.
+        """
         query = """
-            SELECT p.id as personaje_id, p.nombre as personaje_nombre, a.id as actor_id, a.nombre as actor_nombre
-            FROM "Personaje" p
-            LEFT JOIN "Actor" a ON p.actor_id = a.id
-            WHERE p.id IN (
-                SELECT DISTINCT i.personaje_id
+            WITH target AS (
+                SELECT i.id,
+                       pec.id IS NULL AS sin_reparto,
+                       CASE WHEN %(from_default)s THEN COALESCE(pec.fx_default, false)
+                            ELSE %(needs_fx)s END AS new_needs_fx,
+                       CASE WHEN %(from_default)s THEN COALESCE(%(fx_note)s, pec.fx_default_note)
+                            ELSE %(fx_note)s END AS new_fx_note
                 FROM "Intervencion" i
-                JOIN "Take" t ON i.take_id = t.id
-                JOIN "Capitulo" c ON t.capitulo_id = c.id
-                WHERE c.serie_id = %s
+                JOIN "Take" t ON t.id = i.take_id
+                LEFT JOIN "PersonajeEnCapitulo" pec
+                       ON pec.capitulo_id = t.capitulo_id AND pec.personaje_id = i.personaje_id
+                WHERE t.capitulo_id = %(capitulo_id)s
+                  AND (%(personaje_id)s::int IS NULL OR i.personaje_id = %(personaje_id)s::int)
+                  AND (%(ids)s::int[] IS NULL OR i.id = ANY(%(ids)s::int[]))
+            ), valid AS (
+                SELECT * FROM target
+                WHERE NOT (%(from_default)s AND sin_reparto)
+                  AND (NOT new_needs_fx OR length(new_fx_note) BETWEEN 3 AND 120)
+            ), upd AS (
+                UPDATE "Intervencion" i
+                SET needs_fx = v.new_needs_fx,
+                    fx_note = v.new_fx_note,
+                    fx_source = %(fx_source)s,
+                    fx_marked_by = %(user_id)s,
+                    fx_marked_at = CASE WHEN v.new_needs_fx THEN NOW() ELSE NULL END,
+                    "version" = i."version" + 1
+                FROM valid v
+                WHERE i.id = v.id
+                RETURNING i.id, i.take_id, i."version", i.estado, i.needs_fx, i.fx_note, i.fx_source
+            ), aud AS (
+                INSERT INTO "Auditoria" (entidad, entidad_id, usuario_id, accion, payload)
+                SELECT 'Intervencion', upd.id, %(user_id)s, 'UPDATE_FX',
+                       jsonb_build_object('needs_fx', upd.needs_fx, 'nota', upd.fx_note,
+                                          'source', upd.fx_source, 'bulk', true)
+                FROM upd
+            ), """ + _NOTIFY_CTE + """
+            SELECT t.id AS intervencion_id, upd."version",
+                   CASE WHEN upd.id IS NOT NULL THEN 'actualizado'
+                        WHEN %(from_default)s AND t.sin_reparto THEN 'sin_fx_default'
+                        ELSE 'nota_invalida' END AS resultado
+            FROM target t
+            LEFT JOIN upd ON upd.id = t.id
+            LEFT JOIN ntf ON ntf.id = t.id
+            ORDER BY t.id;
+        """
+        params = {
+            'capitulo_id': capitulo_id,
+            'personaje_id': personaje_id,
+            'ids': list(intervencion_ids) if intervencion_ids is not None else None,
+            'needs_fx': needs_fx,
+            'fx_note': fx_note,
+            'fx_source': fx_source,
+            'from_default': fx_source == 'personaje_default',
+            'user_id': user_id,
+        }
+        try:
+            rows = db_handler.execute_query(query, params, fetch_mode="all")
+        except Exception as e:
+            logging.error(f"Error en FX masivo para capítulo {capitulo_id}: {e}")
+            return None
+
+        resultados = [dict(row) for row in rows]
+        if intervencion_ids is not None:
+            encontrados = {row['intervencion_id'] for row in resultados}
+            resultados.extend(
+                {'intervencion_id': i, 'version': None, 'resultado': 'no_encontrado'}
+                for i in intervencion_ids if i not in encontrados
             )
-            ORDER BY p.nombre;
+        actualizadas = sum(1 for row in resultados if row['resultado'] == 'actualizado')
+        if actualizadas:
+            cache.invalidate('capitulo', capitulo_id)
+        logging.info(f"AUDIT: User {user_id} | Action 'UPDATE_FX' (masivo) on {actualizadas} intervenciones del capítulo {capitulo_id}")
+        return resultados
+
+    # --- Import XLSX clásico de series (§16.1) ---
+    def import_series_xlsx(self, stream, filename=None, user_id=None):
+        """
+        Importa el XLSX clásico (series, actores, capítulos, takes, intervenciones)
+        en una única transacción: o entra todo o nada. Las hojas se leen en streaming
+        y se vuelcan por páginas de IMPORT_PAGE_SIZE filas con INSERT ... ON CONFLICT
+        sobre las claves únicas, así que reimportar el mismo fichero no duplica.
+
+        Retorna contadores y tiempos por hoja. Lanza SeriesImportError si el fichero
+        no es válido.
+        """
+        start = time.perf_counter()
+        workbook = series_import.open_workbook(stream)
+        errores, hojas = [], {}
+        try:
+            with db_handler.transaction() as tx:
+                loader = _SeriesXlsxLoader(tx)
+                for sheet, sheet_name in series_import.check_sheets(workbook):
+                    inicio_hoja, filas = time.perf_counter(), 0
+                    rows = series_import.iter_sheet(workbook, sheet, sheet_name, errores, IMPORT_MAX_ERRORS)
+                    for page in odoo_io.batched(rows, IMPORT_PAGE_SIZE):
+                        getattr(loader, f"load_{sheet}")(page, errores)
+                        filas += len(page)
+                    segundos = time.perf_counter() - inicio_hoja
+                    hojas[sheet] = {
+                        'filas': filas, 'segundos': round(segundos, 3),
+                        'filas_por_segundo': round(filas / segundos, 1) if segundos > 0 else None,
+                    }
+                if errores:
+                    raise SeriesImportError("El fichero contiene errores; no se ha importado nada.", errores)
+
+                resultado = dict(loader.contadores)
+        except SeriesImportError as e:
+            db_handler.io_log('import', 'error', f"Import XLSX {filename}: {e.mensaje}",
+                              detalles={'errores': e.errores[:IMPORT_MAX_ERRORS]})
+            raise
+        except psycopg2.errors.UniqueViolation as e:
+            mensaje = "El fichero choca con datos existentes (p. ej. un nombre de serie con otra serie_ref)."
+            db_handler.io_log('import', 'error', f"Import XLSX {filename}: {mensaje}",
+                              detalles={'errores': [str(e).strip()]})
+            raise SeriesImportError(mensaje, [str(e).strip()])
+        finally:
+            workbook.close()
+
+        cache.invalidate('reparto')
+        cache.invalidate('capitulo')
+        segundos = time.perf_counter() - start
+        filas = sum(h['filas'] for h in hojas.values())
+        resultado.update({
+            'filas': filas, 'segundos': round(segundos, 3),
+            'filas_por_segundo': round(filas / segundos, 1) if segundos > 0 else None, 'hojas': hojas,
+        })
+        db_handler.io_log('import', 'ok', f"Import XLSX {filename} (usuario {user_id}): {filas} filas.", detalles=resultado)
+        return resultado
+
+    # --- Lógica de Capítulos ---
+    def get_capitulo_etag(self, capitulo_id):
+        """ETag del detalle de un capítulo (ver get_convocatoria_etag). None si no existe."""
+        query = """
+            SELECT cap.updated_at AS capitulo_updated_at, count(t.id) AS filas,
+                   COALESCE(sum(i."version"), 0) AS versiones,
+                   max(GREATEST(t.updated_at, i.updated_at, p.updated_at)) AS updated_at
+            FROM "Capitulo" cap
+            LEFT JOIN "Take" t ON t.capitulo_id = cap.id
+            LEFT JOIN "Intervencion" i ON i.take_id = t.id
+            LEFT JOIN "Personaje" p ON p.id = i.personaje_id
+            WHERE cap.id = %s
+            GROUP BY cap.id;
         """
-        params = (serie_id,)
         try:
-            return db_handler.execute_query(query, params, fetch_mode="all")
+            row = db_handler.execute_query(query, (capitulo_id,), fetch_mode="one")
+            return _fingerprint_etag(f"capitulo:{capitulo_id}", row) if row else None
+        except Exception as e:
+            logging.error(f"Error calculando ETag del capítulo {capitulo_id}: {e}")
+            return None
+
+    def get_capitulo_detalle(self, capitulo_id, etag=None):
+        """
+        Detalle de un capítulo: sus takes con las intervenciones anidadas, en una sola
+        consulta agrupada en Python. Retorna None si no existe o si hay un error.
+
+        Se sirve desde la caché (espacio 'capitulo'). Si se pasa el ETag actual, forma
+        parte de la clave: una entrada cacheada por otro proceso antes de una escritura
+        nunca se sirve con un ETag posterior. Las escrituras invalidan la clave sin ETag.
+        """
+        key = capitulo_id if etag is None else f"{capitulo_id}:{etag}"
+        try:
+            return cache.get_or_load(
+                'capitulo', key, lambda: self._load_capitulo_detalle(capitulo_id), ttl=CAPITULO_CACHE_TTL
+            )
+        except Exception as e:
+            logging.error(f"Error obteniendo detalle del capítulo {capitulo_id}: {e}")
+            return None
+
+    def _load_capitulo_detalle(self, capitulo_id):
+        query = """
+            SELECT cap.id AS capitulo_id, cap.numero AS numero_capitulo, cap.titulo AS titulo_capitulo,
+                   cap.serie_id, t.id AS take_id, t.numero AS numero_take,
+                   i.id AS intervencion_id, i.orden, i.dialogo, i.tc_in, i.tc_out, i.estado,
+                   i.estado_nota, i.needs_fx, i.fx_note, i."version", p.nombre AS personaje
+            FROM "Capitulo" cap
+            LEFT JOIN "Take" t ON t.capitulo_id = cap.id
+            LEFT JOIN "Intervencion" i ON i.take_id = t.id
+            LEFT JOIN "Personaje" p ON p.id = i.personaje_id
+            WHERE cap.id = %s
+            ORDER BY t.numero, i.orden;
+        """
+        rows = db_handler.execute_query(query, (capitulo_id,), fetch_mode="all")
+        if not rows:
+            return None
+
+        first = rows[0]
+        capitulo = {
+            'id': first['capitulo_id'], 'numero_capitulo': first['numero_capitulo'],
+            'titulo_capitulo': first['titulo_capitulo'], 'serie_id': first['serie_id'],
+        }
+        takes = []
+        for row in rows:
+            if row['take_id'] is None:
+                continue
+            if not takes or takes[-1]['id'] != row['take_id']:
+                takes.append({'id': row['take_id'], 'numero_take': row['numero_take'], 'intervenciones': []})
+            if row['intervencion_id'] is not None:
+                takes[-1]['intervenciones'].append({
+                    'id': row['intervencion_id'], 'take_id': row['take_id'], 'personaje': row['personaje'],
+                    'orden_en_take': row['orden'], 'dialogo': row['dialogo'],
+                    'tc_in': row['tc_in'], 'tc_out': row['tc_out'],
+                    'estado': row['estado'], 'estado_nota': row['estado_nota'],
+                    'completo': row['estado'] == 'realizado',
+                    'needs_fx': row['needs_fx'], 'fx_note': row['fx_note'], 'version': row['version'],
+                })
+        return {'capitulo': capitulo, 'takes': takes}
+
+    def get_intervenciones_por_tc(self, capitulo_id, tc_desde, tc_hasta):
+        """
+        Intervenciones del capítulo cuyo tc_in cae entre `tc_desde` y `tc_hasta`
+        (ambos incluidos), como rango sobre tc_in_frames. Lanza timecode.TimecodeError
+        si algún límite no es válido para los fps de la serie; None si el capítulo no existe.
+        """
+        info = db_handler.execute_query("""
+            SELECT s.fps FROM "Capitulo" cap JOIN "Serie" s ON s.id = cap.serie_id WHERE cap.id = %s;
+        """, (capitulo_id,), fetch_mode="one", readonly=True)
+        if info is None:
+            return None
+        desde = timecode.parse(tc_desde, info['fps']) if tc_desde else 0
+        hasta = timecode.parse(tc_hasta, info['fps']) if tc_hasta else 2**31 - 1
+        return db_handler.execute_query("""
+            SELECT i.id, t.numero AS take_numero, i.orden, p.nombre AS personaje, i.tc_in, i.tc_out,
+                   i.tc_in_frames, i.tc_out_frames, i.estado, i."version"
+            FROM "Take" t
+            JOIN "Intervencion" i ON i.take_id = t.id
+            JOIN "Personaje" p ON p.id = i.personaje_id
+            WHERE t.capitulo_id = %s AND i.tc_in_frames BETWEEN %s AND %s
+            ORDER BY i.tc_in_frames, t.numero, i.orden;
+        """, (capitulo_id, desde, hasta), readonly=True)
+
+    def get_duracion_por_actor(self, capitulo_id=None, serie_id=None):
+        """
+        Duración total (tc_out - tc_in) por actor, en frames y segundos reales, de un
+        capítulo o de toda una serie. `realizado` cuenta solo las intervenciones hechas.
+        """
+        return db_handler.execute_query("""
+            SELECT a.id AS actor_id, a.nombre AS actor, count(*) AS intervenciones,
+                   sum(i.tc_out_frames - i.tc_in_frames) AS frames,
+                   round(sum(i.tc_out_frames - i.tc_in_frames) / max(s.fps), 3) AS segundos,
+                   round(sum(i.tc_out_frames - i.tc_in_frames) FILTER (WHERE i.estado = 'realizado')
+                         / max(s.fps), 3) AS segundos_realizados
+            FROM "Capitulo" cap
+            JOIN "Serie" s ON s.id = cap.serie_id
+            JOIN "Take" t ON t.capitulo_id = cap.id
+            JOIN "Intervencion" i ON i.take_id = t.id
+            JOIN "Personaje" p ON p.id = i.personaje_id
+            LEFT JOIN "Actor" a ON a.id = p.actor_id
+            WHERE (%(capitulo_id)s::int IS NULL OR cap.id = %(capitulo_id)s::int)
+              AND (%(serie_id)s::int IS NULL OR cap.serie_id = %(serie_id)s::int)
+              AND i.tc_in_frames IS NOT NULL AND i.tc_out_frames >= i.tc_in_frames
+            GROUP BY a.id, a.nombre
+            ORDER BY segundos DESC NULLS LAST;
+        """, {'capitulo_id': capitulo_id, 'serie_id': serie_id}, readonly=True)
+
+    def get_capitulo_export_info(self, capitulo_id):
+        """Serie y número del capítulo para nombrar el export. None si no existe."""
+        return db_handler.execute_query("""
+            SELECT cap.id, cap.numero, cap.titulo, s.nombre AS serie_nombre, s.referencia AS serie_referencia
+            FROM "Capitulo" cap
+            JOIN "Serie" s ON s.id = cap.serie_id
+            WHERE cap.id = %s;
+        """, (capitulo_id,), fetch_mode="one", readonly=True)
+
+    def iter_capitulo_export_rows(self, capitulo_id):
+        """
+        Filas del export del capítulo (una por intervención, con personaje y actor),
+        leídas con un cursor de servidor: la memoria no crece con el capítulo.
+        """
+        return db_handler.stream_query("""
+            SELECT t.numero AS take_numero, i.orden, p.nombre AS personaje, a.nombre AS actor,
+                   i.tc_in, i.tc_out, i.dialogo, i.estado::text AS estado, i.estado_nota,
+                   i.needs_fx, i.fx_note
+            FROM "Take" t
+            JOIN "Intervencion" i ON i.take_id = t.id
+            JOIN "Personaje" p ON p.id = i.personaje_id
+            LEFT JOIN "Actor" a ON a.id = p.actor_id
+            WHERE t.capitulo_id = %s
+            ORDER BY t.numero, i.orden;
+        """, (capitulo_id,), readonly=True)
+
+    # --- Búsqueda (§5, §17) ---
+    def buscar_personajes(self, q, capitulo_id=None, convocatoria_id=None, limit=AUTOCOMPLETE_LIMIT):
+        """
+        Autocompletado de personajes. Primero los que empiezan por `q` (índice
+        text_pattern_ops sobre lower(nombre)); si faltan sugerencias y `q` es
+        suficientemente largo, se completan por parecido de trigramas. Opcionalmente
+        se limita a los personajes con intervenciones en un capítulo o convocatoria.
+        """
+        texto = (q or '').strip().lower()
+        if not texto:
+            return []
+        alcance = ''
+        if capitulo_id is not None:
+            alcance = """AND EXISTS (
+                SELECT 1 FROM "Take" t JOIN "Intervencion" i ON i.take_id = t.id
+                WHERE t.capitulo_id = %(capitulo_id)s AND i.personaje_id = p.id)"""
+        elif convocatoria_id is not None:
+            alcance = """AND EXISTS (
+                SELECT 1 FROM "ConvocatoriaItem" ci JOIN "Intervencion" i ON i.take_id = ci.take_id
+                WHERE ci.convocatoria_id = %(convocatoria_id)s AND i.personaje_id = p.id)"""
+        query = f"""
+            WITH prefijo AS (
+                SELECT p.id, 1.0::real AS score, 0 AS grupo
+                FROM "Personaje" p
+                WHERE lower(p.nombre) LIKE %(prefijo)s {alcance}
+                ORDER BY lower(p.nombre)
+                LIMIT %(limit)s
+            ), parecidos AS (
+                SELECT p.id, word_similarity(%(q)s, lower(p.nombre)) AS score, 1 AS grupo
+                FROM "Personaje" p
+                WHERE %(trigramas)s AND %(q)s <%% lower(p.nombre)
+                  AND p.id NOT IN (SELECT id FROM prefijo) {alcance}
+                ORDER BY score DESC
+                LIMIT %(limit)s
+            )
+            SELECT p.id, p.nombre, a.id AS actor_id, a.nombre AS actor_nombre,
+                   round(r.score::numeric, 3) AS score
+            FROM (SELECT * FROM prefijo UNION ALL SELECT * FROM parecidos) r
+            JOIN "Personaje" p ON p.id = r.id
+            LEFT JOIN "Actor" a ON a.id = p.actor_id
+            ORDER BY r.grupo, r.score DESC, p.nombre
+            LIMIT %(limit)s;
+        """
+        params = {
+            'q': texto, 'prefijo': f"{pagination.like_escape(texto)}%", 'limit': limit,
+            'trigramas': len(texto) >= TRIGRAM_MIN_LENGTH,
+            'capitulo_id': capitulo_id, 'convocatoria_id': convocatoria_id,
+        }
+        try:
+            return db_handler.execute_query(query, params, readonly=True)
+        except Exception as e:
+            logging.error(f"Error buscando personajes '{texto}': {e}")
+            return None
+
+    def buscar_dialogos(self, q, capitulo_id=None, serie_id=None, limit=SEARCH_LIMIT):
+        """
+        Búsqueda de texto completo (configuración 'spanish', sintaxis de
+        websearch_to_tsquery) en los diálogos, ordenada por relevancia. El
+        fragmento resaltado solo se calcula para las filas devueltas.
+        """
+        texto = (q or '').strip()
+        if not texto:
+            return []
+        query = """
+            WITH consulta AS (
+                SELECT websearch_to_tsquery('spanish', %(q)s) AS q
+            ), hits AS (
+                SELECT i.id, ts_rank(i.dialogo_tsv, consulta.q) AS rank
+                FROM consulta, "Intervencion" i
+                JOIN "Take" t ON t.id = i.take_id
+                JOIN "Capitulo" cap ON cap.id = t.capitulo_id
+                WHERE i.dialogo_tsv @@ consulta.q
+                  AND (%(capitulo_id)s::int IS NULL OR cap.id = %(capitulo_id)s::int)
+                  AND (%(serie_id)s::int IS NULL OR cap.serie_id = %(serie_id)s::int)
+                ORDER BY rank DESC, i.id
+                LIMIT %(limit)s
+            )
+            SELECT i.id AS intervencion_id, cap.serie_id, cap.id AS capitulo_id,
+                   cap.numero AS capitulo_numero, t.numero AS take_numero, i.orden,
+                   p.nombre AS personaje, i.estado, i.tc_in,
+                   ts_headline('spanish', i.dialogo, consulta.q,
+                               'MaxWords=20, MinWords=8, StartSel=«, StopSel=»') AS fragmento,
+                   round(h.rank::numeric, 4) AS rank
+            FROM hits h
+            CROSS JOIN consulta
+            JOIN "Intervencion" i ON i.id = h.id
+            JOIN "Take" t ON t.id = i.take_id
+            JOIN "Capitulo" cap ON cap.id = t.capitulo_id
+            JOIN "Personaje" p ON p.id = i.personaje_id
+            ORDER BY h.rank DESC, h.id;
+        """
+        params = {'q': texto, 'capitulo_id': capitulo_id, 'serie_id': serie_id, 'limit': limit}
+        try:
+            return db_handler.execute_query(query, params, readonly=True)
+        except Exception as e:
+            logging.error(f"Error buscando diálogos '{texto}': {e}")
+            return None
+
+    def get_siguiente_pendiente(self, personaje_id, capitulo_id=None, convocatoria_id=None, despues_de=None):
+        """
+        Siguiente intervención pendiente del personaje en un capítulo (orden de
+        take y orden) o en una convocatoria (orden de la convocatoria: serie,
+        capítulo, take). Con `despues_de` (id de intervención) se busca a partir
+        de esa posición. Cada take se resuelve con idx_intervencion_siguiente_pendiente.
+        Retorna la intervención o None si no quedan pendientes.
+        """
+        if capitulo_id is not None:
+            origen = """
+                FROM "Take" t
+                JOIN "Capitulo" cap ON cap.id = t.capitulo_id
+                JOIN "Serie" s ON s.id = cap.serie_id
+                JOIN "Intervencion" i ON i.take_id = t.id
+                WHERE t.capitulo_id = %(capitulo_id)s"""
+            posicion = "t.numero, i.orden"
+        elif convocatoria_id is not None:
+            origen = """
+                FROM "ConvocatoriaItem" ci
+                JOIN "Take" t ON t.id = ci.take_id
+                JOIN "Capitulo" cap ON cap.id = t.capitulo_id
+                JOIN "Serie" s ON s.id = cap.serie_id
+                JOIN "Intervencion" i ON i.take_id = t.id
+                WHERE ci.convocatoria_id = %(convocatoria_id)s"""
+            posicion = "s.nombre, cap.numero, t.numero, i.orden"
+        else:
+            raise ValueError("Se requiere capitulo_id o convocatoria_id.")
+
+        desde = ''
+        if despues_de is not None:
+            desde = f"""
+                AND ({posicion}) > (
+                    SELECT {posicion} FROM "Intervencion" i
+                    JOIN "Take" t ON t.id = i.take_id
+                    JOIN "Capitulo" cap ON cap.id = t.capitulo_id
+                    JOIN "Serie" s ON s.id = cap.serie_id
+                    WHERE i.id = %(despues_de)s
+                )"""
+        query = f"""
+            SELECT i.id AS intervencion_id, cap.id AS capitulo_id, cap.numero AS capitulo_numero,
+                   t.id AS take_id, t.numero AS take_numero, i.orden, i.dialogo, i.tc_in, i.tc_out,
+                   i.needs_fx, i."version"
+            {origen}
+              AND i.personaje_id = %(personaje_id)s AND i.estado = 'pendiente'
+              {desde}
+            ORDER BY {posicion}
+            LIMIT 1;
+        """
+        params = {
+            'personaje_id': personaje_id, 'capitulo_id': capitulo_id,
+            'convocatoria_id': convocatoria_id, 'despues_de': despues_de,
+        }
+        return db_handler.execute_query(query, params, fetch_mode="one", readonly=True)
+
+    # --- Métricas (§11) ---
+    def get_metricas(self, desde, hasta, sala_id=None, serie_id=None):
+        """
+        Dashboard de KPIs leído de las vistas materializadas (ver refrescar_metricas
+        en job_scheduler.py): no recorre el histórico de intervenciones. `refrescado`
+        indica la antigüedad de cada vista.
+        """
+        filtros = {'desde': desde, 'hasta': hasta, 'sala_id': sala_id, 'serie_id': serie_id}
+        return {
+            'completado_sala_dia': db_handler.execute_query("""
+                SELECT m.sala_id, s.nombre AS sala, m.fecha, m.convocatorias, m.convocatorias_reabiertas,
+                       m.intervenciones, m.realizadas, m.omitidas, m.pct_completado
+                FROM "MetricaSalaDia" m
+                JOIN "Sala" s ON s.id = m.sala_id
+                WHERE m.fecha BETWEEN %(desde)s AND %(hasta)s
+                  AND (%(sala_id)s::int IS NULL OR m.sala_id = %(sala_id)s::int)
+                ORDER BY m.fecha, m.sala_id;
+            """, filtros, readonly=True),
+            'convocado_vs_ejecutado': db_handler.execute_query("""
+                SELECT m.serie_id, s.nombre AS serie, m.intervenciones, m.convocadas, m.realizadas,
+                       m.omitidas, m.con_fx
+                FROM "MetricaSerie" m
+                JOIN "Serie" s ON s.id = m.serie_id
+                WHERE %(serie_id)s::int IS NULL OR m.serie_id = %(serie_id)s::int
+                ORDER BY s.nombre;
+            """, filtros, readonly=True),
+            'fx_por_personaje': db_handler.execute_query("""
+                SELECT m.serie_id, m.personaje_id, p.nombre AS personaje, m.fx_source, m.intervenciones_fx
+                FROM "MetricaFxPersonaje" m
+                JOIN "Personaje" p ON p.id = m.personaje_id
+                WHERE %(serie_id)s::int IS NULL OR m.serie_id = %(serie_id)s::int
+                ORDER BY m.intervenciones_fx DESC
+                LIMIT 200;
+            """, filtros, readonly=True),
+            'tiempo_por_take': db_handler.execute_query("""
+                SELECT serie_id, sala_id, fecha, takes, segundos_medios
+                FROM "MetricaTiempoTake"
+                WHERE fecha BETWEEN %(desde)s AND %(hasta)s
+                  AND (%(sala_id)s::int IS NULL OR sala_id = %(sala_id)s::int)
+                  AND (%(serie_id)s::int IS NULL OR serie_id = %(serie_id)s::int)
+                ORDER BY fecha, sala_id, serie_id;
+            """, filtros, readonly=True),
+            'reaperturas': db_handler.execute_query("""
+                SELECT fecha, serie_id, reaperturas
+                FROM "MetricaReaperturaDia"
+                WHERE fecha BETWEEN %(desde)s AND %(hasta)s
+                  AND (%(serie_id)s::int IS NULL OR serie_id = %(serie_id)s::int)
+                ORDER BY fecha, serie_id;
+            """, filtros, readonly=True),
+            'refrescado': db_handler.execute_query(
+                'SELECT nombre, refreshed_at, segundos FROM "MetricaRefresco" ORDER BY nombre;', readonly=True
+            ),
+        }
+
+    # --- Lógica de Repartos ---
+    def get_reparto(self, serie_id):
+        """
+        Obtiene el reparto (personaje -> actor) para una serie.
+        Se sirve desde la caché (espacio 'reparto'); las asignaciones la invalidan.
+        """
+        try:
+            return cache.get_or_load(
+                'reparto', serie_id, lambda: self._load_reparto(serie_id), ttl=REPARTO_CACHE_TTL
+            )
         except Exception as e:
             logging.error(f"Error obteniendo reparto para serie {serie_id}: {e}")
             return []
 
+    def _load_reparto(self, serie_id):
+        return [row._asdict() for row in db_handler.execute_prepared(REPARTO, (serie_id,), fetch_mode="all")]
+
+    def assign_reparto(self, personaje_id, actor_id, user_id):
+        """
+        Asigna (o quita, con actor_id=None) el actor de un personaje. Como el actor es
+        del personaje y no de la serie, invalida el reparto cacheado de todas las series.
+        Retorna True si se asignó, False si el personaje o el actor no existen, None si hay un error.
+        """
+        query = """
+            WITH upd AS (
+                UPDATE "Personaje" SET actor_id = %(actor_id)s
+                WHERE id = %(personaje_id)s
+                RETURNING id
+            ), aud AS (
+                INSERT INTO "Auditoria" (entidad, entidad_id, usuario_id, accion, payload)
+                SELECT 'Personaje', upd.id, %(user_id)s, 'UPDATE_REPARTO', %(payload)s::jsonb
+                FROM upd
+            )
+            SELECT id FROM upd;
+        """
+        params = {
+            'actor_id': actor_id, 'personaje_id': personaje_id, 'user_id': user_id,
+            'payload': json.dumps({'actor_id': actor_id}),
+        }
+        try:
+            row = db_handler.execute_query(query, params, fetch_mode="one")
+        except psycopg2.errors.ForeignKeyViolation:
+            logging.warning(f"Actor {actor_id} no existe; no se asigna al personaje {personaje_id}.")
+            return False
+        except Exception as e:
+            logging.error(f"Error asignando actor {actor_id} al personaje {personaje_id}: {e}")
+            return None
+        cache.invalidate('reparto')
+        return row is not None
+
     # Puedes añadir más métodos aquí para los otros flujos de trabajo...
\ No newline at end of file
@@ -7,9 +7,22 @@ usando la librería psycopg2.
 """
 import psycopg2
 import psycopg2.extras
+import atexit
+import datetime
 import os
 import logging
 import json
+import re
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import instrumentation
+import prepared_statements
+from audit_writer import AuditWriter
+from db_pool import ConnectionPool, PoolTimeout, connection_lost, is_connection_error
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s')
 
@@ -19,6 +32,55 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "admin")
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "5432")
 
+# --- Configuración del pool de conexiones ---
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))              # segundos esperando una conexión libre
+DB_POOL_MAX_USES = int(os.getenv("DB_POOL_MAX_USES", "1000"))            # reciclar tras N usos (0 = nunca)
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # reciclar tras T segundos (0 = nunca)
+DB_POOL_HEALTH_CHECK_AFTER = float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30"))  # SELECT 1 si lleva T s ociosa
+
+# --- Réplica de lectura (opcional) ---
+# Con DB_REPLICA_HOST, las lecturas marcadas readonly=True van a la réplica mientras
+# responda, su retraso no pase de DB_REPLICA_MAX_LAG y ya haya aplicado las
+# escrituras de la sesión (read-your-writes por LSN). Si no, van al primario.
+DB_REPLICA_HOST = os.getenv("DB_REPLICA_HOST")
+DB_REPLICA_PORT = os.getenv("DB_REPLICA_PORT", DB_PORT)
+DB_REPLICA_NAME = os.getenv("DB_REPLICA_NAME", DB_NAME)
+DB_REPLICA_USER = os.getenv("DB_REPLICA_USER", DB_USER)
+DB_REPLICA_PASSWORD = os.getenv("DB_REPLICA_PASSWORD", DB_PASSWORD)
+DB_REPLICA_POOL_MAX = int(os.getenv("DB_REPLICA_POOL_MAX", str(DB_POOL_MAX)))
+DB_REPLICA_POOL_TIMEOUT = float(os.getenv("DB_REPLICA_POOL_TIMEOUT", "1"))       # saturada: mejor el primario que esperar
+DB_REPLICA_CONNECT_TIMEOUT = int(os.getenv("DB_REPLICA_CONNECT_TIMEOUT", "3"))
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))                  # segundos
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "1"))    # segundos entre medidas del retraso
+DB_REPLICA_RETRY_AFTER = float(os.getenv("DB_REPLICA_RETRY_AFTER", "30"))         # segundos sin usarla tras un fallo
+
+# Versión de schema.sql que espera este código (tabla "SchemaVersion"). Subirla
+# junto con cualquier cambio del esquema y añadir migrations/NNNN_nombre.sql
+# (NNNN = la nueva versión) que lleve una BD existente de la anterior a esta.
+SCHEMA_VERSION = 1
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), 'migrations')
+# Si la BD está vacía (sin tablas), aplicar schema.sql al arrancar. Nunca se borra nada.
+DB_INIT_IF_EMPTY = os.getenv("DB_INIT_IF_EMPTY", "1") == "1"
+# Si la BD está en una versión anterior, aplicar las migraciones pendientes al arrancar.
+DB_MIGRATE_ON_START = os.getenv("DB_MIGRATE_ON_START", "1") == "1"
+# Clave del advisory lock que serializa las migraciones entre procesos.
+_MIGRATION_LOCK = 0x41535256
+_MIGRATION_FILE = re.compile(r'^(\d{4})_\w+\.sql$')
+
+_pool = None
+_pool_lock = threading.Lock()
+_replica_pool = None
+_inherited_pools = []
+
+
+class SchemaError(RuntimeError):
+    """La BD no tiene la versión de esquema que espera el código."""
+
+class ReplicaError(Exception):
+    """Falló una lectura en la réplica (conexión caída o conflicto con la recuperación)."""
+
 def get_db_connection():
     """Establece y retorna una nueva conexión a la base de datos PostgreSQL."""
     try:
@@ -27,13 +89,292 @@ def get_db_connection():
             user=DB_USER,
             password=DB_PASSWORD,
             host=DB_HOST,
-            port=DB_PORT
+            port=DB_PORT,
+            connection_factory=prepared_statements.PreparingConnection,
         )
         return conn
     except psycopg2.OperationalError as e:
         logging.error(f"Error al conectar a la base de datos: {e}")
         raise
 
+def get_replica_connection():
+    """Nueva conexión a la réplica de lectura (DB_REPLICA_HOST)."""
+    return psycopg2.connect(
+        dbname=DB_REPLICA_NAME,
+        user=DB_REPLICA_USER,
+        password=DB_REPLICA_PASSWORD,
+        host=DB_REPLICA_HOST,
+        port=DB_REPLICA_PORT,
+        connect_timeout=DB_REPLICA_CONNECT_TIMEOUT,
+        connection_factory=prepared_statements.PreparingConnection,
+    )
+
+def get_pool():
+    """Retorna el pool de conexiones del proceso, creándolo la primera vez."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    get_db_connection,
+                    minconn=DB_POOL_MIN,
+                    maxconn=DB_POOL_MAX,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_uses=DB_POOL_MAX_USES,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    health_check_after=DB_POOL_HEALTH_CHECK_AFTER,
+                )
+                logging.info(f"Pool de conexiones creado (min={DB_POOL_MIN}, max={DB_POOL_MAX}).")
+    return _pool
+
+def get_replica_pool():
+    """Pool de la réplica. Se crea vacío (minconn=0): una réplica caída no impide arrancar."""
+    global _replica_pool
+    if _replica_pool is None:
+        with _pool_lock:
+            if _replica_pool is None:
+                _replica_pool = ConnectionPool(
+                    get_replica_connection,
+                    minconn=0,
+                    maxconn=DB_REPLICA_POOL_MAX,
+                    timeout=DB_REPLICA_POOL_TIMEOUT,
+                    max_uses=DB_POOL_MAX_USES,
+                    max_lifetime=DB_POOL_MAX_LIFETIME,
+                    health_check_after=DB_POOL_HEALTH_CHECK_AFTER,
+                )
+                logging.info(f"Pool de la réplica {DB_REPLICA_HOST} creado (max={DB_REPLICA_POOL_MAX}).")
+    return _replica_pool
+
+def close_pool():
+    """Vuelca la auditoría pendiente y cierra los pools de conexiones del proceso (si existen)."""
+    global _pool, _replica_pool
+    _audit_writer.close()
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+        if _replica_pool is not None:
+            _replica_pool.closeall()
+            _replica_pool = None
+
+def _reset_pool_after_fork():
+    """
+    En el proceso hijo de un fork (workers de gunicorn) el pool heredado comparte
+    sockets con el padre: no se puede usar ni cerrar (cerrar enviaría el Terminate
+    por la conexión del padre). Se aparta sin cerrar y el hijo crea el suyo.
+    """
+    global _pool, _replica_pool, _pool_lock, _replica_check_lock, _replica_counters_lock
+    _inherited_pools.extend(p for p in (_pool, _replica_pool) if p is not None)
+    _pool = None
+    _replica_pool = None
+    _pool_lock = threading.Lock()
+    _replica_check_lock = threading.Lock()
+    _replica_counters_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_pool_after_fork)
+
+def get_pool_stats():
+    """Métricas del pool: conexiones en uso, ociosas, hilos esperando y tiempos de espera."""
+    if _pool is None:
+        return {"in_use": 0, "idle": 0, "waiting": 0, "checkouts": 0}
+    return _pool.stats()
+
+# --- Enrutado lectura/escritura ---
+_REPLICA_STATUS_SQL = """
+    SELECT pg_is_in_recovery() AS en_recuperacion,
+           pg_last_wal_replay_lsn()::text AS replay_lsn,
+           CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+           END AS lag;
+"""
+_WRITE_SQL = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE|REFRESH|CREATE|DROP|ALTER)\b', re.IGNORECASE)
+
+_replica_status = {'down_until': 0.0, 'checked_at': float('-inf'), 'lag': None,
+                   'replay_lsn': None, 'in_recovery': None, 'error': None}
+_replica_counters = {'reads_replica': 0, 'reads_primary': 0, 'fallbacks': 0, 'failures': 0}
+_replica_counters_lock = threading.Lock()     # los actualizan todos los hilos del worker
+_replica_check_lock = threading.Lock()
+_write_sql_cache = {}
+# Por hilo: LSN mínimo que la réplica debe haber aplicado para leer de ella, LSN de la
+# última escritura del hilo y si la petición en curso ya ha leído del primario.
+_routing = threading.local()
+
+def parse_lsn(text):
+    """'16/B374D848' -> entero comparable."""
+    hi, lo = text.split('/')
+    return (int(hi, 16) << 32) | int(lo, 16)
+
+def _is_write(query):
+    result = _write_sql_cache.get(query)
+    if result is None:
+        if len(_write_sql_cache) > 2048:
+            _write_sql_cache.clear()
+        result = _write_sql_cache[query] = bool(_WRITE_SQL.search(str(query)))
+    return result
+
+def _count_replica(key):
+    with _replica_counters_lock:
+        _replica_counters[key] += 1
+
+def _mark_replica_down(error):
+    """Solo para errores de conexión: la réplica deja de usarse DB_REPLICA_RETRY_AFTER segundos."""
+    _replica_status['down_until'] = time.monotonic() + DB_REPLICA_RETRY_AFTER
+    _replica_status['error'] = str(error).strip()
+    _count_replica('failures')
+    logging.warning(f"Réplica no disponible; lecturas al primario durante {DB_REPLICA_RETRY_AFTER:g} s: {error}")
+
+def _check_replica():
+    """Mide retraso y LSN aplicado de la réplica. Solo un hilo a la vez; el resto usa la última medida."""
+    if not _replica_check_lock.acquire(blocking=False):
+        return
+    try:
+        with get_replica_pool().connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(_REPLICA_STATUS_SQL)
+                en_recuperacion, replay_lsn, lag = cursor.fetchone()
+            conn.rollback()
+        _replica_status.update(
+            in_recovery=en_recuperacion, lag=float(lag), error=None,
+            # Una BD que no es standby (p. ej. un contenedor de pruebas) no tiene LSN
+            # aplicado: sirve para lecturas, pero no garantiza read-your-writes.
+            replay_lsn=parse_lsn(replay_lsn) if replay_lsn else None,
+        )
+    except PoolTimeout as e:
+        _mark_replica_down(e)
+    except psycopg2.Error as e:
+        if is_connection_error(e):
+            _mark_replica_down(e)
+        else:
+            # Responde pero la medida falló (p. ej. statement_timeout): sin retraso
+            # conocido no se usa hasta la siguiente medida, sin apartarla.
+            _replica_status.update(lag=None, error=str(e).strip())
+    finally:
+        _replica_status['checked_at'] = time.monotonic()
+        _replica_check_lock.release()
+
+def _use_replica():
+    """Si una lectura puede ir a la réplica ahora mismo, desde este hilo."""
+    if not DB_REPLICA_HOST or getattr(_routing, 'primary_pinned', False):
+        return False
+    if time.monotonic() < _replica_status['down_until']:
+        return False
+    if time.monotonic() - _replica_status['checked_at'] >= DB_REPLICA_CHECK_INTERVAL:
+        _check_replica()
+        if time.monotonic() < _replica_status['down_until']:
+            return False
+    lag = _replica_status['lag']
+    if lag is None or lag > DB_REPLICA_MAX_LAG:
+        return False
+    min_lsn = getattr(_routing, 'min_lsn', None)
+    if min_lsn is not None:
+        replay_lsn = _replica_status['replay_lsn']
+        if replay_lsn is None or replay_lsn < min_lsn:
+            return False
+    return True
+
+def begin_request_routing(min_lsn=None):
+    """
+    Al empezar una petición: `min_lsn` es el LSN de la última escritura de la sesión
+    (None si no hay). Mientras la réplica no lo haya aplicado, las lecturas van al
+    primario. Además, una vez que la petición lee del primario no vuelve a la réplica:
+    dentro de una petición los datos nunca retroceden (p. ej. ETag y cuerpo).
+    """
+    _routing.min_lsn = min_lsn
+    _routing.last_write_lsn = None
+    _routing.request_scoped = True
+    _routing.primary_pinned = False
+
+def end_request_routing():
+    """LSN de la última escritura hecha en la petición (None si no hubo), para guardarlo en la sesión."""
+    lsn = getattr(_routing, 'last_write_lsn', None)
+    _routing.min_lsn = None
+    _routing.last_write_lsn = None
+    _routing.request_scoped = False
+    _routing.primary_pinned = False
+    return lsn
+
+def _record_write_lsn(tx):
+    """Tras el COMMIT de una escritura, anota el LSN del primario para read-your-writes."""
+    try:
+        tx.cursor.execute("SELECT pg_current_wal_lsn()::text AS lsn;")
+        lsn = parse_lsn(tx.cursor.fetchone()['lsn'])
+        tx.conn.commit()
+    except psycopg2.Error as e:
+        logging.warning(f"No se pudo leer el LSN tras una escritura: {e}")
+        _routing.primary_pinned = getattr(_routing, 'request_scoped', False)
+        return
+    _routing.last_write_lsn = lsn
+    _routing.min_lsn = max(getattr(_routing, 'min_lsn', None) or 0, lsn)
+
+def _checkout(readonly):
+    """Retorna (pool, conexión): de la réplica si procede, si no del primario."""
+    if readonly and DB_REPLICA_HOST:
+        if _use_replica():
+            try:
+                pool = get_replica_pool()
+                conn = pool.getconn()
+                _count_replica('reads_replica')
+                return pool, conn
+            except PoolTimeout:
+                _count_replica('fallbacks')
+            except psycopg2.Error as e:
+                _mark_replica_down(e)
+        _count_replica('reads_primary')
+        if getattr(_routing, 'request_scoped', False):
+            _routing.primary_pinned = True
+    pool = get_pool()
+    return pool, pool.getconn()
+
+@contextmanager
+def pooled_connection(readonly=False):
+    """
+    Presta una conexión del pool durante el bloque `with`. Con readonly=True puede
+    ser de la réplica; sus fallos de conexión y los conflictos con la recuperación
+    se lanzan como ReplicaError para poder repetir la lectura en el primario.
+    La conexión solo se descarta si está cerrada o el error es de la conexión
+    (SQLSTATE 08xxx, 57P01-03); tras un deadlock, un fallo de serialización o un
+    statement_timeout vuelve al pool (putconn hace el rollback).
+    """
+    start = time.perf_counter()
+    pool, conn = _checkout(readonly)
+    instrumentation.record_pool_wait(time.perf_counter() - start)
+    broken = False
+    try:
+        yield conn
+    except psycopg2.Error as e:
+        broken = connection_lost(conn, e)
+        if pool is not _replica_pool:
+            raise
+        if broken:
+            _mark_replica_down(e)
+        elif isinstance(e, psycopg2.extensions.TransactionRollbackError):
+            # "canceling statement due to conflict with recovery": la réplica no está caída.
+            _count_replica('fallbacks')
+        else:
+            raise
+        raise ReplicaError(str(e)) from e
+    finally:
+        pool.putconn(conn, discard=broken)
+
+def get_replica_stats():
+    """Estado de la réplica: disponibilidad, retraso, LSN aplicado y reparto de lecturas."""
+    if not DB_REPLICA_HOST:
+        return {'configured': False}
+    status = _replica_status
+    with _replica_counters_lock:
+        counters = dict(_replica_counters)
+    return {
+        'configured': True,
+        'host': DB_REPLICA_HOST,
+        'available': time.monotonic() >= status['down_until'],
+        'lag_s': status['lag'],
+        'in_recovery': status['in_recovery'],
+        'replay_lsn': status['replay_lsn'],
+        'last_error': status['error'],
+        **counters,
+        'pool': _replica_pool.stats() if _replica_pool is not None else None,
+    }
+
 def initialize_database():
     """
     Ejecuta el script schema.sql para (re)crear la estructura de la base de datos.
@@ -69,59 +410,343 @@ def initialize_database():
             conn.close()
 
 
-def execute_query(query, params=None, fetch_mode="all"):
+def get_schema_version(conn):
     """
-    Ejecuta una consulta SQL, manejando la conexión, cursor y transacciones.
+    Versión del esquema instalado: un entero, 0 si hay tablas pero no la de
+    versión (esquema anterior al versionado, se migra desde ahí) o None si la
+    BD está vacía.
     """
-    conn = None
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT to_regclass('public."SchemaVersion"') IS NOT NULL AS versionada,
+                   EXISTS (SELECT 1 FROM pg_tables WHERE schemaname = 'public') AS con_tablas;
+        """)
+        versionada, con_tablas = cursor.fetchone()
+        if not con_tablas:
+            return None
+        if not versionada:
+            return 0
+        cursor.execute('SELECT max(version) FROM "SchemaVersion";')
+        return cursor.fetchone()[0] or 0
+
+def list_migrations():
+    """[(versión, ruta)] de migrations/NNNN_nombre.sql, ordenadas por versión."""
+    migraciones = []
+    for nombre in os.listdir(MIGRATIONS_DIR):
+        match = _MIGRATION_FILE.match(nombre)
+        if match:
+            migraciones.append((int(match.group(1)), os.path.join(MIGRATIONS_DIR, nombre)))
+    migraciones.sort()
+    versiones = [version for version, _ in migraciones]
+    if versiones != list(range(1, SCHEMA_VERSION + 1)):
+        raise SchemaError(f"Las migraciones {versiones} no van de 1 a SCHEMA_VERSION={SCHEMA_VERSION} sin huecos.")
+    return migraciones
+
+def apply_migrations():
+    """
+    Aplica en orden las migraciones posteriores a la versión instalada, cada una
+    en su transacción junto con su fila de "SchemaVersion". Un advisory lock
+    serializa a los procesos que arrancan a la vez (API y worker de tareas): el
+    que espera vuelve a leer la versión y salta lo ya aplicado.
+    Retorna la versión final.
+    """
+    migraciones = list_migrations()
+    conn = get_db_connection()
     try:
-        conn = get_db_connection()
-        # Usar RealDictCursor para obtener resultados como diccionarios
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        
-        cursor.execute(query, params)
-        
-        results = None
-        if fetch_mode == "all":
-            results = cursor.fetchall()
-        elif fetch_mode == "one":
-            results = cursor.fetchone()
-        elif fetch_mode == "none":
-            results = cursor.rowcount # Devuelve filas afectadas para INSERT/UPDATE/DELETE
-        else:
-            raise ValueError(f"Modo de fetch no válido: {fetch_mode}")
-            
-        conn.commit()
-        return results
+        for version, path in migraciones:
+            with open(path, 'r', encoding='utf-8') as f:
+                sql_script = f.read()
+            with conn:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_advisory_xact_lock(%s);", (_MIGRATION_LOCK,))
+                    actual = get_schema_version(conn)
+                    if actual is None:
+                        raise SchemaError("La BD está vacía: se crea con schema.sql, no con migraciones.")
+                    if actual >= version:
+                        continue
+                    logging.info(f"Aplicando migración {os.path.basename(path)} (versión {actual} -> {version})...")
+                    cursor.execute(sql_script)
+                    cursor.execute('INSERT INTO "SchemaVersion" (version) VALUES (%s) ON CONFLICT (version) DO NOTHING;',
+                                   (version,))
+        return get_schema_version(conn)
+    except psycopg2.Error as e:
+        raise SchemaError(f"Falló la migración del esquema: {e}") from e
+    finally:
+        conn.close()
 
+def ensure_schema(init_if_empty=DB_INIT_IF_EMPTY, migrate=DB_MIGRATE_ON_START):
+    """
+    Comprobación de arranque: la BD debe tener el esquema SCHEMA_VERSION. Si está
+    vacía y `init_if_empty`, se aplica schema.sql; si está en una versión
+    anterior (0 = sin "SchemaVersion") y `migrate`, se aplican las migraciones
+    pendientes. En cualquier otro caso lanza SchemaError: nunca se recrea (ni se
+    borra) un esquema con datos.
+    Usa conexiones propias, fuera del pool, para no dejar conexiones abiertas
+    en el proceso maestro antes del fork de los workers.
+    """
+    conn = get_db_connection()
+    try:
+        version = get_schema_version(conn)
+    finally:
+        conn.close()
+
+    if version == SCHEMA_VERSION:
+        logging.info(f"Esquema de BD en la versión {version}.")
+        return version
+    if version is None:
+        if not init_if_empty:
+            raise SchemaError("La BD está vacía y DB_INIT_IF_EMPTY=0: aplique schema.sql antes de arrancar.")
+        logging.info("BD vacía: se aplica schema.sql.")
+        initialize_database()
+        return SCHEMA_VERSION
+    if version > SCHEMA_VERSION:
+        raise SchemaError(f"La BD está en la versión de esquema {version} y el código espera {SCHEMA_VERSION} "
+                          "(código más antiguo que la BD).")
+    if not migrate:
+        raise SchemaError(f"La BD está en la versión de esquema {version} y el código espera {SCHEMA_VERSION}: "
+                          "ejecute `python db_handler.py migrate`.")
+    version = apply_migrations()
+    logging.info(f"Esquema de BD migrado a la versión {version}.")
+    return version
+
+def ping():
+    """SELECT 1 con una conexión del pool (readiness). Lanza la excepción si falla."""
+    execute_query("SELECT 1;", fetch_mode="one")
+
+
+def _fetch(cursor, fetch_mode):
+    """Recupera el resultado del último execute según el modo de fetch."""
+    if fetch_mode == "all":
+        return cursor.fetchall()
+    elif fetch_mode == "one":
+        return cursor.fetchone()
+    elif fetch_mode == "none":
+        return cursor.rowcount # Devuelve filas afectadas para INSERT/UPDATE/DELETE
+    raise ValueError(f"Modo de fetch no válido: {fetch_mode}")
+
+
+def execute_query(query, params=None, fetch_mode="all", readonly=False):
+    """
+    Ejecuta una consulta SQL, manejando la conexión, cursor y transacciones.
+    La conexión se toma prestada del pool y se devuelve al terminar.
+    Con readonly=True (solo lecturas) puede ir a la réplica; si falla allí, se
+    repite en el primario.
+    """
+    try:
+        try:
+            with transaction(readonly=readonly) as tx:
+                return tx.execute(query, params, fetch_mode=fetch_mode)
+        except ReplicaError as error:
+            logging.warning(f"Lectura fallida en la réplica, se repite en el primario: {error}")
+            with transaction() as tx:
+                return tx.execute(query, params, fetch_mode=fetch_mode)
+    except PoolTimeout as error:
+        logging.error(f"Sin conexiones libres en el pool: {error}")
+        raise
     except (Exception, psycopg2.DatabaseError) as error:
         logging.error(f"Error ejecutando la consulta: {error}")
-        if conn:
-            conn.rollback()
         raise
-    finally:
-        if conn:
-            conn.close()
+
+def execute_prepared(statement, params=None, fetch_mode="all", readonly=False):
+    """
+    Como execute_query, pero con una sentencia del registro de prepared_statements:
+    se ejecuta por nombre y las filas son namedtuple.
+    """
+    try:
+        try:
+            with transaction(readonly=readonly) as tx:
+                return tx.execute_prepared(statement, params, fetch_mode=fetch_mode)
+        except ReplicaError as error:
+            logging.warning(f"Lectura fallida en la réplica, se repite en el primario: {error}")
+            with transaction() as tx:
+                return tx.execute_prepared(statement, params, fetch_mode=fetch_mode)
+    except PoolTimeout as error:
+        logging.error(f"Sin conexiones libres en el pool: {error}")
+        raise
+    except (Exception, psycopg2.DatabaseError) as error:
+        logging.error(f"Error ejecutando la sentencia {statement.name}: {error}")
+        raise
+
+
+class Transaction:
+    """
+    Unidad de trabajo: varias sentencias sobre la misma conexión que se
+    confirman con un único COMMIT al salir del bloque `transaction()`.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        # Usar RealDictCursor para obtener resultados como diccionarios
+        self.cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        self.tuple_cursor = None   # para las sentencias preparadas (filas namedtuple)
+        self.wrote = False   # con réplica configurada, para anotar el LSN (read-your-writes)
+
+    def execute(self, query, params=None, fetch_mode="all"):
+        """Ejecuta una sentencia dentro de la transacción (sin commit)."""
+        if DB_REPLICA_HOST and not self.wrote:
+            self.wrote = _is_write(query)
+        start = time.perf_counter()
+        try:
+            self.cursor.execute(query, params)
+            return _fetch(self.cursor, fetch_mode)
+        finally:
+            instrumentation.record_query(query, params, time.perf_counter() - start)
+
+    def execute_prepared(self, statement, params=None, fetch_mode="all"):
+        """Ejecuta una sentencia preparada (prepared_statements.Statement) dentro de la transacción."""
+        if DB_REPLICA_HOST and not self.wrote:
+            self.wrote = statement.writes
+        if self.tuple_cursor is None:
+            self.tuple_cursor = self.conn.cursor()
+        start = time.perf_counter()
+        try:
+            return prepared_statements.execute(self.conn, self.tuple_cursor, statement, params, fetch_mode)
+        finally:
+            instrumentation.record_query(statement.sql, params, time.perf_counter() - start)
+
+    def execute_values(self, query, argslist, template=None, page_size=1000, fetch=False):
+        """Inserción multi-fila (`VALUES %s`) con psycopg2.extras.execute_values."""
+        self.wrote = True
+        start = time.perf_counter()
+        try:
+            return psycopg2.extras.execute_values(
+                self.cursor, query, argslist, template=template, page_size=page_size, fetch=fetch
+            )
+        finally:
+            # Los valores de las filas no se guardan ni en las muestras lentas.
+            instrumentation.record_query(query, None, time.perf_counter() - start)
+
+
+@contextmanager
+def transaction(readonly=False):
+    """
+    Abre una transacción sobre una conexión del pool. Hace COMMIT si el bloque
+    termina sin errores y ROLLBACK si lanza una excepción. readonly=True declara
+    que el bloque solo lee: puede ir a la réplica (ver pooled_connection).
+    """
+    with pooled_connection(readonly) as conn:
+        tx = Transaction(conn)
+        try:
+            yield tx
+            conn.commit()
+            if tx.wrote and DB_REPLICA_HOST:
+                _record_write_lsn(tx)
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if not conn.closed:
+                tx.cursor.close()
+                if tx.tuple_cursor is not None:
+                    tx.tuple_cursor.close()
+
+
+def stream_query(query, params=None, itersize=2000, readonly=False):
+    """
+    Itera las filas de una consulta con un cursor de servidor (named cursor),
+    trayendo `itersize` filas por viaje. La memoria no crece con el resultado.
+    La conexión queda prestada hasta agotar o cerrar el generador. Con
+    readonly=True puede leer de la réplica (sin reintento: ya se han entregado filas).
+    """
+    with pooled_connection(readonly) as conn:
+        cursor = conn.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.itersize = itersize
+        try:
+            start = time.perf_counter()
+            try:
+                cursor.execute(query, params)
+            finally:
+                instrumentation.record_query(query, params, time.perf_counter() - start)
+            yield from cursor
+        finally:
+            if not conn.closed:
+                try:
+                    cursor.close()
+                except psycopg2.Error:
+                    pass
+                conn.rollback()
+
 
 # --- Funciones de Auditoría ---
-def audit_log(entidad, entidad_id, usuario_id, accion, payload=None):
-    """Inserta un registro en la tabla de auditoría."""
-    query = """
-        INSERT INTO "Auditoria" (entidad, entidad_id, usuario_id, accion, payload)
-        VALUES (%s, %s, %s, %s, %s);
+_AUDIT_INSERT = """
+    INSERT INTO "Auditoria" (entidad, entidad_id, usuario_id, accion, payload, created_at)
+    VALUES %s;
+"""
+_AUDIT_INSERT_TX = prepared_statements.register("audit_insert", """
+    INSERT INTO "Auditoria" (entidad, entidad_id, usuario_id, accion, payload)
+    VALUES (%s, %s, %s, %s, %s);
+""")
+
+def _write_audit_batch(rows):
+    """Inserta un lote de eventos de auditoría con un INSERT multi-fila."""
+    values = [
+        (entidad, entidad_id, usuario_id, accion, json.dumps(payload) if payload else None, created_at)
+        for entidad, entidad_id, usuario_id, accion, payload, created_at in rows
+    ]
+    with transaction() as tx:
+        tx.execute_values(_AUDIT_INSERT, values, page_size=len(values))
+
+_audit_writer = AuditWriter(_write_audit_batch)
+atexit.register(_audit_writer.close)
+
+def audit_log(entidad, entidad_id, usuario_id, accion, payload=None, tx=None):
+    """
+    Registra un evento en la tabla de auditoría.
+    Si se pasa `tx`, el insert forma parte de esa transacción y sus errores se propagan.
+    Si no, el evento se encola y se escribe por lotes en segundo plano; con la cola
+    llena se escribe en el momento.
     """
-    # Convertir payload a JSON si es un dict
-    payload_json = json.dumps(payload) if payload else None
-    params = (entidad, entidad_id, usuario_id, accion, payload_json)
-    
+    if tx is not None:
+        tx.execute_prepared(
+            _AUDIT_INSERT_TX, (entidad, entidad_id, usuario_id, accion, json.dumps(payload) if payload else None),
+            fetch_mode="none"
+        )
+        return
+
+    # La hora del evento se toma al encolar, no al volcar el lote.
+    row = (entidad, entidad_id, usuario_id, accion, payload, datetime.datetime.now(datetime.timezone.utc))
+    if _audit_writer.enqueue(row):
+        return
     try:
-        execute_query(query, params, fetch_mode="none")
+        _write_audit_batch([row])
         logging.info(f"AUDIT: User {usuario_id} | Action '{accion}' on {entidad} ID {entidad_id}")
     except Exception as e:
         logging.error(f"Fallo al escribir en log de auditoría: {e}")
 
+def flush_audit_log():
+    """Vuelca en el momento los eventos de auditoría encolados."""
+    return _audit_writer.flush()
+
+def get_audit_stats():
+    """Métricas del escritor de auditoría: pendientes, escritos, lotes y rechazos por cola llena."""
+    return _audit_writer.stats()
+
+
+# --- Funciones de Bitácora I/O ---
+def io_log(tipo, estado, mensaje, odoo_batch_id=None, convocatoria_id=None, detalles=None):
+    """
+    Registra una operación de import/export en la Bitácora I/O.
+    Usa su propia transacción para que el registro sobreviva al rollback de la operación.
+    """
+    query = """
+        INSERT INTO "BitacoraIO" (tipo, estado, odoo_batch_id, convocatoria_id, mensaje, detalles)
+        VALUES (%s, %s, %s, %s, %s, %s);
+    """
+    detalles_json = json.dumps(detalles, default=str) if detalles else None
+    params = (tipo, estado, odoo_batch_id, convocatoria_id, mensaje, detalles_json)
+
+    try:
+        execute_query(query, params, fetch_mode="none")
+        logging.info(f"IO: {tipo} [{estado}] batch={odoo_batch_id} convocatoria={convocatoria_id} | {mensaje}")
+    except Exception as e:
+        logging.error(f"Fallo al escribir en la Bitácora I/O: {e}")
+
 
 if __name__ == '__main__':
-    print("Ejecutando inicializador de base de datos...")
-    initialize_database()
-    print("Proceso finalizado.")
\ No newline at end of file
+    if sys.argv[1:] == ['migrate']:
+        print(f"Esquema en la versión {ensure_schema(init_if_empty=False, migrate=True)}.")
+    else:
+        print("Ejecutando inicializador de base de datos...")
+        initialize_database()
+        print("Proceso finalizado.")
\ No newline at end of file
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+db_pool.py
+
+Pool de conexiones PostgreSQL acotado y seguro entre hilos.
+Lo usa db_handler para no abrir una conexión nueva por cada consulta.
+"""
+import collections
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+
+# SQLSTATE que dejan la conexión inservible además de la clase 08 (connection
+# exception): el servidor se apaga o termina la sesión. El resto (deadlock,
+# serialización, statement_timeout, ...) es un fallo de la sentencia y la
+# conexión, tras el rollback, sigue sirviendo.
+CONNECTION_SQLSTATES = ('57P01', '57P02', '57P03')
+
+
+class PoolTimeout(Exception):
+    """No se pudo obtener una conexión del pool dentro del tiempo de espera."""
+
+
+def is_connection_error(error):
+    """Si `error` es de la conexión (no de la sentencia que se estaba ejecutando)."""
+    code = getattr(error, 'pgcode', None)
+    if code is None:
+        # Sin SQLSTATE el error es del cliente: socket roto o servidor que no responde.
+        return isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+    return code.startswith('08') or code in CONNECTION_SQLSTATES
+
+def connection_lost(conn, error):
+    """Si hay que descartar `conn` tras `error`."""
+    return bool(conn.closed) or is_connection_error(error)
+
+
+class _PooledConnection:
+    """Conexión física más los metadatos que necesita el pool para reciclarla."""
+    __slots__ = ("conn", "created_at", "last_used_at", "uses")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used_at = now
+        self.uses = 0
+
+
+class ConnectionPool:
+    """
+    Pool de conexiones con tamaño mínimo/máximo, timeout de checkout,
+    health check de conexiones ociosas y reciclado por usos o antigüedad.
+    """
+
+    def __init__(self, connect, minconn=1, maxconn=10, timeout=10.0,
+                 max_uses=0, max_lifetime=0, health_check_after=30.0):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Tamaños de pool inválidos: min={minconn}, max={maxconn}")
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_uses = max_uses            # 0 = sin límite
+        self.max_lifetime = max_lifetime    # segundos, 0 = sin límite
+        self.health_check_after = health_check_after
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = collections.deque()
+        self._in_use = {}                   # id(conn) -> _PooledConnection
+        self._opening = 0                   # conexiones en proceso de apertura
+        self._closed = False
+
+        # Estadísticas
+        self._waiting = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._created = 0
+        self._recycled = 0
+        self._failed_health_checks = 0
+
+        for _ in range(minconn):
+            self._idle.append(self._open())
+
+    # --- Ciclo de vida de conexiones físicas ---
+    def _open(self):
+        pooled = _PooledConnection(self._connect())
+        with self._cond:
+            self._created += 1
+        return pooled
+
+    @staticmethod
+    def _close_quietly(pooled):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _is_expired(self, pooled):
+        if self.max_uses and pooled.uses >= self.max_uses:
+            return True
+        if self.max_lifetime and time.monotonic() - pooled.created_at >= self.max_lifetime:
+            return True
+        return False
+
+    def _is_healthy(self, pooled):
+        """Comprueba una conexión que lleva tiempo ociosa antes de entregarla."""
+        if pooled.conn.closed:
+            return False
+        if time.monotonic() - pooled.last_used_at < self.health_check_after:
+            return True
+        try:
+            with pooled.conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            pooled.conn.rollback()
+            return True
+        except psycopg2.Error as e:
+            logging.warning(f"Conexión ociosa descartada tras fallar el health check: {e}")
+            return False
+
+    # --- API pública ---
+    def getconn(self):
+        """Obtiene una conexión del pool, esperando como máximo `timeout` segundos."""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        while True:
+            pooled = None
+            must_open = False
+            with self._cond:
+                if self._closed:
+                    raise PoolTimeout("El pool de conexiones está cerrado.")
+                self._waiting += 1
+                try:
+                    while not self._idle and len(self._in_use) + self._opening >= self.maxconn:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._timeouts += 1
+                            raise PoolTimeout(
+                                f"Timeout de {self.timeout}s esperando una conexión "
+                                f"(en uso: {len(self._in_use)}/{self.maxconn})."
+                            )
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+                if self._idle:
+                    pooled = self._idle.pop()
+                else:
+                    self._opening += 1
+                    must_open = True
+
+            if must_open:
+                try:
+                    pooled = self._open()
+                finally:
+                    with self._cond:
+                        self._opening -= 1
+                        self._cond.notify()
+            elif not self._is_healthy(pooled):
+                with self._cond:
+                    self._failed_health_checks += 1
+                self._close_quietly(pooled)
+                continue
+
+            waited = time.monotonic() - start
+            pooled.uses += 1
+            with self._cond:
+                self._in_use[id(pooled.conn)] = pooled
+                self._checkouts += 1
+                self._wait_time_total += waited
+                self._wait_time_max = max(self._wait_time_max, waited)
+            return pooled.conn
+
+    def putconn(self, conn, discard=False):
+        """Devuelve una conexión al pool, o la cierra si está rota o caducada."""
+        with self._cond:
+            pooled = self._in_use.pop(id(conn), None)
+        if pooled is None:
+            logging.warning("Se intentó devolver al pool una conexión que no le pertenece.")
+            conn.close()
+            return
+
+        if not discard and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        expired = self._is_expired(pooled)
+        if discard or conn.closed or self._closed or expired:
+            if expired:
+                with self._cond:
+                    self._recycled += 1
+            self._close_quietly(pooled)
+        else:
+            pooled.last_used_at = time.monotonic()
+
+        with self._cond:
+            if not pooled.conn.closed:
+                self._idle.append(pooled)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Context manager que presta una conexión y la devuelve al salir."""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except psycopg2.Error as e:
+            broken = connection_lost(conn, e)
+            raise
+        finally:
+            self.putconn(conn, discard=broken)
+
+    def closeall(self):
+        """Cierra las conexiones ociosas y marca el pool como cerrado."""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = list(self._idle), collections.deque()
+            self._cond.notify_all()
+        for pooled in idle:
+            self._close_quietly(pooled)
+
+    def stats(self):
+        """Devuelve un snapshot de las métricas del pool."""
+        with self._cond:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "wait_time_total_ms": round(self._wait_time_total * 1000, 3),
+                "wait_time_avg_ms": round(self._wait_time_total * 1000 / self._checkouts, 3) if self._checkouts else 0.0,
+                "wait_time_max_ms": round(self._wait_time_max * 1000, 3),
+                "created": self._created,
+                "recycled": self._recycled,
+                "failed_health_checks": self._failed_health_checks,
+            }
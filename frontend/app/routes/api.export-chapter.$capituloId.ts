@@ -33,9 +33,6 @@ export async function loader({ request, params }: LoaderFunctionArgs) {
       return new Response(errorMessage, { status: apiResponse.status });
     }
 
-    // Obtener el cuerpo del archivo como un stream o buffer
-    const fileBuffer = await apiResponse.arrayBuffer();
-
     // Reenviar las cabeceras relevantes del API al cliente
     const headers = new Headers();
     const contentType = apiResponse.headers.get("Content-Type");
@@ -50,9 +47,9 @@ export async function loader({ request, params }: LoaderFunctionArgs) {
       // Nombre de archivo por defecto si el API no lo envía
       headers.set("Content-Disposition", `attachment; filename="capitulo_${capituloId}_export.xlsx"`);
     }
-    headers.set("Content-Length", String(fileBuffer.byteLength));
 
-    return new Response(fileBuffer, {
+    // El API envía el fichero a trozos: se reenvía el stream sin cargarlo entero en memoria
+    return new Response(apiResponse.body, {
       status: 200,
       headers: headers,
     });
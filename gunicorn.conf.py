@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+gunicorn.conf.py
+
+Configuración del servidor de producción (gunicorn -c gunicorn.conf.py wsgi:app).
+
+- Workers `gthread`: WEB_WORKERS procesos con WEB_THREADS hilos cada uno. Los
+  streams SSE no pasan por aquí: con SSE_URL la API los redirige a sse_server.py
+  (asyncio, un LISTEN para todos los clientes, sin hilo por stream). Sin SSE_URL
+  cada stream ocuparía un hilo y cada worker admitiría como mucho
+  CHANGE_FEED_MAX_SUBSCRIBERS (por defecto WEB_THREADS // 2).
+- Conexiones a la BD: cada worker tiene su pool (hasta DB_POOL_MAX), así que el
+  total es WEB_WORKERS * DB_POOL_MAX; conviene DB_POOL_MAX >= WEB_THREADS.
+- bcrypt (login): cada worker tiene además PASSWORD_WORKERS procesos
+  (password_pool.py); WEB_WORKERS * PASSWORD_WORKERS no debería pasar de los
+  núcleos disponibles.
+- Con preload_app la app se importa una vez en el maestro y los workers arrancan
+  por fork (reinicios rápidos). El maestro no abre conexiones del pool.
+- Métricas: cada worker vuelca las suyas a METRICS_DIR y /metrics (en
+  cualquier worker) suma las de todos (instrumentation.py). Por defecto es un
+  directorio temporal por puerto; se vacía al arrancar el maestro.
+- SIGTERM (docker stop): el worker drena (lifecycle.py) y gunicorn espera hasta
+  WEB_GRACEFUL_TIMEOUT a las peticiones en curso. El stop_grace_period de
+  docker-compose debe ser mayor.
+"""
+import multiprocessing
+import os
+import tempfile
+
+bind = f"{os.getenv('WEB_HOST', '0.0.0.0')}:{os.getenv('WEB_PORT', '5000')}"
+workers = int(os.getenv('WEB_WORKERS', str(min(multiprocessing.cpu_count() * 2 + 1, 8))))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '8'))
+timeout = int(os.getenv('WEB_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', '25'))
+keepalive = int(os.getenv('WEB_KEEPALIVE', '5'))
+# Reciclado de workers tras N peticiones (0 = nunca); el jitter evita que caigan todos a la vez.
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', '0'))
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', '50'))
+preload_app = os.getenv('WEB_PRELOAD', '1') == '1'
+# Antes de importar la app (instrumentation lee METRICS_DIR al importarse).
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(),
+                                                  f"asrecorded-metrics-{os.getenv('WEB_PORT', '5000')}"))
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('WEB_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    """
+    En el maestro, antes de crear workers: se aplican las migraciones pendientes
+    (migrations/) y, si el esquema sigue sin ser el esperado, no se arranca.
+    """
+    import db_handler
+    import instrumentation
+    db_handler.ensure_schema()
+    instrumentation.clear_metrics_dir()
+
+
+def post_worker_init(worker):
+    """
+    En cada worker, tras instalar gunicorn sus señales: encadena el drenaje a
+    SIGTERM, abre el pool (DB_POOL_MIN conexiones) antes de la primera petición y
+    conecta la caché en memoria del worker con la de los demás (change_feed.attach_cache)
+    y empieza a volcar sus métricas a METRICS_DIR.
+    """
+    import db_handler
+    import instrumentation
+    import lifecycle
+    from cache import cache
+    from change_feed import attach_cache
+    lifecycle.install_drain_handler()
+    attach_cache(cache)
+    instrumentation.start_flusher()
+    try:
+        db_handler.get_pool()
+    except Exception as e:
+        worker.log.warning(f"Pool no disponible al arrancar el worker {worker.pid}: {e}")
+
+
+def worker_exit(server, worker):
+    """Vuelca la auditoría pendiente, cierra las conexiones del worker y para el pool de bcrypt."""
+    import db_handler
+    from password_pool import password_pool
+    db_handler.close_pool()
+    password_pool.shutdown()
+
+
+def child_exit(server, worker):
+    """En el maestro, al terminar un worker: sus contadores pasan al archivo de métricas."""
+    import instrumentation
+    instrumentation.mark_process_dead(worker.pid)
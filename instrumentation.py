@@ -0,0 +1,542 @@
+# -*- coding: utf-8 -*-
+"""
+instrumentation.py
+
+Métricas de rendimiento del proceso: cuánto tarda cada petición y en qué se
+va el tiempo (espera de conexión del pool, SQL, serialización JSON y el resto
+en la propia app), cuántas sentencias ejecuta y cuánto tarda cada sentencia,
+agrupadas por huella (el SQL normalizado, sin literales ni parámetros).
+
+- db_handler llama a record_query() y record_pool_wait() en cada sentencia.
+- init_app(app) engancha el ciclo de vida de Flask: histogramas por endpoint y
+  cabeceras X-DB-Queries y Server-Timing en cada respuesta.
+- render() genera el formato de texto de Prometheus (GET /metrics).
+- Las sentencias que superan SLOW_QUERY_MS se guardan como muestra con los
+  parámetros redactados (solo tipo y longitud, nunca el valor).
+- Con REQUEST_PROFILING=1, una petición con la cabecera `X-Profile: 1` se
+  ejecuta bajo cProfile y el resumen se escribe en el log (y en PROFILE_DIR
+  como .prof si está definido).
+
+Los valores se acumulan por proceso. Con varios workers de gunicorn (y
+METRICS_DIR definido, que gunicorn.conf.py fija por defecto) cada worker vuelca
+los suyos a METRICS_DIR/<pid>.json cada METRICS_FLUSH_SECONDS y /metrics suma
+los de todos: contadores e histogramas agregados, gauges de componentes (pool,
+caché, ...) con la etiqueta worker="<pid>" y consultas lentas de todos los
+workers. Los contadores de un worker que termina se archivan en
+METRICS_DIR/finalizados.json para que los totales no retrocedan.
+Sin METRICS_DIR (un solo proceso, desarrollo) se expone solo lo del proceso.
+"""
+import collections
+import cProfile
+import datetime
+import hashlib
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import threading
+import time
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+SLOW_QUERY_SAMPLES = int(os.getenv("SLOW_QUERY_SAMPLES", "100"))
+REQUEST_PROFILING = os.getenv("REQUEST_PROFILING", "0") == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+PROFILE_TOP = int(os.getenv("PROFILE_TOP", "30"))
+PROFILE_HEADER = 'X-Profile'
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+METRICS_ARCHIVE = 'finalizados.json'
+
+METRIC_PREFIX = 'asrecorded'
+# Tope de huellas distintas; a partir de ahí se agrupan en 'otras' (cardinalidad acotada).
+MAX_STATEMENTS = 500
+STATEMENT_LABEL_MAX = 200
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape_label(v)}"' for n, v in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1.0):
+        with self._lock:
+            self._values[labels] += amount
+
+    def snapshot(self):
+        """{labels: valor} del proceso."""
+        with self._lock:
+            return dict(self._values)
+
+    def render(self, lines, values=None):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} counter")
+        items = sorted((self.snapshot() if values is None else values).items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+
+
+class Histogram:
+    """Histograma con cubos fijos (acumulados al exportar, como espera Prometheus)."""
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}          # labels -> [cuenta por cubo..., +Inf, suma]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        n = len(self.buckets)
+        index = n
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            row = self._values.get(labels)
+            if row is None:
+                row = self._values[labels] = [0] * (n + 1) + [0.0]
+            row[index] += 1
+            row[-1] += value
+
+    def snapshot(self):
+        """{labels: [cuenta por cubo..., +Inf, suma]} del proceso."""
+        with self._lock:
+            return {labels: list(row) for labels, row in self._values.items()}
+
+    def render(self, lines, values=None):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} histogram")
+        items = sorted((self.snapshot() if values is None else values).items())
+        for labels, row in items:
+            acumulado = 0
+            for bound, count in zip(self.buckets + ('+Inf',), row[:-1]):
+                acumulado += count
+                le = bound if bound == '+Inf' else _format_value(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [('le', le)])} {acumulado}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(row[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {acumulado}")
+
+
+# --- Registro del proceso ---
+REQUEST_DURATION = Histogram(
+    f"{METRIC_PREFIX}_http_request_duration_seconds", "Duración de las peticiones HTTP.",
+    ('method', 'endpoint', 'status'), LATENCY_BUCKETS)
+REQUEST_QUERIES = Histogram(
+    f"{METRIC_PREFIX}_http_request_queries", "Sentencias SQL por petición.",
+    ('method', 'endpoint'), QUERY_COUNT_BUCKETS)
+REQUEST_PHASE_SECONDS = Counter(
+    f"{METRIC_PREFIX}_http_request_phase_seconds_total",
+    "Tiempo de las peticiones por fase: pool (espera de conexión), db, json y app (el resto).",
+    ('endpoint', 'phase'))
+SQL_DURATION = Histogram(
+    f"{METRIC_PREFIX}_sql_duration_seconds", "Duración de las sentencias SQL por huella.",
+    ('fingerprint',), SQL_BUCKETS)
+SLOW_QUERIES = Counter(
+    f"{METRIC_PREFIX}_sql_slow_total", f"Sentencias que superan {SLOW_QUERY_MS:g} ms.", ('fingerprint',))
+METRICS = (REQUEST_DURATION, REQUEST_QUERIES, REQUEST_PHASE_SECONDS, SQL_DURATION, SLOW_QUERIES)
+
+_statements = {}                    # huella -> SQL normalizado
+_statements_lock = threading.Lock()
+_fingerprint_cache = {}             # SQL tal cual -> (huella, SQL normalizado)
+_slow_queries = collections.deque(maxlen=SLOW_QUERY_SAMPLES)
+
+_local = threading.local()
+_profile_lock = threading.Lock()
+_component_stats = None             # función -> {prefijo: dict de stats} (ver set_component_stats)
+_flusher = None
+
+
+# --- Huellas de sentencias ---
+_WHITESPACE = re.compile(r'\s+')
+_LITERALS = re.compile(r"'(?:[^']|'')*'|%\(\w+\)s|%s|\b\d+(?:\.\d+)?\b")
+_VALUE_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+def normalize_sql(query):
+    """SQL sin literales ni marcadores de parámetros y con los espacios colapsados."""
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    normalized = _LITERALS.sub('?', _WHITESPACE.sub(' ', str(query)).strip())
+    return _VALUE_LISTS.sub('(?)', normalized).rstrip(' ;')
+
+def fingerprint(query):
+    """Retorna (huella, SQL normalizado). La huella son 12 hex del SHA-1 del SQL normalizado."""
+    cached = _fingerprint_cache.get(query)
+    if cached is not None:
+        return cached
+    normalized = normalize_sql(query)
+    result = (hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12], normalized)
+    if len(_fingerprint_cache) >= MAX_STATEMENTS * 4:
+        _fingerprint_cache.clear()
+    _fingerprint_cache[query] = result
+    return result
+
+
+def redact_params(params):
+    """Parámetros sin valores: solo el tipo (y la longitud de textos y colecciones)."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: _redact_value(v) for k, v in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [_redact_value(v) for v in params]
+    return _redact_value(params)
+
+def _redact_value(value):
+    if value is None:
+        return None
+    kind = type(value).__name__
+    if isinstance(value, (str, bytes, list, tuple, set, frozenset, dict)):
+        return f"<{kind}:{len(value)}>"
+    return f"<{kind}>"
+
+
+# --- Estado por hilo (cada petición se atiende en un único hilo) ---
+def _stats():
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        stats = _local.stats = {'queries': 0, 'db': 0.0, 'pool': 0.0, 'json': 0.0}
+    return stats
+
+def reset_thread_stats():
+    """Pone a cero los contadores del hilo y retorna los anteriores."""
+    previous = _stats()
+    _local.stats = {'queries': 0, 'db': 0.0, 'pool': 0.0, 'json': 0.0}
+    return previous
+
+def thread_stats():
+    """Sentencias y segundos de db/pool/json acumulados por el hilo desde el último reset."""
+    return dict(_stats())
+
+
+def record_query(query, params, seconds):
+    """Registra una sentencia ejecutada (la llama db_handler)."""
+    stats = _stats()
+    stats['queries'] += 1
+    stats['db'] += seconds
+
+    fp, normalized = fingerprint(query)
+    with _statements_lock:
+        if fp not in _statements:
+            if len(_statements) >= MAX_STATEMENTS:
+                fp = 'otras'
+            else:
+                _statements[fp] = normalized
+    SQL_DURATION.observe((fp,), seconds)
+
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        SLOW_QUERIES.inc((fp,))
+        sample = {
+            'at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'ms': round(seconds * 1000, 1),
+            'fingerprint': fp,
+            'statement': normalized[:1000],
+            'params': redact_params(params),
+            'endpoint': getattr(_local, 'endpoint', None),
+            'pid': os.getpid(),
+        }
+        _slow_queries.append(sample)
+        logging.warning(f"Consulta lenta ({sample['ms']} ms, {fp}) en {sample['endpoint']}: {normalized[:200]}")
+
+def record_pool_wait(seconds):
+    _stats()['pool'] += seconds
+
+def record_json(seconds):
+    _stats()['json'] += seconds
+
+def get_slow_queries():
+    """
+    Muestras de consultas lentas, de la más reciente a la más antigua: las de
+    todos los workers con METRICS_DIR, las del proceso sin él.
+    """
+    if not METRICS_DIR:
+        return list(reversed(_slow_queries))
+    write_snapshot()
+    samples = [sample for snapshot in _read_snapshots(archive=False) for sample in snapshot.get('slow', ())]
+    samples.sort(key=lambda sample: sample['at'], reverse=True)
+    return samples[:SLOW_QUERY_SAMPLES]
+
+
+# --- Agregación entre workers (METRICS_DIR) ---
+def set_component_stats(func):
+    """`func()` retorna {prefijo: dict de stats} del proceso; se incluye en cada volcado."""
+    global _component_stats
+    _component_stats = func
+
+def _numeric(stats):
+    return {key: int(value) if isinstance(value, bool) else value
+            for key, value in stats.items() if isinstance(value, (int, float))}
+
+def snapshot():
+    """Estado del proceso serializable en JSON (las etiquetas van como listas)."""
+    components = {}
+    if _component_stats is not None:
+        try:
+            components = {prefix: _numeric(stats) for prefix, stats in _component_stats().items()}
+        except Exception as e:
+            logging.warning(f"No se pudieron leer las stats de componentes para las métricas: {e}")
+    with _statements_lock:
+        statements = dict(_statements)
+    return {
+        'pid': os.getpid(),
+        'metrics': {metric.name: [[list(labels), value] for labels, value in metric.snapshot().items()]
+                    for metric in METRICS},
+        'statements': statements,
+        'slow': list(_slow_queries),
+        'components': components,
+    }
+
+def _write_json(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, default=str)
+    os.replace(tmp, path)       # quien lea ve el fichero anterior o el nuevo, nunca uno a medias
+
+def write_snapshot():
+    """Vuelca el estado del proceso a METRICS_DIR/<pid>.json."""
+    if METRICS_DIR:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        _write_json(os.path.join(METRICS_DIR, f"{os.getpid()}.json"), snapshot())
+
+def _read_snapshots(archive=True):
+    snapshots = []
+    for name in sorted(os.listdir(METRICS_DIR)):
+        if not name.endswith('.json') or (name == METRICS_ARCHIVE and not archive):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name), encoding='utf-8') as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue        # el worker acaba de terminar o el fichero se está sustituyendo
+    return snapshots
+
+def _merge(snapshots):
+    """Suma contadores e histogramas de varios volcados: ({nombre: {labels: valor}}, huellas)."""
+    merged = {metric.name: {} for metric in METRICS}
+    statements = {}
+    for snapshot in snapshots:
+        statements.update(snapshot.get('statements', {}))
+        for name, rows in snapshot.get('metrics', {}).items():
+            values = merged.setdefault(name, {})
+            for labels, value in rows:
+                labels = tuple(labels)
+                if isinstance(value, list):
+                    previous = values.get(labels)
+                    values[labels] = value if previous is None else [a + b for a, b in zip(previous, value)]
+                else:
+                    values[labels] = values.get(labels, 0.0) + value
+    return merged, statements
+
+def mark_process_dead(pid):
+    """
+    Lo llama el maestro de gunicorn al terminar un worker: suma sus contadores e
+    histogramas a METRICS_DIR/finalizados.json y borra su volcado (sus gauges y
+    consultas lentas dejan de exponerse).
+    """
+    if not METRICS_DIR:
+        return
+    path = os.path.join(METRICS_DIR, f"{pid}.json")
+    archive_path = os.path.join(METRICS_DIR, METRICS_ARCHIVE)
+    snapshots = []
+    for candidate in (archive_path, path):
+        try:
+            with open(candidate, encoding='utf-8') as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    merged, statements = _merge(snapshots)
+    _write_json(archive_path, {
+        'metrics': {name: [[list(labels), value] for labels, value in values.items()]
+                    for name, values in merged.items()},
+        'statements': statements,
+    })
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def clear_metrics_dir():
+    """Crea METRICS_DIR vacío (lo llama el maestro al arrancar: los volcados de otra ejecución no cuentan)."""
+    if not METRICS_DIR:
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for name in os.listdir(METRICS_DIR):
+        if name.endswith(('.json', '.tmp')):
+            os.remove(os.path.join(METRICS_DIR, name))
+
+def start_flusher():
+    """Hilo que vuelca el estado del proceso cada METRICS_FLUSH_SECONDS (una vez por worker, tras el fork)."""
+    global _flusher
+    if not METRICS_DIR or (_flusher is not None and _flusher.is_alive()):
+        return
+
+    def run():
+        while True:
+            try:
+                write_snapshot()
+            except OSError as e:
+                logging.warning(f"No se pudieron volcar las métricas a {METRICS_DIR}: {e}")
+            time.sleep(METRICS_FLUSH_SECONDS)
+
+    _flusher = threading.Thread(target=run, name='metrics-flusher', daemon=True)
+    _flusher.start()
+
+
+# --- Exportación ---
+def _gauges_from_stats(prefix, stats, worker=None):
+    """
+    Valores numéricos de un dict de stats como gauges: {nombre: [(etiquetas,
+    valor)]}, con la etiqueta worker si se indica.
+    """
+    labels = _format_labels(('worker',), (worker,)) if worker is not None else ''
+    return {f"{METRIC_PREFIX}_{prefix}_{key}": [(labels, value)] for key, value in _numeric(stats).items()}
+
+def render(component_stats=None):
+    """
+    Texto de exposición de Prometheus. `component_stats` es {prefijo: dict de
+    stats} (pool, caché, ...); sus valores numéricos se exportan como gauges.
+    Con METRICS_DIR se agregan los volcados de todos los workers y
+    `component_stats` no se usa: cada worker vuelca los suyos (set_component_stats).
+    """
+    lines = []
+    gauges = {}
+    if METRICS_DIR:
+        write_snapshot()
+        snapshots = _read_snapshots()
+        values, statements = _merge(snapshots)
+        for metric in METRICS:
+            metric.render(lines, values.get(metric.name, {}))
+        workers = [snapshot for snapshot in snapshots if 'pid' in snapshot]
+        for snapshot in workers:
+            for prefix, stats in snapshot.get('components', {}).items():
+                for name, rows in _gauges_from_stats(prefix, stats, snapshot['pid']).items():
+                    gauges.setdefault(name, []).extend(rows)
+        gauges[f"{METRIC_PREFIX}_metrics_workers"] = [('', len(workers))]
+    else:
+        for metric in METRICS:
+            metric.render(lines)
+        with _statements_lock:
+            statements = dict(_statements)
+        for prefix, stats in (component_stats or {}).items():
+            gauges.update(_gauges_from_stats(prefix, stats))
+    name = f"{METRIC_PREFIX}_sql_statement_info"
+    lines.append(f"# HELP {name} SQL normalizado de cada huella.")
+    lines.append(f"# TYPE {name} gauge")
+    for fp, normalized in sorted(statements.items()):
+        lines.append(f'{name}{{fingerprint="{fp}",statement="{_escape_label(normalized[:STATEMENT_LABEL_MAX])}"}} 1')
+    for name, rows in gauges.items():
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in rows:
+            lines.append(f"{name}{labels} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+# --- Integración con Flask ---
+def _start_profile():
+    if not _profile_lock.acquire(blocking=False):
+        return None     # cProfile no admite dos perfiles a la vez
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        _profile_lock.release()
+        return None
+    return profiler
+
+def _finish_profile(profiler, endpoint):
+    try:
+        profiler.disable()
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        logging.info(f"Perfil de {endpoint}:\n{output.getvalue()}")
+        if PROFILE_DIR:
+            path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-"
+                                             f"{re.sub(r'[^A-Za-z0-9]+', '_', endpoint).strip('_')}.prof")
+            profiler.dump_stats(path)
+            return path
+    finally:
+        _profile_lock.release()
+    return None
+
+
+def init_app(app):
+    """Engancha la instrumentación al ciclo de vida de las peticiones de `app`."""
+    from flask import g, request
+    from flask.json.provider import DefaultJSONProvider
+
+    class TimedJSONProvider(DefaultJSONProvider):
+        def dumps(self, obj, **kwargs):
+            start = time.perf_counter()
+            try:
+                return super().dumps(obj, **kwargs)
+            finally:
+                record_json(time.perf_counter() - start)
+
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def _start_request():
+        reset_thread_stats()
+        _local.endpoint = request.url_rule.rule if request.url_rule else '<sin_ruta>'
+        g.instrumentation_start = time.perf_counter()
+        g.profiler = None
+        if REQUEST_PROFILING and request.headers.get(PROFILE_HEADER) == '1':
+            g.profiler = _start_profile()
+
+    @app.after_request
+    def _finish_request(response):
+        start = g.pop('instrumentation_start', None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = _local.endpoint
+        stats = _stats()
+        app_seconds = max(elapsed - stats['db'] - stats['pool'] - stats['json'], 0.0)
+
+        REQUEST_DURATION.observe((request.method, endpoint, str(response.status_code)), elapsed)
+        REQUEST_QUERIES.observe((request.method, endpoint), stats['queries'])
+        for phase in ('pool', 'db', 'json'):
+            REQUEST_PHASE_SECONDS.inc((endpoint, phase), stats[phase])
+        REQUEST_PHASE_SECONDS.inc((endpoint, 'app'), app_seconds)
+
+        response.headers['X-DB-Queries'] = str(stats['queries'])
+        timing = (f'app;dur={app_seconds * 1000:.1f}, pool;dur={stats["pool"] * 1000:.1f}, '
+                  f'db;dur={stats["db"] * 1000:.1f};desc="{stats["queries"]} consultas", '
+                  f'json;dur={stats["json"] * 1000:.1f}, total;dur={elapsed * 1000:.1f}')
+        previous = response.headers.get('Server-Timing')
+        response.headers['Server-Timing'] = f"{previous}, {timing}" if previous else timing
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            path = _finish_profile(profiler, endpoint)
+            response.headers[PROFILE_HEADER] = os.path.basename(path) if path else 'log'
+        return response
+
+    @app.teardown_request
+    def _teardown_request(exc):
+        # Si after_request no llegó a ejecutarse, el perfil no puede quedar activo.
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            _finish_profile(profiler, getattr(_local, 'endpoint', '?'))
+        _local.endpoint = None
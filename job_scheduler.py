@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+"""
+job_scheduler.py
+
+Tareas programadas de import/export (§12). La API solo encola ejecuciones en
+la tabla "JobRun"; este módulo, lanzado como proceso aparte
+(`python job_scheduler.py`), lee "JobConfig".schedule, encola las ejecuciones
+vencidas y las ejecuta en su propio pool de hilos, con límite de concurrencia
+por sala y reintentos con backoff exponencial.
+"""
+import datetime
+import glob
+import json
+import logging
+import os
+import shutil
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from apscheduler.triggers.cron import CronTrigger
+
+import db_handler
+import odoo_io
+from cache import cache
+from change_feed import attach_cache
+from data_handler import DataHandler
+from odoo_io import ConvocatoriaImportError
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s')
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_PER_SALA = int(os.getenv("JOB_MAX_PER_SALA", "1"))     # ejecuciones simultáneas por sala
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))  # segundos entre sondeos de la cola
+JOB_BACKOFF_BASE = float(os.getenv("JOB_BACKOFF_BASE", "30"))   # segundos; se duplica en cada reintento
+JOB_MAX_INTENTOS = int(os.getenv("JOB_MAX_INTENTOS", "5"))
+JOB_STALE_AFTER = int(os.getenv("JOB_STALE_AFTER", "3600"))     # 'en_curso' más antiguo se considera huérfano
+JOB_TIMEZONE = os.getenv("JOB_TIMEZONE", "Europe/Madrid")
+AUDIT_PARTITIONS_AHEAD = int(os.getenv("AUDIT_PARTITIONS_AHEAD", "3"))   # meses de "Auditoria" creados por adelantado
+AUDIT_RETENTION_MONTHS = int(os.getenv("AUDIT_RETENTION_MONTHS", "0"))  # meses conservados, el actual incluido; 0 = todos
+METRICS_REFRESH_INTERVAL = int(os.getenv("METRICS_REFRESH_INTERVAL", "300"))  # segundos entre refrescos de métricas
+# Margen (segundos) hacia atrás desde la pasada anterior al recalcular reaperturas:
+# cubre transacciones largas y el retraso del escritor de auditoría por lotes.
+METRICS_REAPERTURAS_MARGEN = int(os.getenv("METRICS_REAPERTURAS_MARGEN", "86400"))
+JOB_IMPORT_DIR = os.getenv("JOB_IMPORT_DIR", os.path.join(os.path.dirname(__file__), "io_external", "imports"))
+
+# Clave de pg_advisory_xact_lock que serializa el reparto de trabajos entre workers.
+_CLAIM_LOCK_KEY = 7412001
+
+DEFAULT_JOB_BY_TIPO = {'import': 'import_convo_diario', 'export': 'export_convo_cierre'}
+
+handler_instance = DataHandler()
+
+
+class JobError(Exception):
+    """Error de negocio en una tarea. Se reintenta con backoff."""
+
+
+# --- Tareas ---
+def import_convo_diario(params, sala_id):
+    """Importa los lotes (json/csv/xlsx) pendientes en la carpeta de entrada."""
+    directory = params.get('import_path') or JOB_IMPORT_DIR
+    if not os.path.isdir(directory):
+        raise JobError(f"La carpeta de importación no existe: {directory}")
+
+    detalles = []
+    paths = sorted(p for ext in ('json', 'csv', 'xlsx') for p in glob.glob(os.path.join(directory, f"*.{ext}")))
+    for path in paths:
+        filename = os.path.basename(path)
+        try:
+            with open(path, 'rb') as f:
+                header, items = odoo_io.iter_file_batch(f, filename)
+                if sala_id is not None and header['sala_id'] != sala_id:
+                    continue
+                result = handler_instance.import_convocatoria(header, items)
+            destino = 'procesados'
+            detalles.append({'filename': filename, 'status': 'success', **result})
+        except ConvocatoriaImportError as e:
+            destino = 'errores'
+            detalles.append({'filename': filename, 'status': 'error', 'error': e.mensaje, 'details': e.errores})
+        os.makedirs(os.path.join(directory, destino), exist_ok=True)
+        shutil.move(path, os.path.join(directory, destino, filename))
+
+    errores = [d for d in detalles if d['status'] == 'error']
+    return {'ficheros': len(detalles), 'errores': len(errores), 'details': detalles}
+
+
+def _export_all(convocatoria_ids):
+    resultados = [handler_instance.export_convocatoria(cid) for cid in convocatoria_ids]
+    fallidos = [r for r in resultados if r and r.get('error')]
+    if fallidos:
+        raise JobError(f"{len(fallidos)} de {len(resultados)} exports fallaron.")
+    return {'convocatorias': len(resultados), 'items': sum(r['items'] for r in resultados if r)}
+
+
+def export_convocatoria(params, sala_id):
+    """Export bajo demanda de una convocatoria (POST /api/convocatorias/<id>/export)."""
+    convocatoria_id = params['convocatoria_id']
+    resultado = handler_instance.export_convocatoria(convocatoria_id, user_id=params.get('user_id'))
+    if resultado is None:
+        raise JobError(f"La convocatoria {convocatoria_id} no existe.")
+    if resultado.get('error'):
+        raise JobError(f"Odoo no aceptó el export de la convocatoria {convocatoria_id}: {resultado['error']}")
+    return resultado
+
+
+def export_convo_cierre(params, sala_id):
+    """Exporta el delta de las convocatorias cerradas que tienen cambios sin exportar."""
+    series_ids = params.get('series_ids')
+    rows = db_handler.execute_query("""
+        SELECT c.id
+        FROM "Convocatoria" c
+        WHERE c.estado = 'cerrada'
+          AND (%(sala_id)s::int IS NULL OR c.sala_id = %(sala_id)s::int)
+          AND EXISTS (
+              SELECT 1
+              FROM "ConvocatoriaItem" ci
+              JOIN "Intervencion" i ON i.take_id = ci.take_id
+              LEFT JOIN "ExportWatermark" w ON w.convocatoria_id = c.id AND w.intervencion_id = i.id
+              WHERE ci.convocatoria_id = c.id
+                AND (%(series)s::int[] IS NULL OR ci.serie_id = ANY(%(series)s::int[]))
+                AND i."version" > COALESCE(w."version", 0)
+          )
+        ORDER BY c.id;
+    """, {'sala_id': sala_id, 'series': series_ids if isinstance(series_ids, list) else None})
+    return _export_all([r['id'] for r in rows])
+
+
+def export_reintentos(params, sala_id):
+    """Reintenta las convocatorias cuyo último export terminó en error."""
+    rows = db_handler.execute_query("""
+        SELECT ult.convocatoria_id AS id
+        FROM (
+            SELECT DISTINCT ON (b.convocatoria_id) b.convocatoria_id, b.estado
+            FROM "BitacoraIO" b
+            WHERE b.tipo = 'export' AND b.estado <> 'reintento' AND b.convocatoria_id IS NOT NULL
+            ORDER BY b.convocatoria_id, b.created_at DESC, b.id DESC
+        ) ult
+        JOIN "Convocatoria" c ON c.id = ult.convocatoria_id
+        WHERE ult.estado = 'error'
+          AND (%(sala_id)s::int IS NULL OR c.sala_id = %(sala_id)s::int)
+        ORDER BY ult.convocatoria_id;
+    """, {'sala_id': sala_id})
+    return _export_all([r['id'] for r in rows])
+
+
+def _limite_retencion(hoy, meses):
+    """Primer día del mes más antiguo que se conserva: el de `hoy` y los `meses` - 1 anteriores."""
+    n = hoy.year * 12 + hoy.month - 1 - (meses - 1)
+    return datetime.date(n // 12, n % 12 + 1, 1)
+
+
+def mantener_auditoria(params, sala_id):
+    """
+    Crea las particiones mensuales de "Auditoria" de los próximos meses y, si hay
+    retención configurada, borra las que quedan fuera (DROP de la partición entera,
+    sin DELETE fila a fila).
+    """
+    ahead = int(params.get('meses_adelante', AUDIT_PARTITIONS_AHEAD))
+    retention = int(params.get('retencion_meses', AUDIT_RETENTION_MONTHS))
+    hoy = datetime.date.today()
+    with db_handler.transaction() as tx:
+        creadas = tx.execute("SELECT crear_particiones_auditoria(%s, %s) AS n;",
+                             (hoy, ahead + 1), fetch_mode="one")['n']
+        borradas = []
+        if retention > 0:
+            limite = _limite_retencion(hoy, retention)
+            rows = tx.execute("""
+                SELECT c.relname
+                FROM pg_inherits inh
+                JOIN pg_class c ON c.oid = inh.inhrelid
+                WHERE inh.inhparent = '"Auditoria"'::regclass
+                  AND c.relname ~ '^Auditoria_[0-9]{4}_[0-9]{2}$'
+                  AND to_date(substr(c.relname, 11), 'YYYY_MM') < %s
+                ORDER BY c.relname;
+            """, (limite,))
+            for row in rows:
+                tx.execute(f'DROP TABLE "{row["relname"]}";', fetch_mode="none")
+                borradas.append(row['relname'])
+    if creadas or borradas:
+        logging.info(f"Auditoría: {creadas} particiones creadas, {len(borradas)} borradas {borradas}.")
+    return {'creadas': creadas, 'borradas': borradas}
+
+
+METRIC_VIEWS = ('MetricaSalaDia', 'MetricaSerie', 'MetricaFxPersonaje', 'MetricaTiempoTake')
+
+
+def _acumular_reaperturas():
+    """
+    Recalcula "MetricaReaperturaDia" desde el día de la pasada anterior menos
+    METRICS_REAPERTURAS_MARGEN. No se usa una marca por id: los ids de "Auditoria"
+    se asignan al insertar, no al confirmar, y una fila con id menor puede hacerse
+    visible después de otra mayor (transacciones concurrentes, escritor por lotes).
+    Rehacer los días recientes completos recoge esas filas tardías.
+    Retorna el primer día recalculado (None = todo el histórico).
+    """
+    with db_handler.transaction() as tx:
+        marca = tx.execute("""
+            SELECT refreshed_at FROM "MetricaRefresco" WHERE nombre = 'MetricaReaperturaDia' FOR UPDATE;
+        """, fetch_mode="one")
+        desde = None
+        if marca:
+            desde = (marca['refreshed_at'] - datetime.timedelta(seconds=METRICS_REAPERTURAS_MARGEN)).date()
+        tx.execute("""
+            DELETE FROM "MetricaReaperturaDia" WHERE %(desde)s::date IS NULL OR fecha >= %(desde)s::date;
+        """, {'desde': desde}, fetch_mode="none")
+        tx.execute("""
+            INSERT INTO "MetricaReaperturaDia" (fecha, serie_id, reaperturas)
+            SELECT a.created_at::date, cap.serie_id, count(*)
+            FROM "Auditoria" a
+            JOIN "Intervencion" i ON i.id = a.entidad_id
+            JOIN "Take" t ON t.id = i.take_id
+            JOIN "Capitulo" cap ON cap.id = t.capitulo_id
+            WHERE (%(desde)s::date IS NULL OR a.created_at >= %(desde)s::date)
+              AND a.entidad = 'Intervencion' AND a.accion = 'UPDATE_ESTADO'
+              AND a.payload->>'estado' = 'pendiente'
+            GROUP BY a.created_at::date, cap.serie_id;
+        """, {'desde': desde}, fetch_mode="none")
+        tx.execute("""
+            INSERT INTO "MetricaRefresco" (nombre, refreshed_at) VALUES ('MetricaReaperturaDia', NOW())
+            ON CONFLICT (nombre) DO UPDATE SET refreshed_at = NOW();
+        """, fetch_mode="none")
+    return desde
+
+
+def refrescar_metricas(params, sala_id):
+    """
+    Refresca las vistas materializadas de métricas (§11) con REFRESH ... CONCURRENTLY,
+    una por transacción para no bloquear las lecturas del dashboard, y recalcula las
+    reaperturas de los días recientes.
+    """
+    tiempos = {}
+    for vista in METRIC_VIEWS:
+        inicio = time.perf_counter()
+        db_handler.execute_query(f'REFRESH MATERIALIZED VIEW CONCURRENTLY "{vista}";', fetch_mode="none")
+        tiempos[vista] = round(time.perf_counter() - inicio, 3)
+        db_handler.execute_query("""
+            INSERT INTO "MetricaRefresco" (nombre, refreshed_at, segundos) VALUES (%s, NOW(), %s)
+            ON CONFLICT (nombre) DO UPDATE SET refreshed_at = NOW(), segundos = EXCLUDED.segundos;
+        """, (vista, tiempos[vista]), fetch_mode="none")
+    desde = _acumular_reaperturas()
+    return {'vistas': tiempos, 'reaperturas_desde': desde.isoformat() if desde else None}
+
+
+JOBS = {
+    'import_convo_diario': import_convo_diario,
+    'export_convo_cierre': export_convo_cierre,
+    'export_convocatoria': export_convocatoria,
+    'export_reintentos': export_reintentos,
+    'mantener_auditoria': mantener_auditoria,
+    'refrescar_metricas': refrescar_metricas,
+}
+
+# Tareas internas que el worker encola por su cuenta cada `intervalo` segundos.
+MAINTENANCE_JOBS = {
+    'mantener_auditoria': 24 * 3600,
+    'refrescar_metricas': METRICS_REFRESH_INTERVAL,
+}
+
+
+# --- Cola persistente ("JobRun") ---
+def enqueue_job(job, sala_id=None, params=None, job_config_id=None, tx=None):
+    """Encola una ejecución y retorna su id. No ejecuta nada en el proceso que llama."""
+    if job not in JOBS:
+        raise ValueError(f"Tarea desconocida: {job}")
+    query = """
+        INSERT INTO "JobRun" (job, job_config_id, sala_id, params, max_intentos)
+        VALUES (%s, %s, %s, %s, %s)
+        RETURNING id;
+    """
+    args = (job, job_config_id, sala_id, json.dumps(params or {}), JOB_MAX_INTENTOS)
+    row = tx.execute(query, args, fetch_mode="one") if tx else db_handler.execute_query(query, args, fetch_mode="one")
+    logging.info(f"JOB: '{job}' encolado (id {row['id']}, sala {sala_id}).")
+    return row['id']
+
+
+def get_job_run(job_run_id):
+    """Estado de una ejecución."""
+    return db_handler.execute_query('SELECT * FROM "JobRun" WHERE id = %s', (job_run_id,), fetch_mode="one")
+
+
+def list_job_runs(estado=None, limit=50):
+    """Últimas ejecuciones, opcionalmente filtradas por estado."""
+    return db_handler.execute_query("""
+        SELECT id, job, job_config_id, sala_id, estado, intentos, max_intentos, run_after,
+               started_at, finished_at, error, created_at
+        FROM "JobRun"
+        WHERE (%(estado)s::estado_job IS NULL OR estado = %(estado)s::estado_job)
+        ORDER BY id DESC
+        LIMIT %(limit)s;
+    """, {'estado': estado, 'limit': limit})
+
+
+def parse_schedule(schedule):
+    """Valida una expresión crontab de JobConfig.schedule y retorna su trigger."""
+    return CronTrigger.from_crontab(schedule, timezone=JOB_TIMEZONE)
+
+
+def next_run_time(schedule, now=None):
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return parse_schedule(schedule).get_next_fire_time(None, now)
+
+
+def get_io_config():
+    """Configuración global de I/O (JobConfig sin sala) en el formato de /admin/io-management."""
+    rows = db_handler.execute_query("""
+        SELECT tipo, schedule, config FROM "JobConfig" WHERE sala_id IS NULL ORDER BY id;
+    """)
+    result = {}
+    for row in rows:
+        config = row['config'] or {}
+        prefix = 'import' if row['tipo'] == 'import' else 'export'
+        result[f"{prefix}_schedule"] = row['schedule']
+        result[f"{prefix}_path"] = config.get(f"{prefix}_path")
+        if prefix == 'export':
+            result['export_series_ids'] = config.get('series_ids', 'all')
+    return result
+
+
+def save_io_config(data):
+    """
+    Guarda la configuración global de I/O en JobConfig. Un schedule vacío desactiva
+    la tarea. Lanza ValueError si algún schedule no es una expresión crontab válida.
+    """
+    entries = []
+    for tipo in ('import', 'export'):
+        schedule = (data.get(f"{tipo}_schedule") or '').strip() or None
+        if schedule:
+            parse_schedule(schedule)
+        config = {'job': DEFAULT_JOB_BY_TIPO[tipo], f"{tipo}_path": data.get(f"{tipo}_path")}
+        if tipo == 'export':
+            series_ids = data.get('export_series_ids')
+            config['series_ids'] = series_ids if isinstance(series_ids, list) else 'all'
+        entries.append((tipo, schedule, config))
+
+    with db_handler.transaction() as tx:
+        for tipo, schedule, config in entries:
+            params = {'tipo': tipo, 'schedule': schedule, 'activo': schedule is not None, 'config': json.dumps(config)}
+            updated = tx.execute("""
+                UPDATE "JobConfig"
+                SET schedule = %(schedule)s, activo = %(activo)s, config = %(config)s, next_run_at = NULL
+                WHERE tipo = %(tipo)s AND sala_id IS NULL;
+            """, params, fetch_mode="none")
+            if not updated:
+                tx.execute("""
+                    INSERT INTO "JobConfig" (tipo, schedule, activo, config)
+                    VALUES (%(tipo)s, %(schedule)s, %(activo)s, %(config)s);
+                """, params, fetch_mode="none")
+
+
+def schedule_due_jobs():
+    """Encola las JobConfig activas cuyo next_run_at ya venció y calcula el siguiente."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    encolados = 0
+    with db_handler.transaction() as tx:
+        configs = tx.execute("""
+            SELECT id, tipo, sala_id, schedule, config, next_run_at
+            FROM "JobConfig"
+            WHERE activo AND schedule IS NOT NULL AND schedule <> ''
+              AND (next_run_at IS NULL OR next_run_at <= NOW())
+            FOR UPDATE SKIP LOCKED;
+        """)
+        for cfg in configs:
+            try:
+                siguiente = next_run_time(cfg['schedule'], now)
+            except ValueError as e:
+                logging.error(f"JobConfig {cfg['id']}: schedule inválido '{cfg['schedule']}': {e}")
+                tx.execute('UPDATE "JobConfig" SET activo = false WHERE id = %s', (cfg['id'],), fetch_mode="none")
+                continue
+            # Una JobConfig recién activada solo fija su próxima ejecución.
+            if cfg['next_run_at'] is not None:
+                config = cfg['config'] or {}
+                job = config.get('job') or DEFAULT_JOB_BY_TIPO[cfg['tipo']]
+                enqueue_job(job, sala_id=cfg['sala_id'], params=config, job_config_id=cfg['id'], tx=tx)
+                encolados += 1
+            tx.execute("""
+                UPDATE "JobConfig" SET next_run_at = %s, last_run_at = CASE WHEN %s THEN NOW() ELSE last_run_at END
+                WHERE id = %s;
+            """, (siguiente, cfg['next_run_at'] is not None, cfg['id']), fetch_mode="none")
+    return encolados
+
+
+def requeue_stale_jobs():
+    """Devuelve a la cola las ejecuciones 'en_curso' huérfanas (worker caído)."""
+    return db_handler.execute_query("""
+        UPDATE "JobRun"
+        SET estado = 'pendiente', worker = NULL
+        WHERE estado = 'en_curso' AND started_at < NOW() - make_interval(secs => %s);
+    """, (JOB_STALE_AFTER,), fetch_mode="none")
+
+
+def claim_jobs(worker_name, limit):
+    """
+    Reserva hasta `limit` ejecuciones vencidas respetando JOB_MAX_PER_SALA.
+    El advisory lock evita que dos workers cuenten a la vez las que están en curso.
+    """
+    if limit <= 0:
+        return []
+    with db_handler.transaction() as tx:
+        tx.execute("SELECT pg_advisory_xact_lock(%s);", (_CLAIM_LOCK_KEY,), fetch_mode="none")
+        return tx.execute("""
+            WITH locked AS (
+                SELECT id, sala_id, run_after
+                FROM "JobRun"
+                WHERE estado = 'pendiente' AND run_after <= NOW()
+                ORDER BY run_after, id
+                LIMIT %(scan)s
+                FOR UPDATE SKIP LOCKED
+            ), running AS (
+                SELECT sala_id, count(*) AS n
+                FROM "JobRun"
+                WHERE estado = 'en_curso'
+                GROUP BY sala_id
+            ), ranked AS (
+                SELECT l.id, l.run_after,
+                       COALESCE(r.n, 0) + row_number() OVER (PARTITION BY l.sala_id ORDER BY l.run_after, l.id) AS slot
+                FROM locked l
+                LEFT JOIN running r ON r.sala_id IS NOT DISTINCT FROM l.sala_id
+            ), picked AS (
+                SELECT id FROM ranked
+                WHERE slot <= %(per_sala)s
+                ORDER BY run_after, id
+                LIMIT %(limit)s
+            )
+            UPDATE "JobRun" j
+            SET estado = 'en_curso', started_at = NOW(), finished_at = NULL,
+                intentos = j.intentos + 1, worker = %(worker)s
+            FROM picked
+            WHERE j.id = picked.id
+            RETURNING j.id, j.job, j.sala_id, j.params, j.intentos, j.max_intentos;
+        """, {'scan': limit * 10, 'per_sala': JOB_MAX_PER_SALA, 'limit': limit, 'worker': worker_name})
+
+
+def run_job(job_run):
+    """Ejecuta una ejecución reservada y persiste su resultado o el reintento."""
+    job_id = job_run['id']
+    try:
+        resultado = JOBS[job_run['job']](job_run['params'] or {}, job_run['sala_id'])
+    except Exception as e:
+        logging.exception(f"JOB {job_id} ('{job_run['job']}') falló en el intento {job_run['intentos']}:")
+        agotado = job_run['intentos'] >= job_run['max_intentos']
+        espera = JOB_BACKOFF_BASE * 2 ** (job_run['intentos'] - 1)
+        db_handler.execute_query("""
+            UPDATE "JobRun"
+            SET estado = %s, error = %s, worker = NULL,
+                finished_at = CASE WHEN %s THEN NOW() ELSE NULL END,
+                run_after = NOW() + make_interval(secs => %s)
+            WHERE id = %s;
+        """, ('fallido' if agotado else 'pendiente', str(e), agotado, espera, job_id), fetch_mode="none")
+        return
+
+    db_handler.execute_query("""
+        UPDATE "JobRun"
+        SET estado = 'ok', resultado = %s, error = NULL, finished_at = NOW()
+        WHERE id = %s;
+    """, (json.dumps(resultado, default=str), job_id), fetch_mode="none")
+    logging.info(f"JOB {job_id} ('{job_run['job']}') completado.")
+
+
+# --- Worker ---
+class JobWorker:
+    """Bucle de sondeo que planifica y ejecuta tareas en un pool de hilos propio."""
+
+    def __init__(self, workers=JOB_WORKERS, poll_interval=JOB_POLL_INTERVAL):
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._active = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._next_maintenance = {}
+
+    def _done(self, _future):
+        with self._lock:
+            self._active -= 1
+
+    def _enqueue_maintenance(self):
+        now = time.monotonic()
+        for job, intervalo in MAINTENANCE_JOBS.items():
+            if now >= self._next_maintenance.get(job, 0):
+                # Si ya hay una ejecución pendiente o en curso (de este u otro worker) no se apila otra.
+                activa = db_handler.execute_query("""
+                    SELECT 1 FROM "JobRun" WHERE job = %s AND estado IN ('pendiente', 'en_curso') LIMIT 1;
+                """, (job,), fetch_mode="one")
+                if not activa:
+                    enqueue_job(job)
+                self._next_maintenance[job] = now + intervalo
+
+    def poll_once(self):
+        self._enqueue_maintenance()
+        schedule_due_jobs()
+        requeue_stale_jobs()
+        with self._lock:
+            libres = self.workers - self._active
+        for job_run in claim_jobs(self.name, libres):
+            with self._lock:
+                self._active += 1
+            self._executor.submit(run_job, job_run).add_done_callback(self._done)
+
+    def run(self):
+        logging.info(f"Worker de tareas '{self.name}' iniciado ({self.workers} hilos).")
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+            except Exception as e:
+                logging.error(f"Error en el ciclo del worker de tareas: {e}")
+            self._stop.wait(self.poll_interval)
+        logging.info("Esperando a que terminen las tareas en curso...")
+        self._executor.shutdown(wait=True)
+        db_handler.close_pool()
+
+    def stop(self, *_args):
+        self._stop.set()
+
+
+def main():
+    # Las importaciones invalidan reparto/capítulos: el aviso tiene que llegar a los workers de la API.
+    attach_cache(cache, listen=False)
+    worker = JobWorker()
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()
+
+
+if __name__ == '__main__':
+    main()
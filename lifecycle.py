@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+lifecycle.py
+
+Ciclo de vida del proceso que sirve la API (ver gunicorn.conf.py). Al recibir
+SIGTERM el worker entra en drenaje: /api/health/ready pasa a 503, los streams
+SSE se cierran para que los clientes reconecten a otro worker y gunicorn deja
+de aceptar conexiones y espera a las peticiones en curso antes de salir.
+"""
+import logging
+import signal
+import threading
+
+_draining = threading.Event()
+_callbacks = []
+
+
+def is_draining():
+    return _draining.is_set()
+
+
+def on_drain(callback):
+    """Registra una función a llamar (sin argumentos) al empezar el drenaje."""
+    _callbacks.append(callback)
+
+
+def start_draining():
+    if _draining.is_set():
+        return
+    _draining.set()
+    logging.info("Drenando el proceso: readiness en 503 y cierre de streams.")
+    for callback in _callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logging.error(f"Error al drenar ({callback.__name__}): {e}")
+
+
+def install_drain_handler(signum=signal.SIGTERM):
+    """
+    Encadena el drenaje al manejador de `signum` ya instalado (el de gunicorn).
+    Los callbacks corren en un hilo aparte: un manejador de señal interrumpe al
+    hilo principal en cualquier punto y no debe tomar locks.
+    """
+    previous = signal.getsignal(signum)
+
+    def handler(sig, frame):
+        threading.Thread(target=start_draining, name="drain", daemon=True).start()
+        if callable(previous):
+            previous(sig, frame)
+
+    signal.signal(signum, handler)
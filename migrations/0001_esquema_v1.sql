@@ -0,0 +1,308 @@
+-- 0001_esquema_v1.sql
+--
+-- Lleva una BD creada con el schema.sql anterior al versionado (versión 0: sin
+-- "SchemaVersion") a la versión 1 de schema.sql, conservando los datos.
+-- Idempotente: cada paso comprueba si ya está hecho, así que se puede repetir
+-- sobre una BD a medio migrar. db_handler.apply_migrations la ejecuta en una
+-- sola transacción y registra la versión en "SchemaVersion".
+
+DO $$
+BEGIN
+  IF to_regclass('public."Intervencion"') IS NULL THEN
+    RAISE EXCEPTION 'No existe "Intervencion": la BD no tiene el esquema de schema.sql (¿volcado antiguo con tablas en minúsculas?). Hay que convertir los datos a mano.';
+  END IF;
+END;
+$$;
+
+-- Trigramas para el autocompletado de nombres de personaje
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Estados de la bitácora de I/O y de la cola de tareas
+DO $$
+BEGIN
+  IF to_regtype('estado_io') IS NULL THEN
+    CREATE TYPE estado_io AS ENUM ('ok', 'error', 'reintento');
+  END IF;
+  IF to_regtype('estado_job') IS NULL THEN
+    CREATE TYPE estado_job AS ENUM ('pendiente', 'en_curso', 'ok', 'fallido');
+  END IF;
+END;
+$$;
+
+-- "Intervencion": búsqueda de diálogos, timecodes en frames y orden único por take
+ALTER TABLE "Intervencion"
+  ADD COLUMN IF NOT EXISTS dialogo_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('spanish', coalesce(dialogo, ''))) STORED,
+  ADD COLUMN IF NOT EXISTS tc_in_frames INT,
+  ADD COLUMN IF NOT EXISTS tc_out_frames INT;
+
+DO $$
+BEGIN
+  IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                 WHERE conrelid = '"Intervencion"'::regclass AND conname = 'Intervencion_take_id_orden_key') THEN
+    ALTER TABLE "Intervencion" ADD CONSTRAINT "Intervencion_take_id_orden_key" UNIQUE (take_id, orden);
+  END IF;
+END;
+$$;
+
+-- Frames de los timecodes existentes, con las mismas reglas que timecode.parse
+-- (drop-frame a 29.97/59.94). Los timecodes inválidos quedan en NULL.
+CREATE OR REPLACE FUNCTION pg_temp.tc_a_frames(tc TEXT, fps NUMERIC)
+RETURNS INT AS $$
+DECLARE
+  nominal INT;
+  salto INT;
+  hh INT; mm INT; ss INT; ff INT;
+  minutos INT;
+BEGIN
+  tc := btrim(tc);
+  IF tc IS NULL OR fps IS NULL OR fps <= 0 OR tc !~ '^[0-9]{2}:[0-9]{2}:[0-9]{2}[:;][0-9]{2}$' THEN
+    RETURN NULL;
+  END IF;
+  fps := round(fps, 2);
+  nominal := round(fps)::int;
+  salto := CASE fps WHEN 29.97 THEN 2 WHEN 59.94 THEN 4 ELSE 0 END;
+  hh := substr(tc, 1, 2)::int;
+  mm := substr(tc, 4, 2)::int;
+  ss := substr(tc, 7, 2)::int;
+  ff := substr(tc, 10, 2)::int;
+  IF mm >= 60 OR ss >= 60 OR ff >= nominal THEN
+    RETURN NULL;
+  END IF;
+  IF salto > 0 AND ss = 0 AND mm % 10 <> 0 AND ff < salto THEN
+    RETURN NULL;
+  END IF;
+  minutos := hh * 60 + mm;
+  RETURN (hh * 3600 + mm * 60 + ss) * nominal + ff - salto * (minutos - minutos / 10);
+END;
+$$ LANGUAGE plpgsql IMMUTABLE;
+
+-- Sin tocar updated_at: es un dato derivado, no un cambio de la intervención.
+ALTER TABLE "Intervencion" DISABLE TRIGGER set_timestamp;
+UPDATE "Intervencion" i
+SET tc_in_frames = pg_temp.tc_a_frames(i.tc_in, s.fps),
+    tc_out_frames = pg_temp.tc_a_frames(i.tc_out, s.fps)
+FROM "Take" t
+JOIN "Capitulo" cap ON cap.id = t.capitulo_id
+JOIN "Serie" s ON s.id = cap.serie_id
+WHERE t.id = i.take_id
+  AND ((i.tc_in IS NOT NULL AND i.tc_in_frames IS NULL)
+       OR (i.tc_out IS NOT NULL AND i.tc_out_frames IS NULL));
+ALTER TABLE "Intervencion" ENABLE TRIGGER set_timestamp;
+
+-- "JobConfig": próxima y última ejecución del planificador de tareas
+ALTER TABLE "JobConfig"
+  ADD COLUMN IF NOT EXISTS next_run_at TIMESTAMPTZ,
+  ADD COLUMN IF NOT EXISTS last_run_at TIMESTAMPTZ;
+
+-- Tablas nuevas: cola de tareas, bitácora I/O y marca de agua del export
+CREATE TABLE IF NOT EXISTS "JobRun" (
+    id BIGSERIAL PRIMARY KEY,
+    job VARCHAR(100) NOT NULL,
+    job_config_id INT,
+    sala_id INT,
+    params JSONB,
+    estado estado_job NOT NULL DEFAULT 'pendiente',
+    intentos INT NOT NULL DEFAULT 0,
+    max_intentos INT NOT NULL DEFAULT 5,
+    run_after TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    worker VARCHAR(255),
+    resultado JSONB,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    CONSTRAINT fk_job_config FOREIGN KEY(job_config_id) REFERENCES "JobConfig"(id) ON DELETE SET NULL,
+    CONSTRAINT fk_sala FOREIGN KEY(sala_id) REFERENCES "Sala"(id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS "BitacoraIO" (
+    id BIGSERIAL PRIMARY KEY,
+    tipo tipo_job NOT NULL,
+    estado estado_io NOT NULL,
+    odoo_batch_id VARCHAR(255),
+    convocatoria_id INT,
+    mensaje TEXT,
+    detalles JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    CONSTRAINT fk_convocatoria FOREIGN KEY(convocatoria_id) REFERENCES "Convocatoria"(id) ON DELETE SET NULL
+);
+
+CREATE TABLE IF NOT EXISTS "ExportWatermark" (
+    convocatoria_id INT NOT NULL,
+    intervencion_id INT NOT NULL,
+    "version" INT NOT NULL,
+    exported_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (convocatoria_id, intervencion_id),
+    CONSTRAINT fk_convocatoria FOREIGN KEY(convocatoria_id) REFERENCES "Convocatoria"(id) ON DELETE CASCADE,
+    CONSTRAINT fk_intervencion FOREIGN KEY(intervencion_id) REFERENCES "Intervencion"(id) ON DELETE CASCADE
+);
+
+CREATE OR REPLACE TRIGGER set_timestamp BEFORE UPDATE ON "JobRun" FOR EACH ROW EXECUTE PROCEDURE trigger_set_timestamp();
+
+-- "Auditoria" particionada por mes de created_at (retención por DROP de particiones)
+CREATE OR REPLACE FUNCTION crear_particiones_auditoria(desde DATE, meses INT)
+RETURNS INT AS $$
+DECLARE
+  inicio DATE;
+  creadas INT := 0;
+  nombre TEXT;
+BEGIN
+  FOR n IN 0 .. meses - 1 LOOP
+    inicio := (date_trunc('month', desde) + make_interval(months => n))::date;
+    nombre := 'Auditoria_' || to_char(inicio, 'YYYY_MM');
+    IF to_regclass(format('%I', nombre)) IS NULL THEN
+      EXECUTE format(
+        'CREATE TABLE %I PARTITION OF "Auditoria" FOR VALUES FROM (%L) TO (%L)',
+        nombre, inicio, (inicio + interval '1 month')::date
+      );
+      creadas := creadas + 1;
+    END IF;
+  END LOOP;
+  RETURN creadas;
+END;
+$$ LANGUAGE plpgsql;
+
+-- La tabla antigua se renombra, se crea la particionada con la misma secuencia
+-- de ids, se copian las filas a sus meses y se borra la antigua.
+DO $$
+DECLARE
+  primera DATE;
+BEGIN
+  IF (SELECT relkind FROM pg_class WHERE oid = '"Auditoria"'::regclass) = 'p' THEN
+    RETURN;
+  END IF;
+
+  ALTER TABLE "Auditoria" RENAME TO "Auditoria_pre_particion";
+  ALTER TABLE "Auditoria_pre_particion" RENAME CONSTRAINT "Auditoria_pkey" TO "Auditoria_pre_particion_pkey";
+  ALTER SEQUENCE "Auditoria_id_seq" OWNED BY NONE;
+  DROP INDEX IF EXISTS idx_auditoria_entidad, idx_auditoria_usuario, idx_auditoria_fecha;
+
+  CREATE TABLE "Auditoria" (
+      id BIGINT NOT NULL DEFAULT nextval('"Auditoria_id_seq"'),
+      entidad VARCHAR(100) NOT NULL,
+      entidad_id BIGINT NOT NULL,
+      usuario_id INT,
+      accion VARCHAR(255) NOT NULL,
+      payload JSONB,
+      created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+      PRIMARY KEY (id, created_at),
+      CONSTRAINT fk_usuario FOREIGN KEY(usuario_id) REFERENCES "Usuario"(id) ON DELETE SET NULL
+  ) PARTITION BY RANGE (created_at);
+  ALTER SEQUENCE "Auditoria_id_seq" OWNED BY "Auditoria".id;
+  CREATE TABLE "Auditoria_default" PARTITION OF "Auditoria" DEFAULT;
+
+  primera := COALESCE((SELECT min(created_at) FROM "Auditoria_pre_particion")::date, NOW()::date);
+  PERFORM crear_particiones_auditoria(
+    primera,
+    ((extract(year FROM age(date_trunc('month', NOW()), date_trunc('month', primera))) * 12
+      + extract(month FROM age(date_trunc('month', NOW()), date_trunc('month', primera))))::int + 3
+  );
+
+  INSERT INTO "Auditoria" (id, entidad, entidad_id, usuario_id, accion, payload, created_at)
+  SELECT id, entidad, entidad_id, usuario_id, accion, payload, created_at
+  FROM "Auditoria_pre_particion";
+
+  DROP TABLE "Auditoria_pre_particion";
+END;
+$$;
+
+SELECT crear_particiones_auditoria((NOW() - interval '1 month')::date, 4);
+
+-- Índices de los imports, la cola de tareas, los listados keyset y la búsqueda
+CREATE INDEX IF NOT EXISTS idx_convocatoria_item_convocatoria ON "ConvocatoriaItem" (convocatoria_id);
+CREATE INDEX IF NOT EXISTS idx_convocatoria_item_take ON "ConvocatoriaItem" (take_id);
+CREATE INDEX IF NOT EXISTS idx_job_run_pendiente ON "JobRun" (run_after, id) WHERE estado = 'pendiente';
+CREATE INDEX IF NOT EXISTS idx_job_run_estado_sala ON "JobRun" (estado, sala_id);
+CREATE INDEX IF NOT EXISTS idx_bitacora_io_batch ON "BitacoraIO" (odoo_batch_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_intervencion_take_tc ON "Intervencion" (take_id, tc_in_frames) INCLUDE (tc_out_frames);
+CREATE INDEX IF NOT EXISTS idx_intervencion_personaje_tc ON "Intervencion" (personaje_id) INCLUDE (tc_in_frames, tc_out_frames, estado);
+CREATE INDEX IF NOT EXISTS idx_auditoria_entidad ON "Auditoria" (entidad, entidad_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_auditoria_usuario ON "Auditoria" (usuario_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_auditoria_fecha ON "Auditoria" (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_actor_nombre ON "Actor" (nombre, id);
+CREATE INDEX IF NOT EXISTS idx_usuario_rol ON "Usuario" (rol, id);
+CREATE INDEX IF NOT EXISTS idx_personaje_nombre_prefijo ON "Personaje" (lower(nombre) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_personaje_nombre_trgm ON "Personaje" USING gin (lower(nombre) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_intervencion_dialogo_fts ON "Intervencion" USING gin (dialogo_tsv);
+CREATE INDEX IF NOT EXISTS idx_intervencion_siguiente_pendiente ON "Intervencion" (take_id, personaje_id, estado, orden);
+
+-- Métricas §11 precalculadas: mismas definiciones que schema.sql
+CREATE MATERIALIZED VIEW IF NOT EXISTS "MetricaSalaDia" AS
+SELECT c.sala_id, c.fecha,
+       count(DISTINCT c.id) AS convocatorias,
+       count(DISTINCT c.id) FILTER (WHERE c.estado = 'reabierta') AS convocatorias_reabiertas,
+       count(i.id) AS intervenciones,
+       count(i.id) FILTER (WHERE i.estado = 'realizado') AS realizadas,
+       count(i.id) FILTER (WHERE i.estado = 'omitido') AS omitidas,
+       round(100.0 * count(i.id) FILTER (WHERE i.estado = 'realizado') / NULLIF(count(i.id), 0), 1) AS pct_completado
+FROM "Convocatoria" c
+JOIN "ConvocatoriaItem" ci ON ci.convocatoria_id = c.id
+JOIN "Intervencion" i ON i.take_id = ci.take_id
+GROUP BY c.sala_id, c.fecha;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_metrica_sala_dia ON "MetricaSalaDia" (sala_id, fecha);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS "MetricaSerie" AS
+SELECT cap.serie_id,
+       count(i.id) AS intervenciones,
+       count(i.id) FILTER (WHERE ct.take_id IS NOT NULL) AS convocadas,
+       count(i.id) FILTER (WHERE i.estado = 'realizado') AS realizadas,
+       count(i.id) FILTER (WHERE i.estado = 'omitido') AS omitidas,
+       count(i.id) FILTER (WHERE i.needs_fx) AS con_fx
+FROM "Capitulo" cap
+JOIN "Take" t ON t.capitulo_id = cap.id
+JOIN "Intervencion" i ON i.take_id = t.id
+LEFT JOIN (SELECT DISTINCT take_id FROM "ConvocatoriaItem") ct ON ct.take_id = t.id
+GROUP BY cap.serie_id;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_metrica_serie ON "MetricaSerie" (serie_id);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS "MetricaFxPersonaje" AS
+SELECT cap.serie_id, i.personaje_id, COALESCE(i.fx_source::text, 'sin_fuente') AS fx_source,
+       count(*) AS intervenciones_fx
+FROM "Intervencion" i
+JOIN "Take" t ON t.id = i.take_id
+JOIN "Capitulo" cap ON cap.id = t.capitulo_id
+WHERE i.needs_fx
+GROUP BY cap.serie_id, i.personaje_id, COALESCE(i.fx_source::text, 'sin_fuente');
+CREATE UNIQUE INDEX IF NOT EXISTS idx_metrica_fx_personaje ON "MetricaFxPersonaje" (serie_id, personaje_id, fx_source);
+
+CREATE MATERIALIZED VIEW IF NOT EXISTS "MetricaTiempoTake" AS
+WITH por_take AS (
+    SELECT ci.convocatoria_id, cap.serie_id, ci.take_id,
+           min(i.realizado_at) AS inicio, max(i.realizado_at) AS fin
+    FROM "ConvocatoriaItem" ci
+    JOIN "Take" t ON t.id = ci.take_id
+    JOIN "Capitulo" cap ON cap.id = t.capitulo_id
+    JOIN "Intervencion" i ON i.take_id = ci.take_id
+    GROUP BY ci.convocatoria_id, cap.serie_id, ci.take_id
+    HAVING count(*) = count(i.realizado_at)
+), duraciones AS (
+    SELECT convocatoria_id, serie_id,
+           fin - COALESCE(lag(fin) OVER (PARTITION BY convocatoria_id ORDER BY fin), inicio) AS duracion
+    FROM por_take
+)
+SELECT d.serie_id, c.sala_id, c.fecha, count(*) AS takes,
+       round(avg(extract(epoch FROM d.duracion))::numeric, 1) AS segundos_medios
+FROM duraciones d
+JOIN "Convocatoria" c ON c.id = d.convocatoria_id
+GROUP BY d.serie_id, c.sala_id, c.fecha;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_metrica_tiempo_take ON "MetricaTiempoTake" (serie_id, sala_id, fecha);
+
+CREATE TABLE IF NOT EXISTS "MetricaReaperturaDia" (
+    fecha DATE NOT NULL,
+    serie_id INT NOT NULL,
+    reaperturas INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (fecha, serie_id)
+);
+
+CREATE TABLE IF NOT EXISTS "MetricaRefresco" (
+    nombre TEXT PRIMARY KEY,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    segundos NUMERIC(10, 3)
+);
+
+CREATE TABLE IF NOT EXISTS "SchemaVersion" (
+    version INT PRIMARY KEY,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
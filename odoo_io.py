@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+odoo_io.py
+
+Lectura de lotes de convocatorias de Odoo (JSON, CSV o XLSX) y envío de
+exportaciones delta a Odoo (HTTP o fichero local).
+Los items se leen fila a fila para poder volcarlos a la BD por páginas
+sin cargar el fichero completo en memoria, y los exports se serializan
+en streaming hacia el destino.
+"""
+import csv
+import datetime
+import decimal
+import io
+import itertools
+import json
+import os
+import urllib.error
+import urllib.request
+
+import openpyxl
+
+ITEM_REQUIRED_FIELDS = ('serie_ref', 'capitulo_numero', 'take_numero', 'odoo_item_id')
+
+ODOO_EXPORT_URL = os.getenv("ODOO_EXPORT_URL")
+ODOO_EXPORT_TOKEN = os.getenv("ODOO_EXPORT_TOKEN")
+ODOO_EXPORT_DIR = os.getenv("ODOO_EXPORT_DIR", os.path.join(os.path.dirname(__file__), "io_external", "exports"))
+ODOO_EXPORT_TIMEOUT = float(os.getenv("ODOO_EXPORT_TIMEOUT", "30"))
+
+
+class ConvocatoriaImportError(Exception):
+    """Error de validación de un lote de convocatoria. `errores` detalla cada fallo."""
+
+    def __init__(self, mensaje, errores=None):
+        super().__init__(mensaje)
+        self.mensaje = mensaje
+        self.errores = errores or []
+
+
+# --- Cabecera del lote ---
+def parse_header(source):
+    """
+    Valida la cabecera del lote (sala_id, fecha, turno, odoo_batch_id) y
+    la retorna normalizada. `source` es el body JSON o el formulario multipart.
+    """
+    errores = []
+    sala_id = source.get('sala_id')
+    try:
+        sala_id = int(sala_id)
+    except (TypeError, ValueError):
+        errores.append("El campo 'sala_id' (entero) es requerido.")
+
+    fecha = source.get('fecha')
+    try:
+        fecha = datetime.date.fromisoformat(str(fecha))
+    except ValueError:
+        errores.append("El campo 'fecha' (YYYY-MM-DD) es requerido.")
+
+    odoo_batch_id = (source.get('odoo_batch_id') or '').strip()
+    if not odoo_batch_id:
+        errores.append("El campo 'odoo_batch_id' es requerido.")
+
+    if errores:
+        raise ConvocatoriaImportError("Cabecera de lote inválida.", errores)
+    return {
+        'sala_id': sala_id,
+        'fecha': fecha,
+        'turno': source.get('turno') or None,
+        'odoo_batch_id': odoo_batch_id,
+    }
+
+
+# --- Items ---
+def normalize_item(raw, linea):
+    """
+    Convierte un item crudo (dict) en la tupla que se vuelca a la tabla de staging:
+    (linea, odoo_item_id, serie_ref, capitulo_numero, take_numero, estado_planificado).
+    """
+    faltan = [f for f in ITEM_REQUIRED_FIELDS if raw.get(f) in (None, '')]
+    if faltan:
+        raise ConvocatoriaImportError(
+            f"Item {linea} incompleto.", [f"Item {linea}: faltan campos {', '.join(faltan)}."]
+        )
+    try:
+        capitulo_numero = int(raw['capitulo_numero'])
+        take_numero = int(raw['take_numero'])
+    except (TypeError, ValueError):
+        raise ConvocatoriaImportError(
+            f"Item {linea} malformado.",
+            [f"Item {linea}: 'capitulo_numero' y 'take_numero' deben ser enteros."]
+        )
+    estado_planificado = raw.get('estado_planificado')
+    return (
+        linea,
+        str(raw['odoo_item_id']).strip(),
+        str(raw['serie_ref']).strip(),
+        capitulo_numero,
+        take_numero,
+        str(estado_planificado) if estado_planificado not in (None, '') else None,
+    )
+
+
+def iter_json_items(items):
+    """Normaliza la lista `items` de un body JSON."""
+    if not isinstance(items, list) or not items:
+        raise ConvocatoriaImportError("El lote no contiene items.", ["'items' debe ser una lista no vacía."])
+    for linea, raw in enumerate(items, start=1):
+        if not isinstance(raw, dict):
+            raise ConvocatoriaImportError(f"Item {linea} malformado.", [f"Item {linea}: debe ser un objeto."])
+        yield normalize_item(raw, linea)
+
+
+def _iter_csv_rows(stream):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        yield from csv.DictReader(text)
+    finally:
+        text.detach()
+
+
+def _iter_xlsx_rows(stream):
+    workbook = openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            return
+        header = [str(h).strip() if h is not None else '' for h in header]
+        for values in rows:
+            if values is None or all(v in (None, '') for v in values):
+                continue
+            yield dict(zip(header, values))
+    finally:
+        workbook.close()
+
+
+def iter_file_items(stream, filename):
+    """Lee items desde un fichero CSV o XLSX, fila a fila."""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.csv':
+        rows = _iter_csv_rows(stream)
+    elif extension in ('.xlsx', '.xlsm'):
+        rows = _iter_xlsx_rows(stream)
+    else:
+        raise ConvocatoriaImportError("Formato no soportado.", [f"Extensión '{extension}' no soportada (csv, xlsx)."])
+    # La fila 1 es la cabecera: numeramos desde 2 para coincidir con la hoja.
+    for linea, raw in enumerate(rows, start=2):
+        yield normalize_item(raw, linea)
+
+
+def iter_file_batch(stream, filename):
+    """
+    Lee un lote completo desde fichero (para imports programados sin cabecera HTTP).
+    JSON: { sala_id, fecha, turno, odoo_batch_id, items[] }. CSV/XLSX: cada fila lleva
+    además las columnas sala_id, fecha, turno y odoo_batch_id; la cabecera se toma de
+    la primera fila. Retorna (header, items).
+    """
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension == '.json':
+        data = json.load(io.TextIOWrapper(stream, encoding='utf-8-sig'))
+        if not isinstance(data, dict):
+            raise ConvocatoriaImportError("Formato JSON inválido.", ["El fichero debe contener un objeto."])
+        return parse_header(data), iter_json_items(data.get('items'))
+    if extension == '.csv':
+        rows = _iter_csv_rows(stream)
+    elif extension in ('.xlsx', '.xlsm'):
+        rows = _iter_xlsx_rows(stream)
+    else:
+        raise ConvocatoriaImportError("Formato no soportado.", [f"Extensión '{extension}' no soportada (json, csv, xlsx)."])
+    first = next(rows, None)
+    if first is None:
+        raise ConvocatoriaImportError("El lote no contiene items.")
+    header = parse_header(first)
+    items = (normalize_item(raw, linea) for linea, raw in enumerate(itertools.chain([first], rows), start=2))
+    return header, items
+
+
+def batched(iterable, size):
+    """Agrupa un iterable en listas de como máximo `size` elementos."""
+    iterator = iter(iterable)
+    while True:
+        page = list(itertools.islice(iterator, size))
+        if not page:
+            return
+        yield page
+
+
+# --- Export (delta) ---
+class ExportSinkError(Exception):
+    """El destino del export rechazó o no pudo recibir el payload."""
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def iter_export_payload(convocatoria, rows, exported):
+    """
+    Serializa el payload delta (§16.3) en trozos de bytes, fila a fila.
+    Anota en `exported` las parejas (intervencion_id, version) enviadas.
+    """
+    cabecera = {'odoo_batch_id': convocatoria['odoo_batch_id'], 'convocatoria_id': convocatoria['id']}
+    yield json.dumps(cabecera, default=_json_default)[:-1].encode('utf-8') + b', "items": ['
+    for n, row in enumerate(rows):
+        item = {
+            'odoo_item_id': row['odoo_item_id'],
+            'intervencion_id': row['intervencion_id'],
+            'estado': row['estado'],
+            'estado_nota': row['estado_nota'],
+            'tc_in': row['tc_in'],
+            'tc_out': row['tc_out'],
+            'needs_fx': row['needs_fx'],
+            'fx_note': row['fx_note'],
+            'fx_source': row['fx_source'],
+            'fx_marked_at': row['fx_marked_at'],
+            'usuario_ejecucion': row['usuario_ejecucion'],
+            'realizado_at': row['realizado_at'],
+        }
+        exported.append((row['intervencion_id'], row['version']))
+        yield (b', ' if n else b'') + json.dumps(item, default=_json_default).encode('utf-8')
+    yield b']}'
+
+
+class _CountingIterator:
+    """Envuelve un iterable de bytes contando lo que se ha consumido."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.bytes = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        chunk = next(self._chunks)
+        self.bytes += len(chunk)
+        return chunk
+
+
+class FileSink:
+    """Destino local (stand-in de Odoo): escribe cada export como fichero JSON."""
+
+    def __init__(self, directory=ODOO_EXPORT_DIR):
+        self.directory = directory
+
+    def send(self, name, chunks):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        tmp_path = path + ".part"
+        counter = _CountingIterator(chunks)
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in counter:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            raise ExportSinkError(f"No se pudo escribir {path}: {e}") from e
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return counter.bytes
+
+
+class HttpSink:
+    """Destino HTTP: hace POST del payload con Transfer-Encoding: chunked."""
+
+    def __init__(self, url, token=None, timeout=ODOO_EXPORT_TIMEOUT):
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def send(self, name, chunks):
+        counter = _CountingIterator(chunks)
+        headers = {'Content-Type': 'application/json', 'X-Export-Name': name}
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        req = urllib.request.Request(self.url, data=counter, headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as response:
+                response.read()
+        except (urllib.error.URLError, OSError) as e:
+            raise ExportSinkError(f"Odoo no aceptó el export: {e}") from e
+        return counter.bytes
+
+
+def get_export_sink():
+    """Destino configurado: HTTP si hay ODOO_EXPORT_URL, si no fichero en ODOO_EXPORT_DIR."""
+    if ODOO_EXPORT_URL:
+        return HttpSink(ODOO_EXPORT_URL, token=ODOO_EXPORT_TOKEN)
+    return FileSink(ODOO_EXPORT_DIR)
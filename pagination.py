@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+pagination.py
+
+Paginación por keyset (seek) para los listados de la API y de la GUI. Cada
+`Listing` declara su origen, las columnas ordenables (lista blanca) y los
+filtros tipados que admite; a partir de ahí construye la consulta de una página.
+
+El cursor es opaco para el cliente: codifica (orden, sentido, valor de la
+columna de orden, id) de la última fila servida. La página siguiente arranca en
+`WHERE (col, id) > (valor, id)`, que aprovecha el índice en lugar de saltarse
+OFFSET filas, y no se descuadra si entran o salen filas entre peticiones.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+PAGE_SIZE_DEFAULT = 50
+PAGE_SIZE_MAX = 500
+# Por debajo de esta estimación del planner se hace un COUNT(*) exacto.
+EXACT_COUNT_MAX = 10000
+
+ORDERS = ('asc', 'desc')
+_TRUE = ('1', 'true', 'si', 'sí', 'yes')
+_FALSE = ('0', 'false', 'no')
+
+
+class PaginationError(ValueError):
+    """Parámetros de listado inválidos (orden, filtro, cursor o límite)."""
+
+
+class Filter:
+    """
+    Filtro tipado. `sql` es la condición con el marcador `%(nombre)s`;
+    `kind` decide cómo se valida el valor recibido:
+    'int', 'text' (igualdad), 'contains' (ILIKE '%valor%'), 'bool',
+    'datetime' (ISO 8601) o 'enum' (uno de `choices`).
+    """
+
+    def __init__(self, sql, kind='text', choices=None):
+        self.sql = sql
+        self.kind = kind
+        self.choices = choices
+
+    def parse(self, name, raw):
+        if isinstance(raw, str):
+            raw = raw.strip()
+        try:
+            if self.kind == 'int':
+                if isinstance(raw, bool):
+                    raise ValueError(raw)
+                return int(raw)
+            if self.kind == 'bool':
+                if isinstance(raw, bool):
+                    return raw
+                if str(raw).lower() in _TRUE:
+                    return True
+                if str(raw).lower() in _FALSE:
+                    return False
+                raise ValueError(raw)
+            if self.kind == 'datetime':
+                if isinstance(raw, (datetime.date, datetime.datetime)):
+                    return raw
+                return datetime.datetime.fromisoformat(raw)
+        except (TypeError, ValueError):
+            raise PaginationError(f"El filtro '{name}' tiene un valor inválido.")
+        text = str(raw)
+        if self.kind == 'enum' and text not in self.choices:
+            raise PaginationError(f"El filtro '{name}' debe ser uno de {', '.join(self.choices)}.")
+        if self.kind == 'contains':
+            return f"%{like_escape(text)}%"
+        return text
+
+
+def like_escape(text):
+    """Escapa los comodines de LIKE/ILIKE para que el texto del usuario se busque literalmente."""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def encode_cursor(sort, order, value, row_id):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    raw = json.dumps([sort, order, value, row_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort, order, value, row_id = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise PaginationError("Cursor de paginación inválido.")
+    return sort, order, value, row_id
+
+
+class Listing:
+    """
+    Definición de un listado paginable.
+
+    - `source`: FROM (tabla con alias, con JOINs si hace falta).
+    - `columns`: lista SELECT de cada fila.
+    - `key`: columna única que desempata el orden (normalmente el id).
+    - `sorts`: nombre público -> columna. Solo columnas NOT NULL, o el keyset falla.
+    - `filters`: nombre público -> Filter.
+    """
+
+    def __init__(self, source, columns, sorts, default_sort, default_order='asc', filters=None, key='id'):
+        self.source = source
+        self.columns = columns
+        self.sorts = sorts
+        self.default_sort = default_sort
+        self.default_order = default_order
+        self.filters = filters or {}
+        self.key = key
+
+    def where(self, filters):
+        """Retorna (condiciones SQL, params) de los filtros informados. Lanza PaginationError."""
+        clauses, params = [], {}
+        for name, raw in (filters or {}).items():
+            if raw is None or raw == '':
+                continue
+            if name not in self.filters:
+                raise PaginationError(f"Filtro no soportado: '{name}'.")
+            params[name] = self.filters[name].parse(name, raw)
+            clauses.append(self.filters[name].sql)
+        return clauses, params
+
+    def query(self, filters=None, sort=None, order=None, cursor=None, limit=None):
+        """
+        Construye la consulta de una página. Retorna (sql, params, sort, order, limit);
+        la consulta trae `limit + 1` filas para saber si hay página siguiente.
+        """
+        sort = sort or self.default_sort
+        order = (order or self.default_order).lower()
+        if sort not in self.sorts:
+            raise PaginationError(f"Orden no soportado: '{sort}'. Opciones: {', '.join(self.sorts)}.")
+        if order not in ORDERS:
+            raise PaginationError("El sentido del orden debe ser 'asc' o 'desc'.")
+        try:
+            limit = PAGE_SIZE_DEFAULT if limit in (None, '') else int(limit)
+        except (TypeError, ValueError):
+            raise PaginationError("El parámetro 'limit' debe ser un entero.")
+        if not 1 <= limit <= PAGE_SIZE_MAX:
+            raise PaginationError(f"El parámetro 'limit' debe estar entre 1 y {PAGE_SIZE_MAX}.")
+
+        clauses, params = self.where(filters)
+        column = self.sorts[sort]
+        op = '>' if order == 'asc' else '<'
+        if cursor:
+            c_sort, c_order, value, row_id = decode_cursor(cursor)
+            if (c_sort, c_order) != (sort, order):
+                raise PaginationError("El cursor no corresponde a este orden.")
+            params['_cursor_id'] = row_id
+            if column == self.key:
+                clauses.append(f"{self.key} {op} %(_cursor_id)s")
+            else:
+                params['_cursor_value'] = value
+                clauses.append(f"({column}, {self.key}) {op} (%(_cursor_value)s, %(_cursor_id)s)")
+        params['_limit'] = limit + 1
+
+        order_by = f"{self.key} {order.upper()}"
+        if column != self.key:
+            order_by = f"{column} {order.upper()}, {order_by}"
+        sql = f"""
+            SELECT {self.columns}, {column} AS _cursor_value, {self.key} AS _cursor_id
+            FROM {self.source}
+            {'WHERE ' + ' AND '.join(clauses) if clauses else ''}
+            ORDER BY {order_by}
+            LIMIT %(_limit)s;
+        """
+        return sql, params, sort, order, limit
+
+    def count_query(self, filters=None, explain=False):
+        """COUNT(*) de los filtros (sin cursor); con `explain` solo se pide la estimación del planner."""
+        clauses, params = self.where(filters)
+        where = 'WHERE ' + ' AND '.join(clauses) if clauses else ''
+        if explain:
+            return f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {self.source} {where};", params
+        return f"SELECT COUNT(*) AS total FROM {self.source} {where};", params
+
+    def page(self, rows, sort, order, limit):
+        """Recorta la fila de más y retorna {'items', 'next_cursor'}."""
+        rows = [dict(row) for row in rows]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor(sort, order, last['_cursor_value'], last['_cursor_id'])
+        for row in rows:
+            del row['_cursor_value'], row['_cursor_id']
+        return {'items': rows, 'next_cursor': next_cursor}
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+password_pool.py
+
+Verificación y generación de hashes bcrypt fuera de los hilos de petición.
+bcrypt es CPU pura: con cientos de logins a la vez (inicio de turno) ocupaba
+todos los hilos del worker. Aquí corre en un pool de procesos acotado
+(PASSWORD_WORKERS por worker de la API) con control de admisión: como mucho
+PASSWORD_MAX_PENDING operaciones en vuelo; si no hay hueco en
+PASSWORD_ADMISSION_TIMEOUT segundos se lanza PasswordPoolBusy y la API responde
+503 con Retry-After en lugar de encolar sin límite.
+
+Los hashes se generan con BCRYPT_ROUNDS. Si un login correcto trae un hash con
+otro coste, se recalcula en segundo plano y se guarda (rehash transparente).
+"""
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import threading
+
+import bcrypt
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", "2"))
+PASSWORD_MAX_PENDING = int(os.getenv("PASSWORD_MAX_PENDING", str(PASSWORD_WORKERS * 8)))
+PASSWORD_ADMISSION_TIMEOUT = float(os.getenv("PASSWORD_ADMISSION_TIMEOUT", "2"))
+PASSWORD_TIMEOUT = float(os.getenv("PASSWORD_TIMEOUT", "10"))   # segundos esperando el resultado
+
+
+class PasswordPoolBusy(Exception):
+    """No hay capacidad para otra operación bcrypt ahora mismo."""
+
+
+# --- Funciones que corren en los procesos del pool ---
+def _check(password, password_hash):
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+    except ValueError:
+        # Hash corrupto o contraseña que bcrypt no admite (> 72 bytes en bcrypt >= 5).
+        return False
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def hash_cost(password_hash):
+    """Factor de coste de un hash bcrypt ($2b$12$...) o None si no se reconoce."""
+    try:
+        return int(password_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordPool:
+    def __init__(self, workers=PASSWORD_WORKERS, max_pending=PASSWORD_MAX_PENDING,
+                 admission_timeout=PASSWORD_ADMISSION_TIMEOUT, timeout=PASSWORD_TIMEOUT, rounds=BCRYPT_ROUNDS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.admission_timeout = admission_timeout
+        self.timeout = timeout
+        self.rounds = rounds
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    # 'spawn': hacer fork de un worker con hilos y conexiones abiertas no es seguro.
+                    self._executor = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                    )
+        return self._executor
+
+    def _run(self, fn, *args, wait=True):
+        """Ejecuta fn en el pool si hay hueco. Con wait=False no espera hueco y retorna el Future (o None)."""
+        if not self._slots.acquire(timeout=self.admission_timeout if wait else 0):
+            with self._stats_lock:
+                self.rejected += 1
+            if wait:
+                raise PasswordPoolBusy(f"{self.max_pending} operaciones bcrypt en curso.")
+            return None
+        with self._stats_lock:
+            self.in_flight += 1
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        if not wait:
+            return future
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            raise PasswordPoolBusy(f"bcrypt no respondió en {self.timeout} s.")
+
+    def _release(self):
+        with self._stats_lock:
+            self.in_flight -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def check_password(self, password, password_hash):
+        """True si `password` corresponde a `password_hash`. Lanza PasswordPoolBusy si no hay capacidad."""
+        return self._run(_check, password, password_hash)
+
+    def hash_password(self, password):
+        return self._run(_hash, password, self.rounds)
+
+    def needs_rehash(self, password_hash):
+        return hash_cost(password_hash) != self.rounds
+
+    def rehash_in_background(self, password, on_rehash):
+        """
+        Calcula un hash nuevo con el coste actual y llama a `on_rehash(nuevo_hash)`
+        desde un hilo del pool. Si no hay hueco no se hace: se reintentará en el próximo login.
+        """
+        future = self._run(_hash, password, self.rounds, wait=False)
+        if future is None:
+            return False
+
+        def done(f):
+            try:
+                on_rehash(f.result())
+                with self._stats_lock:
+                    self.rehashed += 1
+            except Exception as e:
+                logging.error(f"No se pudo guardar el rehash de la contraseña: {e}")
+
+        future.add_done_callback(done)
+        return True
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def reset_after_fork(self):
+        """El executor heredado del proceso padre no sirve en el hijo (sus hilos no existen)."""
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self.in_flight = 0
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'rounds': self.rounds,
+                'in_flight': self.in_flight,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'rehashed': self.rehashed,
+            }
+
+
+password_pool = PasswordPool()
+os.register_at_fork(after_in_child=password_pool.reset_after_fork)
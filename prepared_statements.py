@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+prepared_statements.py
+
+Registro de sentencias preparadas para las consultas calientes de DataHandler.
+Cada sentencia se prepara (PREPARE) la primera vez que se usa en una conexión
+del pool y después se ejecuta por nombre (EXECUTE): Postgres no vuelve a
+analizar el SQL y, tras unas ejecuciones, reutiliza un plan genérico.
+
+Las filas se devuelven como namedtuple (tuplas con nombre, sin __dict__)
+construidas desde un cursor de tuplas, no como diccionarios de RealDictCursor.
+
+Con DB_PREPARED_STATEMENTS=0 (p. ej. detrás de pgbouncer en modo transacción,
+donde la sesión no es de la conexión) se ejecuta el SQL tal cual, con las
+mismas filas tipadas.
+"""
+import collections
+import hashlib
+import os
+import re
+import threading
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+
+DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "1") == "1"
+
+_PARAM = re.compile(r'%%|%\((\w+)\)s|%s')
+_WRITE_SQL = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE)\b', re.IGNORECASE)
+
+_registry = {}          # nombre -> Statement
+_by_sql = {}            # (prefijo, sql) -> Statement (variantes)
+_lock = threading.Lock()
+_counters = {'prepares': 0, 'executions': 0, 'invalidated': 0}
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Conexión que recuerda qué sentencias tiene preparadas en su sesión."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.stale = set()       # preparadas en el servidor pero con un plan que ya no vale
+
+
+class Statement:
+    """
+    Sentencia con nombre. `sql` usa los marcadores de psycopg2 (todos %s o todos
+    %(nombre)s); se traduce a $1..$n para PREPARE.
+    """
+    __slots__ = ('name', 'sql', 'writes', 'param_names', 'prepare_sql', 'execute_sql', '_row_type')
+
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self.writes = bool(_WRITE_SQL.search(sql))
+        names, positional = [], 0
+
+        def replace(match):
+            nonlocal positional
+            if match.group(0) == '%%':
+                return '%'
+            if match.group(1) is None:
+                positional += 1
+                return f"${positional}"
+            if match.group(1) not in names:
+                names.append(match.group(1))
+            return f"${names.index(match.group(1)) + 1}"
+
+        body = _PARAM.sub(replace, sql).strip().rstrip(';')
+        if names and positional:
+            raise ValueError(f"La sentencia '{name}' mezcla parámetros %s y %(nombre)s.")
+        self.param_names = tuple(names) if names else None
+        count = len(names) or positional
+        self.prepare_sql = f"PREPARE {name} AS {body}"
+        self.execute_sql = f"EXECUTE {name}" + (f" ({', '.join(['%s'] * count)})" if count else "")
+        self._row_type = None
+
+    def bind(self, params):
+        """Parámetros en el orden de $1..$n."""
+        if self.param_names is None:
+            return tuple(params or ())
+        return tuple(params[name] for name in self.param_names)
+
+    def row_type(self, description):
+        """namedtuple con las columnas del resultado (se rehace si cambian)."""
+        fields = tuple(column.name for column in description)
+        row_type = self._row_type
+        if row_type is None or row_type._fields != fields:
+            row_type = collections.namedtuple(f"{self.name}_row", fields, rename=True)
+            self._row_type = row_type
+        return row_type
+
+    def fetch(self, cursor, fetch_mode):
+        if fetch_mode == "none":
+            return cursor.rowcount
+        make = self.row_type(cursor.description)._make
+        if fetch_mode == "all":
+            return list(map(make, cursor.fetchall()))
+        if fetch_mode == "one":
+            row = cursor.fetchone()
+            return make(row) if row is not None else None
+        raise ValueError(f"Modo de fetch no válido: {fetch_mode}")
+
+
+def register(name, sql):
+    """Registra (o recupera) la sentencia `name`. Lanza ValueError si el nombre ya tiene otro SQL."""
+    with _lock:
+        statement = _registry.get(name)
+        if statement is None:
+            statement = _registry[name] = Statement(name, sql)
+        elif statement.sql != sql:
+            raise ValueError(f"La sentencia preparada '{name}' ya está registrada con otro SQL.")
+        return statement
+
+def register_variant(prefix, sql):
+    """Para SQL que se arma en tiempo de ejecución (p. ej. el SET de una actualización): nombre prefijo_hash."""
+    statement = _by_sql.get((prefix, sql))
+    if statement is None:
+        name = f"{prefix}_{hashlib.sha1(sql.encode('utf-8')).hexdigest()[:12]}"
+        statement = _by_sql[(prefix, sql)] = register(name, sql)
+    return statement
+
+
+def execute(conn, cursor, statement, params=None, fetch_mode="all"):
+    """
+    Ejecuta `statement` en `cursor` (de tuplas, sobre `conn`), preparándola antes
+    si esta conexión aún no la tiene. Retorna filas namedtuple, una fila o rowcount.
+    """
+    if not DB_PREPARED_STATEMENTS:
+        cursor.execute(statement.sql, params)
+        return statement.fetch(cursor, fetch_mode)
+
+    prepared = getattr(conn, 'prepared', None)
+    if prepared is None:
+        raise TypeError("La conexión no se abrió con connection_factory=PreparingConnection.")
+    if statement.name not in prepared:
+        if statement.name in conn.stale:
+            cursor.execute(f"DEALLOCATE {statement.name}")
+            conn.stale.discard(statement.name)
+        try:
+            cursor.execute(statement.prepare_sql)
+        except psycopg2.errors.DuplicatePreparedStatement:
+            # La sesión ya la tenía (registro desincronizado): esta transacción falla, la siguiente la usa.
+            prepared.add(statement.name)
+            raise
+        # PREPARE no es transaccional: la sentencia sigue en la sesión aunque se haga ROLLBACK.
+        prepared.add(statement.name)
+        _counters['prepares'] += 1
+    try:
+        cursor.execute(statement.execute_sql, statement.bind(params))
+    except psycopg2.errors.InvalidSqlStatementName:
+        # La sesión la perdió (p. ej. DISCARD ALL): se vuelve a preparar en la siguiente transacción.
+        prepared.discard(statement.name)
+        _counters['invalidated'] += 1
+        raise
+    except psycopg2.errors.FeatureNotSupported:
+        # "cached plan must not change result type" tras un cambio de esquema: DEALLOCATE y PREPARE de nuevo.
+        prepared.discard(statement.name)
+        conn.stale.add(statement.name)
+        _counters['invalidated'] += 1
+        raise
+    _counters['executions'] += 1
+    return statement.fetch(cursor, fetch_mode)
+
+
+def stats():
+    """Sentencias registradas y contadores de PREPARE/EXECUTE de este proceso."""
+    return {'enabled': DB_PREPARED_STATEMENTS, 'registered': len(_registry), **_counters}
@@ -3,12 +3,17 @@
 DROP SCHEMA public CASCADE;
 CREATE SCHEMA public;
 
+-- Trigramas para el autocompletado de personajes (ver DataHandler.buscar_personajes)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Creación de tipos ENUM para un mejor control de datos
 CREATE TYPE rol_usuario AS ENUM ('admin', 'director', 'tecnico', 'supervisor');
 CREATE TYPE estado_intervencion AS ENUM ('pendiente', 'realizado', 'omitido');
 CREATE TYPE fuente_fx AS ENUM ('manual', 'personaje_default', 'odoo');
 CREATE TYPE estado_convocatoria AS ENUM ('no_importada', 'importada', 'en_curso', 'cerrada', 'reabierta');
 CREATE TYPE tipo_job AS ENUM ('import', 'export');
+CREATE TYPE estado_io AS ENUM ('ok', 'error', 'reintento');
+CREATE TYPE estado_job AS ENUM ('pendiente', 'en_curso', 'ok', 'fallido');
 
 -- Tabla de Usuarios
 CREATE TABLE "Usuario" (
@@ -88,8 +93,11 @@ CREATE TABLE "Intervencion" (
     personaje_id INT NOT NULL,
     orden INT NOT NULL,
     dialogo TEXT,
+    dialogo_tsv tsvector GENERATED ALWAYS AS (to_tsvector('spanish', coalesce(dialogo, ''))) STORED,
     tc_in VARCHAR(11), -- HH:MM:SS:FF
     tc_out VARCHAR(11), -- HH:MM:SS:FF
+    tc_in_frames INT,   -- tc_in como número de frame según Serie.fps (ver timecode.py)
+    tc_out_frames INT,
     estado estado_intervencion NOT NULL DEFAULT 'pendiente',
     estado_nota TEXT,
     needs_fx BOOLEAN NOT NULL DEFAULT false,
@@ -107,7 +115,8 @@ CREATE TABLE "Intervencion" (
     CONSTRAINT fk_fx_marked_by FOREIGN KEY(fx_marked_by) REFERENCES "Usuario"(id) ON DELETE SET NULL,
     CONSTRAINT fk_realizado_por FOREIGN KEY(realizado_por_usuario_id) REFERENCES "Usuario"(id) ON DELETE SET NULL,
     CONSTRAINT chk_estado_nota CHECK ( (estado = 'omitido' AND estado_nota IS NOT NULL) OR (estado != 'omitido') ),
-    CONSTRAINT chk_fx_note CHECK ( (needs_fx = true AND fx_note IS NOT NULL AND length(fx_note) >= 3) OR (needs_fx = false) )
+    CONSTRAINT chk_fx_note CHECK ( (needs_fx = true AND fx_note IS NOT NULL AND length(fx_note) >= 3) OR (needs_fx = false) ),
+    UNIQUE(take_id, orden)
 );
 
 -- Tabla de Reparto por Capítulo (PersonajeEnCapitulo)
@@ -155,17 +164,19 @@ CREATE TABLE "ConvocatoriaItem" (
     CONSTRAINT fk_take FOREIGN KEY(take_id) REFERENCES "Take"(id) ON DELETE CASCADE
 );
 
--- Tabla de Auditoría
+-- Tabla de Auditoría (particionada por mes de created_at; ver crear_particiones_auditoria)
 CREATE TABLE "Auditoria" (
-    id BIGSERIAL PRIMARY KEY,
+    id BIGSERIAL,
     entidad VARCHAR(100) NOT NULL,
     entidad_id BIGINT NOT NULL,
     usuario_id INT,
     accion VARCHAR(255) NOT NULL,
     payload JSONB,
     created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (id, created_at),
     CONSTRAINT fk_usuario FOREIGN KEY(usuario_id) REFERENCES "Usuario"(id) ON DELETE SET NULL
-);
+) PARTITION BY RANGE (created_at);
+CREATE TABLE "Auditoria_default" PARTITION OF "Auditoria" DEFAULT;
 
 -- Tabla de Configuración de Tareas (JobConfig)
 CREATE TABLE "JobConfig" (
@@ -175,13 +186,80 @@ CREATE TABLE "JobConfig" (
     schedule TEXT,
     activo BOOLEAN NOT NULL DEFAULT false,
     config JSONB,
+    next_run_at TIMESTAMPTZ,
+    last_run_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    CONSTRAINT fk_sala FOREIGN KEY(sala_id) REFERENCES "Sala"(id) ON DELETE CASCADE
+);
+
+-- Ejecuciones de tareas (cola persistente que consume job_scheduler.py)
+CREATE TABLE "JobRun" (
+    id BIGSERIAL PRIMARY KEY,
+    job VARCHAR(100) NOT NULL,
+    job_config_id INT,
+    sala_id INT,
+    params JSONB,
+    estado estado_job NOT NULL DEFAULT 'pendiente',
+    intentos INT NOT NULL DEFAULT 0,
+    max_intentos INT NOT NULL DEFAULT 5,
+    run_after TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    worker VARCHAR(255),
+    resultado JSONB,
+    error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
     updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    CONSTRAINT fk_job_config FOREIGN KEY(job_config_id) REFERENCES "JobConfig"(id) ON DELETE SET NULL,
     CONSTRAINT fk_sala FOREIGN KEY(sala_id) REFERENCES "Sala"(id) ON DELETE CASCADE
 );
 
+-- Tabla de Bitácora I/O (import/export con Odoo)
+CREATE TABLE "BitacoraIO" (
+    id BIGSERIAL PRIMARY KEY,
+    tipo tipo_job NOT NULL,
+    estado estado_io NOT NULL,
+    odoo_batch_id VARCHAR(255),
+    convocatoria_id INT,
+    mensaje TEXT,
+    detalles JSONB,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    CONSTRAINT fk_convocatoria FOREIGN KEY(convocatoria_id) REFERENCES "Convocatoria"(id) ON DELETE SET NULL
+);
+
+-- Marca de agua de exportación a Odoo: última versión exportada de cada intervención
+CREATE TABLE "ExportWatermark" (
+    convocatoria_id INT NOT NULL,
+    intervencion_id INT NOT NULL,
+    "version" INT NOT NULL,
+    exported_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (convocatoria_id, intervencion_id),
+    CONSTRAINT fk_convocatoria FOREIGN KEY(convocatoria_id) REFERENCES "Convocatoria"(id) ON DELETE CASCADE,
+    CONSTRAINT fk_intervencion FOREIGN KEY(intervencion_id) REFERENCES "Intervencion"(id) ON DELETE CASCADE
+);
+
 -- Índices Sugeridos
 CREATE INDEX idx_intervencion_capitulo_personaje_fx ON "Intervencion" (take_id, personaje_id, needs_fx);
 CREATE INDEX idx_convocatoria_sala_fecha ON "Convocatoria" (sala_id, fecha);
+CREATE INDEX idx_convocatoria_item_convocatoria ON "ConvocatoriaItem" (convocatoria_id);
+CREATE INDEX idx_convocatoria_item_take ON "ConvocatoriaItem" (take_id);
+CREATE INDEX idx_job_run_pendiente ON "JobRun" (run_after, id) WHERE estado = 'pendiente';
+CREATE INDEX idx_job_run_estado_sala ON "JobRun" (estado, sala_id);
+CREATE INDEX idx_bitacora_io_batch ON "BitacoraIO" (odoo_batch_id, created_at);
+CREATE INDEX idx_intervencion_take_tc ON "Intervencion" (take_id, tc_in_frames) INCLUDE (tc_out_frames);
+CREATE INDEX idx_intervencion_personaje_tc ON "Intervencion" (personaje_id) INCLUDE (tc_in_frames, tc_out_frames, estado);
+CREATE INDEX idx_auditoria_entidad ON "Auditoria" (entidad, entidad_id, created_at);
+CREATE INDEX idx_auditoria_usuario ON "Auditoria" (usuario_id, created_at);
+-- Listados paginados por keyset (ver pagination.py): orden + id como desempate.
+CREATE INDEX idx_auditoria_fecha ON "Auditoria" (created_at, id);
+CREATE INDEX idx_actor_nombre ON "Actor" (nombre, id);
+CREATE INDEX idx_usuario_rol ON "Usuario" (rol, id);
+-- Búsqueda (§5, §17): autocompletado de personajes (prefijo y trigramas),
+-- texto completo en español sobre los diálogos y "siguiente pendiente" por personaje.
+CREATE INDEX idx_personaje_nombre_prefijo ON "Personaje" (lower(nombre) text_pattern_ops);
+CREATE INDEX idx_personaje_nombre_trgm ON "Personaje" USING gin (lower(nombre) gin_trgm_ops);
+CREATE INDEX idx_intervencion_dialogo_fts ON "Intervencion" USING gin (dialogo_tsv);
+CREATE INDEX idx_intervencion_siguiente_pendiente ON "Intervencion" (take_id, personaje_id, estado, orden);
 
 -- Trigger para actualizar automáticamente el campo `updated_at` en todas las tablas
 CREATE OR REPLACE FUNCTION trigger_set_timestamp()
@@ -204,5 +282,127 @@ CREATE TRIGGER set_timestamp BEFORE UPDATE ON "PersonajeEnCapitulo" FOR EACH ROW
 CREATE TRIGGER set_timestamp BEFORE UPDATE ON "Convocatoria" FOR EACH ROW EXECUTE PROCEDURE trigger_set_timestamp();
 CREATE TRIGGER set_timestamp BEFORE UPDATE ON "ConvocatoriaItem" FOR EACH ROW EXECUTE PROCEDURE trigger_set_timestamp();
 CREATE TRIGGER set_timestamp BEFORE UPDATE ON "JobConfig" FOR EACH ROW EXECUTE PROCEDURE trigger_set_timestamp();
+CREATE TRIGGER set_timestamp BEFORE UPDATE ON "JobRun" FOR EACH ROW EXECUTE PROCEDURE trigger_set_timestamp();
+
+-- Particiones mensuales de "Auditoria": crea las de `meses` meses a partir de `desde`
+-- (las existentes se respetan). El worker de tareas la llama a diario.
+CREATE OR REPLACE FUNCTION crear_particiones_auditoria(desde DATE, meses INT)
+RETURNS INT AS $$
+DECLARE
+  inicio DATE;
+  creadas INT := 0;
+  nombre TEXT;
+BEGIN
+  FOR n IN 0 .. meses - 1 LOOP
+    inicio := (date_trunc('month', desde) + make_interval(months => n))::date;
+    nombre := 'Auditoria_' || to_char(inicio, 'YYYY_MM');
+    IF to_regclass(format('%I', nombre)) IS NULL THEN
+      EXECUTE format(
+        'CREATE TABLE %I PARTITION OF "Auditoria" FOR VALUES FROM (%L) TO (%L)',
+        nombre, inicio, (inicio + interval '1 month')::date
+      );
+      creadas := creadas + 1;
+    END IF;
+  END LOOP;
+  RETURN creadas;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT crear_particiones_auditoria((NOW() - interval '1 month')::date, 4);
+
+-- Métricas §11. Vistas materializadas que refresca el worker (tarea `refrescar_metricas`,
+-- REFRESH ... CONCURRENTLY); cada una tiene un índice único para poder refrescarse sin
+-- bloquear lecturas. Las reaperturas se acumulan de forma incremental desde "Auditoria".
+
+-- % completado por sala y día
+CREATE MATERIALIZED VIEW "MetricaSalaDia" AS
+SELECT c.sala_id, c.fecha,
+       count(DISTINCT c.id) AS convocatorias,
+       count(DISTINCT c.id) FILTER (WHERE c.estado = 'reabierta') AS convocatorias_reabiertas,
+       count(i.id) AS intervenciones,
+       count(i.id) FILTER (WHERE i.estado = 'realizado') AS realizadas,
+       count(i.id) FILTER (WHERE i.estado = 'omitido') AS omitidas,
+       round(100.0 * count(i.id) FILTER (WHERE i.estado = 'realizado') / NULLIF(count(i.id), 0), 1) AS pct_completado
+FROM "Convocatoria" c
+JOIN "ConvocatoriaItem" ci ON ci.convocatoria_id = c.id
+JOIN "Intervencion" i ON i.take_id = ci.take_id
+GROUP BY c.sala_id, c.fecha;
+CREATE UNIQUE INDEX idx_metrica_sala_dia ON "MetricaSalaDia" (sala_id, fecha);
+
+-- Convocado vs ejecutado por proyecto (serie)
+CREATE MATERIALIZED VIEW "MetricaSerie" AS
+SELECT cap.serie_id,
+       count(i.id) AS intervenciones,
+       count(i.id) FILTER (WHERE ct.take_id IS NOT NULL) AS convocadas,
+       count(i.id) FILTER (WHERE i.estado = 'realizado') AS realizadas,
+       count(i.id) FILTER (WHERE i.estado = 'omitido') AS omitidas,
+       count(i.id) FILTER (WHERE i.needs_fx) AS con_fx
+FROM "Capitulo" cap
+JOIN "Take" t ON t.capitulo_id = cap.id
+JOIN "Intervencion" i ON i.take_id = t.id
+LEFT JOIN (SELECT DISTINCT take_id FROM "ConvocatoriaItem") ct ON ct.take_id = t.id
+GROUP BY cap.serie_id;
+CREATE UNIQUE INDEX idx_metrica_serie ON "MetricaSerie" (serie_id);
+
+-- Volumen y tipo de FX por proyecto/personaje
+CREATE MATERIALIZED VIEW "MetricaFxPersonaje" AS
+SELECT cap.serie_id, i.personaje_id, COALESCE(i.fx_source::text, 'sin_fuente') AS fx_source,
+       count(*) AS intervenciones_fx
+FROM "Intervencion" i
+JOIN "Take" t ON t.id = i.take_id
+JOIN "Capitulo" cap ON cap.id = t.capitulo_id
+WHERE i.needs_fx
+GROUP BY cap.serie_id, i.personaje_id, COALESCE(i.fx_source::text, 'sin_fuente');
+CREATE UNIQUE INDEX idx_metrica_fx_personaje ON "MetricaFxPersonaje" (serie_id, personaje_id, fx_source);
+
+-- Tiempo medio por take: dentro de cada convocatoria, lo que pasa entre que se
+-- cierra un take (todas sus intervenciones realizadas u omitidas) y el anterior.
+CREATE MATERIALIZED VIEW "MetricaTiempoTake" AS
+WITH por_take AS (
+    SELECT ci.convocatoria_id, cap.serie_id, ci.take_id,
+           min(i.realizado_at) AS inicio, max(i.realizado_at) AS fin
+    FROM "ConvocatoriaItem" ci
+    JOIN "Take" t ON t.id = ci.take_id
+    JOIN "Capitulo" cap ON cap.id = t.capitulo_id
+    JOIN "Intervencion" i ON i.take_id = ci.take_id
+    GROUP BY ci.convocatoria_id, cap.serie_id, ci.take_id
+    HAVING count(*) = count(i.realizado_at)
+), duraciones AS (
+    SELECT convocatoria_id, serie_id,
+           fin - COALESCE(lag(fin) OVER (PARTITION BY convocatoria_id ORDER BY fin), inicio) AS duracion
+    FROM por_take
+)
+SELECT d.serie_id, c.sala_id, c.fecha, count(*) AS takes,
+       round(avg(extract(epoch FROM d.duracion))::numeric, 1) AS segundos_medios
+FROM duraciones d
+JOIN "Convocatoria" c ON c.id = d.convocatoria_id
+GROUP BY d.serie_id, c.sala_id, c.fecha;
+CREATE UNIQUE INDEX idx_metrica_tiempo_take ON "MetricaTiempoTake" (serie_id, sala_id, fecha);
+
+-- Reaperturas (intervención devuelta a 'pendiente') por día y serie, a partir de
+-- "Auditoria". Cada pasada recalcula los días desde la anterior menos un margen
+-- (job_scheduler.METRICS_REAPERTURAS_MARGEN).
+CREATE TABLE "MetricaReaperturaDia" (
+    fecha DATE NOT NULL,
+    serie_id INT NOT NULL,
+    reaperturas INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (fecha, serie_id)
+);
+
+CREATE TABLE "MetricaRefresco" (
+    nombre TEXT PRIMARY KEY,
+    refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    segundos NUMERIC(10, 3)
+);
+
+-- Versión del esquema. db_handler.SCHEMA_VERSION debe coincidir: se comprueba al
+-- arrancar la API (db_handler.ensure_schema), que aplica las migraciones de
+-- migrations/ a una BD anterior en lugar de recrear el esquema. Cualquier cambio
+-- de este fichero va acompañado de su migración.
+CREATE TABLE "SchemaVersion" (
+    version INT PRIMARY KEY,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+INSERT INTO "SchemaVersion" (version) VALUES (1);
 
 -- FIN DEL SCRIPT
\ No newline at end of file
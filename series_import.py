@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+series_import.py
+
+Lectura del XLSX clásico de series (§16.1): hojas `series`, `actores`,
+`capitulos`, `takes` e `intervenciones`. El libro se abre en modo read_only y
+cada hoja se recorre fila a fila; las filas salen ya normalizadas como tuplas
+para volcarlas a la BD por lotes (ver DataHandler.import_series_xlsx).
+"""
+import openpyxl
+
+SHEETS = ('series', 'actores', 'capitulos', 'takes', 'intervenciones')
+
+# Columnas obligatorias por hoja. `capitulos` y `takes` son opcionales: los que
+# falten se crean a partir de `intervenciones`.
+REQUIRED_COLUMNS = {
+    'series': ('serie_ref', 'nombre', 'fps'),
+    'actores': ('nombre_actor',),
+    'capitulos': ('serie_ref', 'capitulo_numero'),
+    'takes': ('serie_ref', 'capitulo_numero', 'take_numero'),
+    'intervenciones': ('serie_ref', 'capitulo_numero', 'take_numero', 'personaje', 'nombre_actor', 'orden', 'dialogo'),
+}
+REQUIRED_SHEETS = ('series', 'intervenciones')
+
+
+class SeriesImportError(Exception):
+    """Error de validación del XLSX. `errores` detalla cada fallo (hoja y fila)."""
+
+    def __init__(self, mensaje, errores=None):
+        super().__init__(mensaje)
+        self.mensaje = mensaje
+        self.errores = errores or []
+
+
+def open_workbook(stream):
+    try:
+        return openpyxl.load_workbook(stream, read_only=True, data_only=True)
+    except Exception as e:
+        raise SeriesImportError("El fichero no es un XLSX válido.", [str(e)])
+
+
+def check_sheets(workbook):
+    """Valida que estén las hojas obligatorias. Retorna las hojas presentes, en orden de carga."""
+    presentes = {name.strip().lower(): name for name in workbook.sheetnames}
+    faltan = [s for s in REQUIRED_SHEETS if s not in presentes]
+    if faltan:
+        raise SeriesImportError("Faltan hojas obligatorias.", [f"Hoja '{s}' no encontrada." for s in faltan])
+    return [(s, presentes[s]) for s in SHEETS if s in presentes]
+
+
+def _text(value):
+    if value is None:
+        return None
+    text = str(value).strip()
+    return text or None
+
+
+def _int(value, sheet, linea, campo):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    try:
+        return int(str(value).strip())
+    except (TypeError, ValueError):
+        raise SeriesImportError(f"Hoja '{sheet}' fila {linea}: '{campo}' debe ser entero.")
+
+
+def _normalize(sheet, raw, linea):
+    faltan = [c for c in REQUIRED_COLUMNS[sheet] if raw.get(c) in (None, '') and c != 'dialogo']
+    if faltan:
+        raise SeriesImportError(f"Hoja '{sheet}' fila {linea}: faltan {', '.join(faltan)}.")
+
+    if sheet == 'series':
+        try:
+            fps = float(raw['fps'])
+        except (TypeError, ValueError):
+            raise SeriesImportError(f"Hoja 'series' fila {linea}: 'fps' debe ser numérico.")
+        return (_text(raw['serie_ref']), _text(raw['nombre']), fps)
+    if sheet == 'actores':
+        return (_text(raw['nombre_actor']),)
+    if sheet == 'capitulos':
+        return (linea, _text(raw['serie_ref']), _int(raw['capitulo_numero'], sheet, linea, 'capitulo_numero'),
+                _text(raw.get('titulo')))
+    if sheet == 'takes':
+        return (linea, _text(raw['serie_ref']), _int(raw['capitulo_numero'], sheet, linea, 'capitulo_numero'),
+                _int(raw['take_numero'], sheet, linea, 'take_numero'), _text(raw.get('descripcion')))
+    return (
+        linea,
+        _text(raw['serie_ref']),
+        _int(raw['capitulo_numero'], sheet, linea, 'capitulo_numero'),
+        _int(raw['take_numero'], sheet, linea, 'take_numero'),
+        _text(raw['personaje']),
+        _text(raw['nombre_actor']),
+        _int(raw['orden'], sheet, linea, 'orden'),
+        _text(raw.get('dialogo')),
+        # Los timecodes se validan al volcar, contra los fps de la serie.
+        _text(raw.get('tc_in')),
+        _text(raw.get('tc_out')),
+    )
+
+
+def iter_sheet(workbook, sheet, sheet_name, errores, max_errores):
+    """
+    Recorre una hoja fila a fila y produce tuplas normalizadas. Las filas
+    inválidas se anotan en `errores` (hasta `max_errores`) y se saltan.
+    """
+    rows = workbook[sheet_name].iter_rows(values_only=True)
+    header = next(rows, None)
+    if not header:
+        return
+    header = [str(h).strip().lower() if h is not None else '' for h in header]
+    faltan = [c for c in REQUIRED_COLUMNS[sheet] if c not in header]
+    if faltan:
+        errores.append(f"Hoja '{sheet}': faltan columnas {', '.join(faltan)}.")
+        return
+    # La fila 1 es la cabecera: numeramos desde 2 para coincidir con la hoja.
+    for linea, values in enumerate(rows, start=2):
+        if values is None or all(v in (None, '') for v in values):
+            continue
+        try:
+            yield _normalize(sheet, dict(zip(header, values)), linea)
+        except SeriesImportError as e:
+            if len(errores) < max_errores:
+                errores.append(e.mensaje)
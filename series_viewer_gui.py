@@ -26,6 +26,175 @@ except ImportError:
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+GUI_PAGE_SIZE = 200          # series por página (keyset) al hacer scroll
+SEARCH_DEBOUNCE_MS = 300     # espera tras la última tecla antes de buscar
+DB_THREADS = 2               # hilos del pool para las llamadas a DataHandler
+
+
+class _TaskSignals(QtCore.QObject):
+    """Señales de una tarea en segundo plano. Llegan al hilo de la UI como conexión en cola."""
+    finished = QtCore.Signal(object, object)   # (tarea, resultado)
+    failed = QtCore.Signal(object, str)        # (tarea, mensaje)
+    done = QtCore.Signal(object)               # siempre al terminar, también si se canceló
+
+
+class DbTask(QtCore.QRunnable):
+    """
+    Llamada a DataHandler en un hilo del pool. Si se cancela antes de empezar no
+    se ejecuta; si ya está en curso, la consulta termina pero quien la lanzó
+    descarta el resultado.
+    """
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+        self.signals = _TaskSignals()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        try:
+            if self.cancelled:
+                return
+            try:
+                result = self.fn(*self.args, **self.kwargs)
+            except Exception as e:
+                logging.exception("Error en tarea de base de datos:")
+                self.signals.failed.emit(self, str(e))
+                return
+            self.signals.finished.emit(self, result)
+        finally:
+            self.signals.done.emit(self)
+
+
+class SeriesTableModel(QtCore.QAbstractTableModel):
+    """
+    Series en un modelo de Qt con carga incremental: la vista pide más filas
+    (canFetchMore/fetchMore) al acercarse al final y el modelo trae la siguiente
+    página keyset de DataHandler.list_series en el pool de hilos. Una búsqueda o
+    recarga nueva cancela la carga anterior; sus resultados tardíos se ignoran.
+    """
+    COLUMNS = (('id', "ID"), ('numero_referencia', "Referencia"), ('nombre_serie', "Nombre Serie"))
+
+    loading_changed = QtCore.Signal(bool)
+    page_loaded = QtCore.Signal(int, object, bool)   # (filas cargadas, total o None, total exacto)
+    load_failed = QtCore.Signal(str)
+
+    def __init__(self, handler, thread_pool, parent=None):
+        super().__init__(parent)
+        self.handler = handler
+        self.thread_pool = thread_pool
+        self._rows = []              # tuplas de texto ya formateado: data() no calcula nada
+        self._search = ''
+        self._cursor = None
+        self._has_more = True
+        self._task = None            # carga en curso (como mucho una)
+        self._live_tasks = set()     # referencias hasta que terminan, aunque se hayan cancelado
+        self._total = (None, False)
+
+    # --- Interfaz de QAbstractTableModel ---
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def data(self, index, role=QtCore.Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.ItemDataRole.DisplayRole:
+            return self._rows[index.row()][index.column()]
+        if role == QtCore.Qt.ItemDataRole.TextAlignmentRole and index.column() == 0:
+            return QtCore.Qt.AlignmentFlag.AlignCenter
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.ItemDataRole.DisplayRole):
+        if role == QtCore.Qt.ItemDataRole.DisplayRole and orientation == QtCore.Qt.Orientation.Horizontal:
+            return self.COLUMNS[section][1]
+        return super().headerData(section, orientation, role)
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return not parent.isValid() and self._has_more and self._task is None
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if self.canFetchMore(parent):
+            self._load_page()
+
+    # --- Carga ---
+    def set_search(self, text):
+        """Vacía el modelo y empieza a cargar desde la primera página con el filtro `text`."""
+        self._search = text.strip()
+        self.reload()
+
+    def reload(self):
+        self.cancel()
+        self.beginResetModel()
+        self._rows = []
+        self._cursor = None
+        self._has_more = True
+        self._total = (None, False)
+        self.endResetModel()
+        self._load_page()
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self.loading_changed.emit(False)
+
+    def _load_page(self):
+        if self.handler is None:
+            return
+        filters = {'search': self._search} if self._search else None
+        task = DbTask(
+            self.handler.list_series, filters, cursor=self._cursor, limit=GUI_PAGE_SIZE,
+            con_total=self._cursor is None,   # el total solo hace falta en la primera página
+        )
+        task.signals.finished.connect(self._on_page)
+        task.signals.failed.connect(self._on_failed)
+        task.signals.done.connect(self._live_tasks.discard)
+        self._live_tasks.add(task)
+        self._task = task
+        self.loading_changed.emit(True)
+        self.thread_pool.start(task)
+
+    def _on_page(self, task, page):
+        if task is not self._task:
+            return   # carga cancelada o sustituida por otra más reciente
+        self._task = None
+        self.loading_changed.emit(False)
+        if page is None:
+            self._has_more = False
+            self.load_failed.emit("No se pudieron obtener datos de series.")
+            return
+        items = page['items']
+        if items:
+            first = len(self._rows)
+            self.beginInsertRows(QtCore.QModelIndex(), first, first + len(items) - 1)
+            self._rows.extend(
+                tuple(str(serie.get(key) if serie.get(key) is not None else '') for key, _ in self.COLUMNS)
+                for serie in items
+            )
+            self.endInsertRows()
+        self._cursor = page['next_cursor']
+        self._has_more = self._cursor is not None
+        if page.get('total') is not None:
+            self._total = (page['total'], page['total_exacto'])
+        self.page_loaded.emit(len(self._rows), self._total[0], self._total[1])
+
+    def _on_failed(self, task, message):
+        if task is not self._task:
+            return
+        self._task = None
+        self._has_more = False
+        self.loading_changed.emit(False)
+        self.load_failed.emit(message)
+
+
 class SeriesViewerWindow(QtWidgets.QMainWindow):
     """Ventana principal para visualizar y añadir series."""
 
@@ -43,8 +212,24 @@ class SeriesViewerWindow(QtWidgets.QMainWindow):
              self.show_error_message(f"Error al inicializar DataHandler:\n{e}")
              self.handler = None
 
+        # Las llamadas a la BD nunca corren en el hilo de la UI.
+        self.thread_pool = QtCore.QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(DB_THREADS)
+        self._save_task = None
+
+        self.model = SeriesTableModel(self.handler, self.thread_pool, self)
+        self.model.loading_changed.connect(self.on_loading_changed)
+        self.model.page_loaded.connect(self.on_page_loaded)
+        self.model.load_failed.connect(self.on_load_failed)
+
+        # Búsqueda con debounce: se lanza SEARCH_DEBOUNCE_MS después de la última tecla.
+        self.search_timer = QtCore.QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(SEARCH_DEBOUNCE_MS)
+        self.search_timer.timeout.connect(lambda: self.model.set_search(self.search_input.text()))
+
         self.setup_ui() # Llama a un método para configurar la UI
-        self.load_series_data() # Carga los datos al iniciar
+        self.load_series_data() # Carga la primera página al iniciar
 
     def setup_ui(self):
         """Configura los widgets y layouts de la interfaz gráfica."""
@@ -82,19 +267,28 @@ class SeriesViewerWindow(QtWidgets.QMainWindow):
         view_groupbox = QtWidgets.QGroupBox("Series Existentes")
         view_layout = QtWidgets.QVBoxLayout(view_groupbox)
 
+        toolbar_layout = QtWidgets.QHBoxLayout()
+        self.search_input = QtWidgets.QLineEdit()
+        self.search_input.setPlaceholderText("Buscar por nombre o referencia...")
+        self.search_input.setClearButtonEnabled(True)
+        self.search_input.textChanged.connect(self.search_timer.start)
+        toolbar_layout.addWidget(self.search_input)
+
         self.reload_button = QtWidgets.QPushButton("Recargar Lista")
         self.reload_button.setIcon(QtGui.QIcon.fromTheme("view-refresh", QtGui.QIcon("path/to/default/refresh/icon.png"))) # Icono opcional
         self.reload_button.clicked.connect(self.load_series_data)
-        # Añade un botón de recarga explícito
-        view_layout.addWidget(self.reload_button, 0, QtCore.Qt.AlignmentFlag.AlignRight) # Alinea a la derecha
-
-
-        self.table_widget = QtWidgets.QTableWidget()
-        self.table_widget.setColumnCount(3)
-        self.table_widget.setHorizontalHeaderLabels(["ID", "Referencia", "Nombre Serie"])
-        self.table_widget.horizontalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeMode.Stretch)
-        # Permitir resize interactivo de la última columna
-        self.table_widget.horizontalHeader().setSectionResizeMode(2, QtWidgets.QHeaderView.ResizeMode.Interactive)
+        toolbar_layout.addWidget(self.reload_button)
+        view_layout.addLayout(toolbar_layout)
+
+        self.table_widget = QtWidgets.QTableView()
+        self.table_widget.setModel(self.model)
+        header = self.table_widget.horizontalHeader()
+        header.setSectionResizeMode(0, QtWidgets.QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(1, QtWidgets.QHeaderView.ResizeMode.Interactive)
+        header.setSectionResizeMode(2, QtWidgets.QHeaderView.ResizeMode.Stretch)
+        # Alto de fila fijo: la vista no mide cada fila al insertar páginas.
+        self.table_widget.verticalHeader().setSectionResizeMode(QtWidgets.QHeaderView.ResizeMode.Fixed)
+        self.table_widget.verticalHeader().setVisible(False)
         self.table_widget.setEditTriggers(QtWidgets.QAbstractItemView.EditTrigger.NoEditTriggers)
         self.table_widget.setSelectionBehavior(QtWidgets.QAbstractItemView.SelectionBehavior.SelectRows)
         self.table_widget.setAlternatingRowColors(True) # Mejora visual
@@ -106,54 +300,29 @@ class SeriesViewerWindow(QtWidgets.QMainWindow):
         self.statusBar().showMessage("Listo.")
 
     def load_series_data(self):
-        """Obtiene los datos de las series usando DataHandler y los carga en la tabla."""
+        """Recarga la lista desde la primera página (en segundo plano)."""
         if not self.handler:
             self.show_error_message("DataHandler no está disponible.")
             return
-
-        self.statusBar().showMessage("Cargando datos de series...")
-        logging.info("Intentando cargar datos de series...")
-        self.table_widget.setRowCount(0) # Limpia la tabla antes de cargar
-
-        try:
-            series_data = self.handler.get_all_series()
-
-            if series_data is None:
-                 logging.warning("handler.get_all_series() retornó None.")
-                 self.show_error_message("No se pudieron obtener datos (resultado None).")
-                 self.statusBar().showMessage("Error al cargar datos.")
-                 return
-
-            logging.info(f"Datos recibidos: {len(series_data)} series.")
-            self.table_widget.setRowCount(len(series_data))
-
-            if not series_data:
-                 self.statusBar().showMessage("No se encontraron series en la base de datos.")
-                 return
-
-            for row_index, serie in enumerate(series_data):
-                id_item = QtWidgets.QTableWidgetItem(str(serie.get('id', '')))
-                # Hacer el ID no editable y centrado (ejemplo)
-                id_item.setFlags(id_item.flags() ^ QtCore.Qt.ItemFlag.ItemIsEditable)
-                id_item.setTextAlignment(QtCore.Qt.AlignmentFlag.AlignCenter)
-
-                ref_item = QtWidgets.QTableWidgetItem(str(serie.get('numero_referencia', '')))
-                nombre_item = QtWidgets.QTableWidgetItem(str(serie.get('nombre_serie', '')))
-
-                self.table_widget.setItem(row_index, 0, id_item)
-                self.table_widget.setItem(row_index, 1, ref_item)
-                self.table_widget.setItem(row_index, 2, nombre_item)
-
-            self.table_widget.resizeColumnsToContents() # Ajusta columnas después de insertar
-            self.table_widget.horizontalHeader().setSectionResizeMode(2, QtWidgets.QHeaderView.ResizeMode.Stretch) # Estira la última de nuevo
-
-            self.statusBar().showMessage(f"Se cargaron {len(series_data)} series.")
-            logging.info("Tabla actualizada con datos de series.")
-
-        except Exception as e:
-            logging.exception("Ocurrió un error al cargar los datos de series:")
-            self.show_error_message(f"Error al cargar datos desde la base de datos:\n{e}")
-            self.statusBar().showMessage("Error al cargar datos.")
+        self.search_timer.stop()
+        logging.info("Recargando datos de series...")
+        self.model.set_search(self.search_input.text())
+
+    def on_loading_changed(self, loading):
+        if loading:
+            self.statusBar().showMessage("Cargando datos de series...")
+
+    def on_page_loaded(self, loaded, total, exacto):
+        if not loaded:
+            self.statusBar().showMessage("No se encontraron series.")
+        elif total is None or loaded >= total:
+            self.statusBar().showMessage(f"Se cargaron {loaded} series.")
+        else:
+            self.statusBar().showMessage(f"Cargadas {loaded} de {'' if exacto else '~'}{total} series.")
+
+    def on_load_failed(self, message):
+        self.statusBar().showMessage("Error al cargar datos.")
+        self.show_error_message(f"Error al cargar datos desde la base de datos:\n{message}")
 
     def save_new_serie(self):
         """Guarda la nueva serie introducida en los campos de texto."""
@@ -170,35 +339,53 @@ class SeriesViewerWindow(QtWidgets.QMainWindow):
             self.show_error_message("El Número de Referencia y el Nombre de Serie no pueden estar vacíos.")
             return
 
+        if self._save_task is not None:
+            return
+
         logging.info(f"Intentando guardar nueva serie: Ref={ref}, Nombre={name}")
         self.statusBar().showMessage("Guardando nueva serie...")
-
-        try:
-            # Llama al método del DataHandler para añadir la serie
-            success = self.handler.add_serie(ref, name)
-
-            if success:
-                logging.info("Nueva serie guardada exitosamente.")
-                self.statusBar().showMessage("¡Nueva serie guardada con éxito!")
-                # Limpia los campos de entrada
-                self.ref_input.clear()
-                self.name_input.clear()
-                # Recarga la tabla para mostrar la nueva serie inmediatamente
-                self.load_series_data()
-                # Opcional: Mostrar un mensaje de éxito
-                QtWidgets.QMessageBox.information(self, "Éxito", "La nueva serie ha sido guardada.")
-            else:
-                # El error específico (ej. duplicado) ya se logueó en db_handler/data_handler
-                logging.warning("No se pudo guardar la nueva serie (posible duplicado o error).")
-                self.show_error_message("No se pudo guardar la nueva serie.\nEs posible que el Nº de Referencia o el Nombre ya existan.")
-                self.statusBar().showMessage("Error al guardar la serie.")
-
-        except Exception as e:
-            # Captura errores inesperados durante el proceso de guardado
-            logging.exception("Ocurrió un error al guardar la nueva serie:")
-            self.show_error_message(f"Error inesperado al guardar la serie:\n{e}")
-            self.statusBar().showMessage("Error inesperado al guardar.")
-
+        self.save_button.setEnabled(False)
+
+        # Llama al método del DataHandler para añadir la serie, fuera del hilo de la UI
+        task = DbTask(self.handler.add_serie, ref, name)
+        task.signals.finished.connect(self.on_serie_saved)
+        task.signals.failed.connect(self.on_save_failed)
+        self._save_task = task
+        self.thread_pool.start(task)
+
+    def on_serie_saved(self, task, success):
+        self._save_task = None
+        self.save_button.setEnabled(True)
+        if success:
+            logging.info("Nueva serie guardada exitosamente.")
+            self.statusBar().showMessage("¡Nueva serie guardada con éxito!")
+            # Limpia los campos de entrada
+            self.ref_input.clear()
+            self.name_input.clear()
+            # Recarga la tabla para mostrar la nueva serie inmediatamente
+            self.load_series_data()
+            # Opcional: Mostrar un mensaje de éxito
+            QtWidgets.QMessageBox.information(self, "Éxito", "La nueva serie ha sido guardada.")
+        else:
+            # El error específico (ej. duplicado) ya se logueó en db_handler/data_handler
+            logging.warning("No se pudo guardar la nueva serie (posible duplicado o error).")
+            self.show_error_message("No se pudo guardar la nueva serie.\nEs posible que el Nº de Referencia o el Nombre ya existan.")
+            self.statusBar().showMessage("Error al guardar la serie.")
+
+    def on_save_failed(self, task, message):
+        # Captura errores inesperados durante el proceso de guardado
+        self._save_task = None
+        self.save_button.setEnabled(True)
+        self.show_error_message(f"Error inesperado al guardar la serie:\n{message}")
+        self.statusBar().showMessage("Error inesperado al guardar.")
+
+    def closeEvent(self, event):
+        """Descarta las cargas pendientes y espera a las consultas en curso antes de cerrar."""
+        self.search_timer.stop()
+        self.model.cancel()
+        self.thread_pool.clear()
+        self.thread_pool.waitForDone(5000)
+        super().closeEvent(event)
 
     def show_error_message(self, message):
         """Muestra un diálogo de mensaje de error."""
@@ -0,0 +1,428 @@
+# -*- coding: utf-8 -*-
+"""
+sse_server.py
+
+Servidor de los streams SSE de cambios en intervenciones (`python sse_server.py`),
+aparte de los workers gthread de la API. Es un único proceso asyncio con una sola
+conexión LISTEN (fuera del pool) que reparte cada aviso entre todos sus clientes:
+un stream abierto es una corrutina y una cola en memoria, no un hilo, así que el
+número de visores lo limitan SSE_MAX_CLIENTS y los descriptores de fichero, no
+WEB_THREADS. La API redirige aquí sus rutas de stream cuando SSE_URL está definida.
+
+Atiende las mismas rutas que la API (/api/salas/<id>/convocatoria/stream?fecha=
+y /api/convocatorias/<id>/stream) con la misma cookie de sesión de Flask (firmada
+con FLASK_SECRET_KEY) y los mismos eventos: 'cambio', 'resync' y un comentario de
+heartbeat cada SSE_HEARTBEAT_SECONDS. Las consultas a la BD del arranque de cada
+stream (usuario y convocatorias) van al pool de hilos del bucle y terminan antes
+de empezar a emitir.
+
+SIGTERM: deja de aceptar conexiones y cierra los streams; los clientes reconectan
+solos (retry).
+"""
+import asyncio
+import http
+import http.cookies
+import json
+import logging
+import os
+import re
+import signal
+from urllib.parse import parse_qs, urlsplit
+
+import itsdangerous
+import psycopg2
+import psycopg2.extensions
+from flask import Flask
+
+import db_handler
+from cache import cache
+from change_feed import (CHANGE_FEED_CHANNEL, CHANGE_FEED_QUEUE_SIZE, CHANGE_FEED_RECONNECT_MAX, EVENT_CAMBIO,
+                         EVENT_CLOSE, EVENT_RESYNC, SSE_HEARTBEAT_SECONDS, SSE_RETRY_MS, SubscriberLimit,
+                         format_event, parse_cambio)
+from data_handler import DataHandler
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - [%(filename)s:%(lineno)d] - %(message)s')
+
+SSE_HOST = os.getenv("SSE_HOST", "0.0.0.0")
+SSE_PORT = int(os.getenv("SSE_PORT", "5001"))
+SSE_MAX_CLIENTS = int(os.getenv("SSE_MAX_CLIENTS", "5000"))          # 0 = sin límite
+SSE_REQUEST_TIMEOUT = float(os.getenv("SSE_REQUEST_TIMEOUT", "10"))  # segundos para recibir la cabecera HTTP
+SSE_SHUTDOWN_TIMEOUT = float(os.getenv("SSE_SHUTDOWN_TIMEOUT", "5"))
+# Orígenes del frontend a los que se permite abrir el stream con credenciales (CORS).
+SSE_CORS_ORIGINS = [o.strip() for o in os.getenv(
+    "SSE_CORS_ORIGINS", "http://localhost:3000,http://127.0.0.1:3000,http://localhost:5173").split(",") if o.strip()]
+STREAM_ROLES = ('admin', 'director', 'tecnico', 'supervisor')
+
+STREAM_SALA = re.compile(r"^/api/salas/(\d+)/convocatoria/stream$")
+STREAM_CONVOCATORIA = re.compile(r"^/api/convocatorias/(\d+)/stream$")
+
+# Solo para leer la cookie de sesión que firma la API (misma clave y mismo formato).
+_flask = Flask(__name__)
+_flask.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'un-secreto-muy-seguro-para-desarrollo')
+_session_serializer = _flask.session_interface.get_signing_serializer(_flask)
+_session_max_age = int(_flask.permanent_session_lifetime.total_seconds())
+
+handler_instance = DataHandler()
+
+
+class AsyncSubscription:
+    """Suscripción de un cliente; misma semántica que change_feed.Subscription, sobre asyncio.Queue."""
+
+    def __init__(self, convocatoria_ids, maxsize=CHANGE_FEED_QUEUE_SIZE):
+        self.convocatoria_ids = frozenset(convocatoria_ids)
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def _clear(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    def push(self, event, data):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait((event, data))
+        except asyncio.QueueFull:
+            # El cliente va atrasado: se vacía su cola y se le pide que recargue.
+            self.overflowed = True
+            self._clear()
+            self.queue.put_nowait((EVENT_RESYNC, None))
+
+    def close(self):
+        """Descarta lo pendiente y deja solo el aviso de cierre."""
+        self._clear()
+        self.queue.put_nowait((EVENT_CLOSE, None))
+
+    async def get(self, timeout):
+        """Retorna (evento, datos) o None si no llega nada en `timeout` segundos."""
+        try:
+            item = self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if item[0] == EVENT_RESYNC:
+            self.overflowed = False
+        return item
+
+
+class AsyncChangeFeed:
+    """
+    LISTEN único leído desde el bucle de eventos (loop.add_reader) y reparto a las
+    suscripciones. Todo corre en el hilo del bucle: no hace falta lock.
+    """
+
+    def __init__(self, connect=db_handler.get_db_connection, channel=CHANGE_FEED_CHANNEL,
+                 max_subscribers=SSE_MAX_CLIENTS):
+        self._connect = connect
+        self.channel = channel
+        self.max_subscribers = max_subscribers
+        self._subscribers = {}          # convocatoria_id -> set(AsyncSubscription)
+        self._active = set()
+        self._closing = False
+        self.listening = False
+        self.rejected = 0
+        self.notifications = 0
+        self.reconnects = 0
+
+    # --- Suscripciones ---
+    def subscribe(self, convocatoria_ids):
+        """Nueva suscripción. Lanza SubscriberLimit al llegar a max_subscribers o al cerrar el proceso."""
+        if self._closing or (self.max_subscribers and len(self._active) >= self.max_subscribers):
+            self.rejected += 1
+            raise SubscriberLimit(f"Máximo de {self.max_subscribers} streams alcanzado.")
+        subscription = AsyncSubscription(convocatoria_ids)
+        self._active.add(subscription)
+        for convocatoria_id in subscription.convocatoria_ids:
+            self._subscribers.setdefault(convocatoria_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Idempotente."""
+        if subscription not in self._active:
+            return
+        self._active.discard(subscription)
+        for convocatoria_id in subscription.convocatoria_ids:
+            subs = self._subscribers.get(convocatoria_id)
+            if subs is None:
+                continue
+            subs.discard(subscription)
+            if not subs:
+                del self._subscribers[convocatoria_id]
+
+    def dispatch(self, payload):
+        parsed = parse_cambio(payload, self.channel)
+        if parsed is None:
+            return
+        convocatoria_ids, diff = parsed
+        targets = set()
+        for convocatoria_id in convocatoria_ids:
+            targets.update(self._subscribers.get(convocatoria_id, ()))
+        for subscription in targets:
+            subscription.push(EVENT_CAMBIO, diff)
+
+    def resync_all(self):
+        """Tras una reconexión se pudieron perder avisos: todos recargan."""
+        for subscription in list(self._active):
+            subscription.push(EVENT_RESYNC, None)
+
+    def shutdown(self):
+        """Rechaza suscripciones nuevas y cierra las abiertas (los clientes reconectan)."""
+        self._closing = True
+        for subscription in list(self._active):
+            subscription.close()
+
+    # --- Listener ---
+    def _listen(self):
+        conn = self._connect()
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel};")
+        return conn
+
+    def _on_readable(self, conn, lost):
+        try:
+            conn.poll()
+        except psycopg2.Error as e:
+            if not lost.done():
+                lost.set_exception(e)
+            return
+        while conn.notifies:
+            notify = conn.notifies.pop(0)
+            self.notifications += 1
+            if notify.channel == self.channel:
+                self.dispatch(notify.payload)
+
+    async def run(self):
+        """Escucha hasta que se cancela la tarea; reconecta con backoff exponencial."""
+        loop = asyncio.get_running_loop()
+        backoff = 1.0
+        first = True
+        while True:
+            conn = None
+            try:
+                # La conexión (bloqueante) se abre fuera del bucle; después solo se lee cuando hay datos.
+                conn = await loop.run_in_executor(None, self._listen)
+                lost = loop.create_future()
+                loop.add_reader(conn.fileno(), self._on_readable, conn, lost)
+                try:
+                    self.listening = True
+                    logging.info(f"SSE escuchando en {self.channel}.")
+                    if not first:
+                        self.reconnects += 1
+                        self.resync_all()
+                    first = False
+                    backoff = 1.0
+                    await lost
+                finally:
+                    self.listening = False
+                    loop.remove_reader(conn.fileno())
+            except psycopg2.Error as e:
+                logging.warning(f"SSE: listener desconectado ({e}); reintento en {backoff:.0f}s.")
+                first = False
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, CHANGE_FEED_RECONNECT_MAX)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
+
+    def stats(self):
+        return {
+            'listening': self.listening,
+            'subscribers': len(self._active),
+            'max_subscribers': self.max_subscribers,
+            'rejected': self.rejected,
+            'convocatorias': len(self._subscribers),
+            'notifications': self.notifications,
+            'reconnects': self.reconnects,
+        }
+
+
+# --- HTTP ---
+class HttpError(Exception):
+    def __init__(self, status, mensaje, headers=None):
+        super().__init__(mensaje)
+        self.status, self.mensaje, self.headers = status, mensaje, headers or {}
+
+
+async def read_request(reader):
+    """Lee la cabecera HTTP. Retorna (método, ruta, query, cabeceras en minúsculas)."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode('latin-1').split("\r\n")
+    method, target, _version = lines[0].split(" ", 2)
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    url = urlsplit(target)
+    return method, url.path, parse_qs(url.query), headers
+
+
+def session_user_id(cookie_header):
+    """user_id de la cookie de sesión de Flask, o None si falta, está caducada o la firma no vale."""
+    cookies = http.cookies.SimpleCookie()
+    try:
+        cookies.load(cookie_header or '')
+    except http.cookies.CookieError:
+        return None
+    morsel = cookies.get(_flask.config['SESSION_COOKIE_NAME'])
+    if morsel is None:
+        return None
+    try:
+        data = _session_serializer.loads(morsel.value, max_age=_session_max_age)
+    except itsdangerous.BadData:
+        return None
+    return data.get('user_id')
+
+
+def cors_headers(headers):
+    origin = headers.get('origin')
+    if origin in SSE_CORS_ORIGINS:
+        return {'Access-Control-Allow-Origin': origin, 'Access-Control-Allow-Credentials': 'true', 'Vary': 'Origin'}
+    return {}
+
+
+def _head(status, headers):
+    lines = [f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+
+async def _send_json(writer, status, body, headers):
+    payload = json.dumps(body).encode()
+    writer.write(_head(status, {'Content-Type': 'application/json', 'Content-Length': str(len(payload)),
+                                'Connection': 'close', **headers}) + payload)
+    await writer.drain()
+
+
+class SseServer:
+    """Servidor HTTP mínimo (solo GET de streams y /health) sobre un AsyncChangeFeed."""
+
+    def __init__(self, feed, handler=handler_instance):
+        self.feed = feed
+        self.handler = handler
+
+    async def _resolve(self, method, path, query, headers):
+        """Autentica y retorna los ids de convocatoria del stream; HttpError si no procede."""
+        if method != 'GET':
+            raise HttpError(405, "Método no permitido.")
+        sala = STREAM_SALA.match(path)
+        convocatoria = STREAM_CONVOCATORIA.match(path)
+        if not (sala or convocatoria):
+            raise HttpError(404, "Recurso no encontrado.")
+
+        user_id = session_user_id(headers.get('cookie'))
+        if user_id is None:
+            raise HttpError(401, "Acceso no autorizado. Se requiere inicio de sesión.")
+        loop = asyncio.get_running_loop()
+        try:
+            user = await loop.run_in_executor(None, self.handler.get_usuario_sesion, user_id)
+        except Exception as e:
+            logging.error(f"Error comprobando la sesión del usuario {user_id}: {e}")
+            raise HttpError(503, "No se pudo comprobar la sesión.")
+        if not user or not user['activo']:
+            raise HttpError(401, "La sesión ya no es válida.")
+        if user['rol'] not in STREAM_ROLES:
+            raise HttpError(403, "Permiso denegado para este recurso.")
+
+        if convocatoria:
+            return [int(convocatoria.group(1))]
+        fecha = (query.get('fecha') or [None])[0]
+        if not fecha:
+            raise HttpError(400, "El parámetro 'fecha' es requerido.")
+        convocatoria_ids = await loop.run_in_executor(
+            None, self.handler.get_convocatoria_ids, int(sala.group(1)), fecha)
+        if convocatoria_ids is None:
+            raise HttpError(500, "Error al obtener la convocatoria.")
+        if not convocatoria_ids:
+            raise HttpError(404, "No hay convocatoria para esa sala y fecha.")
+        return convocatoria_ids
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                method, path, query, headers = await asyncio.wait_for(read_request(reader), SSE_REQUEST_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                return
+            cors = cors_headers(headers)
+            if method == 'GET' and path == '/health':
+                await _send_json(writer, 200, self.feed.stats(), cors)
+                return
+            try:
+                convocatoria_ids = await self._resolve(method, path, query, headers)
+                subscription = self.feed.subscribe(convocatoria_ids)
+            except HttpError as e:
+                await _send_json(writer, e.status, {"error": e.mensaje}, {**cors, **e.headers})
+                return
+            except SubscriberLimit:
+                await _send_json(writer, 503, {"error": "Demasiados streams abiertos en este servidor."},
+                                 {**cors, 'Retry-After': str(max(SSE_RETRY_MS // 1000, 1))})
+                return
+            try:
+                await self._stream(reader, writer, subscription, cors)
+            finally:
+                self.feed.unsubscribe(subscription)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _stream(self, reader, writer, subscription, cors):
+        writer.write(_head(200, {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no', 'Connection': 'close', **cors}))
+        writer.write(f"retry: {SSE_RETRY_MS}\n\n".encode())
+        await writer.drain()
+        # El cliente no envía nada más: cualquier lectura que vuelva (EOF) es que se ha ido.
+        gone = asyncio.ensure_future(reader.read(1))
+        gone.add_done_callback(lambda _: subscription.close())
+        try:
+            while True:
+                item = await subscription.get(timeout=SSE_HEARTBEAT_SECONDS)
+                if item is None:
+                    writer.write(b": ping\n\n")
+                elif item[0] == EVENT_CLOSE:
+                    return
+                else:
+                    writer.write(format_event(*item).encode())
+                # Un cliente que no lee bloquea aquí; su cola se llena y recibirá un 'resync'.
+                await asyncio.wait_for(writer.drain(), SSE_HEARTBEAT_SECONDS * 2)
+        except asyncio.TimeoutError:
+            logging.info("SSE: cliente sin leer; se cierra el stream.")
+        finally:
+            gone.cancel()
+
+
+async def serve(host=SSE_HOST, port=SSE_PORT):
+    # Solo lee usuarios, nunca invalida: con la caché en memoria no recibiría las
+    # invalidaciones de la API (rol, desactivación), así que se consulta la BD.
+    cache.set_synced(False)
+    feed = AsyncChangeFeed()
+    server = SseServer(feed)
+    listener = asyncio.ensure_future(feed.run())
+    tcp = await asyncio.start_server(server.handle, host, port)
+    logging.info(f"SSE sirviendo en {host}:{port} (máx. {SSE_MAX_CLIENTS} streams).")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    await stop.wait()
+
+    logging.info("SSE: cerrando streams.")
+    tcp.close()
+    feed.shutdown()
+    listener.cancel()
+    try:
+        await asyncio.wait_for(tcp.wait_closed(), SSE_SHUTDOWN_TIMEOUT)
+    except asyncio.TimeoutError:
+        pass
+
+
+def main():
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Dobles compartidos: una transacción falsa en lugar de db_handler.Transaction."""
+import contextlib
+
+import pytest
+
+import db_handler
+
+
+def _normalizar(sql):
+    return ' '.join(sql.split())
+
+
+class FakeTx:
+    """
+    Transacción que registra lo que se ejecuta y responde con
+    `respuestas(sql, params)` (por defecto None). Las sentencias preparadas
+    reciben el SQL de la Statement y se enlazan con `bind`, como en la BD.
+    """
+
+    def __init__(self, respuestas=None):
+        self.respuestas = respuestas or (lambda sql, params: None)
+        self.ejecutado = []     # execute: (sql normalizado, params, fetch_mode)
+        self.preparadas = []    # execute_prepared: (Statement, parámetros enlazados)
+        self.values = []        # execute_values: (sql normalizado, filas)
+        self.confirmada = False
+        self.deshecha = False
+
+    def execute(self, query, params=None, fetch_mode="all"):
+        self.ejecutado.append((_normalizar(query), params, fetch_mode))
+        return self.respuestas(query, params)
+
+    def execute_prepared(self, statement, params=None, fetch_mode="all"):
+        self.preparadas.append((statement, statement.bind(params)))
+        return self.respuestas(statement.sql, params)
+
+    def execute_values(self, query, argslist, template=None, page_size=1000, fetch=False):
+        argslist = list(argslist)
+        self.values.append((_normalizar(query), argslist))
+        respuesta = self.respuestas(query, argslist)
+        return respuesta if fetch else None
+
+
+@pytest.fixture
+def crear_tx():
+    """Fábrica de FakeTx para pasarlas como `tx=` a DataHandler."""
+    return FakeTx
+
+
+@pytest.fixture
+def fake_tx(monkeypatch):
+    """db_handler.transaction() entrega siempre esta FakeTx y anota COMMIT o ROLLBACK."""
+    tx = FakeTx()
+
+    @contextlib.contextmanager
+    def transaction(readonly=False):
+        try:
+            yield tx
+        except Exception:
+            tx.deshecha = True
+            raise
+        tx.confirmada = True
+    monkeypatch.setattr(db_handler, 'transaction', transaction)
+    return tx
+
+
+@pytest.fixture
+def cliente(monkeypatch):
+    """Cliente de la API con sesión de un usuario admin activo (sin consultar la BD)."""
+    import api_app
+    monkeypatch.setattr(api_app.handler_instance, 'get_usuario_sesion',
+                        lambda user_id: {'id': user_id, 'activo': True, 'rol': 'admin'})
+    api_app.app.config['TESTING'] = True
+    client = api_app.app.test_client()
+    with client.session_transaction() as sesion:
+        sesion['user_id'] = 5
+    return client
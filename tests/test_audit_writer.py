@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""Escritor de auditoría por lotes: volcado por tamaño y por tiempo, cola llena y cierre ordenado."""
+import datetime
+import threading
+import time
+
+import pytest
+
+import audit_writer
+import db_handler
+from audit_writer import AuditWriter
+
+
+class Destino:
+    """write_batch falso: guarda los lotes y puede fallar las primeras `fallos` veces."""
+
+    def __init__(self, fallos=0):
+        self.lotes = []
+        self.fallos = fallos
+        self.escrito = threading.Event()
+
+    def __call__(self, rows):
+        if self.fallos:
+            self.fallos -= 1
+            raise RuntimeError('BD caída')
+        self.lotes.append(list(rows))
+        self.escrito.set()
+
+
+def _evento(n):
+    return ('Intervencion', n, 5, 'UPDATE_ESTADO', {'n': n}, datetime.datetime(2025, 5, 7))
+
+
+def _esperar(condicion, timeout=5.0):
+    limite = time.monotonic() + timeout
+    while not condicion():
+        assert time.monotonic() < limite, 'timeout esperando al hilo de volcado'
+        time.sleep(0.005)
+
+
+def test_volcado_al_completar_el_lote():
+    destino = Destino()
+    writer = AuditWriter(destino, batch_size=3, flush_interval=60)
+    try:
+        for n in range(7):
+            assert writer.enqueue(_evento(n))
+        # Con flush_interval de 60 s solo los lotes completos salen antes del cierre.
+        _esperar(lambda: len(destino.lotes) == 2)
+        assert [len(lote) for lote in destino.lotes] == [3, 3]
+        assert writer.stats()['written'] == 6
+    finally:
+        writer.close()
+    assert [len(lote) for lote in destino.lotes] == [3, 3, 1]
+
+
+def test_volcado_por_tiempo():
+    destino = Destino()
+    writer = AuditWriter(destino, batch_size=100, flush_interval=0.05)
+    try:
+        inicio = time.monotonic()
+        writer.enqueue(_evento(1))
+        writer.enqueue(_evento(2))
+        assert destino.escrito.wait(5)
+        assert time.monotonic() - inicio >= 0.05
+        assert destino.lotes == [[_evento(1), _evento(2)]]
+        assert writer.stats()['batches'] == 1 and writer.stats()['written'] == 2
+    finally:
+        writer.close()
+
+
+def test_fallo_de_bd_reintenta_sin_perder_el_lote(monkeypatch):
+    monkeypatch.setattr(audit_writer, 'AUDIT_RETRY_MAX', 0.05)
+    destino = Destino(fallos=2)
+    writer = AuditWriter(destino, batch_size=2, flush_interval=0.01)
+    try:
+        writer.enqueue(_evento(1))
+        writer.enqueue(_evento(2))
+        assert destino.escrito.wait(5)
+        assert destino.lotes == [[_evento(1), _evento(2)]] and writer.stats()['failed_batches'] == 2
+    finally:
+        writer.close()
+
+
+def test_cola_llena_rechaza():
+    destino = Destino()
+    writer = AuditWriter(destino, maxsize=2, batch_size=100, flush_interval=60)
+    writer._ensure_started = lambda: None       # sin hilo: la cola no se vacía
+    assert writer.enqueue(_evento(1)) and writer.enqueue(_evento(2))
+    assert not writer.enqueue(_evento(3))
+    assert writer.stats()['rejected'] == 1 and writer.stats()['pending'] == 2
+
+
+def test_audit_log_escribe_en_sincrono_con_la_cola_llena(monkeypatch):
+    sincronos = []
+    writer = AuditWriter(Destino(), maxsize=1, flush_interval=60)
+    writer._ensure_started = lambda: None
+    monkeypatch.setattr(db_handler, '_audit_writer', writer)
+    monkeypatch.setattr(db_handler, '_write_audit_batch', sincronos.append)
+
+    db_handler.audit_log('Intervencion', 1, 5, 'UPDATE_ESTADO', {'estado': 'realizado'})
+    assert sincronos == [] and writer.stats()['pending'] == 1
+    db_handler.audit_log('Intervencion', 2, 5, 'UPDATE_ESTADO', {'estado': 'omitido'})
+    (fila,), = sincronos
+    assert fila[:5] == ('Intervencion', 2, 5, 'UPDATE_ESTADO', {'estado': 'omitido'})
+    assert fila[5].tzinfo is not None       # la hora es la del evento, no la del volcado
+
+
+def test_cierre_vuelca_cola_y_lote_a_medias():
+    destino = Destino()
+    writer = AuditWriter(destino, batch_size=10, flush_interval=60)
+    for n in range(4):
+        writer.enqueue(_evento(n))
+    # El hilo ya tiene eventos en su lote sin escribir (esperando a completar o al plazo).
+    _esperar(lambda: writer._queue.qsize() == 0)
+    writer.close()
+    assert [e for lote in destino.lotes for e in lote] == [_evento(n) for n in range(4)]
+    assert writer.stats()['pending'] == 0
+    assert not writer.enqueue(_evento(5))       # cerrado: quien llama escribe en síncrono
+    writer.close()                               # idempotente
+
+
+def test_cierre_reintenta_si_la_bd_falla():
+    destino = Destino(fallos=2)
+    writer = AuditWriter(destino, batch_size=10, flush_interval=0.01)
+    writer._ensure_started = lambda: None
+    writer.enqueue(_evento(1))
+    writer.close(timeout=5)
+    assert destino.lotes == [[_evento(1)]] and writer.stats()['pending'] == 0
+
+
+def test_cierre_con_bd_caida_no_descarta_lo_pendiente(caplog):
+    destino = Destino(fallos=1000)
+    writer = AuditWriter(destino, batch_size=10, flush_interval=0.01)
+    writer._ensure_started = lambda: None
+    writer.enqueue(_evento(1))
+    inicio = time.monotonic()
+    writer.close(timeout=0.1)
+    assert time.monotonic() - inicio < 1        # el apagado no se bloquea más allá del timeout
+    assert destino.lotes == [] and writer.stats()['pending'] == 1
+    assert 'sin escribir al cerrar' in caplog.text
+    # Lo pendiente sigue en memoria: un flush explícito todavía puede escribirlo.
+    destino.fallos = 0
+    assert writer.flush() == 1 and destino.lotes == [[_evento(1)]]
+
+
+@pytest.mark.parametrize('batch_size', [1, 3])
+def test_flush_explicito(batch_size):
+    destino = Destino()
+    writer = AuditWriter(destino, batch_size=batch_size, flush_interval=60)
+    writer._ensure_started = lambda: None
+    for n in range(3):
+        writer.enqueue(_evento(n))
+    assert writer.flush() == 3
+    assert len(destino.lotes) == 3 // batch_size and writer.stats()['pending'] == 0
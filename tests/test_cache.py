@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Caché read-through en memoria: TTL, LRU, generaciones e invalidación entre procesos."""
+import json
+
+import pytest
+
+import cache as cache_module
+import change_feed
+from cache import Cache, MemoryBackend
+
+
+class Reloj:
+    def __init__(self):
+        self.ahora = 1000.0
+
+    def __call__(self):
+        return self.ahora
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    reloj = Reloj()
+    monkeypatch.setattr(cache_module.time, 'monotonic', reloj)
+    return reloj
+
+
+def _loader(valores):
+    llamadas = []
+
+    def load():
+        llamadas.append(1)
+        return valores.pop(0)
+    return load, llamadas
+
+
+def test_read_through():
+    cache = Cache(MemoryBackend())
+    load, llamadas = _loader(['a', 'b'])
+    assert cache.get_or_load('reparto', 1, load) == 'a'
+    assert cache.get_or_load('reparto', 1, load) == 'a'
+    assert len(llamadas) == 1
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_ratio']) == (1, 1, 0.5)
+    assert stats['namespaces'] == {'reparto': {'hits': 1, 'misses': 1}}
+
+
+def test_no_cachea_none():
+    cache = Cache(MemoryBackend())
+    load, llamadas = _loader([None, 'x'])
+    assert cache.get_or_load('reparto', 1, load) is None
+    assert cache.get_or_load('reparto', 1, load) == 'x'
+    assert len(llamadas) == 2
+
+
+def test_ttl(reloj):
+    cache = Cache(MemoryBackend(), default_ttl=10)
+    load, _ = _loader(['a', 'b', 'c'])
+    cache.get_or_load('capitulo', 1, load)
+    reloj.ahora += 9
+    assert cache.get_or_load('capitulo', 1, load) == 'a'
+    reloj.ahora += 2
+    assert cache.get_or_load('capitulo', 1, load) == 'b'
+    assert cache.get_or_load('capitulo', 2, load, ttl=1) == 'c'
+    reloj.ahora += 1.5
+    assert cache.backend.get(cache._key('capitulo', 2)) == (False, None)
+
+
+def test_lru():
+    backend = MemoryBackend(max_entries=2)
+    backend.set('a', 1, 60)
+    backend.set('b', 2, 60)
+    assert backend.get('a') == (True, 1)     # 'a' pasa a ser la más reciente
+    backend.set('c', 3, 60)
+    assert backend.get('b') == (False, None)
+    assert backend.get('a') == (True, 1) and backend.get('c') == (True, 3)
+    assert backend.evictions == 1 and backend.size() == 2
+
+
+def test_invalidar_clave_y_espacio():
+    cache = Cache(MemoryBackend())
+    load, _ = _loader(['a1', 'a2', 'b1', 'a3', 'b2'])
+    cache.get_or_load('reparto', 'a', load)
+    cache.invalidate('reparto', 'a')
+    assert cache.get_or_load('reparto', 'a', load) == 'a2'
+    cache.get_or_load('reparto', 'b', load)
+    cache.invalidate('reparto')
+    assert cache.backend.generation('reparto') == 1
+    assert cache.get_or_load('reparto', 'a', load) == 'a3'
+    assert cache.get_or_load('reparto', 'b', load) == 'b2'
+
+
+def test_invalidar_publica_a_otros_procesos():
+    cache = Cache(MemoryBackend())
+    avisos = []
+    cache.set_publisher(lambda namespace, key: avisos.append((namespace, key)))
+    cache.invalidate('reparto', 3)
+    cache.invalidate('capitulo')
+    assert avisos == [('reparto', 3), ('capitulo', None)] and cache.published == 2
+
+
+def test_publicador_que_falla_no_rompe_la_invalidacion():
+    cache = Cache(MemoryBackend())
+    cache.backend.set(cache._key('reparto', 1), 'viejo', 60)
+
+    def falla(namespace, key):
+        raise RuntimeError('sin BD')
+    cache.set_publisher(falla)
+    cache.invalidate('reparto', 1)
+    assert cache.backend.get(cache._key('reparto', 1)) == (False, None) and cache.published == 0
+
+
+def test_apply_remote_no_reenvia():
+    cache = Cache(MemoryBackend())
+    avisos = []
+    cache.set_publisher(lambda namespace, key: avisos.append((namespace, key)))
+    load, _ = _loader(['a', 'b'])
+    cache.get_or_load('reparto', 1, load)
+    cache.apply_remote('reparto', 1)
+    assert cache.get_or_load('reparto', 1, load) == 'b'
+    assert avisos == [] and cache.remote_invalidations == 1
+
+
+def test_sin_sincronizar_se_salta_la_cache():
+    cache = Cache(MemoryBackend())
+    load, llamadas = _loader(['a', 'b', 'c', 'd'])
+    cache.get_or_load('reparto', 1, load)
+    cache.set_synced(False)
+    assert cache.get_or_load('reparto', 1, load) == 'b'
+    assert cache.get_or_load('reparto', 1, load) == 'c'
+    # Al reconectar se vacía la copia local: 'a' pudo quedar obsoleto mientras tanto.
+    cache.set_synced(True)
+    assert cache.backend.size() == 0
+    assert cache.get_or_load('reparto', 1, load) == 'd'
+    assert len(llamadas) == 4
+
+
+def test_aviso_remoto_por_notify(monkeypatch):
+    cache = Cache(MemoryBackend())
+    cache.backend.set(cache._key('reparto', 5), 'viejo', 60)
+    monkeypatch.setattr(change_feed, '_origin', lambda: 'host:1')
+
+    # Aviso propio (ya aplicado al invalidar) y aviso malformado: se ignoran.
+    change_feed._apply_cache_invalidation(cache, json.dumps({'origen': 'host:1', 'namespace': 'reparto', 'key': 5}))
+    change_feed._apply_cache_invalidation(cache, '{no es json')
+    assert cache.backend.get(cache._key('reparto', 5)) == (True, 'viejo')
+
+    change_feed._apply_cache_invalidation(cache, json.dumps({'origen': 'host:2', 'namespace': 'reparto', 'key': 5}))
+    assert cache.backend.get(cache._key('reparto', 5)) == (False, None)
+    assert cache.remote_invalidations == 1
+
+
+def test_publish_cache_invalidation(monkeypatch):
+    enviados = []
+    monkeypatch.setattr(change_feed.db_handler, 'execute_query',
+                        lambda sql, params, fetch_mode: enviados.append((sql, params)))
+    change_feed.publish_cache_invalidation('capitulo', None)
+    (sql, (canal, payload)), = enviados
+    assert canal == change_feed.CACHE_CHANNEL
+    assert json.loads(payload) == {'origen': change_feed._origin(), 'namespace': 'capitulo', 'key': None}
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Reparto de cambios en vivo: límite de suscriptores por proceso y colas por cliente."""
+import json
+
+import pytest
+
+import api_app
+import change_feed
+from change_feed import EVENT_CAMBIO, EVENT_CLOSE, EVENT_RESYNC, ChangeFeed, SubscriberLimit, Subscription
+
+
+@pytest.fixture
+def feed(monkeypatch):
+    feed = ChangeFeed(connect=None, max_subscribers=2)
+    monkeypatch.setattr(feed, '_ensure_started', lambda: None)     # sin listener (sin BD)
+    return feed
+
+
+def test_limite_de_suscriptores(feed):
+    a = feed.subscribe([1])
+    feed.subscribe([1, 2])
+    with pytest.raises(SubscriberLimit):
+        feed.subscribe([3])
+    feed.unsubscribe(a)
+    feed.unsubscribe(a)     # idempotente: lo llaman el generador y el cierre de la respuesta
+    feed.subscribe([3])
+    stats = feed.stats()
+    assert (stats['subscribers'], stats['max_subscribers'], stats['rejected'], stats['convocatorias']) == (2, 2, 1, 3)
+
+
+def test_sin_limite(monkeypatch):
+    feed = ChangeFeed(connect=None, max_subscribers=0)
+    monkeypatch.setattr(feed, '_ensure_started', lambda: None)
+    for _ in range(10):
+        feed.subscribe([1])
+    assert feed.stats()['subscribers'] == 10
+
+
+def test_reparto_por_convocatoria(feed):
+    a, b = feed.subscribe([1]), feed.subscribe([2])
+    feed._dispatch(json.dumps({'intervencion_id': 9, 'estado': 'realizado', 'needs_fx': False,
+                               'version': 4, 'convocatorias': [1], 'otro': 'x'}))
+    feed._dispatch('{malformado')
+    assert a.get(0) == (EVENT_CAMBIO, {'intervencion_id': 9, 'estado': 'realizado', 'needs_fx': False, 'version': 4})
+    assert a.get(0) is None and b.get(0) is None
+
+
+def test_cola_llena_pide_resync():
+    subscription = Subscription([1], maxsize=2)
+    for n in range(5):
+        subscription.push(EVENT_CAMBIO, n)
+    assert subscription.get(0) == (EVENT_RESYNC, None)
+    assert subscription.get(0) is None
+    subscription.push(EVENT_CAMBIO, 6)
+    assert subscription.get(0) == (EVENT_CAMBIO, 6)
+
+
+def test_shutdown_cierra_los_streams(feed):
+    a = feed.subscribe([1])
+    a.push(EVENT_CAMBIO, 1)
+    feed.shutdown()
+    assert a.get(0) == (EVENT_CLOSE, None)
+
+
+def test_sse_503_al_llegar_al_limite(feed, monkeypatch):
+    monkeypatch.setattr(api_app, 'change_feed', feed)
+    monkeypatch.setattr(api_app.lifecycle, 'is_draining', lambda: False)
+    with api_app.app.test_request_context():
+        abiertas = [api_app.change_stream_response([1]) for _ in range(2)]
+        rechazada = api_app.change_stream_response([1])
+        assert [r.status_code for r in abiertas] == [200, 200]
+        assert rechazada.status_code == 503 and int(rechazada.headers['Retry-After']) >= 1
+        # Al cerrarse la respuesta (cliente que se va sin leer) se libera el hueco.
+        abiertas[0].close()
+        assert api_app.change_stream_response([1]).status_code == 200
+    assert feed.stats()['rejected'] == 1
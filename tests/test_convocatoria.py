@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""ETag de la convocatoria por vista: la huella cubre todas las tablas que aparecen en la respuesta."""
+import datetime
+import re
+
+import pytest
+
+import api_app
+import db_handler
+from data_handler import DataHandler
+
+TABLAS_PLANA = {'Convocatoria', 'ConvocatoriaItem', 'Intervencion'}
+TABLAS_ARBOL = TABLAS_PLANA | {'Take', 'Capitulo', 'Serie', 'Personaje', 'Actor'}
+
+
+def _tablas_de_la_huella(sql):
+    """Tablas cuyo updated_at entra en el GREATEST(...) de la huella."""
+    alias = {a: tabla for tabla, a in re.findall(r'(?:FROM|JOIN) "(\w+)" (\w+)', sql)}
+    greatest = re.search(r'GREATEST\(([^)]*)\)', sql).group(1)
+    return {alias[a] for a in re.findall(r'(\w+)\.updated_at', greatest)}
+
+
+class BD:
+    """updated_at de cada tabla; la huella devuelve el máximo de las que consulta la sentencia."""
+
+    def __init__(self):
+        inicio = datetime.datetime(2025, 5, 7, 8, tzinfo=datetime.timezone.utc)
+        self.updated_at = dict.fromkeys(TABLAS_ARBOL, inicio)
+        self.consultadas = []
+
+    def tocar(self, tabla):
+        # Lo que hace el trigger set_timestamp en cualquier UPDATE.
+        self.updated_at[tabla] = max(self.updated_at.values()) + datetime.timedelta(seconds=1)
+
+    def execute_prepared(self, statement, params=None, fetch_mode="all", readonly=False):
+        self.consultadas.append(statement.name)
+        tablas = _tablas_de_la_huella(statement.sql)
+        return (3, 12, 12, max(self.updated_at[t] for t in tablas))
+
+
+@pytest.fixture
+def bd(monkeypatch):
+    bd = BD()
+    monkeypatch.setattr(db_handler, 'execute_prepared', bd.execute_prepared)
+    return bd
+
+
+def test_huellas_cubren_las_tablas_de_cada_vista():
+    from data_handler import CONVOCATORIA_ARBOL_ETAG, CONVOCATORIA_ETAG
+    assert _tablas_de_la_huella(CONVOCATORIA_ETAG.sql) == TABLAS_PLANA
+    assert _tablas_de_la_huella(CONVOCATORIA_ARBOL_ETAG.sql) == TABLAS_ARBOL
+
+
+def test_etag_arbol_cambia_tras_un_cambio_de_reparto(bd):
+    handler = DataHandler()
+    plana = handler.get_convocatoria_etag(1, '2025-05-07')
+    arbol = handler.get_convocatoria_etag(1, '2025-05-07', 'arbol')
+    assert plana != arbol
+    assert bd.consultadas == ['convocatoria_etag', 'convocatoria_arbol_etag']
+
+    bd.tocar('Personaje')    # assign_reparto: UPDATE "Personaje" SET actor_id = ...
+    assert handler.get_convocatoria_etag(1, '2025-05-07', 'arbol') != arbol
+    assert handler.get_convocatoria_etag(1, '2025-05-07') == plana
+
+    for tabla in ('Actor', 'Serie', 'Take', 'Capitulo'):
+        arbol = handler.get_convocatoria_etag(1, '2025-05-07', 'arbol')
+        bd.tocar(tabla)
+        assert handler.get_convocatoria_etag(1, '2025-05-07', 'arbol') != arbol, tabla
+
+
+def test_tablet_no_recibe_304_tras_el_reparto(bd, cliente, monkeypatch):
+    monkeypatch.setattr(api_app.handler_instance, 'get_convocatoria_arbol_json', lambda sala_id, fecha: '[]')
+    url = '/api/salas/1/convocatoria?fecha=2025-05-07&vista=arbol'
+    etag = cliente.get(url).headers['ETag']
+    assert cliente.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+    bd.tocar('Personaje')
+    response = cliente.get(url, headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""Pool de conexiones: timeout de checkout, aperturas en curso, health check, reciclado y cierre (sin BD)."""
+import threading
+import time
+import types
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+import db_pool
+from db_pool import ConnectionPool, PoolTimeout
+
+
+class Conexion:
+    """Conexión falsa: registra las sentencias y puede fallar el SELECT 1 del health check."""
+
+    def __init__(self, n):
+        self.n = n
+        self.closed = 0
+        self.rota = False
+        self.estado = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        self.sentencias = []
+        self.rollbacks = 0
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql):
+                if conn.rota:
+                    raise psycopg2.OperationalError('server closed the connection unexpectedly')
+                conn.sentencias.append(sql)
+        return Cursor()
+
+    def get_transaction_status(self):
+        return self.estado
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.estado = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class Conectar:
+    """Callable `connect` del pool: numera las conexiones que abre."""
+
+    def __init__(self):
+        self.abiertas = []
+
+    def __call__(self):
+        self.abiertas.append(Conexion(len(self.abiertas) + 1))
+        return self.abiertas[-1]
+
+
+@pytest.fixture
+def conectar():
+    return Conectar()
+
+
+@pytest.fixture
+def reloj(monkeypatch):
+    """Sustituye time.monotonic del pool por un reloj que avanza a mano."""
+    reloj = types.SimpleNamespace(ahora=1000.0)
+    monkeypatch.setattr(db_pool, 'time', types.SimpleNamespace(monotonic=lambda: reloj.ahora))
+    return reloj
+
+
+def test_tamanos_invalidos(conectar):
+    with pytest.raises(ValueError):
+        ConnectionPool(conectar, minconn=3, maxconn=2)
+
+
+def test_minconn_se_abre_al_crear(conectar):
+    pool = ConnectionPool(conectar, minconn=2, maxconn=4)
+    assert len(conectar.abiertas) == 2
+    assert pool.stats()['idle'] == 2 and pool.stats()['created'] == 2
+
+
+def test_timeout_de_checkout(conectar):
+    pool = ConnectionPool(conectar, minconn=0, maxconn=1, timeout=0.05)
+    conn = pool.getconn()
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    pool.putconn(conn)
+    assert pool.getconn() is conn           # la ociosa se reutiliza, no se abre otra
+    stats = pool.stats()
+    assert (stats['timeouts'], stats['checkouts'], stats['created'], stats['waiting']) == (1, 2, 1, 0)
+
+
+def test_devolver_libera_a_quien_espera(conectar):
+    pool = ConnectionPool(conectar, minconn=0, maxconn=1, timeout=5)
+    conn = pool.getconn()
+    obtenida = []
+    hilo = threading.Thread(target=lambda: obtenida.append(pool.getconn()))
+    hilo.start()
+    while pool.stats()['waiting'] == 0:
+        time.sleep(0.001)
+    pool.putconn(conn)
+    hilo.join(5)
+    assert obtenida == [conn]
+
+
+def test_aperturas_en_curso_cuentan_para_el_maximo(conectar):
+    """Mientras una conexión se abre (fuera del lock) ocupa su hueco: no se abren más de maxconn."""
+    abriendo, seguir = threading.Event(), threading.Event()
+
+    def conectar_lento():
+        abriendo.set()
+        seguir.wait(5)
+        return conectar()
+
+    pool = ConnectionPool(conectar_lento, minconn=0, maxconn=1, timeout=0.05)
+    obtenida = []
+    hilo = threading.Thread(target=lambda: obtenida.append(pool.getconn()))
+    hilo.start()
+    abriendo.wait(5)
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    seguir.set()
+    hilo.join(5)
+    assert obtenida == conectar.abiertas and pool._opening == 0
+
+
+def test_apertura_fallida_devuelve_el_hueco(conectar):
+    fallos = [psycopg2.OperationalError('could not connect to server')]
+
+    def conectar_con_fallo():
+        if fallos:
+            raise fallos.pop()
+        return conectar()
+
+    pool = ConnectionPool(conectar_con_fallo, minconn=0, maxconn=1, timeout=0.05)
+    with pytest.raises(psycopg2.OperationalError):
+        pool.getconn()
+    assert pool._opening == 0
+    assert pool.getconn() is conectar.abiertas[0]
+
+
+def test_health_check_solo_tras_estar_ociosa(conectar, reloj):
+    pool = ConnectionPool(conectar, minconn=0, maxconn=2, health_check_after=30)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    reloj.ahora += 10
+    assert pool.getconn() is conn and conn.sentencias == []
+    pool.putconn(conn)
+
+    reloj.ahora += 31
+    assert pool.getconn() is conn and conn.sentencias == ['SELECT 1']
+    assert conn.rollbacks == 1      # el health check no deja transacción abierta
+    pool.putconn(conn)
+
+    # Ociosa y caída: se descarta y se entrega una nueva.
+    reloj.ahora += 31
+    conn.rota = True
+    nueva = pool.getconn()
+    assert nueva is conectar.abiertas[1] and conn.closed
+    assert pool.stats()['failed_health_checks'] == 1
+
+
+def test_ociosa_cerrada_se_descarta_sin_consultar(conectar):
+    pool = ConnectionPool(conectar, minconn=1, maxconn=1)
+    conectar.abiertas[0].closed = 2
+    assert pool.getconn() is conectar.abiertas[1]
+    assert conectar.abiertas[0].sentencias == []
+
+
+def test_reciclado_por_usos(conectar):
+    pool = ConnectionPool(conectar, minconn=0, maxconn=1, max_uses=2)
+    for _ in range(2):
+        conn = pool.getconn()
+        pool.putconn(conn)
+    assert conn.closed and pool.stats()['idle'] == 0 and pool.stats()['recycled'] == 1
+    assert pool.getconn() is conectar.abiertas[1]
+
+
+def test_reciclado_por_antiguedad(conectar, reloj):
+    pool = ConnectionPool(conectar, minconn=0, maxconn=1, max_lifetime=60)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    assert not conn.closed
+    conn = pool.getconn()
+    reloj.ahora += 60
+    pool.putconn(conn)
+    assert conn.closed and pool.stats()['recycled'] == 1
+
+
+def test_transaccion_abierta_se_deshace_al_devolver(conectar):
+    pool = ConnectionPool(conectar, minconn=0, maxconn=1)
+    conn = pool.getconn()
+    conn.estado = psycopg2.extensions.TRANSACTION_STATUS_INERROR
+    pool.putconn(conn)
+    assert conn.rollbacks == 1 and not conn.closed and pool.stats()['idle'] == 1
+
+
+def _error(base, pgcode):
+    return type(base.__name__, (base,), {'pgcode': pgcode})('error simulado')
+
+
+@pytest.mark.parametrize('error, descartada', [
+    (psycopg2.OperationalError('server closed the connection unexpectedly'), True),
+    (_error(psycopg2.OperationalError, '57P01'), True),
+    (_error(psycopg2.IntegrityError, '23505'), False),
+    (_error(psycopg2.extensions.QueryCanceledError, '57014'), False),
+])
+def test_connection_descarta_solo_errores_de_conexion(conectar, error, descartada):
+    pool = ConnectionPool(conectar, minconn=0, maxconn=1)
+    with pytest.raises(type(error)):
+        with pool.connection():
+            raise error
+    conn = conectar.abiertas[0]
+    assert bool(conn.closed) is descartada
+    assert pool.stats()['idle'] == (0 if descartada else 1) and pool.stats()['in_use'] == 0
+
+
+def test_conexion_ajena(conectar):
+    pool = ConnectionPool(conectar, minconn=0, maxconn=1)
+    ajena = Conexion(99)
+    pool.putconn(ajena)
+    assert ajena.closed and pool.stats()['idle'] == 0
+
+
+def test_closeall(conectar):
+    pool = ConnectionPool(conectar, minconn=2, maxconn=3)
+    prestada = pool.getconn()
+    pool.closeall()
+    ociosa = next(c for c in conectar.abiertas if c is not prestada)
+    assert ociosa.closed and not prestada.closed
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    # La que estaba prestada se cierra al devolverla, no vuelve a las ociosas.
+    pool.putconn(prestada)
+    assert prestada.closed and pool.stats()['idle'] == 0 and pool.stats()['in_use'] == 0
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Clasificación de errores de conexión y reparto de lecturas entre réplica y primario."""
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+import db_handler
+import db_pool
+
+
+def _error(base, pgcode):
+    """Error de psycopg2 con el SQLSTATE indicado (los construidos a mano no lo llevan)."""
+    return type(base.__name__, (base,), {'pgcode': pgcode})('error simulado')
+
+
+@pytest.mark.parametrize('error, esperado', [
+    (psycopg2.OperationalError('server closed the connection unexpectedly'), True),
+    (psycopg2.InterfaceError('connection already closed'), True),
+    (_error(psycopg2.OperationalError, '08006'), True),
+    (_error(psycopg2.OperationalError, '57P01'), True),      # admin_shutdown
+    (_error(psycopg2.OperationalError, '57P03'), True),      # cannot_connect_now
+    (_error(psycopg2.extensions.QueryCanceledError, '57014'), False),   # statement_timeout
+    (_error(psycopg2.extensions.TransactionRollbackError, '40P01'), False),   # deadlock
+    (_error(psycopg2.extensions.TransactionRollbackError, '40001'), False),   # serialización / recuperación
+    (_error(psycopg2.IntegrityError, '23505'), False),
+    (psycopg2.ProgrammingError('sin SQLSTATE'), False),
+])
+def test_is_connection_error(error, esperado):
+    assert db_pool.is_connection_error(error) is esperado
+
+
+class Conexion:
+    def __init__(self, closed=0):
+        self.closed = closed
+
+
+def test_connection_lost():
+    sentencia = _error(psycopg2.IntegrityError, '23505')
+    assert not db_pool.connection_lost(Conexion(), sentencia)
+    assert db_pool.connection_lost(Conexion(closed=2), sentencia)
+    assert db_pool.connection_lost(Conexion(), _error(psycopg2.OperationalError, '08003'))
+
+
+class FakePool:
+    def __init__(self):
+        self.devueltas = []
+
+    def putconn(self, conn, discard=False):
+        self.devueltas.append(discard)
+
+
+@pytest.fixture
+def replica(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(db_handler, '_replica_pool', pool)
+    monkeypatch.setattr(db_handler, '_checkout', lambda readonly: (pool, Conexion()))
+    monkeypatch.setattr(db_handler, '_replica_status', dict(db_handler._replica_status, down_until=0.0))
+    monkeypatch.setattr(db_handler, '_replica_counters', dict.fromkeys(db_handler._replica_counters, 0))
+    return pool
+
+
+def _leer_con_error(error):
+    with db_handler.pooled_connection(readonly=True):
+        raise error
+
+
+def test_replica_caida_se_aparta(replica):
+    with pytest.raises(db_handler.ReplicaError):
+        _leer_con_error(_error(psycopg2.OperationalError, '57P01'))
+    assert replica.devueltas == [True]
+    assert db_handler._replica_status['down_until'] > 0
+    assert db_handler._replica_counters['failures'] == 1
+
+
+def test_conflicto_con_la_recuperacion_no_aparta_la_replica(replica):
+    with pytest.raises(db_handler.ReplicaError):
+        _leer_con_error(_error(psycopg2.extensions.TransactionRollbackError, '40001'))
+    assert replica.devueltas == [False]
+    assert db_handler._replica_status['down_until'] == 0.0
+    assert db_handler._replica_counters == {'reads_replica': 0, 'reads_primary': 0, 'fallbacks': 1, 'failures': 0}
+
+
+def test_error_de_la_sentencia_se_propaga(replica):
+    error = _error(psycopg2.extensions.QueryCanceledError, '57014')
+    with pytest.raises(psycopg2.extensions.QueryCanceledError):
+        _leer_con_error(error)
+    assert replica.devueltas == [False]
+    assert db_handler._replica_status['down_until'] == 0.0
+    assert db_handler._replica_counters['failures'] == 0
+
+
+def test_primario_no_descarta_por_errores_de_sentencia(monkeypatch):
+    pool = FakePool()
+    monkeypatch.setattr(db_handler, '_checkout', lambda readonly: (pool, Conexion()))
+    with pytest.raises(psycopg2.IntegrityError):
+        with db_handler.pooled_connection():
+            raise _error(psycopg2.IntegrityError, '23505')
+    with pytest.raises(psycopg2.OperationalError):
+        with db_handler.pooled_connection():
+            raise _error(psycopg2.OperationalError, '08006')
+    assert pool.devueltas == [False, True]
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Export delta a Odoo: marca de agua por intervención, reintentos y primer export completo."""
+import json
+
+import pytest
+
+import data_handler
+import db_handler
+import job_scheduler
+import odoo_io
+from data_handler import DataHandler
+
+CONVOCATORIA = {'id': 3, 'odoo_batch_id': 'B-1'}
+
+
+def _fila(odoo_item_id, intervencion_id, version):
+    return {
+        'odoo_item_id': odoo_item_id, 'intervencion_id': intervencion_id, 'version': version,
+        'estado': 'realizado', 'estado_nota': None, 'tc_in': None, 'tc_out': None, 'needs_fx': False,
+        'fx_note': None, 'fx_source': None, 'fx_marked_at': None, 'usuario_ejecucion': None, 'realizado_at': None,
+    }
+
+
+class FallaNVeces:
+    """Destino que falla las primeras `n` veces y después delega en `sink`."""
+
+    def __init__(self, n, sink):
+        self.n, self.sink, self.llamadas = n, sink, 0
+
+    def send(self, name, chunks):
+        self.llamadas += 1
+        if self.llamadas <= self.n:
+            next(iter(chunks))      # consume parte del payload, como un envío cortado
+            raise odoo_io.ExportSinkError('timeout')
+        return self.sink.send(name, chunks)
+
+
+@pytest.fixture
+def bd(monkeypatch, fake_tx):
+    """Sustituye las llamadas a la BD de export_convocatoria; `bd.filas` es el delta."""
+    estado = type('BD', (), {})()
+    estado.filas, estado.consultas, estado.bitacora, estado.auditoria = [], [], [], []
+    estado.tx = fake_tx
+
+    def stream_query(query, params=None, itersize=2000, readonly=False):
+        estado.consultas.append(' '.join(query.split()))
+        return (fila for fila in list(estado.filas))
+
+    monkeypatch.setattr(db_handler, 'execute_query', lambda *args, **kwargs: dict(CONVOCATORIA))
+    monkeypatch.setattr(db_handler, 'stream_query', stream_query)
+    monkeypatch.setattr(db_handler, 'io_log', lambda tipo, est, mensaje, **kw: estado.bitacora.append(est))
+    monkeypatch.setattr(db_handler, 'audit_log', lambda **kw: estado.auditoria.append(kw))
+    monkeypatch.setattr(data_handler.time, 'sleep', lambda segundos: None)
+    return estado
+
+
+def test_delta_sin_marca_parte_de_la_version_0(bd, tmp_path):
+    DataHandler().export_convocatoria(3, sink=odoo_io.FileSink(str(tmp_path)))
+    assert 'i."version" > COALESCE(w."version", 0)' in bd.consultas[0]
+
+
+def test_intervencion_en_dos_items_deja_una_sola_marca(bd, tmp_path):
+    bd.filas = [_fila(10, 1, 1), _fila(10, 2, 4), _fila(11, 1, 1), _fila(11, 2, 4)]
+    resultado = DataHandler().export_convocatoria(3, user_id=5, sink=odoo_io.FileSink(str(tmp_path)))
+
+    assert resultado['enviado'] and resultado['items'] == 4 and resultado['intentos'] == 1
+    (sql, marcas), = bd.tx.values
+    assert 'GREATEST("ExportWatermark"."version", EXCLUDED."version")' in sql
+    assert sorted(marcas) == [(3, 1, 1), (3, 2, 4)]
+
+    fichero, = tmp_path.iterdir()
+    payload = json.loads(fichero.read_text())
+    assert payload['odoo_batch_id'] == 'B-1'
+    assert [(i['odoo_item_id'], i['intervencion_id']) for i in payload['items']] == [(10, 1), (10, 2), (11, 1), (11, 2)]
+    assert bd.auditoria[0]['accion'] == 'EXPORT' and bd.bitacora == ['ok']
+
+
+def test_sin_cambios_no_envia(bd, tmp_path):
+    resultado = DataHandler().export_convocatoria(3, sink=odoo_io.FileSink(str(tmp_path)))
+    assert resultado == {'convocatoria_id': 3, 'items': 0, 'enviado': False}
+    assert bd.tx.values == [] and list(tmp_path.iterdir()) == []
+
+
+def test_reintento_reenvia_el_delta_completo(bd, tmp_path):
+    bd.filas = [_fila(10, 1, 2), _fila(10, 2, 3)]
+    sink = FallaNVeces(2, odoo_io.FileSink(str(tmp_path)))
+    resultado = DataHandler().export_convocatoria(3, sink=sink)
+    assert resultado['intentos'] == 3 and resultado['items'] == 2
+    assert bd.tx.values[0][1] == [(3, 1, 2), (3, 2, 3)]
+    assert bd.bitacora == ['reintento', 'reintento', 'ok']
+
+
+def test_envio_fallido_no_avanza_la_marca(bd, tmp_path):
+    bd.filas = [_fila(10, 1, 2)]
+    sink = FallaNVeces(data_handler.EXPORT_MAX_ATTEMPTS, odoo_io.FileSink(str(tmp_path)))
+    resultado = DataHandler().export_convocatoria(3, sink=sink)
+    assert not resultado['enviado'] and resultado['error'] == 'timeout'
+    assert bd.tx.values == [] and bd.bitacora[-1] == 'error'
+
+
+def test_cierre_incluye_convocatorias_nunca_editadas(monkeypatch):
+    consultas = []
+    monkeypatch.setattr(db_handler, 'execute_query', lambda query, params=None, **kw: consultas.append(query) or [])
+    job_scheduler.export_convo_cierre({}, None)
+    assert 'i."version" > COALESCE(w."version", 0)' in ' '.join(consultas[0].split())
+
+
+def test_job_export_convocatoria(monkeypatch):
+    llamadas = []
+    resultados = {3: {'convocatoria_id': 3, 'items': 2, 'enviado': True}, 4: None,
+                  5: {'convocatoria_id': 5, 'items': 0, 'enviado': False, 'error': 'timeout'}}
+    monkeypatch.setattr(job_scheduler.handler_instance, 'export_convocatoria',
+                        lambda cid, user_id=None: llamadas.append((cid, user_id)) or resultados[cid])
+    assert job_scheduler.export_convocatoria({'convocatoria_id': 3, 'user_id': 5}, 1)['items'] == 2
+    assert llamadas == [(3, 5)]
+    # Convocatoria inexistente o envío fallido: JobError, que el worker reintenta con backoff.
+    for cid in (4, 5):
+        with pytest.raises(job_scheduler.JobError):
+            job_scheduler.export_convocatoria({'convocatoria_id': cid}, 1)
+
+
+def test_endpoint_encola_el_export(cliente, monkeypatch):
+    import api_app
+    encolados = []
+    monkeypatch.setattr(api_app.handler_instance, 'get_convocatoria_sala_id', lambda cid: 7 if cid == 3 else None)
+    monkeypatch.setattr(api_app.handler_instance, 'export_convocatoria',
+                        lambda *a, **kw: pytest.fail('el export no se ejecuta en el hilo de la petición'))
+    monkeypatch.setattr(job_scheduler, 'enqueue_job',
+                        lambda job, sala_id=None, params=None: encolados.append((job, sala_id, params)) or 41)
+
+    respuesta = cliente.post('/api/convocatorias/3/export')
+    assert respuesta.status_code == 202 and respuesta.get_json()['job_id'] == 41
+    assert encolados == [('export_convocatoria', 7, {'convocatoria_id': 3, 'user_id': 5})]
+    assert cliente.post('/api/convocatorias/9/export').status_code == 404 and len(encolados) == 1
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""FX masivo por capítulo: un solo UPDATE por conjuntos, fx_default del reparto y resultado por intervención."""
+import pytest
+
+import api_app
+import data_handler
+import db_handler
+from data_handler import DataHandler
+
+
+@pytest.fixture
+def bd(monkeypatch):
+    """execute_query falso: registra (sql, params) y devuelve `bd.filas`; `bd.invalidadas` recoge la caché."""
+    class Bd:
+        filas = []
+        consultas = []
+        invalidadas = []
+        error = None
+
+    def execute_query(query, params=None, fetch_mode="all", readonly=False):
+        if Bd.error:
+            raise Bd.error
+        Bd.consultas.append((' '.join(query.split()), params))
+        return Bd.filas
+    monkeypatch.setattr(db_handler, 'execute_query', execute_query)
+    monkeypatch.setattr(data_handler.cache, 'invalidate', lambda ns, key=None: Bd.invalidadas.append((ns, key)))
+    Bd.consultas, Bd.invalidadas = [], []
+    return Bd
+
+
+def _fila(intervencion_id, resultado, version=None):
+    return {'intervencion_id': intervencion_id, 'version': version, 'resultado': resultado}
+
+
+def test_manual_una_sola_sentencia(bd):
+    bd.filas = [_fila(1, 'actualizado', 4), _fila(2, 'nota_invalida')]
+    resultados = DataHandler().bulk_update_fx(9, True, 'Grito', 'manual', 5)
+    assert resultados == bd.filas
+    (sql, params), = bd.consultas
+    assert params == {'capitulo_id': 9, 'personaje_id': None, 'ids': None, 'needs_fx': True, 'fx_note': 'Grito',
+                      'fx_source': 'manual', 'from_default': False, 'user_id': 5}
+    # Versión, auditoría y aviso de cambio en la misma sentencia que el UPDATE.
+    assert '"version" = i."version" + 1' in sql and 'INSERT INTO "Auditoria"' in sql and 'pg_notify' in sql
+    assert bd.invalidadas == [('capitulo', 9)]
+
+
+def test_fx_default_del_reparto(bd):
+    bd.filas = [_fila(1, 'actualizado', 2), _fila(3, 'sin_fx_default')]
+    DataHandler().bulk_update_fx(9, None, None, 'personaje_default', 5, personaje_id=4)
+    (sql, params), = bd.consultas
+    assert params['from_default'] and params['personaje_id'] == 4 and params['needs_fx'] is None
+    # needs_fx = fx_default del personaje en el capítulo (false si no lo tiene) y la nota,
+    # la enviada o la fx_default_note; sin fila de reparto no se toca la intervención.
+    assert 'THEN COALESCE(pec.fx_default, false) ELSE %(needs_fx)s END AS new_needs_fx' in sql
+    assert 'THEN COALESCE(%(fx_note)s, pec.fx_default_note) ELSE %(fx_note)s END AS new_fx_note' in sql
+    assert 'WHERE NOT (%(from_default)s AND sin_reparto)' in sql
+    assert "WHEN %(from_default)s AND t.sin_reparto THEN 'sin_fx_default'" in sql
+    # Marcar con FX exige nota válida también cuando sale del reparto.
+    assert 'AND (NOT new_needs_fx OR length(new_fx_note) BETWEEN 3 AND 120)' in sql
+
+
+def test_ids_que_no_son_del_capitulo(bd):
+    bd.filas = [_fila(2, 'actualizado', 5)]
+    resultados = DataHandler().bulk_update_fx(9, False, None, 'manual', 5, intervencion_ids=(2, 7))
+    assert bd.consultas[0][1]['ids'] == [2, 7]
+    assert resultados == [_fila(2, 'actualizado', 5), _fila(7, 'no_encontrado')]
+
+
+def test_sin_cambios_no_invalida(bd):
+    bd.filas = [_fila(1, 'nota_invalida')]
+    DataHandler().bulk_update_fx(9, True, None, 'manual', 5)
+    assert bd.invalidadas == []
+
+
+def test_error_de_bd(bd):
+    bd.error = RuntimeError('deadlock')
+    assert DataHandler().bulk_update_fx(9, True, 'Grito', 'manual', 5) is None
+
+
+@pytest.fixture
+def llamadas(cliente, monkeypatch):
+    llamadas = []
+
+    def bulk_update_fx(capitulo_id, needs_fx, fx_note, fx_source, user_id, personaje_id=None, intervencion_ids=None):
+        llamadas.append((capitulo_id, needs_fx, fx_note, fx_source, user_id, personaje_id, intervencion_ids))
+        return [_fila(i, 'actualizado', 1) for i in intervencion_ids or [1]]
+    monkeypatch.setattr(api_app.handler_instance, 'bulk_update_fx', bulk_update_fx)
+    return llamadas
+
+
+@pytest.mark.parametrize('cuerpo', [
+    {'apply': {'needs_fx': True, 'fx_note': 'Grito'}},
+    {'capitulo_id': True, 'apply': {'needs_fx': True, 'fx_note': 'Grito'}},
+    {'capitulo_id': 9, 'personaje_id': '4', 'apply': {'needs_fx': False}},
+    {'capitulo_id': 9, 'intervencion_ids': [], 'apply': {'needs_fx': False}},
+    {'capitulo_id': 9, 'intervencion_ids': [1, 'a'], 'apply': {'needs_fx': False}},
+    {'capitulo_id': 9, 'apply': {'needs_fx': True, 'fx_note': 'no'}},
+    {'capitulo_id': 9, 'apply': {'needs_fx': True, 'fx_note': 'Grito', 'fx_source': 'odoo'}},
+    {'capitulo_id': 9, 'apply': {'fx_source': 'personaje_default', 'fx_note': 'x' * 121}},
+])
+def test_validacion(cliente, llamadas, cuerpo):
+    assert cliente.post('/api/fx/bulk', json=cuerpo).status_code == 400
+    assert llamadas == []
+
+
+def test_limite_de_ids(cliente, llamadas):
+    cuerpo = {'capitulo_id': 9, 'intervencion_ids': list(range(api_app.FX_BULK_MAX_IDS + 1)),
+              'apply': {'needs_fx': False}}
+    assert cliente.post('/api/fx/bulk', json=cuerpo).status_code == 400
+
+
+def test_endpoint(cliente, llamadas):
+    respuesta = cliente.post('/api/fx/bulk', json={'capitulo_id': 9, 'intervencion_ids': [3, 1, 3],
+                                                   'apply': {'needs_fx': True, 'fx_note': 'Grito'}})
+    assert respuesta.status_code == 200
+    assert llamadas == [(9, True, 'Grito', 'manual', 5, None, [3, 1])]     # ids sin repetir, en orden
+    cuerpo = respuesta.get_json()
+    assert (cuerpo['total'], cuerpo['actualizadas']) == (2, 2)
+
+
+def test_endpoint_fx_default_sin_needs_fx(cliente, llamadas):
+    # Con personaje_default needs_fx lo decide el reparto: no se exige en el cuerpo.
+    respuesta = cliente.post('/api/fx/bulk', json={'capitulo_id': 9, 'personaje_id': 4,
+                                                   'apply': {'fx_source': 'personaje_default'}})
+    assert respuesta.status_code == 200
+    assert llamadas == [(9, None, None, 'personaje_default', 5, 4, None)]
+
+
+def test_endpoint_error(cliente, monkeypatch):
+    monkeypatch.setattr(api_app.handler_instance, 'bulk_update_fx', lambda *a, **kw: None)
+    respuesta = cliente.post('/api/fx/bulk', json={'capitulo_id': 9, 'apply': {'needs_fx': False}})
+    assert respuesta.status_code == 500
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""Import de lotes de Odoo: idempotente por odoo_batch_id y todo o nada en una transacción."""
+import psycopg2.errors
+import pytest
+
+import api_app
+import data_handler
+import db_handler
+import odoo_io
+from data_handler import DataHandler
+from odoo_io import ConvocatoriaImportError
+
+HEADER = {'sala_id': 3, 'fecha': '2025-05-07', 'turno': 'M', 'odoo_batch_id': 'B-1'}
+
+
+def _items(n):
+    return [(linea, f"I-{linea}", 'SER', 1, linea, 'convocado') for linea in range(1, n + 1)]
+
+
+@pytest.fixture
+def bd(monkeypatch, fake_tx):
+    """
+    Respuestas de la transacción por sentencia. `bd.existente` simula un lote ya
+    importado; `bd.duplicados` / `bd.no_resueltos`, las comprobaciones del staging;
+    `bd.insertar` es lo que devuelve el INSERT de ConvocatoriaItem (o la excepción que lanza).
+    """
+    class Bd:
+        existente = None
+        duplicados = []
+        no_resueltos = []
+        insertar = 3
+        bitacora = []
+        tx = fake_tx
+
+    def respuestas(sql, params):
+        if 'INSERT INTO "Convocatoria"' in sql:
+            return None if Bd.existente else {'id': 11}
+        if 'LEFT JOIN "ConvocatoriaItem"' in sql:
+            return Bd.existente
+        if 'HAVING count(*) > 1' in sql:
+            return Bd.duplicados
+        if 'WHERE t.id IS NULL' in sql:
+            return Bd.no_resueltos
+        if 'INSERT INTO "ConvocatoriaItem"' in sql:
+            if isinstance(Bd.insertar, Exception):
+                raise Bd.insertar
+            return Bd.insertar
+        return None
+
+    fake_tx.respuestas = respuestas
+    monkeypatch.setattr(db_handler, 'io_log', lambda tipo, estado, mensaje, **kw: Bd.bitacora.append((estado, kw)))
+    monkeypatch.setattr(data_handler, 'IMPORT_PAGE_SIZE', 2)
+    return Bd
+
+
+def _sentencias(tx):
+    return [sql for sql, _, _ in tx.ejecutado]
+
+
+def test_import_por_paginas_en_una_transaccion(bd):
+    resultado = DataHandler().import_convocatoria(HEADER, iter(_items(3)), user_id=5)
+    assert resultado['convocatoria_id'] == 11 and resultado['items'] == 3 and not resultado['ya_importado']
+    # El staging se llena por páginas de IMPORT_PAGE_SIZE y los items se insertan con un solo INSERT ... SELECT.
+    assert [len(filas) for _, filas in bd.tx.values] == [2, 1]
+    assert sum('INSERT INTO "ConvocatoriaItem"' in sql for sql in _sentencias(bd.tx)) == 1
+    (statement, args), = bd.tx.preparadas
+    assert 'INSERT INTO "Auditoria"' in statement.sql and 'IMPORT' in args
+    assert bd.tx.confirmada and bd.bitacora[-1][0] == 'ok'
+
+
+def test_lote_ya_importado_no_toca_nada(bd):
+    bd.existente = {'id': 8, 'items': 40}
+    consumidos = []
+
+    def items():
+        consumidos.append(1)
+        yield from _items(3)
+
+    resultado = DataHandler().import_convocatoria(HEADER, items())
+    assert resultado == {'convocatoria_id': 8, 'items': 40, 'ya_importado': True}
+    assert consumidos == [] and bd.tx.values == [] and bd.tx.preparadas == []
+    assert not any('TEMP TABLE' in sql for sql in _sentencias(bd.tx))
+    assert bd.bitacora == []
+
+
+def test_lote_vacio(bd):
+    with pytest.raises(ConvocatoriaImportError, match='no contiene items'):
+        DataHandler().import_convocatoria(HEADER, iter([]))
+    assert bd.tx.deshecha and bd.bitacora[-1][0] == 'error'
+
+
+def test_duplicados_deshacen_todo(bd):
+    bd.duplicados = [{'odoo_item_id': 'I-1', 'lineas': [1, 4]}]
+    with pytest.raises(ConvocatoriaImportError) as error:
+        DataHandler().import_convocatoria(HEADER, iter(_items(4)))
+    assert error.value.errores == ["odoo_item_id 'I-1' repetido en items [1, 4]."]
+    assert bd.tx.deshecha and not any('INSERT INTO "ConvocatoriaItem"' in sql for sql in _sentencias(bd.tx))
+
+
+def test_items_sin_resolver_deshacen_todo(bd):
+    bd.no_resueltos = [
+        {'linea': 1, 'serie_ref': 'X', 'capitulo_numero': 1, 'take_numero': 1, 'serie_ok': False, 'capitulo_ok': False},
+        {'linea': 2, 'serie_ref': 'SER', 'capitulo_numero': 9, 'take_numero': 1, 'serie_ok': True, 'capitulo_ok': False},
+        {'linea': 3, 'serie_ref': 'SER', 'capitulo_numero': 1, 'take_numero': 99, 'serie_ok': True, 'capitulo_ok': True},
+    ]
+    with pytest.raises(ConvocatoriaImportError) as error:
+        DataHandler().import_convocatoria(HEADER, iter(_items(3)))
+    assert error.value.errores == [
+        "Item 1: serie_ref 'X' no encontrada.",
+        "Item 2: capítulo 9 no existe en la serie 'SER'.",
+        "Item 3: take 99 no existe en el capítulo 1.",
+    ]
+    assert bd.tx.deshecha and bd.tx.preparadas == []
+    assert bd.bitacora == [('error', {'odoo_batch_id': 'B-1', 'detalles': {'errores': error.value.errores}})]
+
+
+def test_item_invalido_a_mitad_del_fichero(bd):
+    """Un item malo en la página 2 deshace también la convocatoria y la página 1 ya volcadas."""
+    def items():
+        yield from _items(2)
+        yield odoo_io.normalize_item({'odoo_item_id': 'I-3'}, 3)
+
+    with pytest.raises(ConvocatoriaImportError, match='Item 3 incompleto'):
+        DataHandler().import_convocatoria(HEADER, items())
+    assert bd.tx.deshecha and len(bd.tx.values) == 1
+
+
+def test_choque_con_datos_existentes(bd):
+    bd.insertar = psycopg2.errors.UniqueViolation('duplicate key value violates unique constraint')
+    with pytest.raises(ConvocatoriaImportError, match='choca con datos ya importados'):
+        DataHandler().import_convocatoria(HEADER, iter(_items(2)))
+    assert bd.tx.deshecha and bd.bitacora[-1][0] == 'error'
+
+
+@pytest.mark.parametrize('resultado, status', [
+    ({'convocatoria_id': 11, 'items': 2, 'ya_importado': False}, 201),
+    ({'convocatoria_id': 8, 'items': 40, 'ya_importado': True}, 200),
+])
+def test_endpoint(cliente, monkeypatch, resultado, status):
+    recibidos = []
+
+    def import_convocatoria(header, items, user_id=None):
+        recibidos.append((header, list(items), user_id))
+        return resultado
+    monkeypatch.setattr(api_app.handler_instance, 'import_convocatoria', import_convocatoria)
+    items = [{'odoo_item_id': 'I-1', 'serie_ref': 'SER', 'capitulo_numero': 1, 'take_numero': 2}]
+    respuesta = cliente.post('/api/convocatorias/import', json={**HEADER, 'items': items})
+    assert respuesta.status_code == status and respuesta.get_json()['convocatoria_id'] == resultado['convocatoria_id']
+    (header, filas, user_id), = recibidos
+    assert header['odoo_batch_id'] == 'B-1' and len(filas) == 1 and user_id == 5
+
+
+def test_endpoint_lote_invalido(cliente, monkeypatch):
+    def import_convocatoria(header, items, user_id=None):
+        raise ConvocatoriaImportError("Hay items que no se pudieron resolver.", ["Item 1: ..."])
+    monkeypatch.setattr(api_app.handler_instance, 'import_convocatoria', import_convocatoria)
+    respuesta = cliente.post('/api/convocatorias/import', json={**HEADER, 'items': []})
+    assert respuesta.status_code == 422 and respuesta.get_json()['details'] == ["Item 1: ..."]
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Métricas agregadas entre workers (METRICS_DIR) y exposición de Prometheus."""
+import json
+import os
+
+import pytest
+
+import instrumentation
+
+SLOW = instrumentation.SLOW_QUERIES.name
+SQL = instrumentation.SQL_DURATION.name
+
+
+def _volcado(pid, lentas, histograma, componentes=None, slow=()):
+    return {
+        'pid': pid,
+        'metrics': {SLOW: [[['fp_test'], lentas]], SQL: [[['fp_test'], histograma]]},
+        'statements': {'fp_test': 'SELECT ? FROM t'},
+        'slow': list(slow),
+        'components': componentes or {},
+    }
+
+
+@pytest.fixture
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'METRICS_DIR', str(tmp_path))
+    monkeypatch.setattr(instrumentation, '_component_stats', None)
+    return tmp_path
+
+
+def _escribir(directorio, nombre, datos):
+    (directorio / nombre).write_text(json.dumps(datos))
+
+
+def _lineas(texto, prefijo):
+    return [linea for linea in texto.splitlines() if linea.startswith(prefijo)]
+
+
+def test_merge_suma_contadores_e_histogramas():
+    n = len(instrumentation.SQL_BUCKETS) + 1
+    a = _volcado(1, 2.0, [1] + [0] * (n - 1) + [0.5])
+    b = _volcado(2, 3.0, [0, 2] + [0] * (n - 2) + [1.0])
+    merged, statements = instrumentation._merge([a, b])
+    assert merged[SLOW][('fp_test',)] == 5.0
+    assert merged[SQL][('fp_test',)] == [1, 2] + [0] * (n - 2) + [1.5]
+    assert statements == {'fp_test': 'SELECT ? FROM t'}
+
+
+def test_render_agrega_workers(metrics_dir):
+    n = len(instrumentation.SQL_BUCKETS) + 1
+    _escribir(metrics_dir, '111.json', _volcado(111, 2.0, [1] + [0] * n, {'pool': {'in_use': 3, 'healthy': True}}))
+    _escribir(metrics_dir, '222.json', _volcado(222, 1.0, [1] + [0] * n, {'pool': {'in_use': 1, 'name': 'x'}}))
+    (metrics_dir / 'roto.json').write_text('{a medias')
+
+    texto = instrumentation.render()
+    assert f'{SLOW}{{fingerprint="fp_test"}} 3' in texto
+    assert f'{SQL}_count{{fingerprint="fp_test"}} 2' in texto
+    assert 'asrecorded_pool_in_use{worker="111"} 3' in texto
+    assert 'asrecorded_pool_in_use{worker="222"} 1' in texto
+    assert 'asrecorded_pool_healthy{worker="111"} 1' in texto
+    assert not _lineas(texto, 'asrecorded_pool_name')
+    # Los dos volcados escritos más el de este proceso.
+    assert 'asrecorded_metrics_workers 3' in texto
+    assert (metrics_dir / f"{os.getpid()}.json").exists()
+
+
+def test_worker_terminado_no_resta(metrics_dir):
+    n = len(instrumentation.SQL_BUCKETS) + 1
+    _escribir(metrics_dir, '111.json', _volcado(111, 2.0, [1] + [0] * n, {'pool': {'in_use': 3}}))
+    instrumentation.mark_process_dead(111)
+    _escribir(metrics_dir, '222.json', _volcado(222, 1.0, [1] + [0] * n))
+    instrumentation.mark_process_dead(222)
+
+    assert sorted(os.listdir(metrics_dir)) == [instrumentation.METRICS_ARCHIVE]
+    texto = instrumentation.render()
+    assert f'{SLOW}{{fingerprint="fp_test"}} 3' in texto
+    assert not _lineas(texto, 'asrecorded_pool_in_use')
+    assert 'asrecorded_metrics_workers 1' in texto
+
+
+def test_mark_process_dead_sin_volcado(metrics_dir):
+    instrumentation.mark_process_dead(999)
+    assert json.loads((metrics_dir / instrumentation.METRICS_ARCHIVE).read_text())['metrics'][SLOW] == []
+
+
+def test_consultas_lentas_de_todos_los_workers(metrics_dir):
+    _escribir(metrics_dir, '111.json', _volcado(111, 1.0, [], slow=[{'at': '2025-05-07T10:00:00', 'pid': 111}]))
+    _escribir(metrics_dir, '222.json', _volcado(222, 1.0, [], slow=[{'at': '2025-05-07T11:00:00', 'pid': 222}]))
+    _escribir(metrics_dir, instrumentation.METRICS_ARCHIVE,
+              {'metrics': {}, 'slow': [{'at': '2025-05-07T12:00:00', 'pid': 1}]})
+    pids = [m['pid'] for m in instrumentation.get_slow_queries() if m['pid'] in (1, 111, 222)]
+    assert pids == [222, 111]
+
+
+def test_clear_metrics_dir(metrics_dir):
+    _escribir(metrics_dir, '111.json', {})
+    _escribir(metrics_dir, 'x.json.5.tmp', {})
+    (metrics_dir / 'otro.txt').write_text('se queda')
+    instrumentation.clear_metrics_dir()
+    assert os.listdir(metrics_dir) == ['otro.txt']
+
+
+def test_render_sin_metrics_dir(monkeypatch):
+    monkeypatch.setattr(instrumentation, 'METRICS_DIR', None)
+    texto = instrumentation.render({'cache': {'hits': 4, 'backend': 'MemoryBackend'}})
+    assert 'asrecorded_cache_hits 4' in texto
+    assert 'worker=' not in texto and 'asrecorded_metrics_workers' not in texto
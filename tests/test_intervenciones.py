@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""Actualizaciones condicionales de intervenciones: conflictos de versión y guarda de timecodes."""
+import collections
+
+import pytest
+
+import api_app
+import data_handler
+import timecode
+from data_handler import UPDATE_CONFLICT, UPDATE_NOT_FOUND, UPDATE_OK, DataHandler
+
+Fila = collections.namedtuple('Fila', 'version actualizado capitulo_id valido')
+
+
+@pytest.fixture
+def handler():
+    return DataHandler()
+
+
+@pytest.fixture
+def tx_que_devuelve(crear_tx):
+    """FakeTx cuya sentencia preparada devuelve `fila` (None: la intervención no existe)."""
+    return lambda fila: crear_tx(lambda sql, params: fila)
+
+
+def test_actualizacion_ok(handler, tx_que_devuelve):
+    tx = tx_que_devuelve(Fila(4, True, 9, True))
+    resultado = handler.update_intervention_status(1, 'realizado', None, 5, expected_version=3, tx=tx)
+    assert resultado == {'resultado': UPDATE_OK, 'version': 4, 'capitulo_id': 9}
+    statement, _ = tx.preparadas[0]
+    assert 'FOR UPDATE' in statement.sql and statement.writes
+
+
+def test_conflicto_devuelve_la_version_vigente(handler, tx_que_devuelve):
+    tx = tx_que_devuelve(Fila(7, False, None, True))
+    resultado = handler.update_intervention_status(1, 'realizado', None, 5, expected_version=3, tx=tx)
+    assert resultado == {'resultado': UPDATE_CONFLICT, 'version': 7}
+
+
+def test_no_encontrada(handler, tx_que_devuelve):
+    resultado = handler.update_intervention_status(1, 'realizado', None, 5, expected_version=3,
+                                                   tx=tx_que_devuelve(None))
+    assert resultado == {'resultado': UPDATE_NOT_FOUND, 'version': None}
+
+
+def test_timecode_valida_contra_el_valor_guardado(handler, tx_que_devuelve):
+    # Solo cambia tc_out: la guarda compara con cur.tc_in_frames, leído con FOR UPDATE.
+    tx = tx_que_devuelve(Fila(3, False, None, False))
+    with pytest.raises(timecode.TimecodeError, match='valor guardado'):
+        handler.update_intervention_timecode(1, {'tc_out': '00:00:01:00'}, 5, expected_version=3, tx=tx, fps='25')
+    statement, args = tx.preparadas[0]
+    assert '%(tc_out_frames)s::int >= cur.tc_in_frames' in statement.sql
+    assert 25 in args and '00:00:01:00' in args
+
+
+def test_timecode_en_conflicto_prima_la_version(handler, tx_que_devuelve):
+    # La guarda falla contra una fila que ya no es la que el cliente vio: es un conflicto, no un 400.
+    tx = tx_que_devuelve(Fila(8, False, None, False))
+    resultado = handler.update_intervention_timecode(1, {'tc_in': '00:00:02:00'}, 5, expected_version=3,
+                                                     tx=tx, fps='25')
+    assert resultado == {'resultado': UPDATE_CONFLICT, 'version': 8}
+    assert 'cur.tc_out_frames >= %(tc_in_frames)s::int' in tx.preparadas[0][0].sql
+
+
+def test_timecode_normaliza_y_valida_antes_de_la_bd(handler, tx_que_devuelve):
+    tx = tx_que_devuelve(Fila(2, True, 1, True))
+    handler.update_intervention_timecode(1, {'tc_in': '00:01:00:02', 'tc_out': None}, 5, tx=tx, fps='29.97')
+    _, args = tx.preparadas[0]
+    assert '00:01:00:02' in args and 1800 in args
+    with pytest.raises(timecode.TimecodeError):
+        handler.update_intervention_timecode(1, {'tc_in': '00:00:02:00', 'tc_out': '00:00:01:00'}, 5,
+                                             tx=tx_que_devuelve(None), fps='25')
+    with pytest.raises(timecode.TimecodeError):
+        handler.update_intervention_timecode(1, {'tc_in': '00:01:00;00'}, 5, tx=tx_que_devuelve(None), fps='29.97')
+
+
+def test_412_con_la_version_vigente(cliente, monkeypatch):
+    recibido = {}
+
+    def update(intervencion_id, cambios, user_id, expected_version=None):
+        recibido.update(cambios=cambios, expected_version=expected_version)
+        return {'resultado': UPDATE_CONFLICT, 'version': 7}
+    monkeypatch.setattr(api_app.handler_instance, 'update_intervention_timecode', update)
+
+    response = cliente.patch('/api/intervenciones/1/timecode', json={'tc_out': '00:00:01:00'},
+                             headers={'If-Match': '"3"'})
+    assert response.status_code == 412
+    assert response.get_json()['version'] == 7 and response.headers['ETag'] == '"7"'
+    assert recibido == {'cambios': {'tc_out': '00:00:01:00'}, 'expected_version': 3}
+
+
+def test_400_si_la_guarda_falla(cliente, monkeypatch):
+    def update(*args, **kwargs):
+        raise timecode.TimecodeError("'tc_out' no puede ser anterior a 'tc_in' (valor guardado).")
+    monkeypatch.setattr(api_app.handler_instance, 'update_intervention_timecode', update)
+    response = cliente.patch('/api/intervenciones/1/timecode', json={'tc_out': '00:00:01:00', 'version': 3})
+    assert response.status_code == 400 and 'valor guardado' in response.get_json()['error']
+
+
+def test_if_match_invalido(cliente):
+    response = cliente.patch('/api/intervenciones/1/timecode', json={'tc_in': '00:00:01:00'},
+                             headers={'If-Match': 'abc'})
+    assert response.status_code == 400
+
+
+def test_cache_no_se_invalida_dentro_de_tx(handler, tx_que_devuelve, monkeypatch):
+    invalidados = []
+    monkeypatch.setattr(data_handler.cache, 'invalidate', lambda *args: invalidados.append(args))
+    handler.update_intervention_status(1, 'realizado', None, 5, tx=tx_que_devuelve(Fila(2, True, 9, True)))
+    assert invalidados == []
+    monkeypatch.setattr(data_handler.db_handler, 'execute_prepared',
+                        lambda statement, params, fetch_mode: Fila(2, True, 9, True))
+    handler.update_intervention_status(1, 'realizado', None, 5)
+    assert invalidados == [('capitulo', 9)]
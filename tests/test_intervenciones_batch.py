@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Lotes de operaciones sobre intervenciones: una transacción, control de versión y resultado por operación."""
+import collections
+
+import pytest
+
+import api_app
+import data_handler
+from data_handler import (UPDATE_CONFLICT, UPDATE_INVALID, UPDATE_NOT_FOUND, UPDATE_OK, UPDATE_ROLLED_BACK,
+                          UPDATE_SKIPPED, DataHandler)
+
+Fila = collections.namedtuple('Fila', 'version actualizado capitulo_id valido')
+
+
+@pytest.fixture
+def bd(monkeypatch, fake_tx):
+    """
+    Intervenciones en memoria detrás de la transacción falsa. La sentencia de
+    _update_intervention se resuelve como en la BD: actualiza si la versión
+    esperada coincide (y la guarda de timecodes se cumple) y si no devuelve la
+    vigente. `bd.fps` es el de la serie de cada intervención y `bd.esperadas`
+    la versión esperada que recibe cada sentencia.
+    """
+    class Bd:
+        filas = {
+            1: {'version': 3, 'capitulo_id': 9, 'tc_in_frames': 100, 'tc_out_frames': 200},
+            2: {'version': 1, 'capitulo_id': 9, 'tc_in_frames': None, 'tc_out_frames': None},
+            3: {'version': 6, 'capitulo_id': 10, 'tc_in_frames': None, 'tc_out_frames': None},
+        }
+        fps = {1: '25', 2: '25', 3: '29.97'}
+        invalidadas, esperadas = [], []
+        error = None
+        tx = fake_tx
+
+    def respuestas(sql, params):
+        if Bd.error:
+            raise Bd.error
+        if 'JOIN "Serie" s' in sql:
+            (ids,) = params
+            return [{'id': i, 'fps': Bd.fps[i]} for i in ids if i in Bd.fps]
+        Bd.esperadas.append(params['expected_version'])
+        fila = Bd.filas.get(params['id'])
+        if fila is None:
+            return None
+        tc_in = params.get('tc_in_frames', fila['tc_in_frames'])
+        tc_out = params.get('tc_out_frames', fila['tc_out_frames'])
+        valido = tc_in is None or tc_out is None or tc_out >= tc_in
+        if params['expected_version'] not in (None, fila['version']) or not valido:
+            return Fila(fila['version'], False, None, valido)
+        fila.update(version=fila['version'] + 1, tc_in_frames=tc_in, tc_out_frames=tc_out)
+        return Fila(fila['version'], True, fila['capitulo_id'], True)
+
+    fake_tx.respuestas = respuestas
+    monkeypatch.setattr(data_handler.cache, 'invalidate', lambda ns, key=None: Bd.invalidadas.append((ns, key)))
+    return Bd
+
+
+def _estado(intervencion_id, version, estado='realizado'):
+    return {'op': 'estado', 'id': intervencion_id, 'version': version, 'estado': estado, 'estado_nota': None}
+
+
+def _fx(intervencion_id, version):
+    return {'op': 'fx', 'id': intervencion_id, 'version': version, 'needs_fx': True, 'fx_note': 'Grito',
+            'fx_source': 'manual'}
+
+
+def _timecode(intervencion_id, version, **cambios):
+    return {'op': 'timecode', 'id': intervencion_id, 'version': version, 'cambios': cambios}
+
+
+def _resultados(resultados):
+    return [(r['id'], r['resultado'], r['version']) for r in resultados]
+
+
+def test_lote_en_una_transaccion(bd):
+    operaciones = [_estado(1, 3), _fx(3, 6), {'op': 'dialogo', 'id': 99, 'version': 1, 'dialogo': 'Hola.'}]
+    resultados, aplicado = DataHandler().apply_intervention_batch(operaciones, 5)
+    assert aplicado
+    assert _resultados(resultados) == [(1, UPDATE_OK, 4), (3, UPDATE_OK, 7), (99, UPDATE_NOT_FOUND, None)]
+    assert [(r['indice'], r['op']) for r in resultados] == [(0, 'estado'), (1, 'fx'), (2, 'dialogo')]
+    assert all('capitulo_id' not in r for r in resultados)
+    # Una sentencia por operación en la misma transacción, y la caché de cada capítulo tocado tras el COMMIT.
+    assert len(bd.tx.preparadas) == 3 and bd.tx.confirmada
+    assert sorted(bd.invalidadas) == [('capitulo', 9), ('capitulo', 10)]
+
+
+def test_conflicto_solo_afecta_a_su_operacion(bd):
+    resultados, aplicado = DataHandler().apply_intervention_batch([_estado(1, 2), _estado(2, 1), _fx(2, 1)], 5)
+    # La versión vigente en el conflicto es la de la fila bloqueada, no la que envió el cliente.
+    assert aplicado and _resultados(resultados) == [(1, UPDATE_CONFLICT, 3), (2, UPDATE_OK, 2), (2, UPDATE_OK, 3)]
+    assert bd.filas[1]['version'] == 3 and bd.invalidadas == [('capitulo', 9)]
+
+
+def test_version_del_cliente_se_traduce_dentro_del_lote(bd):
+    """Varias operaciones sobre la misma intervención con la versión que vio el cliente."""
+    operaciones = [_estado(1, 3), _fx(1, 3), {'op': 'dialogo', 'id': 1, 'version': 3, 'dialogo': None}]
+    resultados, _ = DataHandler().apply_intervention_batch(operaciones, 5)
+    assert _resultados(resultados) == [(1, UPDATE_OK, 4), (1, UPDATE_OK, 5), (1, UPDATE_OK, 6)]
+    assert bd.esperadas == [3, 4, 5]
+
+
+def test_sin_traduccion_si_la_primera_no_se_aplico(bd):
+    # Si la primera choca, la segunda con la misma versión también: el cliente tiene que releer.
+    resultados, _ = DataHandler().apply_intervention_batch([_estado(1, 2), _fx(1, 2)], 5)
+    assert _resultados(resultados) == [(1, UPDATE_CONFLICT, 3), (1, UPDATE_CONFLICT, 3)]
+    # Y sin versión no hay control de concurrencia (ni traducción).
+    resultados, _ = DataHandler().apply_intervention_batch([_estado(1, None), _fx(1, None)], 5)
+    assert _resultados(resultados) == [(1, UPDATE_OK, 4), (1, UPDATE_OK, 5)]
+
+
+def test_timecodes_validados_por_operacion(bd):
+    operaciones = [
+        _timecode(2, 1, tc_in='00:00:01:30'),                       # imposible a 25 fps
+        _timecode(1, 3, tc_out='00:00:02:00'),                      # anterior al tc_in guardado (100 frames)
+        _timecode(3, 6, tc_in='00:01:00;02', tc_out=None),          # drop-frame a 29.97
+        _timecode(99, 1, tc_in='00:00:01:00'),
+    ]
+    resultados, aplicado = DataHandler().apply_intervention_batch(operaciones, 5)
+    assert aplicado and _resultados(resultados) == [
+        (2, UPDATE_INVALID, None), (1, UPDATE_INVALID, None), (3, UPDATE_OK, 7), (99, UPDATE_NOT_FOUND, None),
+    ]
+    assert 'fuera de rango' in resultados[0]['error']
+    assert 'valor guardado' in resultados[1]['error']
+    assert bd.filas[3]['tc_in_frames'] == 1800
+    # Los fps de todas las operaciones de timecode se leen con una sola consulta.
+    (sql, (ids,), _), = bd.tx.ejecutado
+    assert 'JOIN "Serie" s' in sql and sorted(ids) == [1, 2, 3, 99]
+
+
+def test_atomico_deshace_todo_en_la_primera_que_falla(bd):
+    operaciones = [_estado(1, 3), _fx(2, 0), _estado(3, 6)]
+    resultados, aplicado = DataHandler().apply_intervention_batch(operaciones, 5, atomico=True)
+    assert not aplicado
+    assert _resultados(resultados) == [
+        (1, UPDATE_ROLLED_BACK, None), (2, UPDATE_CONFLICT, 1), (3, UPDATE_SKIPPED, None),
+    ]
+    assert [r['indice'] for r in resultados] == [0, 1, 2]
+    # La tercera no llega a ejecutarse y nada se confirma ni se invalida.
+    assert len(bd.tx.preparadas) == 2 and bd.tx.deshecha and not bd.tx.confirmada and bd.invalidadas == []
+
+
+def test_atomico_sin_fallos_se_confirma(bd):
+    resultados, aplicado = DataHandler().apply_intervention_batch([_estado(1, 3), _fx(2, 1)], 5, atomico=True)
+    assert aplicado and bd.tx.confirmada and {r['resultado'] for r in resultados} == {UPDATE_OK}
+
+
+def test_error_de_bd_deshace_el_lote(bd):
+    bd.error = RuntimeError('deadlock detected')
+    assert DataHandler().apply_intervention_batch([_estado(1, 3), _fx(2, 1)], 5) is None
+    assert bd.tx.deshecha and bd.invalidadas == []
+
+
+@pytest.fixture
+def lotes(cliente, monkeypatch):
+    lotes = []
+
+    def apply_intervention_batch(operaciones, user_id, atomico=False):
+        lotes.append((operaciones, user_id, atomico))
+        return [{'indice': i, 'op': op['op'], 'id': op['id'], 'resultado': UPDATE_OK, 'version': 2}
+                for i, op in enumerate(operaciones)], True
+    monkeypatch.setattr(api_app.handler_instance, 'apply_intervention_batch', apply_intervention_batch)
+    return lotes
+
+
+@pytest.mark.parametrize('cuerpo', [
+    {},
+    {'operaciones': []},
+    {'operaciones': [{'op': 'estado', 'id': 1, 'estado': 'realizado'}], 'atomico': 'si'},
+    {'operaciones': [{'op': 'estado', 'id': 1, 'estado': 'realizado'}] * (api_app.INTERVENTION_BATCH_MAX_OPS + 1)},
+])
+def test_lote_mal_formado(cliente, lotes, cuerpo):
+    assert cliente.post('/api/intervenciones/batch', json=cuerpo).status_code == 400
+    assert lotes == []
+
+
+def test_una_operacion_invalida_rechaza_el_lote(cliente, lotes):
+    operaciones = [
+        {'op': 'estado', 'id': 1, 'estado': 'realizado'},
+        {'op': 'estado', 'id': 2, 'estado': 'omitido'},
+        {'op': 'fx', 'id': True, 'needs_fx': False},
+        {'op': 'dialogo', 'id': 3, 'version': '4', 'dialogo': 'x'},
+        {'op': 'timecode', 'id': 4, 'tc_in': 100},
+        {'op': 'borrar', 'id': 5},
+        'estado',
+    ]
+    respuesta = cliente.post('/api/intervenciones/batch', json={'operaciones': operaciones})
+    assert respuesta.status_code == 400 and lotes == []
+    assert [d['indice'] for d in respuesta.get_json()['details']] == [1, 2, 3, 4, 5, 6]
+
+
+def test_endpoint(cliente, lotes):
+    operaciones = [{'op': 'fx', 'id': 1, 'version': 3, 'needs_fx': True, 'fx_note': 'Grito'},
+                   {'op': 'timecode', 'id': 2, 'tc_out': None}]
+    respuesta = cliente.post('/api/intervenciones/batch', json={'operaciones': operaciones, 'atomico': True})
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['aplicado'] and respuesta.get_json()['actualizadas'] == 2
+    # Operaciones normalizadas: fx_source por defecto y timecode con sus cambios.
+    assert lotes == [([
+        {'op': 'fx', 'id': 1, 'version': 3, 'needs_fx': True, 'fx_note': 'Grito', 'fx_source': 'manual'},
+        {'op': 'timecode', 'id': 2, 'version': None, 'cambios': {'tc_out': None}},
+    ], 5, True)]
+
+
+@pytest.mark.parametrize('resultado, status', [
+    (([{'indice': 0, 'op': 'estado', 'id': 1, 'resultado': UPDATE_CONFLICT, 'version': 4}], False), 409),
+    (None, 500),
+])
+def test_endpoint_lote_no_aplicado(cliente, monkeypatch, resultado, status):
+    monkeypatch.setattr(api_app.handler_instance, 'apply_intervention_batch', lambda *a, **kw: resultado)
+    respuesta = cliente.post('/api/intervenciones/batch',
+                             json={'operaciones': [{'op': 'estado', 'id': 1, 'version': 3, 'estado': 'realizado'}]})
+    assert respuesta.status_code == status
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""Cola de tareas: registro, planificación, reserva y ciclo del worker (sin BD)."""
+import datetime
+
+import pytest
+
+import db_handler
+import job_scheduler
+
+
+@pytest.fixture
+def consultas(monkeypatch):
+    """Sustituye db_handler.execute_query: registra y retorna None."""
+    registro = []
+    monkeypatch.setattr(db_handler, 'execute_query',
+                        lambda query, params=None, fetch_mode="all", readonly=False:
+                        registro.append((' '.join(query.split()), params)))
+    return registro
+
+
+def test_registro_de_tareas():
+    assert set(job_scheduler.MAINTENANCE_JOBS) <= set(job_scheduler.JOBS)
+    assert set(job_scheduler.DEFAULT_JOB_BY_TIPO.values()) <= set(job_scheduler.JOBS)
+    with pytest.raises(ValueError):
+        job_scheduler.enqueue_job('no_existe')
+
+
+def test_next_run_time():
+    ahora = datetime.datetime(2025, 5, 7, 10, 0, tzinfo=datetime.timezone.utc)
+    siguiente = job_scheduler.next_run_time('30 * * * *', ahora)
+    assert siguiente > ahora and siguiente.minute == 30
+    with pytest.raises(ValueError):
+        job_scheduler.parse_schedule('cada hora')
+
+
+def test_schedule_due_jobs(fake_tx):
+    configs = [
+        {'id': 1, 'tipo': 'import', 'sala_id': 3, 'schedule': '0 6 * * *', 'config': None, 'next_run_at': None},
+        {'id': 2, 'tipo': 'export', 'sala_id': None, 'schedule': '0 * * * *',
+         'config': {'export_path': '/x'}, 'next_run_at': datetime.datetime(2025, 5, 7)},
+        {'id': 3, 'tipo': 'import', 'sala_id': None, 'schedule': 'mal', 'config': None, 'next_run_at': None},
+    ]
+    fake_tx.respuestas = lambda sql, params: configs if 'FOR UPDATE SKIP LOCKED' in sql else {'id': 99}
+
+    assert job_scheduler.schedule_due_jobs() == 1
+    sentencias = [(sql.split()[0], sql.split()[2] if sql.startswith('INSERT') else None, params)
+                  for sql, params, _ in fake_tx.ejecutado[1:]]
+    # La 1 (recién activada) solo fija next_run_at; la 2 encola; la 3 se desactiva.
+    assert sentencias[0][0] == 'UPDATE' and sentencias[0][2][1:] == (False, 1)
+    assert sentencias[1][:2] == ('INSERT', '"JobRun"')
+    assert sentencias[1][2][:3] == ('export_convo_cierre', 2, None)
+    assert sentencias[2][0] == 'UPDATE' and sentencias[2][2][1:] == (True, 2)
+    assert sentencias[3] == ('UPDATE', None, (3,))
+
+
+def test_claim_jobs(fake_tx, monkeypatch):
+    monkeypatch.setattr(job_scheduler, 'JOB_MAX_PER_SALA', 2)
+    fake_tx.respuestas = lambda sql, params: [{'id': 1}] if 'RETURNING' in sql else None
+    assert job_scheduler.claim_jobs('w1', 3) == [{'id': 1}]
+    (lock, lock_params, _), (_, params, _) = fake_tx.ejecutado
+    assert lock.startswith('SELECT pg_advisory_xact_lock') and lock_params == (job_scheduler._CLAIM_LOCK_KEY,)
+    assert params == {'scan': 30, 'per_sala': 2, 'limit': 3, 'worker': 'w1'}
+
+
+def test_claim_jobs_sin_hueco_no_toca_la_bd(fake_tx):
+    assert job_scheduler.claim_jobs('w1', 0) == []
+    assert fake_tx.ejecutado == []
+
+
+def _job_run(job, intentos=1, max_intentos=3):
+    return {'id': 7, 'job': job, 'sala_id': 2, 'params': {'a': 1}, 'intentos': intentos, 'max_intentos': max_intentos}
+
+
+def test_run_job_ok(consultas, monkeypatch):
+    monkeypatch.setitem(job_scheduler.JOBS, 'prueba', lambda params, sala_id: {'params': params, 'sala': sala_id})
+    job_scheduler.run_job(_job_run('prueba'))
+    (sql, params), = consultas
+    assert "estado = 'ok'" in sql and params == ('{"params": {"a": 1}, "sala": 2}', 7)
+
+
+@pytest.mark.parametrize('intentos, estado, espera', [(1, 'pendiente', 30.0), (2, 'pendiente', 60.0), (3, 'fallido', 120.0)])
+def test_run_job_reintento_con_backoff(consultas, monkeypatch, intentos, estado, espera):
+    monkeypatch.setattr(job_scheduler, 'JOB_BACKOFF_BASE', 30.0)
+
+    def falla(params, sala_id):
+        raise job_scheduler.JobError('sin fichero')
+    monkeypatch.setitem(job_scheduler.JOBS, 'prueba', falla)
+    job_scheduler.run_job(_job_run('prueba', intentos=intentos))
+    (_, params), = consultas
+    assert params == (estado, 'sin fichero', estado == 'fallido', espera, 7)
+
+
+def test_poll_once(consultas, monkeypatch):
+    encolados, reservas, llamadas = [], [], []
+    monkeypatch.setattr(job_scheduler, 'enqueue_job', lambda job, **kwargs: encolados.append(job))
+    monkeypatch.setattr(job_scheduler, 'schedule_due_jobs', lambda: llamadas.append('schedule'))
+    monkeypatch.setattr(job_scheduler, 'requeue_stale_jobs', lambda: llamadas.append('requeue'))
+    monkeypatch.setitem(job_scheduler.JOBS, 'prueba', lambda params, sala_id: 'hecho')
+
+    def claim_jobs(worker_name, limit):
+        reservas.append((worker_name, limit))
+        return [_job_run('prueba')] if len(reservas) == 1 else []
+    monkeypatch.setattr(job_scheduler, 'claim_jobs', claim_jobs)
+
+    worker = job_scheduler.JobWorker(workers=2, poll_interval=0)
+    try:
+        worker.poll_once()
+        worker.poll_once()
+    finally:
+        worker._executor.shutdown(wait=True)
+
+    # El mantenimiento se encola una vez por intervalo, no en cada sondeo.
+    assert encolados == list(job_scheduler.MAINTENANCE_JOBS)
+    assert llamadas == ['schedule', 'requeue'] * 2
+    assert reservas[0] == (worker.name, 2)
+    assert worker._active == 0
+    assert any("estado = 'ok'" in sql and params[1] == 7 for sql, params in consultas)
+
+
+def test_poll_once_no_apila_mantenimiento_pendiente(monkeypatch):
+    monkeypatch.setattr(db_handler, 'execute_query', lambda *args, **kwargs: {'?column?': 1})
+    encolados = []
+    monkeypatch.setattr(job_scheduler, 'enqueue_job', lambda job, **kwargs: encolados.append(job))
+    monkeypatch.setattr(job_scheduler, 'schedule_due_jobs', lambda: 0)
+    monkeypatch.setattr(job_scheduler, 'requeue_stale_jobs', lambda: 0)
+    monkeypatch.setattr(job_scheduler, 'claim_jobs', lambda worker_name, limit: [])
+    worker = job_scheduler.JobWorker(workers=1)
+    try:
+        worker.poll_once()
+    finally:
+        worker._executor.shutdown(wait=True)
+    assert encolados == []
+
+
+@pytest.mark.parametrize('hoy, meses, limite', [
+    (datetime.date(2025, 5, 7), 1, datetime.date(2025, 5, 1)),      # solo el mes en curso
+    (datetime.date(2025, 5, 31), 2, datetime.date(2025, 4, 1)),
+    (datetime.date(2025, 1, 1), 1, datetime.date(2025, 1, 1)),
+    (datetime.date(2025, 1, 15), 2, datetime.date(2024, 12, 1)),     # cruza el año
+    (datetime.date(2025, 3, 31), 15, datetime.date(2024, 1, 1)),
+])
+def test_limite_retencion(hoy, meses, limite):
+    assert job_scheduler._limite_retencion(hoy, meses) == limite
+
+
+def test_mantener_auditoria_borra_lo_anterior_al_limite(fake_tx, monkeypatch):
+    class Hoy(datetime.date):
+        @classmethod
+        def today(cls):
+            return cls(2025, 5, 7)
+    monkeypatch.setattr(job_scheduler.datetime, 'date', Hoy)
+    fake_tx.respuestas = lambda sql, params: ({'n': 1} if 'crear_particiones_auditoria' in sql
+                                              else [{'relname': 'Auditoria_2025_04'}] if 'pg_inherits' in sql else None)
+
+    resultado = job_scheduler.mantener_auditoria({'retencion_meses': 1, 'meses_adelante': 2}, None)
+    assert resultado == {'creadas': 1, 'borradas': ['Auditoria_2025_04']}
+    (_, crear, _), (_, limite, _), (drop, _, _) = fake_tx.ejecutado
+    assert crear == (datetime.date(2025, 5, 7), 3) and limite == (datetime.date(2025, 5, 1),)
+    assert drop == 'DROP TABLE "Auditoria_2025_04";'
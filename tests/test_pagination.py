@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""Paginación por keyset: filtros, cursor y consulta de cada página."""
+import datetime
+
+import pytest
+
+import pagination
+from pagination import Filter, Listing, PaginationError
+
+LISTADO = Listing(
+    source='"Serie" s',
+    columns='s.id, s.nombre',
+    sorts={'id': 's.id', 'nombre': 's.nombre', 'creada': 's.created_at'},
+    default_sort='nombre',
+    filters={
+        'id': Filter('s.id = %(id)s', 'int'),
+        'activa': Filter('s.activa = %(activa)s', 'bool'),
+        'q': Filter('s.nombre ILIKE %(q)s', 'contains'),
+        'estado': Filter('s.estado = %(estado)s', 'enum', choices=('abierta', 'cerrada')),
+        'desde': Filter('s.created_at >= %(desde)s', 'datetime'),
+    },
+    key='s.id',
+)
+
+
+@pytest.mark.parametrize('kind, raw, esperado', [
+    ('int', ' 7 ', 7),
+    ('bool', 'Sí', True),
+    ('bool', 'no', False),
+    ('bool', True, True),
+    ('datetime', '2025-05-07T10:00:00', datetime.datetime(2025, 5, 7, 10)),
+    ('contains', '50%_a\\b', '%50\\%\\_a\\\\b%'),
+    ('text', ' hola ', 'hola'),
+])
+def test_filter_parse(kind, raw, esperado):
+    assert Filter('x', kind).parse('f', raw) == esperado
+
+
+@pytest.mark.parametrize('kind, raw', [('int', 'siete'), ('int', True), ('bool', 'quizá'), ('datetime', 'ayer')])
+def test_filter_parse_invalido(kind, raw):
+    with pytest.raises(PaginationError):
+        Filter('x', kind).parse('f', raw)
+
+
+def test_filter_enum():
+    filtro = Filter('x', 'enum', choices=('a', 'b'))
+    assert filtro.parse('f', 'a') == 'a'
+    with pytest.raises(PaginationError):
+        filtro.parse('f', 'c')
+
+
+@pytest.mark.parametrize('value', [None, 3, 'Serie ñ', '2025-05-07T10:00:00'])
+def test_cursor_ida_y_vuelta(value):
+    cursor = pagination.encode_cursor('nombre', 'desc', value, 42)
+    assert '=' not in cursor
+    assert pagination.decode_cursor(cursor) == ('nombre', 'desc', value, 42)
+
+
+def test_cursor_con_fecha():
+    cursor = pagination.encode_cursor('creada', 'asc', datetime.datetime(2025, 5, 7, 10), 1)
+    assert pagination.decode_cursor(cursor)[2] == '2025-05-07T10:00:00'
+
+
+@pytest.mark.parametrize('cursor', ['no-es-base64!', 'e30', pagination.encode_cursor('a', 'b', 'c', 1)[:-3]])
+def test_cursor_invalido(cursor):
+    with pytest.raises(PaginationError):
+        pagination.decode_cursor(cursor)
+
+
+def test_where_ignora_vacios_y_rechaza_desconocidos():
+    clauses, params = LISTADO.where({'id': '3', 'q': '', 'activa': None})
+    assert clauses == ['s.id = %(id)s'] and params == {'id': 3}
+    with pytest.raises(PaginationError):
+        LISTADO.where({'otro': '1'})
+
+
+def test_query_primera_pagina():
+    sql, params, sort, order, limit = LISTADO.query({'estado': 'abierta'})
+    assert (sort, order, limit) == ('nombre', 'asc', pagination.PAGE_SIZE_DEFAULT)
+    assert params == {'estado': 'abierta', '_limit': pagination.PAGE_SIZE_DEFAULT + 1}
+    assert 'WHERE s.estado = %(estado)s' in sql
+    assert 'ORDER BY s.nombre ASC, s.id ASC' in sql
+    assert '_cursor' not in sql.split('FROM')[1]
+
+
+def test_query_con_cursor_usa_keyset():
+    cursor = pagination.encode_cursor('nombre', 'desc', 'M', 10)
+    sql, params, *_ = LISTADO.query(sort='nombre', order='DESC', cursor=cursor, limit='20')
+    assert '(s.nombre, s.id) < (%(_cursor_value)s, %(_cursor_id)s)' in sql
+    assert 'ORDER BY s.nombre DESC, s.id DESC' in sql
+    assert params == {'_cursor_value': 'M', '_cursor_id': 10, '_limit': 21}
+
+
+def test_query_con_cursor_por_la_clave():
+    cursor = pagination.encode_cursor('id', 'asc', 10, 10)
+    sql, params, *_ = LISTADO.query(sort='id', cursor=cursor)
+    assert 's.id > %(_cursor_id)s' in sql and '_cursor_value' not in params
+    assert 'ORDER BY s.id ASC' in sql and 's.id ASC, s.id' not in sql
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'sort': 'otro'},
+    {'order': 'arriba'},
+    {'limit': 0},
+    {'limit': pagination.PAGE_SIZE_MAX + 1},
+    {'limit': 'diez'},
+    {'sort': 'nombre', 'cursor': pagination.encode_cursor('id', 'asc', 1, 1)},
+    {'sort': 'nombre', 'order': 'asc', 'cursor': pagination.encode_cursor('nombre', 'desc', 'a', 1)},
+])
+def test_query_invalida(kwargs):
+    with pytest.raises(PaginationError):
+        LISTADO.query(**kwargs)
+
+
+def test_count_query():
+    sql, params = LISTADO.count_query({'id': 1})
+    assert sql.startswith('SELECT COUNT(*) AS total FROM "Serie" s WHERE s.id = %(id)s') and params == {'id': 1}
+    sql, _ = LISTADO.count_query(explain=True)
+    assert sql.startswith('EXPLAIN (FORMAT JSON) SELECT 1 FROM "Serie" s')
+
+
+def _filas(ids):
+    return [{'id': i, 'nombre': f"S{i:03d}", '_cursor_value': f"S{i:03d}", '_cursor_id': i} for i in ids]
+
+
+def test_page_recorta_y_da_cursor():
+    pagina = LISTADO.page(_filas([1, 2, 3]), 'nombre', 'asc', 2)
+    assert pagina['items'] == [{'id': 1, 'nombre': 'S001'}, {'id': 2, 'nombre': 'S002'}]
+    assert pagination.decode_cursor(pagina['next_cursor']) == ('nombre', 'asc', 'S002', 2)
+
+
+def test_page_ultima():
+    pagina = LISTADO.page(_filas([1, 2]), 'nombre', 'asc', 2)
+    assert pagina == {'items': [{'id': 1, 'nombre': 'S001'}, {'id': 2, 'nombre': 'S002'}], 'next_cursor': None}
+
+
+def test_recorrido_completo_sin_huecos_ni_repetidos():
+    # Simula la BD aplicando la condición del keyset sobre una lista ordenada.
+    filas = _filas(range(1, 24))
+    vistos, cursor = [], None
+    while True:
+        _, params, sort, order, limit = LISTADO.query(sort='nombre', cursor=cursor, limit=5)
+        restantes = [f for f in filas if cursor is None
+                     or (f['_cursor_value'], f['_cursor_id']) > (params['_cursor_value'], params['_cursor_id'])]
+        pagina = LISTADO.page(restantes[:params['_limit']], sort, order, limit)
+        vistos += [f['id'] for f in pagina['items']]
+        cursor = pagina['next_cursor']
+        if cursor is None:
+            break
+    assert vistos == list(range(1, 24))
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""bcrypt fuera de los hilos de petición: admisión, rehash transparente y sesión cacheada del usuario."""
+import concurrent.futures
+
+import bcrypt
+import pytest
+
+import api_app
+import db_handler
+from cache import cache
+from password_pool import PasswordPool, PasswordPoolBusy, hash_cost
+
+
+class Executor:
+    """Sustituto del ProcessPoolExecutor: ejecuta en el momento o, con `retener`, deja el Future pendiente."""
+
+    def __init__(self):
+        self.retener = False
+        self.pendientes = []
+
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        if self.retener:
+            self.pendientes.append((future, fn, args))
+        else:
+            future.set_result(fn(*args))
+        return future
+
+    def completar(self):
+        future, fn, args = self.pendientes.pop(0)
+        future.set_result(fn(*args))
+
+
+@pytest.fixture
+def executor():
+    return Executor()
+
+
+@pytest.fixture
+def pool(executor):
+    pool = PasswordPool(workers=1, max_pending=2, admission_timeout=0.01, timeout=0.05, rounds=5)
+    pool._executor = executor
+    return pool
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def test_check_y_hash(pool):
+    password_hash = pool.hash_password('secreta')
+    assert hash_cost(password_hash) == 5
+    assert pool.check_password('secreta', password_hash)
+    assert not pool.check_password('otra', password_hash)
+    assert not pool.check_password('secreta', 'no-es-un-hash')
+    assert pool.stats()['in_flight'] == 0 and pool.stats()['completed'] == 4
+
+
+def test_rechazo_por_saturacion(pool, executor):
+    password_hash = _hash('secreta', 4)
+    executor.retener = True
+    assert pool.rehash_in_background('a', lambda h: None) and pool.rehash_in_background('b', lambda h: None)
+    # Sin hueco: el login no se encola, falla en admission_timeout.
+    with pytest.raises(PasswordPoolBusy):
+        pool.check_password('secreta', password_hash)
+    assert not pool.rehash_in_background('c', lambda h: None)     # el rehash no espera hueco
+    assert pool.stats()['rejected'] == 2 and pool.stats()['in_flight'] == 2
+
+    executor.completar()
+    executor.retener = False
+    assert pool.check_password('secreta', password_hash)
+    assert pool.stats()['in_flight'] == 1
+
+
+def test_sin_respuesta_a_tiempo(pool, executor):
+    executor.retener = True
+    with pytest.raises(PasswordPoolBusy):
+        pool.check_password('secreta', _hash('secreta', 4))
+    # El hueco sigue ocupado hasta que la operación termina de verdad.
+    assert pool.stats()['in_flight'] == 1
+    executor.completar()
+    assert pool.stats()['in_flight'] == 0
+
+
+@pytest.fixture
+def login(monkeypatch, pool):
+    """Login contra un usuario en memoria, con el pool de la fixture y sin auditoría."""
+    usuario = {'id': 5, 'nombre': 'ana', 'rol': 'tecnico', 'activo': True, 'password_hash': _hash('secreta', 4)}
+    guardados = []
+    monkeypatch.setattr(api_app, 'password_pool', pool)
+    monkeypatch.setattr(api_app.handler_instance, 'get_usuario_login',
+                        lambda nombre: dict(usuario) if nombre == 'ana' else None)
+    monkeypatch.setattr(api_app.handler_instance, 'update_password_hash',
+                        lambda usuario_id, nuevo: guardados.append((usuario_id, nuevo)))
+    monkeypatch.setattr(db_handler, 'audit_log', lambda *args, **kwargs: None)
+    cliente = api_app.app.test_client()
+    cliente.usuario, cliente.guardados = usuario, guardados
+    return cliente
+
+
+def test_login_rehash_transparente(login, pool):
+    respuesta = login.post('/api/login', json={'nombre': 'ana', 'password': 'secreta'})
+    assert respuesta.status_code == 200
+    (usuario_id, nuevo), = login.guardados
+    assert usuario_id == 5 and hash_cost(nuevo) == pool.rounds and bcrypt.checkpw(b'secreta', nuevo.encode())
+    assert pool.stats()['rehashed'] == 1
+
+    # Con el coste actual ya no se recalcula.
+    login.usuario['password_hash'] = nuevo
+    assert login.post('/api/login', json={'nombre': 'ana', 'password': 'secreta'}).status_code == 200
+    assert len(login.guardados) == 1
+
+
+def test_login_fallido_no_rehash(login):
+    assert login.post('/api/login', json={'nombre': 'ana', 'password': 'mala'}).status_code == 401
+    login.usuario['activo'] = False
+    assert login.post('/api/login', json={'nombre': 'ana', 'password': 'secreta'}).status_code == 403
+    assert login.guardados == []
+
+
+def test_login_saturado_responde_503(login, executor):
+    executor.retener = True
+    respuesta = login.post('/api/login', json={'nombre': 'ana', 'password': 'secreta'})
+    assert respuesta.status_code == 503 and respuesta.headers['Retry-After'] == '1'
+
+
+@pytest.fixture
+def usuarios(monkeypatch):
+    """Usuarios en "BD" para get_usuario_sesion (con la caché real) y update_usuario."""
+    filas = {5: {'id': 5, 'nombre': 'ana', 'rol': 'admin', 'activo': True}}
+    lecturas = []
+
+    def cargar(usuario_id):
+        lecturas.append(usuario_id)
+        return dict(filas[usuario_id]) if usuario_id in filas else None
+
+    def execute_query(query, params=None, fetch_mode="all", readonly=False):
+        fila = filas[params['usuario_id']]
+        fila.update({k: params[k] for k in ('rol', 'activo') if params[k] is not None})
+        return dict(fila)
+
+    monkeypatch.setattr(api_app.handler_instance, '_load_usuario_sesion', cargar)
+    monkeypatch.setattr(db_handler, 'execute_query', execute_query)
+    monkeypatch.setattr(cache, '_synced', True)
+    cache.invalidate('usuario')
+    return filas, lecturas
+
+
+def _cliente_con_sesion(user_id):
+    api_app.app.config['TESTING'] = True
+    cliente = api_app.app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion['user_id'] = user_id
+    return cliente
+
+
+def test_sesion_cacheada_hasta_cambio_de_rol(usuarios):
+    filas, lecturas = usuarios
+    cliente = _cliente_con_sesion(5)
+    assert cliente.get('/api/admin/change-feed').status_code == 200
+    assert cliente.get('/api/admin/change-feed').status_code == 200
+    assert lecturas == [5]      # la segunda petición sale de la caché
+
+    assert api_app.handler_instance.update_usuario(5, {'rol': 'tecnico'}, 1)['rol'] == 'tecnico'
+    assert cliente.get('/api/admin/change-feed').status_code == 403
+    assert lecturas == [5, 5]
+
+
+def test_desactivar_cierra_la_sesion(usuarios):
+    filas, lecturas = usuarios
+    cliente = _cliente_con_sesion(5)
+    assert cliente.get('/api/admin/change-feed').status_code == 200
+    api_app.handler_instance.update_usuario(5, {'activo': False}, 1)
+    assert cliente.get('/api/admin/change-feed').status_code == 401
+    with cliente.session_transaction() as sesion:
+        assert 'user_id' not in sesion
+    # Sin sesión ya no se consulta al usuario.
+    assert cliente.get('/api/admin/change-feed').status_code == 401 and lecturas == [5, 5]
+
+
+def test_usuario_borrado(usuarios):
+    filas, _ = usuarios
+    cliente = _cliente_con_sesion(5)
+    del filas[5]
+    assert cliente.get('/api/admin/change-feed').status_code == 401
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""Sentencias preparadas: traducción de marcadores, registro e invalidación por conexión."""
+import collections
+import types
+
+import psycopg2.errors
+import pytest
+
+import prepared_statements
+from prepared_statements import Statement
+
+Column = collections.namedtuple('Column', 'name')
+
+
+class FakeCursor:
+    """Cursor de tuplas que registra lo ejecutado; `fallos` mapea prefijo de SQL -> excepción."""
+
+    def __init__(self, rows=(), columns=('id', 'nombre'), fallos=None):
+        self.rows = list(rows)
+        self.description = [Column(c) for c in columns]
+        self.rowcount = len(self.rows)
+        self.fallos = dict(fallos or {})
+        self.ejecutado = []
+
+    def execute(self, sql, params=None):
+        self.ejecutado.append((sql, params))
+        for prefijo, error in list(self.fallos.items()):
+            if sql.startswith(prefijo):
+                del self.fallos[prefijo]
+                raise error
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+def _conexion():
+    return types.SimpleNamespace(prepared=set(), stale=set())
+
+
+@pytest.fixture(autouse=True)
+def registro_limpio(monkeypatch):
+    monkeypatch.setattr(prepared_statements, '_registry', {})
+    monkeypatch.setattr(prepared_statements, '_by_sql', {})
+    monkeypatch.setattr(prepared_statements, '_counters', {'prepares': 0, 'executions': 0, 'invalidated': 0})
+    monkeypatch.setattr(prepared_statements, 'DB_PREPARED_STATEMENTS', True)
+
+
+def test_marcadores_posicionales():
+    st = Statement('s_pos', 'SELECT * FROM "Take" WHERE sala = %s AND fecha = %s;')
+    assert st.prepare_sql == 'PREPARE s_pos AS SELECT * FROM "Take" WHERE sala = $1 AND fecha = $2'
+    assert st.execute_sql == 'EXECUTE s_pos (%s, %s)'
+    assert st.param_names is None and not st.writes
+    assert st.bind(['A', '2025-05-07']) == ('A', '2025-05-07')
+
+
+def test_marcadores_con_nombre_repetidos():
+    st = Statement('s_nom', 'UPDATE t SET a = %(a)s, b = %(b)s WHERE a <> %(a)s AND x LIKE \'%%z\'')
+    assert st.prepare_sql == "PREPARE s_nom AS UPDATE t SET a = $1, b = $2 WHERE a <> $1 AND x LIKE '%z'"
+    assert st.execute_sql == 'EXECUTE s_nom (%s, %s)'
+    assert st.writes
+    assert st.bind({'b': 2, 'a': 1, 'sobra': 3}) == (1, 2)
+
+
+def test_sin_parametros():
+    st = Statement('s_sin', 'SELECT 1')
+    assert st.execute_sql == 'EXECUTE s_sin' and st.bind(None) == ()
+
+
+def test_mezcla_de_marcadores():
+    with pytest.raises(ValueError):
+        Statement('s_mix', 'SELECT %s, %(a)s')
+
+
+def test_fetch():
+    st = Statement('s_fetch', 'SELECT id, nombre FROM t')
+    filas = st.fetch(FakeCursor([(1, 'a'), (2, 'b')]), 'all')
+    assert [f.nombre for f in filas] == ['a', 'b'] and filas[0]._fields == ('id', 'nombre')
+    assert st.fetch(FakeCursor([(1, 'a')]), 'one').id == 1
+    assert st.fetch(FakeCursor([]), 'one') is None
+    assert st.fetch(FakeCursor([(1, 'a')] * 3), 'none') == 3
+    with pytest.raises(ValueError):
+        st.fetch(FakeCursor(), 'muchas')
+
+
+def test_row_type_se_rehace_si_cambian_las_columnas():
+    st = Statement('s_cols', 'SELECT * FROM t')
+    primero = st.row_type(FakeCursor().description)
+    assert st.row_type(FakeCursor().description) is primero
+    assert st.row_type(FakeCursor(columns=('id', 'class')).description)._fields == ('id', '_1')
+
+
+def test_register():
+    st = prepared_statements.register('s_reg', 'SELECT 1')
+    assert prepared_statements.register('s_reg', 'SELECT 1') is st
+    with pytest.raises(ValueError):
+        prepared_statements.register('s_reg', 'SELECT 2')
+
+
+def test_register_variant():
+    a = prepared_statements.register_variant('upd', 'UPDATE t SET a = %s')
+    assert a.name.startswith('upd_') and len(a.name) == len('upd_') + 12
+    assert prepared_statements.register_variant('upd', 'UPDATE t SET a = %s') is a
+    assert prepared_statements.register_variant('upd', 'UPDATE t SET b = %s').name != a.name
+
+
+def test_execute_prepara_una_vez_por_conexion():
+    st = Statement('s_exec', 'SELECT id, nombre FROM t WHERE id = %s')
+    conn, cursor = _conexion(), FakeCursor([(1, 'a')])
+    prepared_statements.execute(conn, cursor, st, (1,), 'one')
+    prepared_statements.execute(conn, cursor, st, (2,), 'one')
+    assert [sql for sql, _ in cursor.ejecutado] == [st.prepare_sql, st.execute_sql, st.execute_sql]
+    assert cursor.ejecutado[-1][1] == (2,)
+    assert conn.prepared == {'s_exec'}
+
+    otra = _conexion()
+    prepared_statements.execute(otra, cursor, st, (3,), 'one')
+    assert cursor.ejecutado[-2][0] == st.prepare_sql
+    assert prepared_statements.stats()['prepares'] == 2 and prepared_statements.stats()['executions'] == 3
+
+
+def test_execute_sin_preparar():
+    prepared_statements.DB_PREPARED_STATEMENTS = False
+    st = Statement('s_texto', 'SELECT id, nombre FROM t WHERE id = %s')
+    cursor = FakeCursor([(1, 'a')])
+    assert prepared_statements.execute(object(), cursor, st, (1,), 'one').nombre == 'a'
+    assert cursor.ejecutado == [(st.sql, (1,))]
+
+
+def test_execute_exige_preparing_connection():
+    with pytest.raises(TypeError):
+        prepared_statements.execute(object(), FakeCursor(), Statement('s_tipo', 'SELECT 1'))
+
+
+def test_sentencia_perdida_se_vuelve_a_preparar():
+    # Tras un DISCARD ALL la sesión ya no la tiene: falla esa ejecución y la siguiente la prepara.
+    st = Statement('s_perdida', 'SELECT id, nombre FROM t')
+    conn = _conexion()
+    conn.prepared.add('s_perdida')
+    cursor = FakeCursor([(1, 'a')], fallos={'EXECUTE': psycopg2.errors.InvalidSqlStatementName()})
+    with pytest.raises(psycopg2.errors.InvalidSqlStatementName):
+        prepared_statements.execute(conn, cursor, st)
+    assert 's_perdida' not in conn.prepared and not conn.stale
+
+    prepared_statements.execute(conn, cursor, st)
+    assert [sql for sql, _ in cursor.ejecutado] == [st.execute_sql, st.prepare_sql, st.execute_sql]
+    assert prepared_statements.stats()['invalidated'] == 1
+
+
+def test_plan_obsoleto_hace_deallocate_y_prepare():
+    # "cached plan must not change result type": la sesión aún la tiene, hay que soltarla antes.
+    st = Statement('s_obsoleta', 'SELECT * FROM t')
+    conn = _conexion()
+    conn.prepared.add('s_obsoleta')
+    cursor = FakeCursor([(1, 'a')], fallos={'EXECUTE': psycopg2.errors.FeatureNotSupported()})
+    with pytest.raises(psycopg2.errors.FeatureNotSupported):
+        prepared_statements.execute(conn, cursor, st)
+    assert conn.stale == {'s_obsoleta'} and not conn.prepared
+
+    prepared_statements.execute(conn, cursor, st)
+    assert [sql for sql, _ in cursor.ejecutado[1:]] == ['DEALLOCATE s_obsoleta', st.prepare_sql, st.execute_sql]
+    assert conn.prepared == {'s_obsoleta'} and not conn.stale
+
+
+def test_prepare_duplicado_marca_la_sentencia():
+    st = Statement('s_dup', 'SELECT 1')
+    conn = _conexion()
+    cursor = FakeCursor(fallos={'PREPARE': psycopg2.errors.DuplicatePreparedStatement()})
+    with pytest.raises(psycopg2.errors.DuplicatePreparedStatement):
+        prepared_statements.execute(conn, cursor, st)
+    assert conn.prepared == {'s_dup'}
+    prepared_statements.execute(conn, cursor, st, fetch_mode='none')
+    assert cursor.ejecutado[-1][0] == 'EXECUTE s_dup'
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Versionado del esquema: migraciones ordenadas y comprobación de arranque."""
+import re
+
+import pytest
+
+import db_handler
+from db_handler import SchemaError
+
+
+class Cursor:
+    def __init__(self, respuestas):
+        self.respuestas = list(respuestas)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchone(self):
+        return self.respuestas.pop(0)
+
+
+class Conexion:
+    def __init__(self, *respuestas):
+        self.respuestas = respuestas
+        self.cerrada = False
+
+    def cursor(self):
+        return Cursor(self.respuestas)
+
+    def close(self):
+        self.cerrada = True
+
+
+@pytest.mark.parametrize('respuestas, version', [
+    ([(False, False)], None),
+    ([(False, True)], 0),
+    ([(True, True), (1,)], 1),
+    ([(True, True), (None,)], 0),
+])
+def test_get_schema_version(respuestas, version):
+    assert db_handler.get_schema_version(Conexion(*respuestas)) == version
+
+
+def test_migraciones_del_repositorio():
+    migraciones = db_handler.list_migrations()
+    assert [version for version, _ in migraciones] == list(range(1, db_handler.SCHEMA_VERSION + 1))
+
+
+def test_schema_sql_registra_la_version_actual():
+    with open('schema.sql', encoding='utf-8') as f:
+        versiones = re.findall(r'INSERT INTO "SchemaVersion" \(version\) VALUES \((\d+)\)', f.read())
+    assert versiones == [str(db_handler.SCHEMA_VERSION)]
+
+
+@pytest.mark.parametrize('ficheros', [
+    ['0001_a.sql', '0003_c.sql'],
+    ['0002_b.sql'],
+    [],
+])
+def test_migraciones_con_huecos(tmp_path, monkeypatch, ficheros):
+    monkeypatch.setattr(db_handler, 'MIGRATIONS_DIR', str(tmp_path))
+    monkeypatch.setattr(db_handler, 'SCHEMA_VERSION', 2)
+    for nombre in ficheros:
+        (tmp_path / nombre).write_text('SELECT 1;')
+    with pytest.raises(SchemaError):
+        db_handler.list_migrations()
+
+
+def test_migraciones_ignora_otros_ficheros(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_handler, 'MIGRATIONS_DIR', str(tmp_path))
+    monkeypatch.setattr(db_handler, 'SCHEMA_VERSION', 2)
+    for nombre in ('0002_b.sql', '0001_a.sql', 'README.md', '1_x.sql'):
+        (tmp_path / nombre).write_text('SELECT 1;')
+    assert [version for version, _ in db_handler.list_migrations()] == [1, 2]
+
+
+@pytest.fixture
+def arranque(monkeypatch):
+    """ensure_schema con la versión instalada y las acciones sustituidas."""
+    estado = {'version': None, 'acciones': []}
+    monkeypatch.setattr(db_handler, 'get_db_connection', lambda: Conexion())
+    monkeypatch.setattr(db_handler, 'get_schema_version', lambda conn: estado['version'])
+    monkeypatch.setattr(db_handler, 'initialize_database', lambda: estado['acciones'].append('schema.sql'))
+    monkeypatch.setattr(db_handler, 'apply_migrations',
+                        lambda: estado['acciones'].append('migrar') or db_handler.SCHEMA_VERSION)
+    return estado
+
+
+def test_arranque_en_la_version_actual(arranque):
+    arranque['version'] = db_handler.SCHEMA_VERSION
+    assert db_handler.ensure_schema() == db_handler.SCHEMA_VERSION
+    assert arranque['acciones'] == []
+
+
+def test_arranque_bd_vacia(arranque):
+    assert db_handler.ensure_schema(init_if_empty=True) == db_handler.SCHEMA_VERSION
+    assert arranque['acciones'] == ['schema.sql']
+    with pytest.raises(SchemaError):
+        db_handler.ensure_schema(init_if_empty=False)
+
+
+def test_arranque_migra_esquemas_anteriores(arranque):
+    arranque['version'] = 0
+    assert db_handler.ensure_schema(migrate=True) == db_handler.SCHEMA_VERSION
+    assert arranque['acciones'] == ['migrar']
+    with pytest.raises(SchemaError, match='migrate'):
+        db_handler.ensure_schema(migrate=False)
+
+
+def test_arranque_nunca_recrea_un_esquema_mas_nuevo(arranque):
+    arranque['version'] = db_handler.SCHEMA_VERSION + 1
+    with pytest.raises(SchemaError):
+        db_handler.ensure_schema(init_if_empty=True, migrate=True)
+    assert arranque['acciones'] == []
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""Import del XLSX clásico de series: todo o nada, por páginas y reimportable sin duplicar ni subir versión."""
+import decimal
+import io
+
+import openpyxl
+import psycopg2.errors
+import pytest
+
+import api_app
+import data_handler
+import db_handler
+from data_handler import DataHandler
+from series_import import SeriesImportError
+
+SERIES = [('serie_ref', 'nombre', 'fps'), ('SER', 'La serie', 25)]
+INTERVENCIONES = [
+    ('serie_ref', 'capitulo_numero', 'take_numero', 'personaje', 'nombre_actor', 'orden', 'dialogo', 'tc_in', 'tc_out'),
+    ('SER', 1, 1, 'ANA', 'Ana Actriz', 1, 'Hola.', '00:00:01:00', '00:00:02:00'),
+    ('SER', 1, 1, 'LUIS', 'Luis Actor', 2, 'Adiós.', '00:00:02:10', None),
+    ('SER', 2.0, 1, 'ANA', 'Ana Actriz', 1, None, None, None),
+]
+
+
+def _xlsx(**hojas):
+    """Libro en memoria con una hoja por argumento (primera fila = cabecera)."""
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for nombre, filas in hojas.items():
+        hoja = workbook.create_sheet(nombre)
+        for fila in filas:
+            hoja.append(list(fila))
+    stream = io.BytesIO()
+    workbook.save(stream)
+    stream.seek(0)
+    return stream
+
+
+@pytest.fixture
+def bd(monkeypatch, fake_tx):
+    """
+    Tablas en memoria detrás de la transacción falsa: los INSERT ... ON CONFLICT
+    se resuelven como en PostgreSQL (incluido el WHERE IS DISTINCT FROM de
+    Intervencion, que no devuelve fila si nada cambia). `bd.bitacora` recoge
+    io_log y `bd.invalidadas` la caché.
+    """
+    class Bd:
+        series, actores, personajes, capitulos, takes = {}, {}, {}, {}, {}
+        reparto = set()
+        intervenciones = {}
+        bitacora, invalidadas = [], []
+        error = None
+        tx = fake_tx
+
+    def _id(tabla):
+        return len(tabla) + 1
+
+    def respuestas(sql, params):
+        if 'FROM "Serie"' in sql:
+            return [{'id': i, 'referencia': ref, 'fps': fps} for ref, (i, fps) in Bd.series.items()]
+        if 'FROM "Actor"' in sql:
+            return [{'id': i, 'nombre': n} for n, i in Bd.actores.items()]
+        if 'FROM "Personaje"' in sql:
+            return [{'id': i, 'nombre': n} for n, i in Bd.personajes.items()]
+        if 'FROM "Capitulo" c' in sql:
+            (serie_id,) = params
+            filas = []
+            for (s, numero), capitulo_id in Bd.capitulos.items():
+                takes = [(n, t) for (c, n), t in Bd.takes.items() if c == capitulo_id] or [(None, None)]
+                filas += [{'capitulo_id': capitulo_id, 'capitulo_numero': numero, 'take_id': t, 'take_numero': n}
+                          for n, t in takes if s == serie_id]
+            return filas
+        if 'INSERT INTO "Serie"' in sql:
+            if Bd.error:
+                raise Bd.error
+            filas = []
+            for ref, _nombre, fps in params:
+                serie_id = Bd.series.get(ref, (_id(Bd.series), None))[0]
+                Bd.series[ref] = (serie_id, decimal.Decimal(str(fps)).quantize(decimal.Decimal('0.001')))
+                filas.append({'id': serie_id, 'referencia': ref, 'fps': Bd.series[ref][1]})
+            return filas
+        if 'INSERT INTO "Actor"' in sql or 'INSERT INTO "Personaje"' in sql:
+            tabla = Bd.actores if 'INSERT INTO "Actor"' in sql else Bd.personajes
+            filas = []
+            for fila in params:
+                tabla[fila[0]] = _id(tabla)
+                filas.append({'id': tabla[fila[0]], 'nombre': fila[0]})
+            return filas
+        if 'INSERT INTO "Capitulo"' in sql or 'INSERT INTO "Take"' in sql:
+            tabla, padre = (Bd.capitulos, 'serie_id') if 'INSERT INTO "Capitulo"' in sql else (Bd.takes, 'capitulo_id')
+            filas = []
+            for padre_id, numero, _ in params:
+                tabla.setdefault((padre_id, numero), _id(tabla))
+                filas.append({'id': tabla[(padre_id, numero)], padre: padre_id, 'numero': numero})
+            return filas
+        if 'INSERT INTO "PersonajeEnCapitulo"' in sql:
+            Bd.reparto.update(params)
+            return None
+        if 'INSERT INTO "Intervencion"' in sql:
+            filas = []
+            for take_id, personaje_id, orden, dialogo, tc_in, tc_out, tc_in_frames, tc_out_frames in params:
+                actual = Bd.intervenciones.get((take_id, orden))
+                nueva = {'personaje_id': personaje_id, 'dialogo': dialogo, 'tc_in': tc_in, 'tc_out': tc_out,
+                         'tc_in_frames': tc_in_frames, 'tc_out_frames': tc_out_frames}
+                if actual is None:
+                    Bd.intervenciones[(take_id, orden)] = {**nueva, 'version': 1}
+                    filas.append({'insertada': True})
+                elif any(actual[k] != nueva[k] for k in ('personaje_id', 'dialogo', 'tc_in', 'tc_out')):
+                    actual.update(nueva, version=actual['version'] + 1)
+                    filas.append({'insertada': False})
+            return filas
+        return None
+
+    fake_tx.respuestas = respuestas
+    monkeypatch.setattr(db_handler, 'io_log', lambda tipo, estado, mensaje, **kw: Bd.bitacora.append((estado, kw)))
+    monkeypatch.setattr(data_handler.cache, 'invalidate', lambda ns, key=None: Bd.invalidadas.append(ns))
+    monkeypatch.setattr(data_handler, 'IMPORT_PAGE_SIZE', 2)
+    return Bd
+
+
+def _importar(**hojas):
+    return DataHandler().import_series_xlsx(_xlsx(**hojas), filename='series.xlsx', user_id=5)
+
+
+def _paginas(tx, tabla):
+    return [len(filas) for sql, filas in tx.values if f'INSERT INTO "{tabla}"' in sql]
+
+
+def test_import_completo(bd):
+    resultado = _importar(series=SERIES, actores=[('nombre_actor',), ('Ana Actriz',)], intervenciones=INTERVENCIONES)
+    assert {k: resultado[k] for k in ('series', 'capitulos', 'takes', 'actores_nuevos', 'personajes_nuevos',
+                                      'intervenciones_nuevas')} == {
+        'series': 1, 'capitulos': 2, 'takes': 2, 'actores_nuevos': 2, 'personajes_nuevos': 2,
+        'intervenciones_nuevas': 3,
+    }
+    assert resultado['filas'] == 5 and set(resultado['hojas']) == {'series', 'actores', 'intervenciones'}
+    # Intervenciones por páginas de IMPORT_PAGE_SIZE, con los frames calculados a los fps de la serie.
+    assert _paginas(bd.tx, 'Intervencion') == [2, 1]
+    assert bd.intervenciones[(1, 1)]['tc_in_frames'] == 25 and bd.intervenciones[(1, 2)]['tc_in_frames'] == 60
+    assert bd.intervenciones[(2, 1)]['dialogo'] is None
+    # El personaje nuevo se crea con su actor y entra en el reparto de cada capítulo en que habla.
+    assert bd.reparto == {(1, 1), (1, 2), (2, 1)}
+    (_, personajes), = [(sql, filas) for sql, filas in bd.tx.values if 'INSERT INTO "Personaje"' in sql]
+    assert personajes == [('ANA', bd.actores['Ana Actriz']), ('LUIS', bd.actores['Luis Actor'])]
+    assert bd.tx.confirmada and bd.invalidadas == ['reparto', 'capitulo'] and bd.bitacora[-1][0] == 'ok'
+
+
+def test_reimportar_no_duplica_ni_sube_version(bd):
+    _importar(series=SERIES, intervenciones=INTERVENCIONES)
+    antes = {clave: dict(fila) for clave, fila in bd.intervenciones.items()}
+
+    resultado = _importar(series=SERIES, intervenciones=INTERVENCIONES)
+    assert resultado['intervenciones_sin_cambios'] == 3
+    assert not any(resultado.get(k) for k in ('intervenciones_nuevas', 'intervenciones_actualizadas',
+                                              'actores_nuevos', 'personajes_nuevos', 'capitulos', 'takes'))
+    assert bd.intervenciones == antes
+    # Los nombres, capítulos y takes ya existentes se resuelven en memoria: no se reinsertan.
+    assert _paginas(bd.tx, 'Actor') == [2] and _paginas(bd.tx, 'Capitulo') == [1, 1]
+
+    cambiadas = INTERVENCIONES[:2] + [INTERVENCIONES[3][:6] + ('Nuevo texto.', None, None)]
+    resultado = _importar(series=SERIES, intervenciones=cambiadas)
+    assert (resultado['intervenciones_actualizadas'], resultado['intervenciones_sin_cambios']) == (1, 1)
+    assert bd.intervenciones[(2, 1)]['version'] == 2 and bd.intervenciones[(1, 1)]['version'] == 1
+
+
+def test_capitulos_y_takes_de_sus_hojas(bd):
+    resultado = _importar(
+        series=SERIES,
+        capitulos=[('serie_ref', 'capitulo_numero', 'titulo'), ('SER', 1, 'Piloto'), ('SER', 3, None)],
+        takes=[('serie_ref', 'capitulo_numero', 'take_numero', 'descripcion'), ('SER', 3, 7, 'Exterior')],
+        intervenciones=INTERVENCIONES,
+    )
+    (_, capitulos), *_ = [(sql, filas) for sql, filas in bd.tx.values if 'INSERT INTO "Capitulo"' in sql]
+    assert capitulos == [(1, 1, 'Piloto'), (1, 3, None)]
+    assert bd.takes[(bd.capitulos[(1, 3)], 7)] == 1
+    # Solo el capítulo 2 (que sale en intervenciones) se crea aparte.
+    assert resultado['capitulos'] == 3 and _paginas(bd.tx, 'Capitulo') == [2, 1]
+
+
+def test_serie_ref_desconocida_no_importa_nada(bd):
+    filas = INTERVENCIONES + [('OTRA', 1, 1, 'ANA', 'Ana Actriz', 3, 'x', None, None)]
+    with pytest.raises(SeriesImportError) as error:
+        _importar(series=SERIES, intervenciones=filas)
+    assert error.value.mensaje == "El fichero contiene errores; no se ha importado nada."
+    assert error.value.errores == ["Hoja 'intervenciones' fila 5: serie_ref 'OTRA' no existe."]
+    assert bd.tx.deshecha and not bd.tx.confirmada and bd.invalidadas == []
+    assert bd.bitacora == [('error', {'detalles': {'errores': error.value.errores}})]
+
+
+def test_timecode_invalido_para_los_fps(bd):
+    filas = INTERVENCIONES[:2] + [INTERVENCIONES[2][:7] + ('00:00:01:30', '1:2')]
+    with pytest.raises(SeriesImportError) as error:
+        _importar(series=SERIES, intervenciones=filas)
+    assert error.value.errores == [
+        "Hoja 'intervenciones' fila 3: 'tc_in' (00:00:01:30) no es un timecode válido a 25.000 fps.",
+        "Hoja 'intervenciones' fila 3: 'tc_out' (1:2) no es un timecode válido a 25.000 fps.",
+    ]
+    assert bd.tx.deshecha
+
+
+def test_filas_invalidas_se_acumulan(bd, monkeypatch):
+    monkeypatch.setattr(data_handler, 'IMPORT_MAX_ERRORS', 3)
+    filas = INTERVENCIONES + [
+        (None,) * 9,                                                  # fila en blanco: se salta
+        ('SER', 1, 1, None, 'Ana Actriz', 4, 'x', None, None),
+        ('SER', 1, 1, 'ANA', 'Ana Actriz', 'cinco', 'x', None, None),
+        ('SER', 1.5, 1, 'ANA', 'Ana Actriz', 6, 'x', None, None),
+        ('SER', 1, 1, 'ANA', None, 7, 'x', None, None),
+    ]
+    with pytest.raises(SeriesImportError) as error:
+        _importar(series=SERIES, intervenciones=filas)
+    # Como mucho IMPORT_MAX_ERRORS errores detallados.
+    assert error.value.errores == [
+        "Hoja 'intervenciones' fila 6: faltan personaje.",
+        "Hoja 'intervenciones' fila 7: 'orden' debe ser entero.",
+        "Hoja 'intervenciones' fila 8: 'capitulo_numero' debe ser entero.",
+    ]
+    assert bd.tx.deshecha
+
+
+@pytest.mark.parametrize('hojas, errores', [
+    ({'series': SERIES}, ["Hoja 'intervenciones' no encontrada."]),
+    ({'Series ': SERIES, 'intervenciones': [INTERVENCIONES[0][:5]]},
+     ["Hoja 'intervenciones': faltan columnas orden, dialogo."]),
+    ({'series': [('serie_ref', 'nombre', 'fps'), ('SER', 'La serie', 'PAL')], 'intervenciones': INTERVENCIONES},
+     ["Hoja 'series' fila 2: 'fps' debe ser numérico."]),
+])
+def test_estructura_invalida(bd, hojas, errores):
+    with pytest.raises(SeriesImportError) as error:
+        _importar(**hojas)
+    assert error.value.errores[:len(errores)] == errores
+    assert bd.tx.deshecha and bd.bitacora[-1][0] == 'error'
+
+
+def test_no_es_un_xlsx(bd):
+    with pytest.raises(SeriesImportError, match='no es un XLSX válido'):
+        DataHandler().import_series_xlsx(io.BytesIO(b'serie_ref;nombre'), filename='series.xlsx')
+    assert bd.tx.ejecutado == []
+
+
+def test_choque_con_datos_existentes(bd):
+    bd.error = psycopg2.errors.UniqueViolation('duplicate key value violates unique constraint "Serie_nombre_key"')
+    with pytest.raises(SeriesImportError, match='choca con datos existentes'):
+        _importar(series=SERIES, intervenciones=INTERVENCIONES)
+    assert bd.tx.deshecha and bd.bitacora[-1][0] == 'error'
+
+
+def _subir(cliente, contenido=b'PK', nombre='series.xlsx'):
+    return cliente.post('/api/import/excel', data={'file': (io.BytesIO(contenido), nombre)},
+                        content_type='multipart/form-data')
+
+
+def test_endpoint_formato(cliente, monkeypatch):
+    monkeypatch.setattr(api_app.handler_instance, 'import_series_xlsx',
+                        lambda *a, **kw: pytest.fail('no debe importar'))
+    assert cliente.post('/api/import/excel', data={}, content_type='multipart/form-data').status_code == 400
+    assert _subir(cliente, nombre='series.csv').status_code == 400
+
+
+def test_endpoint(cliente, monkeypatch):
+    llamadas = []
+
+    def import_series_xlsx(stream, filename=None, user_id=None):
+        llamadas.append((stream.read(), filename, user_id))
+        return {'filas': 4, 'segundos': 0.5, 'filas_por_segundo': 8.0, 'hojas': {}}
+    monkeypatch.setattr(api_app.handler_instance, 'import_series_xlsx', import_series_xlsx)
+    respuesta = _subir(cliente, nombre='../Series 2025.xlsx')
+    assert respuesta.status_code == 200 and respuesta.get_json()['filas'] == 4
+    assert llamadas == [(b'PK', 'Series_2025.xlsx', 5)]
+
+
+def test_endpoint_fichero_con_errores(cliente, monkeypatch):
+    def import_series_xlsx(stream, filename=None, user_id=None):
+        raise SeriesImportError("El fichero contiene errores; no se ha importado nada.", ["Hoja 'series' fila 2: ..."])
+    monkeypatch.setattr(api_app.handler_instance, 'import_series_xlsx', import_series_xlsx)
+    respuesta = _subir(cliente)
+    assert respuesta.status_code == 422 and respuesta.get_json()['details'] == ["Hoja 'series' fila 2: ..."]
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Servidor SSE asyncio: sesión de Flask, reparto desde un único LISTEN y streams sin hilo por cliente."""
+import asyncio
+import json
+import socket
+import threading
+
+import psycopg2
+import pytest
+
+import api_app
+import sse_server
+from change_feed import EVENT_CAMBIO, EVENT_CLOSE, EVENT_RESYNC, SubscriberLimit
+from sse_server import AsyncChangeFeed, AsyncSubscription, SseServer
+
+AVISO = json.dumps({'intervencion_id': 9, 'estado': 'realizado', 'needs_fx': False, 'version': 4,
+                    'convocatorias': [1]})
+
+
+def _cookie(user_id):
+    """Cookie de sesión tal como la firma la API."""
+    serializer = api_app.app.session_interface.get_signing_serializer(api_app.app)
+    return f"{api_app.app.config['SESSION_COOKIE_NAME']}={serializer.dumps({'user_id': user_id})}"
+
+
+class FakeHandler:
+    usuarios = {5: {'id': 5, 'activo': True, 'rol': 'tecnico'}, 6: {'id': 6, 'activo': False, 'rol': 'admin'},
+                7: {'id': 7, 'activo': True, 'rol': 'invitado'}}
+
+    def get_usuario_sesion(self, user_id):
+        return self.usuarios.get(user_id)
+
+    def get_convocatoria_ids(self, sala_id, fecha):
+        return [1, 2] if sala_id == 3 else []
+
+
+def test_sesion_firmada_por_la_api():
+    assert sse_server.session_user_id(_cookie(5)) == 5
+    assert sse_server.session_user_id(_cookie(5)[:-2] + 'xx') is None
+    assert sse_server.session_user_id('otra=1') is None and sse_server.session_user_id(None) is None
+
+
+def test_cola_llena_pide_resync():
+    async def escenario():
+        subscription = AsyncSubscription([1], maxsize=2)
+        for n in range(5):
+            subscription.push(EVENT_CAMBIO, n)
+        assert await subscription.get(0) == (EVENT_RESYNC, None)
+        assert await subscription.get(0) is None
+        subscription.push(EVENT_CAMBIO, 6)
+        assert await subscription.get(0) == (EVENT_CAMBIO, 6)
+        subscription.push(EVENT_CAMBIO, 7)
+        subscription.close()
+        assert await subscription.get(0) == (EVENT_CLOSE, None)
+    asyncio.run(escenario())
+
+
+def test_reparto_y_limite():
+    async def escenario():
+        feed = AsyncChangeFeed(connect=None, max_subscribers=2)
+        a, b = feed.subscribe([1]), feed.subscribe([2])
+        with pytest.raises(SubscriberLimit):
+            feed.subscribe([1])
+        feed.dispatch(AVISO)
+        feed.dispatch('{malformado')
+        assert await a.get(0) == (EVENT_CAMBIO, {'intervencion_id': 9, 'estado': 'realizado',
+                                                 'needs_fx': False, 'version': 4})
+        assert await b.get(0) is None
+        feed.unsubscribe(a)
+        feed.unsubscribe(a)
+        feed.shutdown()
+        with pytest.raises(SubscriberLimit):
+            feed.subscribe([3])     # cerrando: no se aceptan streams nuevos
+        assert feed.stats()['rejected'] == 2 and await b.get(0) == (EVENT_CLOSE, None)
+    asyncio.run(escenario())
+
+
+class FakeListenConn:
+    """Conexión LISTEN sobre un socketpair: escribir en `peer` la hace legible."""
+
+    class Notify:
+        def __init__(self, channel, payload):
+            self.channel, self.payload = channel, payload
+
+    def __init__(self):
+        self.sock, self.peer = socket.socketpair()
+        self.notifies, self.pending, self.closed, self.roto = [], [], False, False
+
+    def set_isolation_level(self, level):
+        pass
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *exc):
+                return False
+
+            def execute(self, sql):
+                conn.listen = sql
+        return Cursor()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def poll(self):
+        self.sock.recv(1024)
+        if self.roto:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        self.notifies.extend(self.pending)
+        self.pending = []
+
+    def notify(self, payload, channel=sse_server.CHANGE_FEED_CHANNEL):
+        self.pending.append(self.Notify(channel, payload))
+        self.peer.send(b'x')
+
+    def close(self):
+        self.closed = True
+        self.sock.close()
+        self.peer.close()
+
+
+def test_listener_reparte_y_reconecta(monkeypatch):
+    monkeypatch.setattr(sse_server, 'CHANGE_FEED_RECONNECT_MAX', 0)
+    conexiones = []
+
+    def connect():
+        conexiones.append(FakeListenConn())
+        return conexiones[-1]
+
+    async def escenario():
+        feed = AsyncChangeFeed(connect=connect)
+        subscription = feed.subscribe([1])
+        tarea = asyncio.ensure_future(feed.run())
+        while not feed.listening:
+            await asyncio.sleep(0.01)
+        assert conexiones[0].listen == f"LISTEN {sse_server.CHANGE_FEED_CHANNEL};"
+        conexiones[0].notify(AVISO)
+        conexiones[0].notify(AVISO, channel='otro_canal')
+        assert (await subscription.get(1))[0] == EVENT_CAMBIO
+
+        # Caída de la conexión: se cierra, se reconecta (backoff) y los clientes recargan.
+        monkeypatch.setattr(asyncio, 'sleep', _sin_espera(asyncio.sleep))
+        conexiones[0].roto = True
+        conexiones[0].peer.send(b'x')
+        assert await subscription.get(1) == (EVENT_RESYNC, None)
+        assert conexiones[0].closed and len(conexiones) == 2
+        assert feed.stats()['reconnects'] == 1 and feed.stats()['notifications'] == 2
+        tarea.cancel()
+    asyncio.run(escenario())
+
+
+def _sin_espera(sleep):
+    return lambda segundos, *a: sleep(0)
+
+
+async def _peticion(port, path, cookie=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    cabeceras = f"GET {path} HTTP/1.1\r\nHost: x\r\nOrigin: http://localhost:3000\r\n"
+    if cookie:
+        cabeceras += f"Cookie: {cookie}\r\n"
+    writer.write((cabeceras + "\r\n").encode())
+    await writer.drain()
+    head = (await reader.readuntil(b"\r\n\r\n")).decode()
+    return int(head.split()[1]), head, reader, writer
+
+
+def test_streams_en_un_solo_hilo():
+    async def escenario():
+        feed = AsyncChangeFeed(connect=None)
+        tcp = await asyncio.start_server(SseServer(feed, handler=FakeHandler()).handle, '127.0.0.1', 0)
+        port = tcp.sockets[0].getsockname()[1]
+
+        assert (await _peticion(port, '/api/convocatorias/1/stream'))[0] == 401
+        assert (await _peticion(port, '/api/convocatorias/1/stream', _cookie(6)))[0] == 401
+        assert (await _peticion(port, '/api/convocatorias/1/stream', _cookie(7)))[0] == 403
+        assert (await _peticion(port, '/api/salas/3/convocatoria/stream', _cookie(5)))[0] == 400
+        assert (await _peticion(port, '/api/salas/4/convocatoria/stream?fecha=2025-05-07', _cookie(5)))[0] == 404
+
+        hilos = threading.active_count()
+        clientes = []
+        for n in range(200):
+            path = '/api/salas/3/convocatoria/stream?fecha=2025-05-07' if n % 2 else '/api/convocatorias/1/stream'
+            status, head, reader, writer = await _peticion(port, path, _cookie(5))
+            assert status == 200 and 'text/event-stream' in head
+            assert 'Access-Control-Allow-Origin: http://localhost:3000' in head
+            assert await reader.readuntil(b"\n\n") == b"retry: %d\n\n" % sse_server.SSE_RETRY_MS
+            clientes.append((reader, writer))
+        # 200 streams abiertos sin un hilo por cliente (solo el pool del bucle para las consultas).
+        assert feed.stats()['subscribers'] == 200
+        assert threading.active_count() - hilos <= 1
+
+        feed.dispatch(AVISO)
+        for reader, _ in clientes:
+            evento = (await reader.readuntil(b"\n\n")).decode()
+            assert evento.startswith('event: cambio\n') and '"version": 4' in evento
+
+        # El cliente que se va libera su suscripción sin esperar al heartbeat.
+        for _, writer in clientes[:50]:
+            writer.close()
+        for _ in range(100):
+            if feed.stats()['subscribers'] == 150:
+                break
+            await asyncio.sleep(0.01)
+        assert feed.stats()['subscribers'] == 150
+
+        feed.shutdown()
+        for reader, _ in clientes[50:]:
+            assert await reader.read() == b''
+        tcp.close()
+    asyncio.run(escenario())
+
+
+def test_api_redirige_al_servidor_sse(cliente, monkeypatch):
+    monkeypatch.setattr(api_app, 'SSE_URL', 'http://localhost:5001')
+    respuesta = cliente.get('/api/salas/3/convocatoria/stream?fecha=2025-05-07')
+    assert respuesta.status_code == 307
+    assert respuesta.headers['Location'] == 'http://localhost:5001/api/salas/3/convocatoria/stream?fecha=2025-05-07'
+    respuesta = cliente.get('/api/convocatorias/1/stream')
+    assert respuesta.headers['Location'] == 'http://localhost:5001/api/convocatorias/1/stream'
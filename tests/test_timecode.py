@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Timecodes SMPTE <-> frames, con y sin drop-frame."""
+import pytest
+
+import timecode
+from timecode import TimecodeError
+
+
+@pytest.mark.parametrize('fps, nominal, drop', [
+    (24, 24, 0), (25, 25, 0), ('23.976', 24, 0), ('29.97', 30, 2), (29.97, 30, 2), ('59.94', 60, 4), (30, 30, 0),
+])
+def test_frame_rate(fps, nominal, drop):
+    assert timecode.frame_rate(fps) == (nominal, drop)
+
+
+def test_frame_rate_invalido():
+    with pytest.raises(TimecodeError):
+        timecode.frame_rate(0)
+
+
+@pytest.mark.parametrize('tc, fps, frames', [
+    ('00:00:00:00', 25, 0),
+    ('01:00:00:00', 25, 90000),
+    ('00:00:01:00', '23.976', 24),
+    # Drop-frame: el minuto 1 empieza en ;02 y el 10 no salta frames.
+    ('00:00:59;29', '29.97', 1799),
+    ('00:01:00;02', '29.97', 1800),
+    ('00:10:00;00', '29.97', 17982),
+    ('01:00:00;00', '29.97', 107892),
+    ('00:01:00;04', '59.94', 3600),
+    ('00:01:00:04', '59.94', 3600),
+])
+def test_parse(tc, fps, frames):
+    assert timecode.parse(tc, fps) == frames
+
+
+@pytest.mark.parametrize('tc, fps', [
+    ('00:00:00', 25),
+    ('00-00-00-00', 25),
+    ('0a:00:00:00', 25),
+    ('00:60:00:00', 25),
+    ('00:00:60:00', 25),
+    ('00:00:00:25', 25),
+    ('00:01:00;00', '29.97'),
+    ('00:01:00;01', '29.97'),
+    ('00:01:00;03', '59.94'),
+])
+def test_parse_invalido(tc, fps):
+    with pytest.raises(TimecodeError):
+        timecode.parse(tc, fps)
+
+
+def test_parse_none():
+    assert timecode.parse(None, 25) is None
+    assert timecode.format_frames(None, 25) is None
+
+
+@pytest.mark.parametrize('fps', [24, 25, '23.976', '29.97', '59.94'])
+def test_ida_y_vuelta(fps):
+    # Dos horas en saltos que no caen siempre en el mismo frame del minuto.
+    for frames in range(0, 2 * 3600 * 60, 997):
+        tc = timecode.format_frames(frames, fps)
+        assert timecode.parse(tc, fps) == frames, tc
+
+
+@pytest.mark.parametrize('fps, drop', [('29.97', 2), ('59.94', 4)])
+def test_ida_y_vuelta_en_cambio_de_minuto(fps, drop):
+    inicio = timecode.parse('00:00:59:00', fps)
+    for frames in range(inicio, timecode.parse('00:11:00:10', fps)):
+        tc = timecode.format_frames(frames, fps)
+        mm, ss, ff = int(tc[3:5]), int(tc[6:8]), int(tc[9:11])
+        assert not (ss == 0 and mm % 10 and ff < drop), tc
+        assert timecode.parse(tc, fps) == frames
+
+
+def test_format_frames_fuera_de_rango():
+    with pytest.raises(TimecodeError):
+        timecode.format_frames(-1, 25)
+    with pytest.raises(TimecodeError):
+        timecode.format_frames(100 * 3600 * 25, 25)
+
+
+@pytest.mark.parametrize('fps', [25, '29.97', '59.94'])
+def test_parse_many_coincide_con_parse(fps):
+    tcs = ['00:00:00:00', '00:01:00;02', '00:01:00;00', None, '00:10:00:00', 'basura', ' 01:02:03:04 ',
+           '00:00:00:59', '00:61:00:00', '00:01:00;04', 'ñ0:00:00:00']
+    frames, invalidos = timecode.parse_many(tcs, fps)
+    for i, tc in enumerate(tcs):
+        if tc is None:
+            assert frames[i] is None and i not in invalidos
+            continue
+        try:
+            esperado = timecode.parse(tc, fps)
+        except TimecodeError:
+            assert i in invalidos and frames[i] is None, tc
+        else:
+            assert frames[i] == esperado and i not in invalidos, tc
+
+
+def test_parse_many_vacio():
+    assert timecode.parse_many([], 25) == ([], [])
+    assert timecode.parse_many([None, None], 25) == ([None, None], [])
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+timecode.py
+
+Timecodes SMPTE HH:MM:SS:FF <-> número de frame, según los fps de la serie
+(§9: validación contra Serie.fps). 29.97 y 59.94 se cuentan en drop-frame
+(se saltan los frames 0-1 / 0-3 de cada minuto salvo los múltiplos de 10);
+23.976 se cuenta a 24 sin saltos. El separador de frames puede ser ':' o ';'.
+
+Los frames se guardan junto al texto (tc_in_frames/tc_out_frames) para poder
+ordenar, filtrar por rango y sumar duraciones con enteros indexados.
+`parse_many` valida lotes enteros (imports/exports) con numpy, sin bucle por fila.
+"""
+import decimal
+
+import numpy as np
+
+TC_LENGTH = 11
+DROP_FRAME_RATES = {decimal.Decimal('29.97'): 2, decimal.Decimal('59.94'): 4}
+
+_DIGIT_COLUMNS = [0, 1, 3, 4, 6, 7, 9, 10]
+
+
+class TimecodeError(ValueError):
+    """Timecode mal formado o imposible para los fps de la serie."""
+
+
+def frame_rate(fps):
+    """Retorna (frames nominales por segundo, frames que se saltan por minuto en drop-frame)."""
+    fps = decimal.Decimal(str(fps)).quantize(decimal.Decimal('0.01'))
+    if fps <= 0:
+        raise TimecodeError(f"fps inválidos: {fps}")
+    return int(fps.to_integral_value(rounding=decimal.ROUND_HALF_UP)), DROP_FRAME_RATES.get(fps, 0)
+
+
+def parse(tc, fps):
+    """Convierte 'HH:MM:SS:FF' en número de frame. Lanza TimecodeError si no es válido."""
+    if tc is None:
+        return None
+    nominal, drop = frame_rate(fps)
+    tc = str(tc).strip()
+    if (len(tc) != TC_LENGTH or tc[2] != ':' or tc[5] != ':' or tc[8] not in ':;'
+            or not all(tc[i].isdigit() for i in _DIGIT_COLUMNS)):
+        raise TimecodeError(f"Timecode '{tc}' no tiene el formato HH:MM:SS:FF.")
+    hh, mm, ss, ff = int(tc[0:2]), int(tc[3:5]), int(tc[6:8]), int(tc[9:11])
+    if mm >= 60 or ss >= 60 or ff >= nominal:
+        raise TimecodeError(f"Timecode '{tc}' fuera de rango para {fps} fps.")
+    if drop and ss == 0 and mm % 10 and ff < drop:
+        raise TimecodeError(f"Timecode '{tc}' no existe en drop-frame ({fps} fps).")
+    frames = (hh * 3600 + mm * 60 + ss) * nominal + ff
+    if drop:
+        minutos = hh * 60 + mm
+        frames -= drop * (minutos - minutos // 10)
+    return frames
+
+
+def format_frames(frames, fps):
+    """Convierte un número de frame en 'HH:MM:SS:FF' (inversa de `parse`)."""
+    if frames is None:
+        return None
+    if frames < 0:
+        raise TimecodeError(f"Número de frame negativo: {frames}")
+    nominal, drop = frame_rate(fps)
+    if drop:
+        por_10_min = nominal * 600 - drop * 9
+        por_min = nominal * 60 - drop
+        bloques, resto = divmod(frames, por_10_min)
+        frames += drop * 9 * bloques
+        if resto > drop:
+            frames += drop * ((resto - drop) // por_min)
+    segundos, ff = divmod(frames, nominal)
+    minutos, ss = divmod(segundos, 60)
+    hh, mm = divmod(minutos, 60)
+    if hh > 99:
+        raise TimecodeError(f"El frame {frames} supera las 99 horas.")
+    return f"{hh:02d}:{mm:02d}:{ss:02d}:{ff:02d}"
+
+
+def parse_many(tcs, fps):
+    """
+    Versión vectorizada de `parse` para un lote. Retorna (frames, invalidos):
+    `frames` es una lista con el frame de cada timecode (None si falta o no es
+    válido) e `invalidos` los índices de los timecodes no válidos.
+    """
+    nominal, drop = frame_rate(fps)
+    presentes = [i for i, tc in enumerate(tcs) if tc is not None]
+    frames = [None] * len(tcs)
+    if not presentes:
+        return frames, []
+
+    textos = [str(tcs[i]).strip() for i in presentes]
+    raw = np.array([t.encode('ascii', 'replace') if len(t) == TC_LENGTH else b'' for t in textos],
+                   dtype=f'S{TC_LENGTH}')
+    b = raw.view(np.uint8).reshape(-1, TC_LENGTH).astype(np.int64)
+    d = b[:, _DIGIT_COLUMNS] - ord('0')
+    valid = (
+        (b[:, 2] == ord(':')) & (b[:, 5] == ord(':')) & ((b[:, 8] == ord(':')) | (b[:, 8] == ord(';')))
+        & ((d >= 0) & (d <= 9)).all(axis=1)
+    )
+    hh, mm, ss, ff = (d[:, 0] * 10 + d[:, 1], d[:, 2] * 10 + d[:, 3],
+                      d[:, 4] * 10 + d[:, 5], d[:, 6] * 10 + d[:, 7])
+    valid &= (mm < 60) & (ss < 60) & (ff < nominal)
+    total = (hh * 3600 + mm * 60 + ss) * nominal + ff
+    if drop:
+        valid &= ~((ss == 0) & (mm % 10 != 0) & (ff < drop))
+        minutos = hh * 60 + mm
+        total -= drop * (minutos - minutos // 10)
+
+    invalidos = []
+    for pos, i in enumerate(presentes):
+        if valid[pos]:
+            frames[i] = int(total[pos])
+        else:
+            invalidos.append(i)
+    return frames, invalidos
+
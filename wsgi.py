@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+wsgi.py
+
+Punto de entrada de producción:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+El esquema no se crea ni se borra aquí: gunicorn.conf.py comprueba su versión
+una vez en el proceso maestro (db_handler.ensure_schema) antes de lanzar los
+workers, y cada worker abre su propio pool de conexiones tras el fork.
+"""
+from api_app import app  # noqa: F401